@@ -1 +1,2 @@
-from .dop853_lyapunov import dop853_lyapunov_max
+from .dop853_lyapunov import (dop853_lyapunov_max, dop853_lyapunov_max_batch,
+                              dop853_variational_lyapunov)
@@ -11,45 +11,119 @@ from __future__ import division, print_function
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
 
+# Standard library
+import threading
+
 # Third-party
 import numpy as np
 cimport numpy as np
 np.import_array()
 
 from libc.stdio cimport printf
+from cpython.exc cimport PyErr_CheckSignals
 
-from ...potential.cpotential cimport _CPotential
+from ...potential.cpotential cimport _CPotential, hessianfunc
 
 cdef extern from "math.h":
     double sqrt(double x) nogil
     double log(double x) nogil
 
 cdef extern from "dopri/dop853.h":
+    ctypedef struct Dop853Workspace:
+        pass
+
     ctypedef void (*GradFn)(double t, double *pars, double *q, double *grad) nogil
-    ctypedef void (*SolTrait)(long nr, double xold, double x, double* y, unsigned n, int* irtrn)
+    ctypedef void (*SolTraitWs)(long nr, double xold, double x, double* y, unsigned n, int* irtrn,
+                                Dop853Workspace *ws) nogil
     ctypedef void (*FcnEqDiff)(unsigned n, double x, double *y, double *f, GradFn gradfunc, double *gpars, unsigned norbits) nogil
-    double contd8 (unsigned ii, double x)
+
+    Dop853Workspace *dop853_workspace_alloc() nogil
+    void dop853_workspace_free(Dop853Workspace *ws) nogil
 
     # See dop853.h for full description of all input parameters
-    int dop853 (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
-                double x, double* y, double xend,
-                double* rtoler, double* atoler, int itoler, SolTrait solout,
-                int iout, FILE* fileout, double uround, double safe, double fac1,
-                double fac2, double beta, double hmax, double h, long nmax, int meth,
-                long nstiff, unsigned nrdens, unsigned* icont, unsigned licont)
+    int dop853_ws (Dop853Workspace *ws,
+                   unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+                   double x, double* y, double xend,
+                   double* rtoler, double* atoler, int itoler, SolTraitWs solout,
+                   int iout, FILE* fileout, double uround, double safe, double fac1,
+                   double fac2, double beta, double hmax, double h, long nmax, int meth,
+                   long nstiff, unsigned nrdens, unsigned* icont, unsigned licont) nogil
 
     void Fwrapper (unsigned ndim, double t, double *w, double *f,
-                   GradFn func, double *pars, unsigned norbits)
-    double six_norm (double *x)
+                   GradFn func, double *pars, unsigned norbits) nogil
+    double six_norm (double *x) nogil
 
 cdef extern from "stdio.h":
     ctypedef struct FILE
     FILE *stdout
 
-cdef void solout(long nr, double xold, double x, double* y, unsigned n, int* irtrn):
-    # TODO: see here for example in FORTRAN:
-    #   http://www.unige.ch/~hairer/prog/nonstiff/dr_dop853.f
-    pass
+# Everything needed to evaluate the variational equations. A pointer to this
+#   struct is passed to the integrator in place of the potential parameters.
+cdef struct Variational:
+    GradFn gradient
+    hessianfunc hessian
+    double *pars
+    int half_ndim
+    int nvec
+    double *hess # scratch space, half_ndim x half_ndim
+
+cdef void variational_eqs(unsigned n, double t, double *y, double *f,
+                          GradFn gradfunc, double *gpars, unsigned norbits) nogil:
+    """
+    Equations of motion for a single orbit followed by ``nvec`` deviation
+    vectors evolved with the linearized equations (the tangent map), i.e.
+    for a deviation vector (dq, dp): d(dq)/dt = dp and d(dp)/dt = -H dq,
+    where H is the Hessian of the potential along the orbit.
+    """
+    cdef:
+        Variational *var = <Variational*>gpars
+        int i, j, k
+        int nh = var.half_ndim
+        int ndim = 2*nh
+        double *dy
+        double *df
+
+    var.gradient(t, var.pars, y, &f[nh])
+    var.hessian(t, var.pars, y, var.hess)
+    for k in range(nh):
+        f[k] = y[nh+k]
+        f[nh+k] = -f[nh+k]
+
+    for i in range(1,var.nvec+1):
+        dy = &y[i*ndim]
+        df = &f[i*ndim]
+        for k in range(nh):
+            df[k] = dy[nh+k]
+            df[nh+k] = 0.
+            for j in range(nh):
+                df[nh+k] -= var.hess[k*nh+j] * dy[j]
+
+cdef void gram_schmidt(double *y, int nvec, int n, double *mo) nogil:
+    """
+    Modified Gram-Schmidt orthonormalization of the ``nvec`` vectors of
+    length ``n`` stored contiguously in ``y``. The norms are stored in
+    ``mo``. Same algorithm as `gary.util.gram_schmidt`.
+    """
+    cdef:
+        int i, j, k
+        double esc
+
+    for i in range(nvec):
+        # Remove component in direction j
+        for j in range(i):
+            esc = 0.
+            for k in range(n):
+                esc += y[j*n+k] * y[i*n+k]
+            for k in range(n):
+                y[i*n+k] -= y[j*n+k] * esc
+
+        # Normalization
+        mo[i] = 0.
+        for k in range(n):
+            mo[i] += y[i*n+k] * y[i*n+k]
+        mo[i] = sqrt(mo[i])
+        for k in range(n):
+            y[i*n+k] /= mo[i]
 
 cpdef dop853_lyapunov_max(_CPotential cpotential, double[::1] w0,
                           double dt, int nsteps, double t0,
@@ -75,6 +149,10 @@ cpdef dop853_lyapunov_max(_CPotential cpotential, double[::1] w0,
         # temp stuff
         double[:,::1] d0_vec = np.random.uniform(size=(noffset_orbits,ndim))
 
+        GradFn gradfunc = <GradFn>cpotential.c_gradient
+        double *pars = &(cpotential._parameters[0])
+        Dop853Workspace *ws
+
     # store initial conditions
     for i in range(norbits):
         if i == 0:  # store initial conditions for parent orbit
@@ -90,42 +168,390 @@ cpdef dop853_lyapunov_max(_CPotential cpotential, double[::1] w0,
                 all_w[0,i,k] = w0[k] + d0_vec[i-1,k]
                 w[i*ndim + k] = all_w[0,i,k]
 
+    ws = dop853_workspace_alloc()
+    if ws == NULL:
+        raise MemoryError("Failed to allocate DOP853 workspace.")
+
     # dummy counter for storing Lyapunov stuff, which only happens every few steps
     jiter = 0
-    for j in range(1,nsteps,1):
-        res = dop853(ndim*norbits, <FcnEqDiff> Fwrapper,
-                     <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), norbits,
-                     t[j-1], &w[0], t[j], &rtol, &atol, 0, solout, 0,
-                     NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt, nmax, 0, 1, 0, NULL, 0);
-
-        if res == -1:
-            raise RuntimeError("Input is not consistent.")
-        elif res == -2:
-            raise RuntimeError("Larger nmax is needed.")
-        elif res == -3:
-            raise RuntimeError("Step size becomes too small.")
-        elif res == -4:
-            raise RuntimeError("The problem is probably stff (interrupted).")
-
-        # store position of main orbit
-        for i in range(norbits):
+    try:
+        for j in range(1,nsteps,1):
+            with nogil:
+                res = dop853_ws(ws, ndim*norbits, <FcnEqDiff> Fwrapper,
+                                gradfunc, pars, norbits,
+                                t[j-1], &w[0], t[j], &rtol, &atol, 0, NULL, 0,
+                                NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt, nmax, 0, 1, 0, NULL, 0)
+
+            if res == -1:
+                raise RuntimeError("Input is not consistent.")
+            elif res == -2:
+                raise RuntimeError("Larger nmax is needed.")
+            elif res == -3:
+                raise RuntimeError("Step size becomes too small.")
+            elif res == -4:
+                raise RuntimeError("The problem is probably stff (interrupted).")
+
+            with nogil:
+                # store position of main orbit
+                for i in range(norbits):
+                    for k in range(ndim):
+                        all_w[j,i,k] = w[i*ndim + k]
+
+                if (j % nsteps_per_pullback) == 0:
+                    # get magnitude of deviation vector
+                    for i in range(1,norbits):
+                        for k in range(ndim):
+                            d1[i,k] = w[i*ndim + k] - w[k]
+
+                        d1_mag = six_norm(&d1[i,0])
+                        LEs[jiter,i-1] = log(d1_mag / d0)
+
+                        # renormalize offset orbits
+                        for k in range(ndim):
+                            w[i*ndim + k] = w[k] + d0 * d1[i,k] / d1_mag
+
+                    jiter += 1
+
+    finally:
+        dop853_workspace_free(ws)
+
+    LEs = np.array([np.sum(LEs[:j],axis=0)/t[j*nsteps_per_pullback] for j in range(1,niter)])
+    return np.asarray(t), np.asarray(all_w), np.asarray(LEs)
+
+cpdef dop853_variational_lyapunov(_CPotential cpotential, double[:,::1] w0,
+                                  double[:,::1] d0_vec, double dt, int nsteps,
+                                  double t0, int nsteps_per_pullback,
+                                  double atol=1E-10, double rtol=1E-10, int nmax=0):
+    """
+    dop853_variational_lyapunov(cpotential, w0, d0_vec, dt, nsteps, t0, nsteps_per_pullback, atol=1E-10, rtol=1E-10, nmax=0)
+
+    Estimate Lyapunov exponents by integrating the variational equations
+    along each orbit, using the Hessian of the potential. The deviation
+    vectors are re-orthonormalized every ``nsteps_per_pullback`` steps;
+    with as many deviation vectors as phase-space dimensions, this gives the
+    full Lyapunov spectrum.
+
+    Each orbit is integrated independently (with its own step size control).
+
+    Parameters
+    ----------
+    cpotential : `_CPotential`
+        Must have a Hessian function.
+    w0 : array_like
+        Initial conditions, shape ``(norbits, ndim)``.
+    d0_vec : array_like
+        Initial orthonormal deviation vectors, shape ``(nvec, ndim)``. The
+        same vectors are used for all orbits.
+    dt : float
+    nsteps : int
+    t0 : float
+    nsteps_per_pullback : int
+
+    Returns
+    -------
+    t : `~numpy.ndarray`
+        Times of the re-orthonormalizations, including ``t0``, with shape
+        ``(niter+1,)`` where ``niter = nsteps // nsteps_per_pullback``.
+    w : `~numpy.ndarray`
+        Orbits at times ``t``, shape ``(niter+1, norbits, ndim)``.
+    LEs : `~numpy.ndarray`
+        Running estimates of the Lyapunov exponents, shape
+        ``(niter, norbits, nvec)``.
+    """
+    cdef:
+        int i, j, k, n, jiter
+        int res
+        int norbits = w0.shape[0]
+        int ndim = w0.shape[1]
+        int nvec = d0_vec.shape[0]
+        int niter = nsteps // nsteps_per_pullback
+        int nstate = ndim*(nvec+1)
+
+        double[::1] t = t0 + dt*nsteps_per_pullback*np.arange(niter+1, dtype=np.float64)
+        double[::1] y = np.empty(nstate)
+        double[::1] mo = np.empty(nvec)
+        double[::1] sum_log = np.empty(nvec)
+        double[::1] hess = np.empty((ndim//2)*(ndim//2))
+        double[:,:,::1] all_w = np.zeros((niter+1,norbits,ndim))
+        double[:,:,::1] LEs = np.zeros((niter,norbits,nvec))
+
+        Variational var
+        Dop853Workspace *ws
+
+    if cpotential.c_hessian == NULL:
+        raise ValueError("Potential C instance has no defined Hessian function.")
+
+    if d0_vec.shape[1] != ndim:
+        raise ValueError("Deviation vectors must have the same dimensionality as the "
+                         "initial conditions.")
+
+    var.gradient = <GradFn>cpotential.c_gradient
+    var.hessian = cpotential.c_hessian
+    var.pars = &(cpotential._parameters[0])
+    var.half_ndim = ndim // 2
+    var.nvec = nvec
+    var.hess = &hess[0]
+
+    ws = dop853_workspace_alloc()
+    if ws == NULL:
+        raise MemoryError("Failed to allocate DOP853 workspace.")
+
+    try:
+        for n in range(norbits):
             for k in range(ndim):
-                all_w[j,i,k] = w[i*ndim + k]
+                all_w[0,n,k] = w0[n,k]
+                y[k] = w0[n,k]
+
+            for i in range(nvec):
+                sum_log[i] = 0.
+                for k in range(ndim):
+                    y[(i+1)*ndim + k] = d0_vec[i,k]
+
+            for jiter in range(niter):
+                with nogil:
+                    res = dop853_ws(ws, nstate, <FcnEqDiff> variational_eqs,
+                                    NULL, <double*>&var, 1,
+                                    t[jiter], &y[0], t[jiter+1], &rtol, &atol, 0, NULL, 0,
+                                    NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt, nmax, 0, 1, 0, NULL, 0)
+
+                if res == -1:
+                    raise RuntimeError("Input is not consistent.")
+                elif res == -2:
+                    raise RuntimeError("Larger nmax is needed.")
+                elif res == -3:
+                    raise RuntimeError("Step size becomes too small.")
+                elif res == -4:
+                    raise RuntimeError("The problem is probably stff (interrupted).")
+
+                with nogil:
+                    for k in range(ndim):
+                        all_w[jiter+1,n,k] = y[k]
+
+                    gram_schmidt(&y[ndim], nvec, ndim, &mo[0])
+                    for i in range(nvec):
+                        sum_log[i] += log(mo[i])
+                        LEs[jiter,n,i] = sum_log[i] / (t[jiter+1] - t0)
+
+    finally:
+        dop853_workspace_free(ws)
+
+    return np.asarray(t), np.asarray(all_w), np.asarray(LEs)
+
+# ==============================================================================
+# Batch version of dop853_lyapunov_max() for many initial conditions
+#
+cdef _check_result(int res):
+    if res == -1:
+        raise RuntimeError("Input is not consistent.")
+    elif res == -2:
+        raise RuntimeError("Larger nmax is needed.")
+    elif res == -3:
+        raise RuntimeError("Step size becomes too small.")
+    elif res == -4:
+        raise RuntimeError("The problem is probably stiff (interrupted).")
+
+cdef int _lyapunov_max_orbit(Dop853Workspace *ws, GradFn gradfunc, double *pars,
+                             double[:,::1] w0, double[:,::1] d0_vec, int n,
+                             double dt, int nsteps, double t0, double d0,
+                             int nsteps_per_pullback, double atol, double rtol,
+                             int nmax, double *w, double *d1, double[:,::1] LEs,
+                             double[:,:,::1] all_w, int store_every) nogil:
+    """
+    Estimate the maximum Lyapunov exponent for orbit ``n`` of ``w0`` with
+    offset orbits, storing the final estimate for each offset orbit in
+    ``LEs[n]`` and, if ``store_every > 0``, the parent orbit every
+    ``store_every`` steps in ``all_w[:,n]``. ``w`` and ``d1`` are scratch
+    space. Returns the result code from ``dop853_ws()``.
+    """
+    cdef:
+        int i, j, k
+        int res = 1
+        int ndim = w0.shape[1]
+        int noffset = d0_vec.shape[0]
+        int norbits = noffset + 1
+        double d1_mag, t1, t2, t_pullback = t0
+
+    for i in range(noffset):
+        LEs[n,i] = 0.
+
+    for k in range(ndim):
+        w[k] = w0[n,k]
+        for i in range(noffset):
+            w[(i+1)*ndim + k] = w0[n,k] + d0_vec[i,k]
+
+    if store_every > 0:
+        for k in range(ndim):
+            all_w[0,n,k] = w[k]
+
+    for j in range(1,nsteps+1):
+        t1 = t0 + (j-1)*dt
+        t2 = t0 + j*dt
+        res = dop853_ws(ws, ndim*norbits, <FcnEqDiff> Fwrapper,
+                        gradfunc, pars, norbits,
+                        t1, &w[0], t2, &rtol, &atol, 0, NULL, 0,
+                        NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt, nmax, 0, 1, 0, NULL, 0)
+        if res < 0:
+            return res
+
+        if store_every > 0 and (j % store_every) == 0:
+            for k in range(ndim):
+                all_w[j // store_every,n,k] = w[k]
 
         if (j % nsteps_per_pullback) == 0:
-            # get magnitude of deviation vector
+            t_pullback = t2
             for i in range(1,norbits):
+                d1_mag = 0.
                 for k in range(ndim):
-                    d1[i,k] = w[i*ndim + k] - w[k]
-
-                d1_mag = six_norm(&d1[i,0])
-                LEs[jiter,i-1] = log(d1_mag / d0)
+                    d1[k] = w[i*ndim + k] - w[k]
+                    d1_mag += d1[k]*d1[k]
+                d1_mag = sqrt(d1_mag)
+                LEs[n,i-1] += log(d1_mag / d0)
 
                 # renormalize offset orbits
                 for k in range(ndim):
-                    w[i*ndim + k] = w[k] + d0 * d1[i,k] / d1_mag
+                    w[i*ndim + k] = w[k] + d0 * d1[k] / d1_mag
 
-            jiter += 1
+    for i in range(noffset):
+        LEs[n,i] /= (t_pullback - t0)
 
-    LEs = np.array([np.sum(LEs[:j],axis=0)/t[j*nsteps_per_pullback] for j in range(1,niter)])
-    return np.asarray(t), np.asarray(all_w), np.asarray(LEs)
+    return res
+
+def _lyapunov_max_worker(_CPotential cpotential, double[:,::1] w0, double[:,::1] d0_vec,
+                         double dt, int nsteps, double t0, double d0,
+                         int nsteps_per_pullback, double atol, double rtol, int nmax,
+                         double[:,::1] LEs, double[:,:,::1] all_w, int store_every,
+                         int i1, int i2):
+    """
+    Compute the maximum Lyapunov exponent for orbits ``i1 <= n < i2`` with
+    the GIL released. Each call uses its own workspace. Returns the result
+    code from ``dop853_ws()`` (negative on failure).
+    """
+    cdef:
+        int n
+        int res = 1
+        int ndim = w0.shape[1]
+        double[::1] w = np.empty(ndim*(d0_vec.shape[0]+1))
+        double[::1] d1 = np.empty(ndim)
+
+        GradFn gradfunc = <GradFn>cpotential.c_gradient
+        double *pars = &(cpotential._parameters[0])
+        Dop853Workspace *ws
+
+    ws = dop853_workspace_alloc()
+    if ws == NULL:
+        raise MemoryError("Failed to allocate DOP853 workspace.")
+
+    try:
+        for n in range(i1,i2):
+            with nogil:
+                res = _lyapunov_max_orbit(ws, gradfunc, pars, w0, d0_vec, n,
+                                          dt, nsteps, t0, d0, nsteps_per_pullback,
+                                          atol, rtol, nmax, &w[0], &d1[0],
+                                          LEs, all_w, store_every)
+            if res < 0:
+                break
+
+            PyErr_CheckSignals()
+
+    finally:
+        dop853_workspace_free(ws)
+
+    return res
+
+def _lyapunov_max_thread(results, int i, *args):
+    # store the result code (or exception) so it can be raised in the
+    #   calling thread
+    try:
+        results[i] = _lyapunov_max_worker(*args)
+    except Exception as e:
+        results[i] = e
+
+cpdef dop853_lyapunov_max_batch(_CPotential cpotential, double[:,::1] w0,
+                                double[:,::1] d0_vec, double dt, int nsteps,
+                                double t0, double d0, int nsteps_per_pullback,
+                                double atol=1E-10, double rtol=1E-10, int nmax=0,
+                                int store_every=0, int nthreads=1):
+    """
+    dop853_lyapunov_max_batch(cpotential, w0, d0_vec, dt, nsteps, t0, d0, nsteps_per_pullback, atol=1E-10, rtol=1E-10, nmax=0, store_every=0, nthreads=1)
+
+    Estimate the maximum Lyapunov exponent for many initial conditions
+    using offset orbits. Only the final estimates are kept and, optionally,
+    the parent orbits every ``store_every`` steps. The orbits are split over
+    ``nthreads`` threads.
+
+    Parameters
+    ----------
+    cpotential : `_CPotential`
+    w0 : array_like
+        Initial conditions, shape ``(norbits, ndim)``.
+    d0_vec : array_like
+        Initial offset vectors, shape ``(noffset, ndim)``, each of length
+        ``d0``. The same vectors are used for all orbits.
+    dt : float
+    nsteps : int
+    t0 : float
+    d0 : float
+    nsteps_per_pullback : int
+    store_every : int (optional)
+        If positive, store the parent orbits every ``store_every`` steps.
+    nthreads : int (optional)
+
+    Returns
+    -------
+    LEs : `~numpy.ndarray`
+        Final Lyapunov exponent estimates, shape ``(norbits, noffset)``.
+    t : `~numpy.ndarray`
+        Times of the stored orbits. Only returned if ``store_every > 0``.
+    w : `~numpy.ndarray`
+        Stored parent orbits, shape ``(ntimes, norbits, ndim)``. Only
+        returned if ``store_every > 0``.
+    """
+    cdef:
+        int i
+        int norbits = w0.shape[0]
+        int ndim = w0.shape[1]
+        int noffset = d0_vec.shape[0]
+        int ntimes = 0
+        double[:,::1] LEs = np.zeros((norbits,noffset))
+        double[:,:,::1] all_w
+
+    if nsteps < nsteps_per_pullback:
+        raise ValueError("nsteps must be at least nsteps_per_pullback.")
+
+    if d0_vec.shape[1] != ndim:
+        raise ValueError("Offset vectors must have the same dimensionality as the "
+                         "initial conditions.")
+
+    if store_every > 0:
+        ntimes = nsteps // store_every + 1
+    all_w = np.zeros((max(ntimes,1),norbits,ndim))
+
+    nthreads = max(1, min(nthreads, norbits))
+    if nthreads == 1:
+        _check_result(_lyapunov_max_worker(cpotential, w0, d0_vec, dt, nsteps, t0, d0,
+                                           nsteps_per_pullback, atol, rtol, nmax,
+                                           LEs, all_w, store_every, 0, norbits))
+
+    else:
+        bounds = np.linspace(0, norbits, nthreads+1).astype(int)
+        results = [None]*nthreads
+        threads = [threading.Thread(target=_lyapunov_max_thread,
+                                    args=(results, i, cpotential, w0, d0_vec, dt,
+                                          nsteps, t0, d0, nsteps_per_pullback,
+                                          atol, rtol, nmax, LEs, all_w, store_every,
+                                          bounds[i], bounds[i+1]))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+            _check_result(res)
+
+    if store_every > 0:
+        t = t0 + dt*store_every*np.arange(ntimes, dtype=np.float64)
+        return np.asarray(LEs), t, np.asarray(all_w)
+    return np.asarray(LEs)
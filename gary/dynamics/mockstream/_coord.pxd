@@ -1,10 +1,10 @@
-cdef void sat_rotation_matrix(double *w, double *R)
+cdef void sat_rotation_matrix(double *w, double *R) nogil
 
 cdef void to_sat_coords(double *w, double *R,
-                        double *w_prime)
+                        double *w_prime) nogil
 
 cdef void from_sat_coords(double *w_prime, double *R,
-                          double *w)
+                          double *w) nogil
 
-cdef void car_to_cyl(double *w, double *cyl)
-cdef void cyl_to_car(double *cyl, double *w)
+cdef void car_to_cyl(double *w, double *cyl) nogil
+cdef void cyl_to_car(double *cyl, double *w) nogil
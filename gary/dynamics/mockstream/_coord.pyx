@@ -23,7 +23,7 @@ cdef extern from "math.h":
     double fmod(double y, double x) nogil
 
 cdef void sat_rotation_matrix(double *w, # in
-                              double *R): # out
+                              double *R) nogil: # out
     cdef:
         double x1_norm, x2_norm, x3_norm = 0.
         unsigned int i
@@ -63,7 +63,7 @@ cdef void sat_rotation_matrix(double *w, # in
     R[8] = x3[2]
 
 cdef void to_sat_coords(double *w, double *R, # in
-                        double *w_prime): # out
+                        double *w_prime) nogil: # out
     # Translate to be centered on progenitor
     cdef int i
 
@@ -77,7 +77,7 @@ cdef void to_sat_coords(double *w, double *R, # in
     w_prime[5] = w[3]*R[6] + w[4]*R[7] + w[5]*R[8]
 
 cdef void from_sat_coords(double *w_prime, double *R, # in
-                          double *w): # out
+                          double *w) nogil: # out
     cdef int i
 
     # Project back from sat plane
@@ -92,7 +92,7 @@ cdef void from_sat_coords(double *w_prime, double *R, # in
 # ---------------------------------------------------------------------
 
 cdef void car_to_cyl(double *w, # in
-                     double *cyl): # out
+                     double *cyl) nogil: # out
     cdef:
         double R = sqrt(w[0]*w[0] + w[1]*w[1])
         double phi = atan2(w[1], w[0])
@@ -110,7 +110,7 @@ cdef void car_to_cyl(double *w, # in
     cyl[5] = w[5]
 
 cdef void cyl_to_car(double *cyl, # in
-                     double *w): # out
+                     double *w) nogil: # out
     w[0] = cyl[0] * cos(cyl[1])
     w[1] = cyl[0] * sin(cyl[1])
     w[2] = cyl[2]
@@ -12,6 +12,9 @@ from __future__ import division, print_function
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
 
+# Standard library
+import threading
+
 # Third-party
 import numpy as np
 cimport numpy as np
@@ -21,44 +24,159 @@ from libc.math cimport M_PI
 from cpython.exc cimport PyErr_CheckSignals
 
 from ...potential.cpotential cimport _CPotential
+from ...potential.cpotential import _CCompositePotential
+from ...integrate.cyintegrators.leapfrog cimport c_init_velocity, c_leapfrog_step
 from ._coord cimport (sat_rotation_matrix, to_sat_coords, from_sat_coords,
                       cyl_to_car, car_to_cyl)
 
-__all__ = ['_mock_stream_dop853']
+__all__ = ['_mock_stream_dop853', '_mock_stream_leapfrog']
 
 cdef extern from "math.h":
     double sqrt(double x) nogil
+    double pow(double x, double y) nogil
 
 cdef extern from "dop853.h":
-    ctypedef void (*GradFn)(double *pars, double *q, double *grad) nogil
-    ctypedef void (*SolTrait)(long nr, double xold, double x, double* y, unsigned n, int* irtrn)
+    ctypedef struct Dop853Workspace:
+        void *solout_data
+
+    ctypedef void (*GradFn)(double t, double *pars, double *q, double *grad) nogil
+    ctypedef void (*SolTraitWs)(long nr, double xold, double x, double* y, unsigned n, int* irtrn,
+                                Dop853Workspace *ws) nogil
     ctypedef void (*FcnEqDiff)(unsigned n, double x, double *y, double *f, GradFn gradfunc, double *gpars, unsigned norbits) nogil
 
+    Dop853Workspace *dop853_workspace_alloc() nogil
+    void dop853_workspace_free(Dop853Workspace *ws) nogil
+    double contd8_ws (Dop853Workspace *ws, unsigned ii, double x) nogil
+
     # See dop853.h for full description of all input parameters
-    int dop853 (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
-                double x, double* y, double xend,
-                double* rtoler, double* atoler, int itoler, SolTrait solout,
-                int iout, FILE* fileout, double uround, double safe, double fac1,
-                double fac2, double beta, double hmax, double h, long nmax, int meth,
-                long nstiff, unsigned nrdens, unsigned* icont, unsigned licont)
+    int dop853_ws (Dop853Workspace *ws,
+                   unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+                   double x, double* y, double xend,
+                   double* rtoler, double* atoler, int itoler, SolTraitWs solout,
+                   int iout, FILE* fileout, double uround, double safe, double fac1,
+                   double fac2, double beta, double hmax, double h, long nmax, int meth,
+                   long nstiff, unsigned nrdens, unsigned* icont, unsigned licont) nogil
 
     void Fwrapper (unsigned ndim, double t, double *w, double *f,
-                   GradFn func, double *pars, unsigned norbits)
-    double six_norm (double *x)
+                   GradFn func, double *pars, unsigned norbits) nogil
+    double six_norm (double *x) nogil
 
 cdef extern from "stdio.h":
     ctypedef struct FILE
     FILE *stdout
 
-cpdef _mock_stream_dop853(_CPotential cpotential, double[::1] t, double[:,::1] prog_w,
-                          int release_every,
-                          _k_mean, _k_disp,
-                          double G, _prog_mass,
-                          double atol=1E-10, double rtol=1E-10, int nmax=0):
+# State for the dense output callback, passed through to solout() via the
+#   workspace so that concurrent integrations don't share anything.
+cdef struct DenseOutput:
+    double *t # requested output times
+    double *w # output array, row j starts at w + j*stride
+    int stride # distance between output rows
+    int ntimes # number of requested output times
+    int j # index of the next output time to fill
+    double posneg # direction of integration
+
+cdef void solout(long nr, double xold, double x, double* y, unsigned n, int* irtrn,
+                 Dop853Workspace *ws) nogil:
+    """
+    Called by dop853_ws() after every accepted step. Fills all of the requested
+    output times that lie in the step just taken, (xold, x], using the
+    dense output interpolant.
+    """
+    cdef DenseOutput *dense = <DenseOutput*>ws.solout_data
+    cdef unsigned i
+    cdef double tj
+
+    while dense.j < dense.ntimes:
+        tj = dense.t[dense.j]
+        if (x - tj) * dense.posneg < 0:
+            break
+
+        if nr == 1 or tj == x:
+            for i in range(n):
+                dense.w[dense.j*dense.stride + i] = y[i]
+        else:
+            for i in range(n):
+                dense.w[dense.j*dense.stride + i] = contd8_ws(ws, i, tj)
+
+        dense.j += 1
+
+cdef _check_result(int res):
+    if res == -1:
+        raise RuntimeError("Input is not consistent.")
+    elif res == -2:
+        raise RuntimeError("Larger nmax is needed.")
+    elif res == -3:
+        raise RuntimeError("Step size becomes too small.")
+    elif res == -4:
+        raise RuntimeError("The problem is probably stiff (interrupted).")
+
+def _stream_cpotential(_CPotential cpotential, _CPotential prog_cpotential):
+    """
+    The potential that the stream particles are integrated in: the host
+    potential, plus the potential of the progenitor if specified.
+    """
+    if prog_cpotential is None:
+        return cpotential
+    return _CCompositePotential([cpotential, prog_cpotential])
+
+def _run_parallel(worker, int n, int nthreads, args):
+    """
+    Call ``worker(*args, i1, i2, stop)`` for contiguous blocks of the ``n``
+    particles, in ``nthreads`` threads if more than one. If the calling
+    thread is interrupted, ``stop[0]`` is set so that the workers return
+    early, and the exception is re-raised once they have finished.
     """
-    _mock_stream(cpotential, t, prog_w, release_every, k_mean, k_disp, G, prog_mass, atol, rtol, nmax)
+    cdef int i
 
-    Generate a mock stellar stream using the Streakline method.
+    nthreads = max(1, min(nthreads, n))
+    bounds = np.linspace(0, n, nthreads+1).astype(int)
+    stop = np.zeros(1, dtype=np.intc)
+    results = [None]*nthreads
+
+    def target(i):
+        # store the result code (or exception) so it can be raised in the
+        #   calling thread
+        try:
+            results[i] = worker(*(tuple(args) + (bounds[i], bounds[i+1], stop)))
+        except Exception as e:
+            results[i] = e
+
+    if nthreads == 1:
+        target(0)
+
+    else:
+        threads = [threading.Thread(target=target, args=(i,))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                # join with a timeout so the main thread stays interruptible
+                while thread.is_alive():
+                    thread.join(0.1)
+        except BaseException:
+            stop[0] = 1
+            for thread in threads:
+                thread.join()
+            raise
+
+    for res in results:
+        if isinstance(res, Exception):
+            raise res
+        _check_result(res)
+
+def _mock_stream_ics(_CPotential cpotential, double[::1] t, double[:,::1] prog_w,
+                     int release_every, _k_mean, _k_disp, double G, _prog_mass,
+                     random_state=None):
+    """
+    _mock_stream_ics(cpotential, t, prog_w, release_every, k_mean, k_disp, G, prog_mass, random_state=None)
+
+    Generate the initial conditions for the particles released from the
+    progenitor. Two particles are released (at the inner and outer Lagrange
+    points) every ``release_every`` timesteps. The random ``k`` factors for
+    all particles are drawn at once, then the release conditions are computed
+    with the GIL released.
 
     Parameters
     ----------
@@ -84,161 +202,448 @@ cpdef _mock_stream_dop853(_CPotential cpotential, double[::1] t, double[:,::1] p
     prog_mass : float or `numpy.ndarray`
         The mass of the progenitor or the mass at each time. Should be a scalar or have
         shape ``(ntimesteps,)``.
-    atol : numeric (optional)
-        Passed to the integrator. Absolute tolerance parameter. Default is 1E-10.
-    rtol : numeric (optional)
-        Passed to the integrator. Relative tolerance parameter. Default is 1E-10.
-    nmax : int (optional)
-        Passed to the integrator.
+    random_state : `numpy.random.RandomState` (optional)
+        Used to draw the ``k`` factors. Defaults to the global ``numpy.random``
+        state.
+
+    Returns
+    -------
+    w : `numpy.ndarray`
+        Initial conditions of the particles, shape ``(nparticles,ndim)``.
+    t1 : `numpy.ndarray`
+        Release times of the particles, shape ``(nparticles,)``.
     """
     cdef:
         int i, j, k # indexing
-        int res # result from calling dop853
         int ntimes = t.shape[0] # number of times
-        int nparticles # total number of test particles released
+        int nrelease = (ntimes - 1) // release_every + 1 # number of release times
+        int nparticles = 2 * nrelease # total number of test particles released
 
         unsigned ndim = prog_w.shape[1] # phase-space dimensionality
-        unsigned ndim_2 = ndim / 2 # configuration-space dimensionality
-
-        double dt0 = t[1] - t[0] # initial timestep
-        double[::1] tmp = np.zeros(3) # temporary array
 
         double[::1] w_prime = np.zeros(6) # 6-position of stripped star
         double[::1] cyl = np.zeros(6) # 6-position in cylindrical coords
         double[::1] prog_w_prime = np.zeros(6) # 6-position of progenitor rotated
         double[::1] prog_cyl = np.zeros(6) # 6-position of progenitor in cylindrical coords
 
-        # k-factors for parametrized model of Fardal et al. (2015)
-        double[::1] ks = np.zeros(6)
-
-        # used for figuring out how many orbits to integrate at any given release time
-        unsigned this_ndim, this_norbits
-
-        double Om # angular velocity squared
-        double d, sigma_r # distance, dispersion in release positions
-        double r_tide, menc, f # tidal radius, mass enclosed, f factor
+        double Om # angular velocity
+        double d, Lx, Ly, Lz # distance, angular momentum
+        double r_tide, f # tidal radius, f factor
+        double sign # +1 for the outer, -1 for the inner Lagrange point
 
         double[::1] eps = np.zeros(3) # used for 2nd derivative estimation
         double[:,::1] R = np.zeros((3,3)) # rotation matrix
 
-        double[::1] prog_mass = np.ascontiguousarray(np.atleast_1d(_prog_mass))
-        double[:,::1] k_mean = np.ascontiguousarray(np.atleast_2d(_k_mean))
-        double[:,::1] k_disp = np.ascontiguousarray(np.atleast_2d(_k_disp))
-        double[::1] mu_k
-        double[::1] sigma_k
+        double[::1] prog_mass
+        double[:,:,::1] ks # k-factors for parametrized model of Fardal et al. (2015)
+
+        # container for only current positions of all particles
+        double[::1] w = np.zeros(nparticles*ndim)
+
+        # beginning times for each particle
+        double[::1] t1 = np.empty(nparticles)
+
+    if random_state is None:
+        random_state = np.random
+
+    # mass and k parameters at each release time
+    release_ix = np.arange(0, ntimes, release_every)
+
+    m = np.atleast_1d(_prog_mass).astype(np.float64)
+    if m.shape[0] > 1:
+        m = m[release_ix]
+    prog_mass = np.array(np.broadcast_to(m, (nrelease,)), dtype=np.float64)
+
+    k_mean = np.atleast_2d(_k_mean).astype(np.float64)
+    k_disp = np.atleast_2d(_k_disp).astype(np.float64)
+    if k_mean.shape[0] > 1:
+        k_mean = k_mean[release_ix]
+    if k_disp.shape[0] > 1:
+        k_disp = k_disp[release_ix]
+
+    # draw the k-factors for both particles at all release times at once
+    ks = np.ascontiguousarray(random_state.normal(size=(nrelease,2,6)) * k_disp[:,None] +
+                              k_mean[:,None])
+
+    with nogil:
+        for i in range(nrelease):
+            j = i * release_every
+
+            t1[2*i] = t[j]
+            t1[2*i+1] = t[j]
+
+            # angular velocity
+            d = sqrt(prog_w[j,0]*prog_w[j,0] +
+                     prog_w[j,1]*prog_w[j,1] +
+                     prog_w[j,2]*prog_w[j,2])
+            Lx = prog_w[j,1]*prog_w[j,5] - prog_w[j,2]*prog_w[j,4]
+            Ly = prog_w[j,2]*prog_w[j,3] - prog_w[j,0]*prog_w[j,5]
+            Lz = prog_w[j,0]*prog_w[j,4] - prog_w[j,1]*prog_w[j,3]
+            Om = sqrt(Lx*Lx + Ly*Ly + Lz*Lz) / (d*d)
+
+            # gradient of potential in radial direction
+            f = Om*Om - cpotential._d2_dr2(t[j], &prog_w[j,0], &eps[0], G)
+            r_tide = pow(G*prog_mass[i] / f, 1/3.)
+
+            # the rotation matrix to transform from satellite coords to normal
+            sat_rotation_matrix(&prog_w[j,0], &R[0,0])
+            to_sat_coords(&prog_w[j,0], &R[0,0], &prog_w_prime[0])
+            car_to_cyl(&prog_w_prime[0], &prog_cyl[0])
+
+            # eject stars at tidal radius with same angular velocity as progenitor
+            for k in range(2):
+                if k == 0:
+                    sign = 1.
+                else:
+                    sign = -1.
+
+                cyl[0] = prog_cyl[0] + sign*ks[i,k,0]*r_tide
+                cyl[1] = prog_cyl[1] + sign*ks[i,k,1]*r_tide/prog_cyl[0]
+                cyl[2] = ks[i,k,2]*r_tide/prog_cyl[0]
+                cyl[3] = prog_cyl[3] + ks[i,k,3]*prog_cyl[3]
+                cyl[4] = prog_cyl[4] + sign*ks[i,k,0]*ks[i,k,4]*Om*r_tide
+                cyl[5] = ks[i,k,5]*Om*r_tide
+                cyl_to_car(&cyl[0], &w_prime[0])
+                from_sat_coords(&w_prime[0], &R[0,0], &w[(2*i+k)*ndim])
+
+    return np.asarray(w).reshape(nparticles, ndim), np.asarray(t1)
+
+def _mock_stream_dop853_worker(_CPotential cpotential, double[::1] t1, double[::1] w,
+                               double t_end, double dt0, double atol, double rtol, int nmax,
+                               double[::1] t_output, double[:,:,::1] out,
+                               int i1, int i2, int[::1] stop):
+    """
+    Integrate particles ``i1 <= i < i2`` from their release times, ``t1``, to
+    ``t_end``. If any output times, ``t_output``, are given, the particles are
+    also stored in ``out`` at each of these times after they are released,
+    using the dense output interpolant. Returns the result code from
+    ``dop853_ws()``.
+    """
+    cdef:
+        int i, j, k
+        int res = 1
+        int iout = 0
+        unsigned ndim = w.shape[0] // t1.shape[0]
+        int nout = t_output.shape[0]
+        int jstart # index of the first output time after release
+        double posneg = 1. if t_end >= t1[0] else -1.
+        DenseOutput dense
+        GradFn gradfunc = <GradFn>cpotential.c_gradient
+        double *pars = &(cpotential._parameters[0])
+        Dop853Workspace *ws = dop853_workspace_alloc()
+
+    if ws == NULL:
+        raise MemoryError("Failed to allocate DOP853 workspace.")
+
+    if nout > 0:
+        iout = 2 # dense output performed in solout
+        dense.stride = out.shape[1]*ndim
+        dense.posneg = posneg
+        ws.solout_data = &dense
+
+    try:
+        for i in range(i1,i2):
+            if stop[0]:
+                break
+
+            with nogil:
+                if iout:
+                    jstart = 0
+                    while jstart < nout and (t_output[jstart] - t1[i])*posneg < 0:
+                        jstart += 1
+
+                    dense.t = &t_output[0] + jstart
+                    dense.w = &out[0,i,0] + jstart*dense.stride
+                    dense.ntimes = nout - jstart
+                    dense.j = 0
+
+                res = dop853_ws(ws, ndim, <FcnEqDiff> Fwrapper,
+                                gradfunc, pars, 1,
+                                t1[i], &w[i*ndim], t_end, &rtol, &atol, 0, solout, iout,
+                                NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1,
+                                ndim if iout else 0, NULL, 0)
+
+                # the last step can end a hair short of t_end from roundoff
+                if iout and res >= 0:
+                    for j in range(jstart + dense.j, nout):
+                        for k in range(ndim):
+                            out[j,i,k] = w[i*ndim + k]
+
+            if res < 0:
+                break
+
+            PyErr_CheckSignals()
+
+    finally:
+        dop853_workspace_free(ws)
+
+    return res
 
-    # figure out how many particles are going to be released into the "stream"
-    if ntimes % release_every == 0:
-        nparticles = 2 * (ntimes // release_every)
-    else:
-        nparticles = 2 * (ntimes // release_every + 1)
+cpdef _mock_stream_dop853(_CPotential cpotential, double[::1] t, double[:,::1] prog_w,
+                          int release_every,
+                          _k_mean, _k_disp,
+                          double G, _prog_mass,
+                          double atol=1E-10, double rtol=1E-10, int nmax=0,
+                          int nthreads=1, random_state=None, t_output=None,
+                          _CPotential prog_cpotential=None):
+    """
+    _mock_stream_dop853(cpotential, t, prog_w, release_every, k_mean, k_disp, G, prog_mass, atol, rtol, nmax, nthreads, random_state, t_output, prog_cpotential)
 
-    # container for only current positions of all particles
-    cdef double[::1] w = np.empty(nparticles*ndim)
+    Generate a mock stellar stream using the Streakline method. Each
+    particle is integrated from its release time to the final time with
+    the adaptive DOP853 integrator.
 
-    # beginning times for each particle
-    cdef double[::1] t1 = np.empty(nparticles)
-    cdef double t_end = t[ntimes-1]
+    If ``t_output`` is given, the particles are also recorded at each of
+    these times during the same integration (using the dense output
+    interpolant), and the positions of all particles at all output times are
+    returned along with a boolean mask that is ``True`` where a particle has
+    been released. Particles that haven't been released yet are set to NaN.
 
-    # -------
+    Parameters
+    ----------
+    cpotential : `gary.potential._CPotential`
+        An instance of a ``_CPotential`` representing the gravitational potential.
+    t : `numpy.ndarray`
+        An array of times. Should have shape ``(ntimesteps,)``.
+    prog_w : `numpy.ndarray`
+        The 6D coordinates for the orbit of the progenitor system at all times.
+        Should have shape ``(ntimesteps,6)``.
+    release_every : int
+        Release particles at the Lagrange points every X timesteps.
+    k_mean : `numpy.ndarray`
+        See `_mock_stream_ics`.
+    k_disp : `numpy.ndarray`
+        See `_mock_stream_ics`.
+    G : numeric
+        The value of the gravitational constant, G, in the unit system used.
+    prog_mass : float or `numpy.ndarray`
+        The mass of the progenitor or the mass at each time. Should be a scalar or have
+        shape ``(ntimesteps,)``.
+    atol : numeric (optional)
+        Passed to the integrator. Absolute tolerance parameter. Default is 1E-10.
+    rtol : numeric (optional)
+        Passed to the integrator. Relative tolerance parameter. Default is 1E-10.
+    nmax : int (optional)
+        Passed to the integrator.
+    nthreads : int (optional)
+        Number of threads to split the particles over.
+    random_state : `numpy.random.RandomState` (optional)
+        Used to draw the random release conditions.
+    t_output : `numpy.ndarray` (optional)
+        Times at which to record the particles. Must be sorted in the direction
+        of integration and lie within the range of ``t``.
+    prog_cpotential : `gary.potential._CPotential` (optional)
+        The potential of the progenitor, e.g. a moving Plummer sphere that
+        follows the progenitor orbit. If specified, this is added to
+        ``cpotential`` when integrating the stream particles (but not when
+        computing the release conditions).
+
+    Returns
+    -------
+    w : `numpy.ndarray`
+        The final positions of the particles, with shape ``(nparticles,6)``.
+        Or, if ``t_output`` is given, the positions at the output times with
+        shape ``(noutput,nparticles,6)``.
+    released : `numpy.ndarray`
+        Only returned if ``t_output`` is given. Boolean array with shape
+        ``(noutput,nparticles)``.
+    """
+    cdef:
+        int ntimes = t.shape[0] # number of times
+        int nparticles # total number of test particles released
+        unsigned ndim = prog_w.shape[1] # phase-space dimensionality
+        double dt0 = t[1] - t[0] # initial timestep
+        double t_end = t[ntimes-1]
+        double posneg = 1. if t_end >= t[0] else -1.
+        double[::1] w # container for only current positions of all particles
+        double[::1] t1 # beginning times for each particle
+        double[::1] _t_output # output times
+        double[:,:,::1] out # positions of all particles at the output times
+
+    _w, _t1 = _mock_stream_ics(cpotential, t, prog_w, release_every,
+                               _k_mean, _k_disp, G, _prog_mass,
+                               random_state=random_state)
+    nparticles = _w.shape[0]
+    w = _w.reshape(-1)
+    t1 = _t1
+
+    if t_output is None:
+        _t_output = np.empty(0)
+    else:
+        _t_output = np.ascontiguousarray(np.atleast_1d(t_output), dtype=np.float64)
+    out = np.full((_t_output.shape[0],nparticles,ndim), np.nan)
 
-    # copy over initial conditions from progenitor orbit to each streakline star
-    i = 0
-    for j in range(ntimes):
-        if (j % release_every) != 0:
-            continue
+    # integrate each particle to the final time -- the particles are split
+    #   over the threads, each of which reuses one workspace for all of its
+    #   particles with the GIL released while integrating
+    _run_parallel(_mock_stream_dop853_worker, nparticles, nthreads,
+                  (_stream_cpotential(cpotential, prog_cpotential), t1, w, t_end, dt0,
+                   atol, rtol, nmax, _t_output, out))
 
-        for k in range(ndim):
-            w[2*i*ndim + k] = prog_w[j,k]
-            w[2*i*ndim + k + ndim] = prog_w[j,k]
+    if t_output is None:
+        return np.asarray(w).reshape(nparticles, ndim)
 
-        i += 1
+    released = (np.asarray(_t_output)[:,None] - np.asarray(t1)[None]) * posneg >= 0
+    return np.asarray(out), released
 
-    # now go back to each set of initial conditions and modify initial condition
-    #   based on mock prescription
-    i = 0
-    for j in range(ntimes):
-        if (j % release_every) != 0:
-            continue
+cdef int _store_snapshots(int j, double[:,::1] w, int release_every,
+                          int[::1] out_ix, double[:,:,::1] out, int k,
+                          int i1, int i2) nogil:
+    """
+    Store particles ``i1 <= i < i2`` that have been released by step ``j``
+    in ``out`` for all output steps ``out_ix[k:]`` equal to ``j``. Returns
+    the index of the next output step.
+    """
+    cdef int i, m
 
-        t1[2*i] = t[j]
-        t1[2*i+1] = t[j]
+    while k < out_ix.shape[0] and out_ix[k] == j:
+        for i in range(i1,i2):
+            if (i // 2) * release_every > j:
+                break
 
-        if prog_mass.shape[0] == 1:
-            M = prog_mass[0]
-        else:
-            M = prog_mass[j]
+            for m in range(w.shape[1]):
+                out[k,i,m] = w[i,m]
+        k += 1
 
-        if k_mean.shape[0] == 1:
-            mu_k = k_mean[0]
-            sigma_k = k_disp[0]
-        else:
-            mu_k = k_mean[j]
-            sigma_k = k_disp[j]
-
-        # angular velocity
-        d = sqrt(prog_w[j,0]*prog_w[j,0] +
-                 prog_w[j,1]*prog_w[j,1] +
-                 prog_w[j,2]*prog_w[j,2])
-        Om = np.linalg.norm(np.cross(prog_w[j,:3], prog_w[j,3:]) / d**2)
-
-        # gradient of potential in radial direction
-        f = Om*Om - cpotential._d2_dr2(t[j], &prog_w[j,0], &eps[0], G)
-        r_tide = (G*M / f)**(1/3.)
-
-        # the rotation matrix to transform from satellite coords to normal
-        sat_rotation_matrix(&prog_w[j,0], &R[0,0])
-        to_sat_coords(&prog_w[j,0], &R[0,0], &prog_w_prime[0])
-        car_to_cyl(&prog_w_prime[0], &prog_cyl[0])
-
-        for k in range(6):
-            if sigma_k[k] > 0:
-                ks[k] = np.random.normal(mu_k[k], sigma_k[k])
-            else:
-                ks[k] = mu_k[k]
-
-        # eject stars at tidal radius with same angular velocity as progenitor
-        cyl[0] = prog_cyl[0] + ks[0]*r_tide
-        cyl[1] = prog_cyl[1] + ks[1]*r_tide/prog_cyl[0]
-        cyl[2] = ks[2]*r_tide/prog_cyl[0]
-        cyl[3] = prog_cyl[3] + ks[3]*prog_cyl[3]
-        cyl[4] = prog_cyl[4] + ks[0]*ks[4]*Om*r_tide
-        cyl[5] = ks[5]*Om*r_tide
-        cyl_to_car(&cyl[0], &w_prime[0])
-        from_sat_coords(&w_prime[0], &R[0,0], &w[2*i*ndim])
-
-        for k in range(6):
-            if sigma_k[k] > 0:
-                ks[k] = np.random.normal(mu_k[k], sigma_k[k])
-            else:
-                ks[k] = mu_k[k]
-
-        cyl[0] = prog_cyl[0] - ks[0]*r_tide
-        cyl[1] = prog_cyl[1] - ks[1]*r_tide/prog_cyl[0]
-        cyl[2] = ks[2]*r_tide/prog_cyl[0]
-        cyl[3] = prog_cyl[3] + ks[3]*prog_cyl[3]
-        cyl[4] = prog_cyl[4] - ks[0]*ks[4]*Om*r_tide
-        cyl[5] = ks[5]*Om*r_tide
-        cyl_to_car(&cyl[0], &w_prime[0])
-        from_sat_coords(&w_prime[0], &R[0,0], &w[2*i*ndim + ndim])
-
-        i += 1
-
-    for i in range(nparticles):
-        res = dop853(ndim, <FcnEqDiff> Fwrapper,
-                     <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), 1,
-                     t1[i], &w[i*ndim], t_end, &rtol, &atol, 0, NULL, 0,
-                     NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1, 0, NULL, 0);
-
-        if res == -1:
-            raise RuntimeError("Input is not consistent.")
-        elif res == -2:
-            raise RuntimeError("Larger nmax is needed.")
-        elif res == -3:
-            raise RuntimeError("Step size becomes too small.")
-        elif res == -4:
-            raise RuntimeError("The problem is probably stff (interrupted).")
+    return k
+
+def _mock_stream_leapfrog_worker(_CPotential cpotential, double[::1] t, double[:,::1] w,
+                                 double[:,::1] v_jm1_2, int release_every,
+                                 int[::1] out_ix, double[:,:,::1] out,
+                                 int i1, int i2, int[::1] stop):
+    """
+    Integrate particles ``i1 <= i < i2`` in lock-step from their release
+    times to the final time. The released particles are stored in ``out``
+    at each of the (sorted) output steps, ``out_ix``.
+    """
+    cdef:
+        int i, j
+        int k = 0 # index of the next output step
+        int ntimes = t.shape[0]
+        int ndim_2 = w.shape[1] // 2 # configuration-space dimensionality
+        int j1 # release step of the particle
+        double dt
+        double[::1] grad = np.zeros(max(ndim_2,3))
+
+    k = _store_snapshots(0, w, release_every, out_ix, out, k, i1, i2)
+
+    for j in range(ntimes-1):
+        if stop[0]:
+            break
+
+        dt = t[j+1] - t[j]
+        with nogil:
+            for i in range(i1,i2):
+                # two particles are released every release_every steps
+                j1 = (i // 2) * release_every
+                if j1 > j:
+                    break
+
+                # particles released at this step: initialize the velocities
+                #   so they are evolved by a half step relative to the positions
+                if j1 == j:
+                    c_init_velocity(cpotential, ndim_2, t[j], dt,
+                                    &w[i,0], &w[i,ndim_2], &v_jm1_2[i,0], &grad[0])
+
+                c_leapfrog_step(cpotential, ndim_2, t[j+1], dt,
+                                &w[i,0], &w[i,ndim_2], &v_jm1_2[i,0], &grad[0])
+
+            k = _store_snapshots(j+1, w, release_every, out_ix, out, k, i1, i2)
 
         PyErr_CheckSignals()
 
-    return np.asarray(w).reshape(nparticles, ndim)
+    return 1
+
+cpdef _mock_stream_leapfrog(_CPotential cpotential, double[::1] t, double[:,::1] prog_w,
+                            int release_every,
+                            _k_mean, _k_disp,
+                            double G, _prog_mass, int nthreads=1, random_state=None,
+                            t_output=None, _CPotential prog_cpotential=None):
+    """
+    _mock_stream_leapfrog(cpotential, t, prog_w, release_every, k_mean, k_disp, G, prog_mass, nthreads, random_state, t_output, prog_cpotential)
+
+    Generate a mock stellar stream using the Streakline method. All released
+    particles are integrated in lock-step with the Leapfrog integrator on the
+    time grid of the progenitor orbit, starting from their release times.
+
+    If ``t_output`` is given, the particles are also recorded at each of
+    these times during the same integration, and the positions of all
+    particles at all output times are returned along with a boolean mask that
+    is ``True`` where a particle has been released. Particles that haven't
+    been released yet are set to NaN. Output times are rounded to the
+    nearest time in ``t``.
+
+    Parameters
+    ----------
+    cpotential : `gary.potential._CPotential`
+        An instance of a ``_CPotential`` representing the gravitational potential.
+    t : `numpy.ndarray`
+        An array of times. Should have shape ``(ntimesteps,)``.
+    prog_w : `numpy.ndarray`
+        The 6D coordinates for the orbit of the progenitor system at all times.
+        Should have shape ``(ntimesteps,6)``.
+    release_every : int
+        Release particles at the Lagrange points every X timesteps.
+    k_mean : `numpy.ndarray`
+        See `_mock_stream_ics`.
+    k_disp : `numpy.ndarray`
+        See `_mock_stream_ics`.
+    G : numeric
+        The value of the gravitational constant, G, in the unit system used.
+    prog_mass : float or `numpy.ndarray`
+        The mass of the progenitor or the mass at each time. Should be a scalar or have
+        shape ``(ntimesteps,)``.
+    nthreads : int (optional)
+        Number of threads to split the particles over.
+    random_state : `numpy.random.RandomState` (optional)
+        Used to draw the random release conditions.
+    t_output : `numpy.ndarray` (optional)
+        Times at which to record the particles. Must be sorted in the direction
+        of integration and lie within the range of ``t``.
+    prog_cpotential : `gary.potential._CPotential` (optional)
+        The potential of the progenitor, e.g. a moving Plummer sphere that
+        follows the progenitor orbit. If specified, this is added to
+        ``cpotential`` when integrating the stream particles (but not when
+        computing the release conditions).
+
+    Returns
+    -------
+    w : `numpy.ndarray`
+        The final positions of the particles, with shape ``(nparticles,6)``.
+        Or, if ``t_output`` is given, the positions at the output times with
+        shape ``(noutput,nparticles,6)``.
+    released : `numpy.ndarray`
+        Only returned if ``t_output`` is given. Boolean array with shape
+        ``(noutput,nparticles)``.
+    """
+    cdef:
+        int nparticles # total number of test particles released
+        int ndim_2 = prog_w.shape[1] // 2 # configuration-space dimensionality
+        double[:,::1] w # current positions of all particles
+        double[:,::1] v_jm1_2 # velocities, half a step ahead of the positions
+        int[::1] out_ix # indices of the output times in t
+        double[:,:,::1] out # positions of all particles at the output times
+
+    _w, _t1 = _mock_stream_ics(cpotential, t, prog_w, release_every,
+                               _k_mean, _k_disp, G, _prog_mass,
+                               random_state=random_state)
+    nparticles = _w.shape[0]
+    w = _w
+    v_jm1_2 = np.zeros((nparticles,ndim_2))
+
+    if t_output is None:
+        out_ix = np.empty(0, dtype=np.intc)
+    else:
+        _t = np.asarray(t)
+        out_ix = np.abs(_t[None] - np.atleast_1d(t_output)[:,None]).argmin(axis=1).astype(np.intc)
+    out = np.full((out_ix.shape[0],nparticles,2*ndim_2), np.nan)
+
+    _run_parallel(_mock_stream_leapfrog_worker, nparticles, nthreads,
+                  (_stream_cpotential(cpotential, prog_cpotential), t, w, v_jm1_2,
+                   release_every, out_ix, out))
+
+    if t_output is None:
+        return np.asarray(w)
+
+    released = (np.arange(nparticles)[None] // 2) * release_every <= np.asarray(out_ix)[:,None]
+    return np.asarray(out), released
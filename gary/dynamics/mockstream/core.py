@@ -10,16 +10,17 @@ import astropy.units as u
 import numpy as np
 
 # Project
-from .. import CartesianPhaseSpacePosition
-from ...potential import CPotentialBase
+from .. import CartesianPhaseSpacePosition, CartesianOrbit
+from ...potential import CPotentialBase, MovingPlummerPotential
 from ...integrate import DOPRI853Integrator, LeapfrogIntegrator
-from ._mockstream import _mock_stream_dop853#, _mock_stream_leapfrog
+from ._mockstream import _mock_stream_dop853, _mock_stream_leapfrog
 
 __all__ = ['mock_stream', 'streakline_stream', 'fardal_stream', 'dissolved_fardal_stream']
 
 def mock_stream(potential, w0, prog_mass, k_mean, k_disp,
                 t_f, dt=1., t_0=0., release_every=1,
-                Integrator=LeapfrogIntegrator, Integrator_kwargs=dict()):
+                Integrator=LeapfrogIntegrator, Integrator_kwargs=dict(), nthreads=1,
+                random_state=None, output_times=None, prog_b=None):
     """
     Generate a mock stellar stream in the specified potential with a
     progenitor system that ends up at the specified position.
@@ -55,11 +56,32 @@ def mock_stream(potential, w0, prog_mass, k_mean, k_disp,
         Integrator to use.
     Integrator_kwargs : dict (optional)
         Any extra keyword argumets to pass to the integrator function.
+    nthreads : int (optional)
+        Number of threads to split the integration of the stream particles over.
+    random_state : `numpy.random.RandomState`, int (optional)
+        A random number generator, or a seed to create one, used to draw the
+        release conditions of the stream particles. Defaults to the global
+        ``numpy.random`` state.
+    output_times : array_like (optional)
+        If specified, also record the stream at each of these times during
+        the same integration. With the Leapfrog integrator, the times are
+        rounded to the nearest timestep.
+    prog_b : numeric (optional)
+        If specified, include the self-gravity of the progenitor: the stream
+        particles also feel a Plummer sphere with this scale radius and mass
+        ``prog_mass`` that follows the orbit of the progenitor.
 
     Returns
     -------
     prog_orbit : `~gary.dynamics.CartesianOrbit`
     stream : `~gary.dynamics.CartesianPhaseSpacePosition`
+        Or, if ``output_times`` is specified, a `~gary.dynamics.CartesianOrbit`
+        containing all particles at the (sorted) output times. Particles that
+        haven't been released yet at a given time are set to NaN.
+    released : `numpy.ndarray`
+        Only returned if ``output_times`` is specified. A boolean array with
+        shape ``(len(output_times), nparticles)`` that is ``True`` where a
+        particle has been released.
 
     """
 
@@ -79,6 +101,11 @@ def mock_stream(potential, w0, prog_mass, k_mean, k_disp,
         raise ValueError("Input potential must be a CPotentialBase subclass.")
     # ------------------------------------------------------------------------
 
+    if random_state is None:
+        random_state = np.random
+    elif not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
     # integrate the orbit of the progenitor system
     # TODO: t1 and dt should support units
     if (t_f-t_0) < 0.:
@@ -99,23 +126,55 @@ def mock_stream(potential, w0, prog_mass, k_mean, k_disp,
     prog_w = np.ascontiguousarray(prog_orbit.w(potential.units)[...,0].T) # transpose for Cython funcs
     prog_t = np.ascontiguousarray(prog_orbit.t.decompose(potential.units).value)
 
+    if prog_b is None:
+        prog_cpotential = None
+    else:
+        prog_potential = MovingPlummerPotential(m=prog_mass, b=prog_b, t=prog_t,
+                                                pos=prog_w[:,:3].T, units=potential.units)
+        prog_cpotential = prog_potential.c_instance
+
+    if output_times is not None:
+        output_times = np.sort(np.atleast_1d(output_times)).astype(np.float64)
+        if output_times.min() < prog_t.min() or output_times.max() > prog_t.max():
+            raise ValueError("Output times must lie between t_0 and t_f.")
+
+        if Integrator == LeapfrogIntegrator:
+            ix = np.abs(prog_t[None] - output_times[:,None]).argmin(axis=1)
+            output_times = prog_t[ix]
+
     if Integrator == LeapfrogIntegrator:
-        pass
+        stream_w = _mock_stream_leapfrog(potential.c_instance, t=prog_t, prog_w=prog_w,
+                                         release_every=release_every,
+                                         _k_mean=k_mean, _k_disp=k_disp, G=potential.G,
+                                         _prog_mass=prog_mass, nthreads=nthreads,
+                                         random_state=random_state,
+                                         t_output=output_times,
+                                         prog_cpotential=prog_cpotential)
 
     elif Integrator == DOPRI853Integrator:
         stream_w = _mock_stream_dop853(potential.c_instance, t=prog_t, prog_w=prog_w,
                                        release_every=release_every,
                                        _k_mean=k_mean, _k_disp=k_disp, G=potential.G,
-                                       _prog_mass=prog_mass,
+                                       _prog_mass=prog_mass, nthreads=nthreads,
+                                       random_state=random_state,
+                                       t_output=output_times,
+                                       prog_cpotential=prog_cpotential,
                                        **Integrator_kwargs)
 
     else:
         raise RuntimeError("Should never get here...")
 
+    if output_times is not None:
+        stream_w, released = stream_w
+        stream = CartesianOrbit.from_w(w=stream_w.T.swapaxes(1,2), units=potential.units,
+                                       t=output_times*potential.units['time'])
+        return prog_orbit, stream, released
+
     return prog_orbit, CartesianPhaseSpacePosition.from_w(w=stream_w.T, units=potential.units)
 
 def streakline_stream(potential, w0, prog_mass, t_f, dt=1., t_0=0., release_every=1,
-                      Integrator=LeapfrogIntegrator, Integrator_kwargs=dict()):
+                      Integrator=LeapfrogIntegrator, Integrator_kwargs=dict(), nthreads=1,
+                      random_state=None, output_times=None, prog_b=None):
     """
     Generate a mock stellar stream in the specified potential with a
     progenitor system that ends up at the specified position.
@@ -143,11 +202,32 @@ def streakline_stream(potential, w0, prog_mass, t_f, dt=1., t_0=0., release_ever
         Integrator to use.
     Integrator_kwargs : dict (optional)
         Any extra keyword argumets to pass to the integrator function.
+    nthreads : int (optional)
+        Number of threads to split the integration of the stream particles over.
+    random_state : `numpy.random.RandomState`, int (optional)
+        A random number generator, or a seed to create one, used to draw the
+        release conditions of the stream particles. Defaults to the global
+        ``numpy.random`` state.
+    output_times : array_like (optional)
+        If specified, also record the stream at each of these times during
+        the same integration. With the Leapfrog integrator, the times are
+        rounded to the nearest timestep.
+    prog_b : numeric (optional)
+        If specified, include the self-gravity of the progenitor: the stream
+        particles also feel a Plummer sphere with this scale radius and mass
+        ``prog_mass`` that follows the orbit of the progenitor.
 
     Returns
     -------
     prog_orbit : `~gary.dynamics.CartesianOrbit`
     stream : `~gary.dynamics.CartesianPhaseSpacePosition`
+        Or, if ``output_times`` is specified, a `~gary.dynamics.CartesianOrbit`
+        containing all particles at the (sorted) output times. Particles that
+        haven't been released yet at a given time are set to NaN.
+    released : `numpy.ndarray`
+        Only returned if ``output_times`` is specified. A boolean array with
+        shape ``(len(output_times), nparticles)`` that is ``True`` where a
+        particle has been released.
 
     """
     k_mean = np.zeros(6)
@@ -174,10 +254,13 @@ def streakline_stream(potential, w0, prog_mass, t_f, dt=1., t_0=0., release_ever
     return mock_stream(potential=potential, w0=w0, prog_mass=prog_mass,
                        k_mean=k_mean, k_disp=k_disp,
                        t_f=t_f, dt=dt, t_0=t_0, release_every=release_every,
-                       Integrator=Integrator, Integrator_kwargs=Integrator_kwargs)
+                       Integrator=Integrator, Integrator_kwargs=Integrator_kwargs,
+                       nthreads=nthreads, random_state=random_state,
+                       output_times=output_times, prog_b=prog_b)
 
 def fardal_stream(potential, w0, prog_mass, t_f, dt=1., t_0=0., release_every=1,
-                  Integrator=LeapfrogIntegrator, Integrator_kwargs=dict()):
+                  Integrator=LeapfrogIntegrator, Integrator_kwargs=dict(), nthreads=1,
+                  random_state=None, output_times=None, prog_b=None):
     """
     Generate a mock stellar stream in the specified potential with a
     progenitor system that ends up at the specified position.
@@ -205,11 +288,32 @@ def fardal_stream(potential, w0, prog_mass, t_f, dt=1., t_0=0., release_every=1,
         Integrator to use.
     Integrator_kwargs : dict (optional)
         Any extra keyword argumets to pass to the integrator function.
+    nthreads : int (optional)
+        Number of threads to split the integration of the stream particles over.
+    random_state : `numpy.random.RandomState`, int (optional)
+        A random number generator, or a seed to create one, used to draw the
+        release conditions of the stream particles. Defaults to the global
+        ``numpy.random`` state.
+    output_times : array_like (optional)
+        If specified, also record the stream at each of these times during
+        the same integration. With the Leapfrog integrator, the times are
+        rounded to the nearest timestep.
+    prog_b : numeric (optional)
+        If specified, include the self-gravity of the progenitor: the stream
+        particles also feel a Plummer sphere with this scale radius and mass
+        ``prog_mass`` that follows the orbit of the progenitor.
 
     Returns
     -------
     prog_orbit : `~gary.dynamics.CartesianOrbit`
     stream : `~gary.dynamics.CartesianPhaseSpacePosition`
+        Or, if ``output_times`` is specified, a `~gary.dynamics.CartesianOrbit`
+        containing all particles at the (sorted) output times. Particles that
+        haven't been released yet at a given time are set to NaN.
+    released : `numpy.ndarray`
+        Only returned if ``output_times`` is specified. A boolean array with
+        shape ``(len(output_times), nparticles)`` that is ``True`` where a
+        particle has been released.
 
     """
     k_mean = np.zeros(6)
@@ -236,10 +340,13 @@ def fardal_stream(potential, w0, prog_mass, t_f, dt=1., t_0=0., release_every=1,
     return mock_stream(potential=potential, w0=w0, prog_mass=prog_mass,
                        k_mean=k_mean, k_disp=k_disp,
                        t_f=t_f, dt=dt, t_0=t_0, release_every=release_every,
-                       Integrator=Integrator, Integrator_kwargs=Integrator_kwargs)
+                       Integrator=Integrator, Integrator_kwargs=Integrator_kwargs,
+                       nthreads=nthreads, random_state=random_state,
+                       output_times=output_times, prog_b=prog_b)
 
 def dissolved_fardal_stream(potential, w0, prog_mass, t_disrupt, t_f, dt=1., t_0=0.,
-                            release_every=1, Integrator=LeapfrogIntegrator, Integrator_kwargs=dict()):
+                            release_every=1, Integrator=LeapfrogIntegrator, Integrator_kwargs=dict(), nthreads=1,
+                            random_state=None, output_times=None, prog_b=None):
     """
     Generate a mock stellar stream in the specified potential with a
     progenitor system that ends up at the specified position.
@@ -271,11 +378,32 @@ def dissolved_fardal_stream(potential, w0, prog_mass, t_disrupt, t_f, dt=1., t_0
         Integrator to use.
     Integrator_kwargs : dict (optional)
         Any extra keyword argumets to pass to the integrator function.
+    nthreads : int (optional)
+        Number of threads to split the integration of the stream particles over.
+    random_state : `numpy.random.RandomState`, int (optional)
+        A random number generator, or a seed to create one, used to draw the
+        release conditions of the stream particles. Defaults to the global
+        ``numpy.random`` state.
+    output_times : array_like (optional)
+        If specified, also record the stream at each of these times during
+        the same integration. With the Leapfrog integrator, the times are
+        rounded to the nearest timestep.
+    prog_b : numeric (optional)
+        If specified, include the self-gravity of the progenitor: the stream
+        particles also feel a Plummer sphere with this scale radius and mass
+        ``prog_mass`` that follows the orbit of the progenitor.
 
     Returns
     -------
     prog_orbit : `~gary.dynamics.CartesianOrbit`
     stream : `~gary.dynamics.CartesianPhaseSpacePosition`
+        Or, if ``output_times`` is specified, a `~gary.dynamics.CartesianOrbit`
+        containing all particles at the (sorted) output times. Particles that
+        haven't been released yet at a given time are set to NaN.
+    released : `numpy.ndarray`
+        Only returned if ``output_times`` is specified. A boolean array with
+        shape ``(len(output_times), nparticles)`` that is ``True`` where a
+        particle has been released.
 
     """
 
@@ -309,4 +437,6 @@ def dissolved_fardal_stream(potential, w0, prog_mass, t_disrupt, t_f, dt=1., t_0
     return mock_stream(potential=potential, w0=w0, prog_mass=prog_mass,
                        k_mean=k_mean, k_disp=k_disp,
                        t_f=t_f, dt=dt, t_0=t_0, release_every=release_every,
-                       Integrator=Integrator, Integrator_kwargs=Integrator_kwargs)
+                       Integrator=Integrator, Integrator_kwargs=Integrator_kwargs,
+                       nthreads=nthreads, random_state=random_state,
+                       output_times=output_times, prog_b=prog_b)
@@ -13,13 +13,14 @@ import pytest
 # Custom
 from ....potential import SphericalNFWPotential
 from ....dynamics import CartesianPhaseSpacePosition
-from ....integrate import DOPRI853Integrator
+from ....integrate import DOPRI853Integrator, LeapfrogIntegrator
 from ....units import galactic
 
 # Project
 from ..core import mock_stream, streakline_stream, fardal_stream, dissolved_fardal_stream
 
-def test_mock_stream():
+@pytest.mark.parametrize("Integrator", [LeapfrogIntegrator, DOPRI853Integrator])
+def test_mock_stream(Integrator):
     potential = SphericalNFWPotential(v_c=0.2, r_s=20., units=galactic)
 
     w0 = CartesianPhaseSpacePosition(pos=[0.,15.,0]*u.kpc,
@@ -28,7 +29,7 @@ def test_mock_stream():
     k_disp = [0.,0.,0.,0.,0.,0.]
     prog,stream = mock_stream(potential, w0, k_mean=k_mean, k_disp=k_disp,
                               prog_mass=1E4, t_f=-2048., dt=-2.,
-                              Integrator=DOPRI853Integrator)
+                              Integrator=Integrator)
 
     # fig = prog.plot(subplots_kwargs=dict(sharex=False,sharey=False))
     # fig = stream.plot(color='#ff0000', alpha=0.5, axes=fig.axes)
@@ -47,18 +48,19 @@ def test_mock_stream():
     w0 = [0.,15.,0,-0.13,0,0]
     prog,stream = mock_stream(potential, w0, k_mean=k_mean, k_disp=k_disp,
                               prog_mass=1E4, t_f=-2048., dt=-2.,
-                              Integrator=DOPRI853Integrator)
+                              Integrator=Integrator)
 
 mock_funcs = [streakline_stream, fardal_stream, dissolved_fardal_stream]
 all_extra_args = [dict(), dict(), dict(t_disrupt=-250.)]
 @pytest.mark.parametrize("mock_func, extra_kwargs", zip(mock_funcs, all_extra_args))
-def test_each_type(mock_func, extra_kwargs):
+@pytest.mark.parametrize("Integrator", [LeapfrogIntegrator, DOPRI853Integrator])
+def test_each_type(mock_func, extra_kwargs, Integrator):
     potential = SphericalNFWPotential(v_c=0.2, r_s=20., units=galactic)
 
     w0 = CartesianPhaseSpacePosition(pos=[0.,15.,0]*u.kpc,
                                      vel=[-0.13,0,0]*u.kpc/u.Myr)
     prog,stream = mock_func(potential, w0, prog_mass=1E4, t_f=-2048., dt=-2.,
-                            Integrator=DOPRI853Integrator, **extra_kwargs)
+                            Integrator=Integrator, **extra_kwargs)
 
     # fig = prog.plot(subplots_kwargs=dict(sharex=False,sharey=False))
     # fig = stream.plot(color='#ff0000', alpha=0.5, axes=fig.axes)
@@ -67,3 +69,106 @@ def test_each_type(mock_func, extra_kwargs):
 
     assert prog.t.shape == (1024,)
     assert stream.pos.shape == (3,2048) # two particles per step
+
+def test_leapfrog_dop853():
+    # no dispersion, so the streams should be the same up to integration error
+    potential = SphericalNFWPotential(v_c=0.2, r_s=20., units=galactic)
+
+    w0 = CartesianPhaseSpacePosition(pos=[0.,15.,0]*u.kpc,
+                                     vel=[-0.13,0,0]*u.kpc/u.Myr)
+    prog1,stream1 = streakline_stream(potential, w0, prog_mass=1E4, t_f=-2048., dt=-0.5,
+                                      release_every=4, Integrator=LeapfrogIntegrator)
+    prog2,stream2 = streakline_stream(potential, w0, prog_mass=1E4, t_f=-2048., dt=-0.5,
+                                      release_every=4, Integrator=DOPRI853Integrator)
+
+    assert stream1.pos.shape == stream2.pos.shape
+    assert np.allclose(prog1.pos.value, prog2.pos.value, atol=1E-3)
+
+    dx = np.sqrt(np.sum((stream1.pos - stream2.pos).value**2, axis=0))
+    assert np.all(dx < 1E-4)
+
+@pytest.mark.parametrize("Integrator", [LeapfrogIntegrator, DOPRI853Integrator])
+def test_nthreads(Integrator):
+    # particles are independent, so splitting them over threads doesn't
+    #   change the stream
+    potential = SphericalNFWPotential(v_c=0.2, r_s=20., units=galactic)
+
+    w0 = CartesianPhaseSpacePosition(pos=[0.,15.,0]*u.kpc,
+                                     vel=[-0.13,0,0]*u.kpc/u.Myr)
+    prog1,stream1 = streakline_stream(potential, w0, prog_mass=1E4, t_f=-1024., dt=-2.,
+                                      Integrator=Integrator)
+    prog2,stream2 = streakline_stream(potential, w0, prog_mass=1E4, t_f=-1024., dt=-2.,
+                                      Integrator=Integrator, nthreads=3)
+    assert np.all(stream1.pos == stream2.pos)
+    assert np.all(stream1.vel == stream2.vel)
+
+@pytest.mark.parametrize("Integrator", [LeapfrogIntegrator, DOPRI853Integrator])
+def test_random_state(Integrator):
+    # the same seed should give identical release conditions
+    potential = SphericalNFWPotential(v_c=0.2, r_s=20., units=galactic)
+
+    w0 = CartesianPhaseSpacePosition(pos=[0.,15.,0]*u.kpc,
+                                     vel=[-0.13,0,0]*u.kpc/u.Myr)
+    prog1,stream1 = fardal_stream(potential, w0, prog_mass=1E4, t_f=-256., dt=-2.,
+                                  Integrator=Integrator, random_state=42)
+    prog2,stream2 = fardal_stream(potential, w0, prog_mass=1E4, t_f=-256., dt=-2.,
+                                  Integrator=Integrator,
+                                  random_state=np.random.RandomState(42))
+    assert np.all(stream1.pos == stream2.pos)
+    assert np.all(stream1.vel == stream2.vel)
+
+    prog3,stream3 = fardal_stream(potential, w0, prog_mass=1E4, t_f=-256., dt=-2.,
+                                  Integrator=Integrator, random_state=43)
+    assert not np.all(stream1.pos == stream3.pos)
+
+@pytest.mark.parametrize("Integrator", [LeapfrogIntegrator, DOPRI853Integrator])
+def test_output_times(Integrator):
+    potential = SphericalNFWPotential(v_c=0.2, r_s=20., units=galactic)
+
+    w0 = CartesianPhaseSpacePosition(pos=[0.,15.,0]*u.kpc,
+                                     vel=[-0.13,0,0]*u.kpc/u.Myr)
+    prog,stream = streakline_stream(potential, w0, prog_mass=1E4, t_f=-512., dt=-2.,
+                                    Integrator=Integrator)
+
+    t = prog.t.value
+    output_times = [t[0], t[100], t[-1]]
+    prog,snaps,released = streakline_stream(potential, w0, prog_mass=1E4, t_f=-512., dt=-2.,
+                                            Integrator=Integrator, output_times=output_times)
+
+    assert snaps.pos.shape == (3,3,stream.pos.shape[1])
+    assert released.shape == (3,stream.pos.shape[1])
+    assert released[0].sum() == 2
+    assert released[1].sum() == 202
+    assert np.all(released[2])
+
+    # unreleased particles are NaN
+    assert np.all(np.isnan(snaps.pos.value[:,0,2:]))
+    assert np.all(np.isnan(snaps.pos.value[:,1,202:]))
+    assert np.all(np.isfinite(snaps.pos.value[:,1,:202]))
+
+    # the last snapshot is the final stream
+    assert np.allclose(snaps.pos.value[:,-1], stream.pos.value)
+    assert np.allclose(snaps.vel.value[:,-1], stream.vel.value)
+
+@pytest.mark.parametrize("Integrator", [LeapfrogIntegrator, DOPRI853Integrator])
+def test_self_gravity(Integrator):
+    potential = SphericalNFWPotential(v_c=0.2, r_s=20., units=galactic)
+
+    w0 = CartesianPhaseSpacePosition(pos=[0.,15.,0]*u.kpc,
+                                     vel=[-0.13,0,0]*u.kpc/u.Myr)
+    prog1,stream1 = streakline_stream(potential, w0, prog_mass=1E4, t_f=-512., dt=-2.,
+                                      Integrator=Integrator)
+    prog2,stream2 = streakline_stream(potential, w0, prog_mass=1E4, t_f=-512., dt=-2.,
+                                      Integrator=Integrator, prog_b=0.01)
+
+    # the release conditions are the same, but the progenitor pulls on the
+    #   released particles
+    assert stream1.pos.shape == stream2.pos.shape
+    assert np.allclose(stream1.pos.value[:,-2:], stream2.pos.value[:,-2:])
+    assert not np.allclose(stream1.pos.value, stream2.pos.value)
+
+    # a time-varying mass is also supported
+    prog_mass = np.linspace(1E5, 1E4, prog1.t.size)
+    prog3,stream3 = streakline_stream(potential, w0, prog_mass=prog_mass, t_f=-512., dt=-2.,
+                                      Integrator=Integrator, prog_b=0.01)
+    assert np.all(np.isfinite(stream3.pos.value))
@@ -11,8 +11,10 @@ from scipy.signal import argrelmin
 
 # Project
 from . import CartesianPhaseSpacePosition, CartesianOrbit
+from ..util import gram_schmidt
 
-__all__ = ['fast_lyapunov_max', 'lyapunov_max', 'surface_of_section']
+__all__ = ['fast_lyapunov_max', 'fast_lyapunov_max_batch', 'fast_lyapunov_spectrum',
+           'lyapunov_max', 'surface_of_section']
 
 def fast_lyapunov_max(w0, potential, dt, nsteps, d0=1e-5,
                       nsteps_per_pullback=10, noffset_orbits=2, t1=0.,
@@ -75,6 +77,197 @@ def fast_lyapunov_max(w0, potential, dt, nsteps, d0=1e-5,
     orbit = CartesianOrbit.from_w(w=w, units=potential.units, t=t*tunit, potential=potential)
     return l/tunit, orbit
 
+def fast_lyapunov_max_batch(w0, potential, dt, nsteps, d0=1e-5,
+                            nsteps_per_pullback=10, noffset_orbits=2, t1=0.,
+                            atol=1E-10, rtol=1E-10, nmax=0, nthreads=1,
+                            store_every=None, random_state=None):
+    """
+    Compute the maximum Lyapunov exponent for many initial conditions
+    with the same C-implemented estimator as
+    `~gary.dynamics.fast_lyapunov_max`, but only keeping the final estimates.
+    This is meant for building maps of chaos over large grids of orbits.
+
+    Parameters
+    ----------
+    w0 : `~gary.dynamics.PhaseSpacePosition`, array_like
+        Initial conditions, with shape ``(2*ndim, norbits)`` for an array.
+    potential : `~gary.potential.CPotentialBase`
+        The potential.
+    dt : numeric
+        Timestep.
+    nsteps : int
+        Number of steps to run for.
+    d0 : numeric (optional)
+        The initial separation.
+    nsteps_per_pullback : int (optional)
+        Number of steps to run before re-normalizing the offset vectors.
+    noffset_orbits : int (optional)
+        Number of offset orbits to run.
+    t1 : numeric (optional)
+        Time of initial conditions. Assumed to be t=0.
+    nthreads : int (optional)
+        Number of threads to split the orbits over.
+    store_every : int (optional)
+        If specified, also return the parent orbits sampled every
+        ``store_every`` steps.
+    random_state : `numpy.random.RandomState`, int (optional)
+        A random number generator, or a seed to create one, used to draw the
+        initial offset vectors. Defaults to the global ``numpy.random``
+        state.
+
+    Returns
+    -------
+    LEs : :class:`~astropy.units.Quantity`
+        Final Lyapunov exponent estimates for each orbit and offset orbit,
+        with shape ``(norbits, noffset_orbits)``.
+    orbit : `~gary.dynamics.CartesianOrbit`
+        The parent orbits, sampled every ``store_every`` steps. Only
+        returned if ``store_every`` is specified.
+
+    """
+
+    from .lyapunov import dop853_lyapunov_max_batch
+
+    if not hasattr(potential, 'c_instance'):
+        raise TypeError("Input potential must be a CPotential subclass.")
+
+    if not isinstance(w0, CartesianPhaseSpacePosition):
+        w0 = np.asarray(w0)
+        ndim = w0.shape[0]//2
+        w0 = CartesianPhaseSpacePosition(pos=w0[:ndim],
+                                         vel=w0[ndim:])
+
+    _w0 = w0.w(potential.units)
+    _w0 = np.ascontiguousarray(_w0.reshape(_w0.shape[0], -1).T)
+    ndim = _w0.shape[1]
+
+    if random_state is None:
+        random_state = np.random
+    elif not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    # define offset vectors to start the offset orbits on
+    d0_vec = random_state.uniform(size=(noffset_orbits,ndim))
+    d0_vec /= np.linalg.norm(d0_vec, axis=1)[:,np.newaxis]
+    d0_vec *= d0
+
+    if store_every is None:
+        store_every = 0
+    res = dop853_lyapunov_max_batch(potential.c_instance, _w0, d0_vec,
+                                    dt, nsteps, t1, d0, nsteps_per_pullback,
+                                    atol=atol, rtol=rtol, nmax=nmax,
+                                    store_every=store_every, nthreads=nthreads)
+
+    try:
+        tunit = potential.units['time']
+    except (TypeError, AttributeError):
+        tunit = u.dimensionless_unscaled
+
+    if store_every == 0:
+        return res/tunit
+
+    l,t,w = res
+    w = np.rollaxis(w, -1)
+    orbit = CartesianOrbit.from_w(w=w, units=potential.units, t=t*tunit, potential=potential)
+    return l/tunit, orbit
+
+def fast_lyapunov_spectrum(w0, potential, dt, nsteps, nsteps_per_pullback=10,
+                           nexponents=None, t1=0., atol=1E-10, rtol=1E-10, nmax=0,
+                           random_state=None):
+    """
+    Compute Lyapunov exponents by integrating the variational (linearized)
+    equations along the orbit(s) with the DOPRI853 integrator in C. Unlike
+    `~gary.dynamics.fast_lyapunov_max`, no offset orbits are integrated, so
+    the result does not depend on an initial separation, ``d0``.
+
+    The deviation vectors are evolved with the Hessian of the potential and
+    re-orthonormalized (with modified Gram-Schmidt) every
+    ``nsteps_per_pullback`` steps. With ``nexponents`` equal to the
+    phase-space dimensionality (the default), this estimates the full
+    Lyapunov spectrum, in descending order.
+
+    Parameters
+    ----------
+    w0 : `~gary.dynamics.PhaseSpacePosition`, array_like
+        Initial conditions. May contain many orbits, which are integrated
+        independently.
+    potential : `~gary.potential.CPotentialBase`
+        The potential. Must have a Hessian implemented in C.
+    dt : numeric
+        Timestep.
+    nsteps : int
+        Number of steps to run for.
+    nsteps_per_pullback : int (optional)
+        Number of steps to run before re-orthonormalizing the deviation vectors.
+    nexponents : int (optional)
+        Number of Lyapunov exponents to compute. Defaults to the full spectrum.
+    t1 : numeric (optional)
+        Time of initial conditions. Assumed to be t=0.
+    random_state : `numpy.random.RandomState`, int (optional)
+        A random number generator, or a seed to create one, used to draw the
+        initial deviation vectors. Defaults to the global ``numpy.random``
+        state.
+
+    Returns
+    -------
+    LEs : :class:`~astropy.units.Quantity`
+        Running estimates of the Lyapunov exponents at each pullback. Has
+        shape ``(niter, nexponents)`` for a single orbit, or
+        ``(niter, nexponents, norbits)`` for multiple orbits.
+    orbit : `~gary.dynamics.CartesianOrbit`
+        The orbit(s), sampled at each pullback time.
+
+    """
+
+    from .lyapunov import dop853_variational_lyapunov
+
+    if not hasattr(potential, 'c_instance'):
+        raise TypeError("Input potential must be a CPotential subclass.")
+
+    if not isinstance(w0, CartesianPhaseSpacePosition):
+        w0 = np.asarray(w0)
+        ndim = w0.shape[0]//2
+        w0 = CartesianPhaseSpacePosition(pos=w0[:ndim],
+                                         vel=w0[ndim:])
+
+    _w0 = w0.w(potential.units)
+    single_orbit = np.squeeze(_w0).ndim == 1
+    _w0 = np.ascontiguousarray(_w0.reshape(_w0.shape[0], -1).T)
+    ndim = _w0.shape[1]
+
+    if nexponents is None:
+        nexponents = ndim
+    if nexponents < 1 or nexponents > ndim:
+        raise ValueError("nexponents must be between 1 and the phase-space "
+                         "dimensionality, {}.".format(ndim))
+
+    if random_state is None:
+        random_state = np.random
+    elif not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    # initial, orthonormal deviation vectors
+    d0_vec = random_state.uniform(size=(ndim,ndim))
+    gram_schmidt(d0_vec)
+    d0_vec = np.ascontiguousarray(d0_vec[:nexponents])
+
+    t,w,l = dop853_variational_lyapunov(potential.c_instance, _w0, d0_vec,
+                                        dt, nsteps, t1, nsteps_per_pullback,
+                                        atol, rtol, nmax)
+    w = np.rollaxis(w, -1)
+    l = np.rollaxis(l, -1, 1)
+    if single_orbit:
+        w = w[...,0]
+        l = l[...,0]
+
+    try:
+        tunit = potential.units['time']
+    except (TypeError, AttributeError):
+        tunit = u.dimensionless_unscaled
+
+    orbit = CartesianOrbit.from_w(w=w, units=potential.units, t=t*tunit, potential=potential)
+    return l/tunit, orbit
+
 def lyapunov_max(w0, integrator, dt, nsteps, d0=1e-5, nsteps_per_pullback=10,
                  noffset_orbits=8, t1=0., units=None):
     """
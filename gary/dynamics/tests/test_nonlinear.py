@@ -9,7 +9,8 @@ import numpy as np
 
 # Project
 from ... import potential as gp
-from ..nonlinear import lyapunov_max, fast_lyapunov_max, surface_of_section
+from ..nonlinear import (lyapunov_max, fast_lyapunov_max, fast_lyapunov_max_batch,
+                         fast_lyapunov_spectrum, surface_of_section)
 from ...integrate import DOPRI853Integrator
 from ...util import gram_schmidt, atleast_2d
 from ...units import galactic
@@ -189,6 +190,60 @@ class TestHenonHeilesStableChaos2(HenonHeilesBase):
         self.w0 = np.array([0., 0.56, 0.164113781, 0.112])
         self.check = lambda x: x > 1E-2
 
+def test_fast_lyapunov_spectrum():
+    potential = gp.HenonHeilesPotential()
+    w0 = np.array([[0.,0.295456,0.407308431,0.], # regular
+                   [0.,0.56,0.164113781,0.112]]).T # chaotic
+
+    LEs, orbit = fast_lyapunov_spectrum(w0, potential, dt=1., nsteps=20000,
+                                        nsteps_per_pullback=10,
+                                        random_state=np.random.RandomState(42))
+    assert LEs.shape == (2000,4,2)
+    assert orbit.pos.shape == (2,2001,2)
+
+    # Hamiltonian flow: exponents come in +/- pairs
+    assert np.allclose(LEs[-1].sum(axis=0), 0., atol=1E-8)
+    assert np.allclose(LEs[-1,0], -LEs[-1,3], atol=1E-4)
+    assert np.all(np.diff(LEs[-1], axis=0) < 0)
+
+    assert LEs[-1,0,0] < 2E-3
+    assert LEs[-1,0,1] > 1E-2
+
+    # single orbit, just the maximum exponent
+    LEs, orbit = fast_lyapunov_spectrum(w0[:,1], potential, dt=1., nsteps=20000,
+                                        nsteps_per_pullback=10, nexponents=1,
+                                        random_state=np.random.RandomState(42))
+    assert LEs.shape == (2000,1)
+    assert LEs[-1,0] > 1E-2
+
+def test_fast_lyapunov_max_batch():
+    potential = gp.HenonHeilesPotential()
+    w0 = np.array([[0.,0.295456,0.407308431,0.], # regular
+                   [0.,0.56,0.164113781,0.112]]).T # chaotic
+    w0 = np.repeat(w0, 4, axis=1)
+
+    LEs = fast_lyapunov_max_batch(w0, potential, dt=1., nsteps=20000,
+                                  noffset_orbits=2,
+                                  random_state=np.random.RandomState(42))
+    assert LEs.shape == (8,2)
+    assert np.all(LEs[:4] < 2E-3)
+    assert np.all(LEs[4:] > 1E-2)
+
+    # splitting over threads or storing the orbit doesn't change the result
+    LEs2, orbit = fast_lyapunov_max_batch(w0, potential, dt=1., nsteps=20000,
+                                          noffset_orbits=2, nthreads=3,
+                                          store_every=100,
+                                          random_state=np.random.RandomState(42))
+    assert np.all(LEs2 == LEs)
+    assert orbit.pos.shape == (2,201,8)
+    assert np.allclose(orbit.pos[:,0].value, w0[:2])
+
+    # orbits are independent of the others in the batch
+    LEs3 = fast_lyapunov_max_batch(w0[:,4:5], potential, dt=1., nsteps=20000,
+                                   noffset_orbits=2,
+                                   random_state=np.random.RandomState(42))
+    assert np.all(LEs3[0] == LEs[4])
+
 # --------------------------------------------------------------------
 
 class TestLogarithmic(object):
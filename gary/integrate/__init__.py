@@ -2,3 +2,5 @@ from .pyintegrators.leapfrog import *
 from .pyintegrators.rk5 import *
 from .pyintegrators.dopri853 import *
 from .timespec import *
+from .events import *
+from .pyintegrators.symplectic import *
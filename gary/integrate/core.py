@@ -15,6 +15,30 @@ from ..units import UnitSystem
 
 __all__ = ["Integrator"]
 
+def _output_array(shape, mmap=None):
+    """
+    Make or check an array to store integration output in. If ``mmap`` is
+    None, this returns an array of zeros with the given shape. If ``mmap`` is
+    a filename, a new memory-mapped array is created in that file. Otherwise,
+    ``mmap`` must be a writable array (e.g., a `numpy.memmap`) with the given
+    shape, and is returned as-is.
+    """
+    if mmap is None:
+        return np.zeros(shape, dtype=float)
+
+    if isinstance(mmap, str):
+        return np.memmap(mmap, mode='w+', dtype=float, shape=shape)
+
+    if mmap.shape != shape:
+        raise ValueError("Shape of memory-mapped array doesn't match expected shape of "
+                         "return array ({} vs {})".format(mmap.shape, shape))
+
+    if not mmap.flags.writeable:
+        raise TypeError("Memory-mapped array must be a writable mode, not '{}'"
+                        .format(getattr(mmap, 'mode', 'r')))
+
+    return mmap
+
 class Integrator(object):
 
     def __init__(self, func, func_args=(), func_units=None):
@@ -31,7 +55,8 @@ class Integrator(object):
         """
         Decide how to make the return array. If mmap is False, this returns a
         full array of zeros, but with the correct shape as the output. If mmap
-        is True, return a pointer to a memory-mapped array. The latter is
+        is a memory-mapped array or a filename, the output is written to disk
+        instead (see `_output_array`). The latter is
         particularly useful for integrating a large number of orbits or
         integrating a large number of time steps.
         """
@@ -47,20 +72,7 @@ class Integrator(object):
         self.ndim = self.ndim//2
 
         return_shape = (2*self.ndim,nsteps+1,self.norbits)
-        if mmap is None:
-            # create the return arrays
-            ws = np.zeros(return_shape, dtype=float)
-
-        else:
-            if mmap.shape != return_shape:
-                raise ValueError("Shape of memory-mapped array doesn't match expected shape of "
-                                 "return array ({} vs {})".format(mmap.shape, return_shape))
-
-            if not mmap.flags.writeable:
-                raise TypeError("Memory-mapped array must be a writable mode, not '{}'"
-                                .format(mmap.mode))
-
-            ws = mmap
+        ws = _output_array(return_shape, mmap)
 
         return w0, arr_w0, ws
 
@@ -1,2 +1,4 @@
 from .dop853 import dop853_integrate_potential
 from .leapfrog import leapfrog_integrate_potential
+from .symplectic import symplectic_integrate_potential
+from .rk5 import rk5_integrate_potential
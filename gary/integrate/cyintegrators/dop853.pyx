@@ -11,6 +11,9 @@ from __future__ import division, print_function
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
 
+# Standard library
+import threading
+
 # Third-party
 import numpy as np
 cimport numpy as np
@@ -20,90 +23,386 @@ from libc.stdio cimport printf
 from cpython.exc cimport PyErr_CheckSignals
 
 from ...potential.cpotential cimport _CPotential
+from .events cimport EventDetector, _EventDetector, c_event_start, c_event_step
+from .events import _collect_events
+from ..core import _output_array
+from ..events import _pack_events
+from ..timespec import _store_indices
 
 cdef extern from "math.h":
     double sqrt(double x) nogil
     double log(double x) nogil
 
 cdef extern from "dopri/dop853.h":
+    ctypedef struct Dop853Workspace:
+        long nfcn
+        void *solout_data
+
     ctypedef void (*GradFn)(double t, double *pars, double *q, double *grad) nogil
-    ctypedef void (*SolTrait)(long nr, double xold, double x, double* y, unsigned n, int* irtrn)
+    ctypedef void (*SolTraitWs)(long nr, double xold, double x, double* y, unsigned n, int* irtrn,
+                                Dop853Workspace *ws) nogil
     ctypedef void (*FcnEqDiff)(unsigned n, double x, double *y, double *f, GradFn gradfunc, double *gpars, unsigned norbits) nogil
-    double contd8 (unsigned ii, double x)
+
+    Dop853Workspace *dop853_workspace_alloc() nogil
+    void dop853_workspace_free(Dop853Workspace *ws) nogil
+    double contd8_ws (Dop853Workspace *ws, unsigned ii, double x) nogil
 
     # See dop853.h for full description of all input parameters
-    int dop853 (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
-                double x, double* y, double xend,
-                double* rtoler, double* atoler, int itoler, SolTrait solout,
-                int iout, FILE* fileout, double uround, double safe, double fac1,
-                double fac2, double beta, double hmax, double h, long nmax, int meth,
-                long nstiff, unsigned nrdens, unsigned* icont, unsigned licont)
+    int dop853_ws (Dop853Workspace *ws,
+                   unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+                   double x, double* y, double xend,
+                   double* rtoler, double* atoler, int itoler, SolTraitWs solout,
+                   int iout, FILE* fileout, double uround, double safe, double fac1,
+                   double fac2, double beta, double hmax, double h, long nmax, int meth,
+                   long nstiff, unsigned nrdens, unsigned* icont, unsigned licont) nogil
 
     void Fwrapper (unsigned ndim, double t, double *w, double *f,
-                   GradFn func, double *pars, unsigned norbits)
-    double six_norm (double *x)
+                   GradFn func, double *pars, unsigned norbits) nogil
+    double six_norm (double *x) nogil
 
 cdef extern from "stdio.h":
     ctypedef struct FILE
     FILE *stdout
 
-cdef void solout(long nr, double xold, double x, double* y, unsigned n, int* irtrn):
-    # TODO: see here for example in FORTRAN:
-    #   http://www.unige.ch/~hairer/prog/nonstiff/dr_dop853.f
-    pass
+# State for the dense output callback, passed through to solout() via the
+#   workspace so that concurrent integrations don't share anything.
+cdef struct DenseOutput:
+    double *t # requested output times
+    double *w # output array, element (j,i,k) is at w + j*st + i*so + k*sk
+    long st # distance between output times
+    long so # distance between orbits
+    long sk # distance between phase-space components
+    unsigned ndim # number of phase-space components per orbit
+    int ntimes # number of requested output times
+    int j # index of the next output time to fill
+    double posneg # direction of integration
+    EventDetector *det # event detection for the orbits in the block
+    int i1 # index of the first orbit in the block
+
+# Data for interpolating one orbit of a block with the dense output
+cdef struct DenseInterp:
+    Dop853Workspace *ws
+    unsigned offset # index of the first phase-space component of the orbit
+    unsigned ndim # number of phase-space components per orbit
+
+cdef void dense_interp(double t, double *w, void *data) nogil:
+    cdef DenseInterp *interp = <DenseInterp*>data
+    cdef unsigned k
+    for k in range(interp.ndim):
+        w[k] = contd8_ws(interp.ws, interp.offset + k, t)
+
+cdef void solout(long nr, double xold, double x, double* y, unsigned n, int* irtrn,
+                 Dop853Workspace *ws) nogil:
+    """
+    Called by dop853_ws() after every accepted step. Fills all of the requested
+    output times that lie in the step just taken, (xold, x], using the
+    dense output interpolant, and finds any events in the step.
+    """
+    cdef DenseOutput *dense = <DenseOutput*>ws.solout_data
+    cdef DenseInterp interp
+    cdef unsigned i
+    cdef double tj
+    cdef double *wj
+
+    while dense.j < dense.ntimes:
+        tj = dense.t[dense.j]
+        if (x - tj) * dense.posneg < 0:
+            break
+
+        wj = dense.w + dense.j*dense.st
+        if nr == 1 or tj == x:
+            for i in range(n):
+                wj[(i // dense.ndim)*dense.so + (i % dense.ndim)*dense.sk] = y[i]
+        else:
+            for i in range(n):
+                wj[(i // dense.ndim)*dense.so + (i % dense.ndim)*dense.sk] = contd8_ws(ws, i, tj)
+
+        dense.j += 1
+
+    if dense.det.nevents > 0:
+        interp.ws = ws
+        interp.ndim = dense.ndim
+        for i in range(n // dense.ndim):
+            interp.offset = i*dense.ndim
+            if nr == 1:
+                c_event_start(dense.det, dense.i1 + i, y + interp.offset, NULL)
+            else:
+                c_event_step(dense.det, dense.i1 + i, xold, x, y + interp.offset,
+                             NULL, dense_interp, &interp)
+
+cdef _check_result(int res):
+    if res == -1:
+        raise RuntimeError("Input is not consistent.")
+    elif res == -2:
+        raise RuntimeError("Larger nmax is needed.")
+    elif res == -3:
+        raise RuntimeError("Step size becomes too small.")
+    elif res == -4:
+        raise RuntimeError("The problem is probably stiff (interrupted).")
+
+cdef int _dop853_block(Dop853Workspace *ws, GradFn gradfunc, double *pars,
+                       double[::1] t, double[::1] t_out, double[:,::1] w0,
+                       double[:,:,:] all_w, double[::1] w,
+                       long[::1] nfcn, EventDetector *det, int i1, int i2,
+                       double atol, double rtol, int nmax,
+                       int dense_output) except? -100:
+    """
+    Integrate orbits ``i1 <= i < i2`` of ``w0`` as a single system (i.e.
+    with a shared step size) from ``t[0]`` to ``t[-1]``, storing the state at
+    the times ``t_out`` (a subset of ``t``) in ``all_w``. ``w`` is scratch
+    space for the state vector. The number of function evaluations is stored
+    in ``nfcn[i1:i2]``. Events are found with ``det`` using the dense output
+    interpolant. Returns the result code from ``dop853_ws()`` (negative on
+    failure).
+    """
+    cdef:
+        int i, j, k
+        int res = 1
+        int iout
+        long this_nfcn = 0
+        unsigned norbits = i2 - i1
+        unsigned ndim = all_w.shape[2]
+        int ntimes = t.shape[0]
+        int nout = t_out.shape[0]
+        double dt0 = t[1]-t[0]
+        double tprev = t[0]
+        DenseOutput dense
+        SolTraitWs events_solout = NULL
+        unsigned nrdens = 0
+
+    for i in range(norbits):
+        for k in range(ndim):
+            w[i*ndim + k] = w0[i1+i,k]
+
+    dense.ndim = ndim
+    dense.ntimes = 0
+    dense.j = 0
+    dense.posneg = 1. if t[ntimes-1] >= t[0] else -1.
+    dense.det = det
+    dense.i1 = i1
+    ws.solout_data = &dense
+
+    if dense_output:
+        # Note: icont not needed because nrdens == ndim*norbits
+        dense.t = &t_out[0]
+        dense.w = &all_w[0,i1,0]
+        dense.st = all_w.strides[0] // sizeof(double)
+        dense.so = all_w.strides[1] // sizeof(double)
+        dense.sk = all_w.strides[2] // sizeof(double)
+        dense.ntimes = nout
+
+        if nmax == 0:
+            nmax = max(100000, 100*ntimes)
+
+        iout = 2  # dense output performed in solout
+        with nogil:
+            res = dop853_ws(ws, ndim*norbits, <FcnEqDiff> Fwrapper,
+                            gradfunc, pars, norbits,
+                            t[0], &w[0], t[ntimes-1], &rtol, &atol, 0, solout, iout,
+                            NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1,
+                            ndim*norbits, NULL, 0)
+            this_nfcn = ws.nfcn
+
+            # the last step can end a hair short of t[-1] from roundoff
+            if res >= 0:
+                for j in range(dense.j, nout):
+                    for i in range(norbits):
+                        for k in range(ndim):
+                            all_w[j,i1+i,k] = w[i*ndim + k]
+
+    else:
+        if det.nevents > 0:
+            iout = 2  # solout only finds events
+            events_solout = solout
+            nrdens = ndim*norbits
+        else:
+            iout = 0  # no solout calls
+
+        # restart the integrator at each stored time, t_out[j-1] -> t_out[j]
+        for j in range(nout):
+            with nogil:
+                if t_out[j] != tprev:
+                    res = dop853_ws(ws, ndim*norbits, <FcnEqDiff> Fwrapper,
+                                    gradfunc, pars, norbits,
+                                    tprev, &w[0], t_out[j], &rtol, &atol, 0,
+                                    events_solout, iout, NULL, 0.0, 0.0, 0.0, 0.0,
+                                    0.0, 0.0, dt0, nmax, 0, 1, nrdens, NULL, 0)
+                    this_nfcn += ws.nfcn
+                    tprev = t_out[j]
+
+                for k in range(ndim):
+                    for i in range(norbits):
+                        all_w[j,i1+i,k] = w[i*ndim + k]
+
+            if res < 0:
+                break
+
+            # only has an effect in the main thread
+            PyErr_CheckSignals()
+
+    for i in range(i1,i2):
+        nfcn[i] = this_nfcn
+
+    return res
+
+def _dop853_worker(_CPotential cpotential, double[::1] t, double[::1] t_out,
+                   double[:,::1] w0, double[:,:,:] all_w,
+                   long[::1] nfcn, _EventDetector detector, int i1, int i2,
+                   double atol, double rtol, int nmax, int dense_output,
+                   int independent):
+    """
+    Integrate orbits ``i1 <= i < i2`` of ``w0``, either as one system or,
+    if ``independent`` is set, one orbit at a time. Each call uses its own
+    workspace and the GIL is released while integrating. Returns the result
+    code from ``dop853_ws()`` (negative on failure).
+    """
+    cdef:
+        int i
+        int res = 1
+        unsigned ndim = all_w.shape[2]
+        double[::1] w
+
+        GradFn gradfunc = <GradFn>cpotential.c_gradient
+        double *pars = &(cpotential._parameters[0])
+        Dop853Workspace *ws
+
+    if independent:
+        w = np.empty(ndim)
+    else:
+        w = np.empty(ndim*(i2-i1))
+
+    ws = dop853_workspace_alloc()
+    if ws == NULL:
+        raise MemoryError("Failed to allocate DOP853 workspace.")
+
+    try:
+        if not independent:
+            return _dop853_block(ws, gradfunc, pars, t, t_out, w0, all_w, w,
+                                 nfcn, &detector.det, i1, i2, atol, rtol, nmax,
+                                 dense_output)
+
+        for i in range(i1,i2):
+            res = _dop853_block(ws, gradfunc, pars, t, t_out, w0, all_w, w,
+                                nfcn, &detector.det, i, i+1, atol, rtol, nmax,
+                                dense_output)
+            if res < 0:
+                break
+
+            PyErr_CheckSignals()
+
+    finally:
+        dop853_workspace_free(ws)
+
+    return res
+
+def _dop853_thread(results, int i, *args):
+    # store the result code (or exception) so it can be raised in the
+    #   calling thread
+    try:
+        results[i] = _dop853_worker(*args)
+    except Exception as e:
+        results[i] = e
 
 cpdef dop853_integrate_potential(_CPotential cpotential, double[:,::1] w0,
                                  double[::1] t,
-                                 double atol=1E-10, double rtol=1E-10, int nmax=0):
+                                 double atol=1E-10, double rtol=1E-10, int nmax=0,
+                                 int dense_output=0, int nthreads=1,
+                                 int independent=0, int return_nfcn=0,
+                                 int store_every=1, out=None, events=None):
     """
+    dop853_integrate_potential(cpotential, w0, t, atol=1E-10, rtol=1E-10, nmax=0, dense_output=0, nthreads=1, independent=0, return_nfcn=0, store_every=1, out=None, events=None)
+
     CAUTION: Interpretation of axes is different here! We need the
     arrays to be C ordered and easy to iterate over, so here the
     axes are (norbits, ndim).
 
+    By default, the integrator is restarted for each output interval
+    ``t[j-1] -> t[j]``. With ``dense_output`` set, a single integration is
+    run over the whole time interval and the solution at the requested
+    times is filled in using the dense output interpolant, so the cost
+    scales with the number of steps the integrator needs to take rather
+    than the number of output times. In this mode, ``nmax`` is the maximum
+    number of steps for the whole integration (and defaults to
+    ``max(100000, 100*ntimes)``).
+
+    By default, all orbits are packed into a single state vector and share
+    one adaptive step size, so a single orbit that needs small steps (e.g.,
+    one that passes close to the center) forces small steps on all orbits.
+    With ``independent`` set, each orbit is instead integrated separately
+    with its own step size and error control over the same output times.
+
+    With ``nthreads > 1``, the orbits are split into contiguous blocks that
+    are integrated concurrently in separate threads. The orbits within a
+    block share a step size, so the results agree with the serial case to
+    within the requested tolerance (and are identical for a given value of
+    ``nthreads``). With ``independent`` set, the results don't depend on
+    ``nthreads`` at all. The GIL is released while integrating, so
+    independent calls can also be run concurrently from a thread pool.
+
+    Only the solution at every ``store_every`` output time is stored,
+    starting with the initial conditions, and the stored times are returned.
+    If ``store_every`` is 0, only the final state is stored. Without
+    ``dense_output``, the integrator is then only restarted at the stored
+    times, so the intermediate times just set the initial step size.
+
+    The output is written into ``out`` if given, which must be a writable
+    array (e.g., a view of a `numpy.memmap`) of shape ``(nout, norbits, ndim)``,
+    where ``nout`` is the number of stored times. It does not need to be
+    C-contiguous, so the final output layout can be filled in directly.
+
+    If ``return_nfcn`` is set, an array containing the number of function
+    (gradient) evaluations used for each orbit is also returned.
+
+    If a list of ``events`` (`~gary.integrate.Event` instances) is given,
+    the events are located using the dense output interpolant and the orbit
+    index, event index, time, and phase-space position of each event are
+    also returned (last), sorted by orbit and time.
+
     TODO: add option for a callback function to be called at each step
     """
     cdef:
-        int i, j, k
-        int res, iout
+        int i
         unsigned norbits = w0.shape[0]
         unsigned ndim = w0.shape[1]
-
-        # define full array of times
         int ntimes = len(t)
-        double dt0 = t[1]-t[0]
-        double[::1] w = np.empty(ndim*norbits)
+        double[::1] t_out = np.asarray(t)[_store_indices(ntimes, store_every)]
+        double[:,:,:] all_w = _output_array((t_out.shape[0],norbits,ndim), out)
+        long[::1] nfcn = np.zeros(norbits, dtype='l')
+        double posneg = 1. if t[ntimes-1] >= t[0] else -1.
 
-        # Note: icont not needed because nrdens == ndim
-        double[:,:,::1] all_w = np.empty((ntimes,norbits,ndim))
+    if events is not None:
+        events = _pack_events(events, ndim // 2)
 
-    # store initial conditions
-    for i in range(norbits):
-        for k in range(ndim):
-            w[i*ndim + k] = w0[i,k]
-            all_w[0,i,k] = w0[i,k]
-
-    # TODO: any way to support dense output?
-    iout = 0  # no solout calls
-
-    for j in range(1,ntimes,1):
-        res = dop853(ndim*norbits, <FcnEqDiff> Fwrapper,
-                     <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), norbits,
-                     t[j-1], &w[0], t[j], &rtol, &atol, 0, solout, iout,
-                     NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1, 0, NULL, 0);
-
-        if res == -1:
-            raise RuntimeError("Input is not consistent.")
-        elif res == -2:
-            raise RuntimeError("Larger nmax is needed.")
-        elif res == -3:
-            raise RuntimeError("Step size becomes too small.")
-        elif res == -4:
-            raise RuntimeError("The problem is probably stiff (interrupted).")
+    nthreads = max(1, min(nthreads, norbits))
+    bounds = np.linspace(0, norbits, nthreads+1).astype(int)
+    detectors = [_EventDetector(events, bounds[i], bounds[i+1], ndim // 2, posneg)
+                 for i in range(nthreads)]
 
-        for k in range(ndim):
-            for i in range(norbits):
-                all_w[j,i,k] = w[i*ndim + k]
+    if nthreads == 1:
+        _check_result(_dop853_worker(cpotential, t, t_out, w0, all_w, nfcn,
+                                     detectors[0], 0, norbits, atol, rtol, nmax,
+                                     dense_output, independent))
+
+    else:
+        results = [None]*nthreads
+        threads = [threading.Thread(target=_dop853_thread,
+                                    args=(results, i, cpotential, t, t_out, w0, all_w, nfcn,
+                                          detectors[i], bounds[i], bounds[i+1], atol, rtol,
+                                          nmax, dense_output, independent))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
-        PyErr_CheckSignals()
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+            _check_result(res)
 
-    return np.asarray(t), np.asarray(all_w)
+    result = (np.asarray(t_out), np.asarray(all_w))
+    if return_nfcn:
+        result = result + (np.asarray(nfcn),)
+    if events is not None:
+        result = result + (_collect_events(detectors, posneg),)
+    return result
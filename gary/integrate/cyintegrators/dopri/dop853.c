@@ -6,52 +6,48 @@
 #include "dop853.h"
 
 
-static long      nfcn, nstep, naccpt, nrejct;
-static double    hout, xold, xout;
-static unsigned  nrds, *indir;
-static double    *yy1, *k1, *k2, *k3, *k4, *k5, *k6, *k7, *k8, *k9, *k10;
-static double    *rcont1, *rcont2, *rcont3, *rcont4;
-static double    *rcont5, *rcont6, *rcont7, *rcont8;
+/* Workspace used by the (non-reentrant) legacy interface, dop853() */
+static Dop853Workspace legacy_ws;
 
 
 long nfcnRead (void)
 {
-  return nfcn;
+  return legacy_ws.nfcn;
 
 } /* nfcnRead */
 
 
 long nstepRead (void)
 {
-  return nstep;
+  return legacy_ws.nstep;
 
 } /* stepRead */
 
 
 long naccptRead (void)
 {
-  return naccpt;
+  return legacy_ws.naccpt;
 
 } /* naccptRead */
 
 
 long nrejctRead (void)
 {
-  return nrejct;
+  return legacy_ws.nrejct;
 
 } /* nrejct */
 
 
 double hRead (void)
 {
-  return hout;
+  return legacy_ws.hout;
 
 } /* hRead */
 
 
 double xRead (void)
 {
-  return xout;
+  return legacy_ws.xout;
 
 } /* xRead */
 
@@ -154,13 +150,23 @@ static double hinit (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars,
 
 
 /* core integrator */
-static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+static int dopcor (Dop853Workspace *ws,
+       unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
        double x, double* y, double xend,
 		   double hmax, double h, double* rtoler, double* atoler,
-		   int itoler, FILE* fileout, SolTrait solout, int iout,
+		   int itoler, FILE* fileout, SolTraitWs solout, int iout,
 		   long nmax, double uround, int meth, long nstiff, double safe,
 		   double beta, double fac1, double fac2, unsigned* icont)
 {
+  /* all working storage lives in the workspace */
+  double   *yy1 = ws->yy1, *k1 = ws->k1, *k2 = ws->k2, *k3 = ws->k3, *k4 = ws->k4;
+  double   *k5 = ws->k5, *k6 = ws->k6, *k7 = ws->k7, *k8 = ws->k8, *k9 = ws->k9;
+  double   *k10 = ws->k10;
+  double   *rcont1 = ws->rcont1, *rcont2 = ws->rcont2, *rcont3 = ws->rcont3;
+  double   *rcont4 = ws->rcont4, *rcont5 = ws->rcont5, *rcont6 = ws->rcont6;
+  double   *rcont7 = ws->rcont7, *rcont8 = ws->rcont8;
+  unsigned nrds = ws->nrds;
+
   double   facold, expo1, fac, facc1, facc2, fac11, posneg, xph;
   double   atoli, rtoli, hlamb, err, sk, hnew, yd0, ydiff, bspl;
   double   stnum, stden, sqr, err2, erri, deno;
@@ -374,16 +380,16 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
   iord = 8;
   if (h == 0.0)
     h = hinit (n, fcn, gradfunc, gpars, norbits, x, y, posneg, k1, k2, k3, iord, hmax, atoler, rtoler, itoler);
-  nfcn += 2;
+  ws->nfcn += 2;
   reject = 0;
-  xold = x;
+  ws->xold = x;
 
   if (iout)
   {
     irtrn = 1;
-    hout = 1.0;
-    xout = x;
-    solout (naccpt+1, xold, x, y, n, &irtrn);
+    ws->hout = 1.0;
+    ws->xout = x;
+    solout (ws->naccpt+1, ws->xold, x, y, n, &irtrn, ws);
     if (irtrn < 0)
     {
       if (fileout)
@@ -395,12 +401,12 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
   /* basic integration step */
   while (1)
   {
-    if (nstep > nmax)
+    if (ws->nstep > nmax)
     {
       if (fileout)
 	fprintf (fileout, "Exit of dop853 at x = %.16e, more than nmax = %li are needed\r\n", x, nmax);
-      xout = x;
-      hout = h;
+      ws->xout = x;
+      ws->hout = h;
       return -2;
     }
 
@@ -408,8 +414,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
     {
       if (fileout)
 	fprintf (fileout, "Exit of dop853 at x = %.16e, step size too small h = %.16e\r\n", x, h);
-      xout = x;
-      hout = h;
+      ws->xout = x;
+      ws->hout = h;
       return -3;
     }
 
@@ -419,7 +425,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       last = 1;
     }
 
-    nstep++;
+    ws->nstep++;
 
     /* the twelve stages */
     for (i = 0; i < n; i++)
@@ -462,7 +468,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 			  a127*k7[i] + a128*k8[i] + a129*k9[i] +
 			  a1210*k10[i] + a1211*k2[i]);
     fcn (n, xph, yy1, k3, gradfunc, gpars, norbits);
-    nfcn += 11;
+    ws->nfcn += 11;
     for (i = 0; i < n; i++)
     {
       k4[i] = b1*k1[i] + b6*k6[i] + b7*k7[i] + b8*k8[i] + b9*k9[i] +
@@ -515,12 +521,12 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       /* step accepted */
 
       facold = max_d (err, 1.0E-4);
-      naccpt++;
+      ws->naccpt++;
       fcn (n, xph, k5, k4, gradfunc, gpars, norbits);
-      nfcn++;
+      ws->nfcn++;
 
       /* stiffness detection */
-      if (!(naccpt % nstiff) || (iasti > 0))
+      if (!(ws->naccpt % nstiff) || (iasti > 0))
       {
 	stnum = 0.0;
 	stden = 0.0;
@@ -542,8 +548,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 	      fprintf (fileout, "The problem seems to become stiff at x = %.16e\r\n", x);
 	    else
 	    {
-	      xout = x;
-	      hout = h;
+	      ws->xout = x;
+	      ws->hout = h;
 	      return -4;
 	    }
 	}
@@ -613,7 +619,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 			      a169*k9[i] + a1613*k4[i] + a1614*k10[i] +
 			      a1615*k2[i]);
 	fcn (n, x+c16*h, yy1, k3, gradfunc, gpars, norbits);
-	nfcn += 3;
+	ws->nfcn += 3;
 
 	/* final preparation */
 	if (nrds == n)
@@ -645,14 +651,14 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 
       memcpy (k1, k4, n * sizeof(double));
       memcpy (y, k5, n * sizeof(double));
-      xold = x;
+      ws->xold = x;
       x = xph;
 
       if (iout)
       {
-	hout = h;
-	xout = x;
-	solout (naccpt+1, xold, x, y, n, &irtrn);
+	ws->hout = h;
+	ws->xout = x;
+	solout (ws->naccpt+1, ws->xold, x, y, n, &irtrn, ws);
 	if (irtrn < 0)
 	{
 	  if (fileout)
@@ -664,8 +670,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       /* normal exit */
       if (last)
       {
-	hout=hnew;
-	xout = x;
+	ws->hout=hnew;
+	ws->xout = x;
 	return 1;
       }
 
@@ -681,8 +687,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       /* step rejected */
       hnew = h / min_d (facc1, fac11/safe);
       reject = 1;
-      if (naccpt >= 1)
-	nrejct=nrejct + 1;
+      if (ws->naccpt >= 1)
+	ws->nrejct=ws->nrejct + 1;
       last = 0;
     }
 
@@ -692,28 +698,136 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 } /* dopcor */
 
 
-/* front-end */
-int dop853
- (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+/* workspace management */
+Dop853Workspace *dop853_workspace_alloc (void)
+{
+  Dop853Workspace *ws;
+
+  ws = (Dop853Workspace*) calloc (1, sizeof(Dop853Workspace));
+  return ws;
+
+} /* dop853_workspace_alloc */
+
+
+static void workspace_release (Dop853Workspace *ws)
+{
+  if (ws->yy1)
+    free (ws->yy1);
+  if (ws->rcont1)
+    free (ws->rcont1);
+  if (ws->indir)
+    free (ws->indir);
+
+  ws->yy1 = ws->k1 = ws->k2 = ws->k3 = ws->k4 = ws->k5 = NULL;
+  ws->k6 = ws->k7 = ws->k8 = ws->k9 = ws->k10 = NULL;
+  ws->rcont1 = ws->rcont2 = ws->rcont3 = ws->rcont4 = NULL;
+  ws->rcont5 = ws->rcont6 = ws->rcont7 = ws->rcont8 = NULL;
+  ws->indir = NULL;
+  ws->n_alloc = ws->nrdens_alloc = ws->indir_alloc = 0;
+
+} /* workspace_release */
+
+
+void dop853_workspace_free (Dop853Workspace *ws)
+{
+  if (!ws)
+    return;
+
+  workspace_release (ws);
+  free (ws);
+
+} /* dop853_workspace_free */
+
+
+/* make sure the workspace can hold a system of dimension n with nrdens
+   dense output components -- storage is only ever grown, so a workspace
+   reused for many calls of the same size never hits malloc again */
+static int workspace_reserve (Dop853Workspace *ws, unsigned n, unsigned nrdens)
+{
+  double *block;
+
+  if (n > ws->n_alloc)
+  {
+    block = (double*) malloc (11*(size_t)n*sizeof(double));
+    if (!block)
+      return 1;
+    if (ws->yy1)
+      free (ws->yy1);
+    ws->n_alloc = n;
+    ws->yy1 = block;
+  }
+  ws->k1 = ws->yy1 + n;
+  ws->k2 = ws->k1 + n;
+  ws->k3 = ws->k2 + n;
+  ws->k4 = ws->k3 + n;
+  ws->k5 = ws->k4 + n;
+  ws->k6 = ws->k5 + n;
+  ws->k7 = ws->k6 + n;
+  ws->k8 = ws->k7 + n;
+  ws->k9 = ws->k8 + n;
+  ws->k10 = ws->k9 + n;
+
+  if (nrdens)
+  {
+    if (nrdens > ws->nrdens_alloc)
+    {
+      block = (double*) malloc (8*(size_t)nrdens*sizeof(double));
+      if (!block)
+        return 1;
+      if (ws->rcont1)
+        free (ws->rcont1);
+      ws->nrdens_alloc = nrdens;
+      ws->rcont1 = block;
+    }
+    ws->rcont2 = ws->rcont1 + nrdens;
+    ws->rcont3 = ws->rcont2 + nrdens;
+    ws->rcont4 = ws->rcont3 + nrdens;
+    ws->rcont5 = ws->rcont4 + nrdens;
+    ws->rcont6 = ws->rcont5 + nrdens;
+    ws->rcont7 = ws->rcont6 + nrdens;
+    ws->rcont8 = ws->rcont7 + nrdens;
+
+    if ((nrdens < n) && (n > ws->indir_alloc))
+    {
+      if (ws->indir)
+        free (ws->indir);
+      ws->indir = (unsigned*) malloc (n*sizeof(unsigned));
+      if (!ws->indir)
+      {
+        ws->indir_alloc = 0;
+        return 1;
+      }
+      ws->indir_alloc = n;
+    }
+  }
+
+  return 0;
+
+} /* workspace_reserve */
+
+
+/* re-entrant front-end */
+int dop853_ws
+ (Dop853Workspace *ws,
+  unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
   double x, double* y, double xend, double* rtoler,
-  double* atoler, int itoler, SolTrait solout, int iout, FILE* fileout, double uround,
+  double* atoler, int itoler, SolTraitWs solout, int iout, FILE* fileout, double uround,
   double safe, double fac1, double fac2, double beta, double hmax, double h,
   long nmax, int meth, long nstiff, unsigned nrdens, unsigned* icont, unsigned licont)
 {
-  int       arret, idid;
+  int       arret;
   unsigned  i;
 
   /* initialisations */
-  nfcn = nstep = naccpt = nrejct = arret = 0;
-  rcont1 = rcont2 = rcont3 = rcont4 = rcont5 = rcont6 = rcont7 = rcont8 = NULL;
-  indir = NULL;
+  ws->nfcn = ws->nstep = ws->naccpt = ws->nrejct = arret = 0;
+  ws->use_indir = 0;
 
   /* n, the dimension of the system */
   if (n == UINT_MAX)
   {
     if (fileout)
       fprintf (fileout, "System too big, max. n = %u\r\n", UINT_MAX-1);
-    arret = 1;
+    return -1;
   }
 
   /* nmax, the maximal number of steps */
@@ -750,41 +864,27 @@ int dop853
     arret = 1;
   }
 
-  /* nrdens, number of dense output components */
+  /* is there enough free memory for the method ? */
   if (nrdens > n)
   {
     if (fileout)
       fprintf (fileout, "Curious input, nrdens = %u\r\n", nrdens);
     arret = 1;
   }
+  else if (workspace_reserve (ws, n, nrdens))
+  {
+    if (fileout)
+      fprintf (fileout, "Not enough free memory for the method\r\n");
+    arret = 1;
+  }
   else if (nrdens)
   {
-    /* is there enough memory to allocate rcont12345678&indir ? */
-    rcont1 = (double*) malloc (nrdens*sizeof(double));
-    rcont2 = (double*) malloc (nrdens*sizeof(double));
-    rcont3 = (double*) malloc (nrdens*sizeof(double));
-    rcont4 = (double*) malloc (nrdens*sizeof(double));
-    rcont5 = (double*) malloc (nrdens*sizeof(double));
-    rcont6 = (double*) malloc (nrdens*sizeof(double));
-    rcont7 = (double*) malloc (nrdens*sizeof(double));
-    rcont8 = (double*) malloc (nrdens*sizeof(double));
-    if (nrdens < n)
-      indir = (unsigned*) malloc (n*sizeof(unsigned));
-
-    if (!rcont1 || !rcont2 || !rcont3 || !rcont4 || !rcont5 ||
-	!rcont6 || !rcont7 || !rcont8 || (!indir && (nrdens < n)))
-    {
-      if (fileout)
-	fprintf (fileout, "Not enough free memory for rcont12345678&indir\r\n");
-      arret = 1;
-    }
-
     /* control of length of icont */
     if (nrdens == n)
     {
       if (icont && fileout)
 	fprintf (fileout, "Warning : when nrdens = n there is no need allocating memory for icont\r\n");
-      nrds = n;
+      ws->nrds = n;
     }
     else if (licont < nrdens)
     {
@@ -796,11 +896,12 @@ int dop853
     {
       if ((iout < 2) && fileout)
 	fprintf (fileout, "Warning : put iout = 2 for dense output\r\n");
-      nrds = nrdens;
+      ws->nrds = nrdens;
+      ws->use_indir = 1;
       for (i = 0; i < n; i++)
-	indir[i] = UINT_MAX;
+	ws->indir[i] = UINT_MAX;
       for (i = 0; i < nrdens; i++)
-	indir[icont[i]] = i;
+	ws->indir[icont[i]] = i;
     }
   }
 
@@ -846,119 +947,61 @@ int dop853
   if (hmax == 0.0)
     hmax = xend - x;
 
-  /* is there enough free memory for the method ? */
-  yy1 = (double*) malloc (n*sizeof(double));
-  k1 = (double*) malloc (n*sizeof(double));
-  k2 = (double*) malloc (n*sizeof(double));
-  k3 = (double*) malloc (n*sizeof(double));
-  k4 = (double*) malloc (n*sizeof(double));
-  k5 = (double*) malloc (n*sizeof(double));
-  k6 = (double*) malloc (n*sizeof(double));
-  k7 = (double*) malloc (n*sizeof(double));
-  k8 = (double*) malloc (n*sizeof(double));
-  k9 = (double*) malloc (n*sizeof(double));
-  k10 = (double*) malloc (n*sizeof(double));
-
-  if (!yy1 || !k1 || !k2 || !k3 || !k4 || !k5 || !k6 || !k7 || !k8 || !k9 || !k10)
-  {
-    if (fileout)
-      fprintf (fileout, "Not enough free memory for the method\r\n");
-    arret = 1;
-  }
-
   /* when a failure has occured, we return -1 */
   if (arret)
-  {
-    if (k10)
-      free (k10);
-    if (k9)
-      free (k9);
-    if (k8)
-      free (k8);
-    if (k7)
-      free (k7);
-    if (k6)
-      free (k6);
-    if (k5)
-      free (k5);
-    if (k4)
-      free (k4);
-    if (k3)
-      free (k3);
-    if (k2)
-      free (k2);
-    if (k1)
-      free (k1);
-    if (yy1)
-      free (yy1);
-    if (indir)
-      free (indir);
-    if (rcont8)
-      free (rcont8);
-    if (rcont7)
-      free (rcont7);
-    if (rcont6)
-      free (rcont6);
-    if (rcont5)
-      free (rcont5);
-    if (rcont4)
-      free (rcont4);
-    if (rcont3)
-      free (rcont3);
-    if (rcont2)
-      free (rcont2);
-    if (rcont1)
-      free (rcont1);
-
     return -1;
-  }
-  else
-  {
-    idid = dopcor (n, fcn, gradfunc, gpars, norbits, x, y, xend, hmax, h, rtoler, atoler, itoler, fileout,
-		   solout, iout, nmax, uround, meth, nstiff, safe, beta, fac1, fac2, icont);
-    free (k10);
-    free (k9);
-    free (k8);
-    free (k7);
-    free (k6);
-    free (k5);    /* reverse order freeing too increase chances */
-    free (k4);    /* of efficient dynamic memory managing       */
-    free (k3);
-    free (k2);
-    free (k1);
-    free (yy1);
-    if (indir)
-      free (indir);
-    if (rcont8)
-    {
-      free (rcont8);
-      free (rcont7);
-      free (rcont6);
-      free (rcont5);
-      free (rcont4);
-      free (rcont3);
-      free (rcont2);
-      free (rcont1);
-    }
 
-    return idid;
-  }
+  return dopcor (ws, n, fcn, gradfunc, gpars, norbits, x, y, xend, hmax, h, rtoler, atoler,
+                 itoler, fileout, solout, iout, nmax, uround, meth, nstiff, safe, beta,
+                 fac1, fac2, icont);
+
+} /* dop853_ws */
+
+
+/* adapter so that the legacy solout prototype can be driven by dop853_ws */
+static void legacy_solout (long nr, double xold, double x, double* y, unsigned n,
+                           int* irtrn, Dop853Workspace *ws)
+{
+  ws->legacy_solout (nr, xold, x, y, n, irtrn);
+
+} /* legacy_solout */
+
+
+/* front-end (not re-entrant, uses a module level workspace) */
+int dop853
+ (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+  double x, double* y, double xend, double* rtoler,
+  double* atoler, int itoler, SolTrait solout, int iout, FILE* fileout, double uround,
+  double safe, double fac1, double fac2, double beta, double hmax, double h,
+  long nmax, int meth, long nstiff, unsigned nrdens, unsigned* icont, unsigned licont)
+{
+  int idid;
+
+  legacy_ws.legacy_solout = solout;
+  idid = dop853_ws (&legacy_ws, n, fcn, gradfunc, gpars, norbits, x, y, xend,
+                    rtoler, atoler, itoler, solout ? legacy_solout : NULL, iout,
+                    fileout, uround, safe, fac1, fac2, beta, hmax, h, nmax, meth,
+                    nstiff, nrdens, icont, licont);
+
+  /* as in the original code, storage is released after each call --
+     the statistics remain readable through nfcnRead() etc. */
+  workspace_release (&legacy_ws);
+
+  return idid;
 
 } /* dop853 */
 
 
 /* dense output function */
-double contd8 (unsigned ii, double x)
+double contd8_ws (Dop853Workspace *ws, unsigned ii, double x)
 {
-  unsigned i, j;
+  unsigned i;
   double   s, s1;
 
-  i = UINT_MAX;
-
-  if (!indir)
+  if (!ws->use_indir)
     i = ii;
   else
-    i = indir[ii];
+    i = ws->indir[ii];
 
   if (i == UINT_MAX)
   {
@@ -966,11 +1009,18 @@ double contd8 (unsigned ii, double x)
     return 0.0;
   }
 
-  s = (x - xold) / hout;
+  s = (x - ws->xold) / ws->hout;
   s1 = 1.0 - s;
 
-  return rcont1[i]+s*(rcont2[i]+s1*(rcont3[i]+s*(rcont4[i]+s1*(rcont5[i]+
-	 s*(rcont6[i]+s1*(rcont7[i]+s*rcont8[i]))))));
+  return ws->rcont1[i]+s*(ws->rcont2[i]+s1*(ws->rcont3[i]+s*(ws->rcont4[i]+s1*(ws->rcont5[i]+
+	 s*(ws->rcont6[i]+s1*(ws->rcont7[i]+s*ws->rcont8[i]))))));
+
+} /* contd8_ws */
+
+
+double contd8 (unsigned ii, double x)
+{
+  return contd8_ws (&legacy_ws, ii, x);
 
 } /* contd8 */
 
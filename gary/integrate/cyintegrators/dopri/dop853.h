@@ -188,6 +188,42 @@ typedef void (*GradFn)(double t, double *pars, double *q, double *grad);
 typedef void (*SolTrait)(long nr, double xold, double x, double* y, unsigned n, int* irtrn);
 typedef void (*FcnEqDiff)(unsigned n, double x, double *y, double *f, GradFn gradfunc, double *gpars, unsigned norbits);
 
+/* ADDED BY APW: all state that used to live in module level statics is kept
+   in a workspace so that independent integrations can run concurrently
+   (e.g., from several threads). A workspace may be reused for any number of
+   calls -- storage is grown on demand and only released by
+   dop853_workspace_free(). A single workspace must not be shared between
+   threads. */
+typedef struct Dop853Workspace Dop853Workspace;
+typedef void (*SolTraitWs)(long nr, double xold, double x, double* y, unsigned n, int* irtrn,
+                           Dop853Workspace *ws);
+
+struct Dop853Workspace
+{
+  /* statistics and last step, see nfcnRead() etc. */
+  long      nfcn, nstep, naccpt, nrejct;
+  double    hout, xold, xout;
+
+  /* dense output */
+  unsigned  nrds, *indir;
+  int       use_indir;
+
+  /* stages and dense output coefficients */
+  double    *yy1, *k1, *k2, *k3, *k4, *k5, *k6, *k7, *k8, *k9, *k10;
+  double    *rcont1, *rcont2, *rcont3, *rcont4;
+  double    *rcont5, *rcont6, *rcont7, *rcont8;
+  unsigned  n_alloc, nrdens_alloc, indir_alloc;
+
+  /* free for use by the caller, e.g., to pass state to solout */
+  void      *solout_data;
+
+  /* used internally by the legacy interface */
+  SolTrait  legacy_solout;
+};
+
+extern Dop853Workspace *dop853_workspace_alloc (void);
+extern void dop853_workspace_free (Dop853Workspace *ws);
+
 extern int dop853
  (unsigned n,      /* dimension of the system <= UINT_MAX-1*/
   FcnEqDiff fcn,   /* function computing the value of f(x,y) */
@@ -223,6 +259,19 @@ extern double contd8
   double x         /* approximation at x */
  );
 
+/* ADDED BY APW: re-entrant versions of dop853() and contd8(). The arguments
+   are the same except for the workspace and the solout prototype, which also
+   receives the workspace (e.g., to call contd8_ws() or read solout_data). */
+extern int dop853_ws
+ (Dop853Workspace *ws,
+  unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+  double x, double* y, double xend, double* rtoler, double* atoler, int itoler,
+  SolTraitWs solout, int iout, FILE* fileout, double uround, double safe,
+  double fac1, double fac2, double beta, double hmax, double h, long nmax,
+  int meth, long nstiff, unsigned nrdens, unsigned* icont, unsigned licont);
+
+extern double contd8_ws (Dop853Workspace *ws, unsigned ii, double x);
+
 extern long nfcnRead (void);   /* encapsulation of statistical data */
 extern long nstepRead (void);
 extern long naccptRead (void);
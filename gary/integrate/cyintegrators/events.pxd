@@ -0,0 +1,54 @@
+ctypedef void (*Interpolant)(double t, double *w, void *data) nogil
+
+# State for detecting events for orbits i1 <= i < i2, see events.pyx
+cdef struct EventDetector:
+    int nevents # number of events to detect
+    int ndim # number of spatial dimensions
+    int i1 # index of the first orbit
+    double posneg # direction of integration
+
+    # event specification, see gary.integrate.events
+    int *kind
+    double *coeff
+    double *offset
+    int *direction
+
+    # event function values and state at the last step for each orbit
+    double *g
+    double *w_prev
+    double *f_prev
+
+    # scratch space and the end points of the Hermite interpolant
+    double *w_tmp
+    double *f_tmp
+    double t0, t1
+    double *w0
+    double *f0
+    double *w1
+    double *f1
+
+    # events found so far
+    long n
+    long size
+    long *orbit
+    long *event
+    double *t
+    double *w
+    int failed
+
+cdef class _EventDetector:
+    cdef EventDetector det
+    cdef int[::1] _kind
+    cdef double[:,::1] _coeff
+    cdef double[::1] _offset
+    cdef int[::1] _direction
+    cdef double[:,::1] _g
+    cdef double[:,::1] _w_prev
+    cdef double[:,::1] _f_prev
+    cdef double[::1] _w_tmp
+    cdef double[::1] _f_tmp
+
+cdef void c_event_start(EventDetector *det, int i, double *w, double *grad) nogil
+
+cdef void c_event_step(EventDetector *det, int i, double t0, double t1,
+                       double *w, double *grad, Interpolant interp, void *data) nogil
@@ -0,0 +1,356 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Event detection for the Cython integrators. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+from libc.stdlib cimport realloc, free
+
+cdef extern from "math.h":
+    double fabs(double x) nogil
+
+cdef extern from "float.h":
+    double DBL_EPSILON
+
+# event function types, must match the definitions in gary/integrate/events.py
+cdef enum:
+    EVENT_LINEAR = 0
+    EVENT_RADIAL = 1
+
+# maximum number of iterations when root-finding
+cdef int MAX_ITER = 128
+
+cdef double c_event_value(EventDetector *det, int e, double *w) nogil:
+    """ Evaluate the event function for event ``e`` at phase-space position ``w``. """
+    cdef:
+        int k
+        double g = 0.
+
+    if det.kind[e] == EVENT_RADIAL:
+        for k in range(det.ndim):
+            g += w[k] * w[det.ndim+k]
+
+    else:
+        for k in range(2*det.ndim):
+            g += det.coeff[e*2*det.ndim + k] * w[k]
+        g -= det.offset[e]
+
+    return g
+
+cdef void c_hermite(double t, double *w, void *data) nogil:
+    """
+    Cubic Hermite interpolation of the phase-space position between the end
+    points ``det.w0`` and ``det.w1``, using their time derivatives.
+    """
+    cdef:
+        EventDetector *det = <EventDetector*>data
+        int k
+        double h = det.t1 - det.t0
+        double s = (t - det.t0) / h
+        double h00 = (1 + 2*s) * (1 - s) * (1 - s)
+        double h10 = s * (1 - s) * (1 - s)
+        double h01 = s * s * (3 - 2*s)
+        double h11 = s * s * (s - 1)
+
+    for k in range(2*det.ndim):
+        w[k] = (h00*det.w0[k] + h10*h*det.f0[k] +
+                h01*det.w1[k] + h11*h*det.f1[k])
+
+cdef void c_derivs(int ndim, double *w, double *grad, double *f) nogil:
+    """ The time derivative of the phase-space position given the gradient. """
+    cdef int k
+    for k in range(ndim):
+        f[k] = w[ndim+k]
+        f[ndim+k] = -grad[k]
+
+cdef double c_event_root(EventDetector *det, int e, double a, double b,
+                         double fa, double fb, Interpolant interp, void *data) nogil:
+    """
+    Find the time of the zero of the event function for event ``e``, bracketed
+    by times ``a`` and ``b``, on the interpolant ``interp`` using the
+    Illinois variant of regula falsi. The interpolated phase-space position
+    at the root is left in ``det.w_tmp``.
+    """
+    cdef:
+        int it
+        int side = 0
+        double c, fc
+
+    for it in range(MAX_ITER):
+        c = (a*fb - b*fa) / (fb - fa)
+
+        # fall back to bisection if roundoff puts c outside of the bracket
+        if not ((a < c < b) or (b < c < a)):
+            c = 0.5 * (a + b)
+            if c == a or c == b:
+                break
+
+        interp(c, det.w_tmp, data)
+        fc = c_event_value(det, e, det.w_tmp)
+
+        if fc == 0.:
+            return c
+
+        elif (fc > 0.) == (fb > 0.):
+            b = c
+            fb = fc
+            if side == -1:
+                fa = 0.5 * fa
+            side = -1
+
+        else:
+            a = c
+            fa = fc
+            if side == 1:
+                fb = 0.5 * fb
+            side = 1
+
+        if fabs(b - a) <= 2*DBL_EPSILON * max(fabs(a), fabs(b)):
+            break
+
+    c = 0.5 * (a + b)
+    interp(c, det.w_tmp, data)
+    return c
+
+cdef void c_event_append(EventDetector *det, int i, int e, double t, double *w) nogil:
+    """ Store an event, growing the storage if needed. """
+    cdef:
+        int k
+        long size
+        long *orbit
+        long *event
+        double *tt
+        double *ww
+
+    if det.n == det.size:
+        size = max(2*det.size, 64)
+
+        orbit = <long*>realloc(det.orbit, size*sizeof(long))
+        if orbit != NULL:
+            det.orbit = orbit
+        event = <long*>realloc(det.event, size*sizeof(long))
+        if event != NULL:
+            det.event = event
+        tt = <double*>realloc(det.t, size*sizeof(double))
+        if tt != NULL:
+            det.t = tt
+        ww = <double*>realloc(det.w, size*2*det.ndim*sizeof(double))
+        if ww != NULL:
+            det.w = ww
+
+        if orbit == NULL or event == NULL or tt == NULL or ww == NULL:
+            det.failed = 1
+            return
+        det.size = size
+
+    det.orbit[det.n] = i
+    det.event[det.n] = e
+    det.t[det.n] = t
+    for k in range(2*det.ndim):
+        det.w[det.n*2*det.ndim + k] = w[k]
+    det.n += 1
+
+cdef void c_event_start(EventDetector *det, int i, double *w, double *grad) nogil:
+    """
+    Start detecting events for orbit ``i`` at phase-space position ``w``. If
+    events are to be found with Hermite interpolation, ``grad`` must be the
+    potential gradient at ``w``, otherwise it can be NULL.
+    """
+    cdef:
+        int e, k
+        int ii = i - det.i1
+        int nw = 2*det.ndim
+
+    if det.nevents == 0:
+        return
+
+    for e in range(det.nevents):
+        det.g[ii*det.nevents + e] = c_event_value(det, e, w)
+
+    if grad != NULL:
+        for k in range(nw):
+            det.w_prev[ii*nw + k] = w[k]
+        c_derivs(det.ndim, w, grad, &det.f_prev[ii*nw])
+
+cdef void c_event_step(EventDetector *det, int i, double t0, double t1,
+                       double *w, double *grad, Interpolant interp, void *data) nogil:
+    """
+    Find any events for orbit ``i`` in the step just taken from ``t0`` to
+    ``t1``, ending at phase-space position ``w``. The orbit over the step is
+    given by the interpolant ``interp`` (called with ``data``). If that is
+    NULL, cubic Hermite interpolation between the two ends of the step is
+    used instead, and ``grad`` must be the potential gradient at ``w``.
+
+    At most one crossing of each event per step can be found.
+    """
+    cdef:
+        int e, k, sense
+        int ii = i - det.i1
+        int nw = 2*det.ndim
+        double g0, g1, te
+
+    if det.nevents == 0:
+        return
+
+    if grad != NULL:
+        c_derivs(det.ndim, w, grad, det.f_tmp)
+
+    if interp == NULL:
+        det.t0 = t0
+        det.t1 = t1
+        det.w0 = &det.w_prev[ii*nw]
+        det.f0 = &det.f_prev[ii*nw]
+        det.w1 = w
+        det.f1 = det.f_tmp
+        interp = c_hermite
+        data = det
+
+    for e in range(det.nevents):
+        g0 = det.g[ii*det.nevents + e]
+        g1 = c_event_value(det, e, w)
+        det.g[ii*det.nevents + e] = g1
+
+        if not ((g0 < 0. and g1 >= 0.) or (g0 > 0. and g1 <= 0.)):
+            continue
+
+        # direction of the crossing in time
+        sense = 1 if g1 > g0 else -1
+        if det.posneg < 0:
+            sense = -sense
+
+        if det.direction[e] != 0 and det.direction[e] != sense:
+            continue
+
+        if g1 == 0.:
+            te = t1
+            for k in range(nw):
+                det.w_tmp[k] = w[k]
+        else:
+            te = c_event_root(det, e, t0, t1, g0, g1, interp, data)
+
+        c_event_append(det, i, e, te, det.w_tmp)
+
+    if grad != NULL:
+        for k in range(nw):
+            det.w_prev[ii*nw + k] = w[k]
+            det.f_prev[ii*nw + k] = det.f_tmp[k]
+
+cdef class _EventDetector:
+    """
+    Owns an `EventDetector` and the memory it uses, to detect events for
+    orbits ``i1 <= i < i2`` with ``ndim`` spatial dimensions. ``events`` is
+    the output of `gary.integrate.events._pack_events`, or None to not
+    detect any events. ``posneg`` is the direction of integration. Each
+    thread needs its own detector.
+    """
+
+    def __init__(self, events, int i1, int i2, int ndim, double posneg):
+        cdef int n = i2 - i1
+
+        if events is None:
+            events = (np.zeros(0, dtype=np.intc), np.zeros((0,2*ndim)),
+                      np.zeros(0), np.zeros(0, dtype=np.intc))
+        kind, coeff, offset, direction = events
+
+        self._kind = np.ascontiguousarray(kind, dtype=np.intc)
+        self._coeff = np.ascontiguousarray(coeff, dtype=float)
+        self._offset = np.ascontiguousarray(offset, dtype=float)
+        self._direction = np.ascontiguousarray(direction, dtype=np.intc)
+
+        self.det.nevents = self._kind.shape[0]
+        self.det.ndim = ndim
+        self.det.i1 = i1
+        self.det.posneg = posneg
+
+        if self._coeff.shape[1] != 2*ndim:
+            raise ValueError("Event coefficients must have {} components."
+                             .format(2*ndim))
+
+        if self.det.nevents == 0 or n == 0:
+            self.det.nevents = 0
+            return
+
+        self._g = np.zeros((n,self.det.nevents))
+        self._w_prev = np.zeros((n,2*ndim))
+        self._f_prev = np.zeros((n,2*ndim))
+        self._w_tmp = np.zeros(2*ndim)
+        self._f_tmp = np.zeros(2*ndim)
+
+        self.det.kind = &self._kind[0]
+        self.det.coeff = &self._coeff[0,0]
+        self.det.offset = &self._offset[0]
+        self.det.direction = &self._direction[0]
+        self.det.g = &self._g[0,0]
+        self.det.w_prev = &self._w_prev[0,0]
+        self.det.f_prev = &self._f_prev[0,0]
+        self.det.w_tmp = &self._w_tmp[0]
+        self.det.f_tmp = &self._f_tmp[0]
+
+    def __cinit__(self):
+        self.det.nevents = 0
+        self.det.n = 0
+        self.det.size = 0
+        self.det.orbit = NULL
+        self.det.event = NULL
+        self.det.t = NULL
+        self.det.w = NULL
+        self.det.failed = 0
+
+    def __dealloc__(self):
+        free(self.det.orbit)
+        free(self.det.event)
+        free(self.det.t)
+        free(self.det.w)
+
+    def found(self):
+        """
+        Return the orbit index, event index, time, and phase-space position
+        of the events found.
+        """
+        cdef:
+            long i, k
+            long n = self.det.n
+            int nw = 2*self.det.ndim
+            long[::1] orbit = np.empty(n, dtype='l')
+            long[::1] event = np.empty(n, dtype='l')
+            double[::1] t = np.empty(n)
+            double[:,::1] w = np.empty((n,nw))
+
+        if self.det.failed:
+            raise MemoryError("Failed to allocate memory for events.")
+
+        for i in range(n):
+            orbit[i] = self.det.orbit[i]
+            event[i] = self.det.event[i]
+            t[i] = self.det.t[i]
+            for k in range(nw):
+                w[i,k] = self.det.w[i*nw + k]
+
+        return np.asarray(orbit), np.asarray(event), np.asarray(t), np.asarray(w)
+
+def _collect_events(detectors, double posneg):
+    """
+    Combine the events found by several detectors, sorted by orbit and then
+    by time (in the direction of integration, ``posneg``). Returns the orbit
+    index, event index, time, and phase-space position of each event.
+    """
+    orbit, event, t, w = zip(*[detector.found() for detector in detectors])
+    orbit = np.concatenate(orbit)
+    event = np.concatenate(event)
+    t = np.concatenate(t)
+    w = np.concatenate(w)
+
+    ix = np.lexsort((posneg*t, orbit))
+    return orbit[ix], event[ix], t[ix], w[ix]
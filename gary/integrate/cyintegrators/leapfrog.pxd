@@ -0,0 +1,11 @@
+from ...potential.cpotential cimport _CPotential
+
+cdef void c_drift(int ndim, double dt, double *x, double *v) nogil
+
+cdef void c_kick(int ndim, double dt, double *grad, double *v) nogil
+
+cdef void c_init_velocity(_CPotential p, int ndim, double t, double dt,
+                          double *x_jm1, double *v_jm1, double *v_jm1_2, double *grad) nogil
+
+cdef void c_leapfrog_step(_CPotential p, int ndim, double t, double dt,
+                          double *x_jm1, double *v_jm1, double *v_jm1_2, double *grad) nogil
@@ -11,6 +11,9 @@ from __future__ import division, print_function
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
 
+# Standard library
+import threading
+
 # Third-party
 import numpy as np
 cimport numpy as np
@@ -18,9 +21,26 @@ np.import_array()
 
 # Project
 from ...potential.cpotential cimport _CPotential
+from .events cimport EventDetector, _EventDetector, c_event_start, c_event_step
+from .events import _collect_events
+from ..core import _output_array
+from ..events import _pack_events
+from ..timespec import _store_indices
 
 # ctypedef void (*f_type)(int, double*, double*)
 
+cdef void c_drift(int ndim, double dt, double *x, double *v) nogil:
+    """ Step the positions forward by ``dt`` at fixed velocity. """
+    cdef int k
+    for k in range(ndim):
+        x[k] = x[k] + v[k] * dt
+
+cdef void c_kick(int ndim, double dt, double *grad, double *v) nogil:
+    """ Step the velocities forward by ``dt`` given the potential gradient. """
+    cdef int k
+    for k in range(ndim):
+        v[k] = v[k] - grad[k] * dt  # acceleration is minus gradient
+
 cdef void c_init_velocity(_CPotential p, int ndim, double t, double dt,
                           double *x_jm1, double *v_jm1, double *v_jm1_2, double *grad) nogil:
     cdef int k
@@ -35,8 +55,7 @@ cdef void c_leapfrog_step(_CPotential p, int ndim, double t, double dt,
     cdef int k
 
     # full step the positions
-    for k in range(ndim):
-        x_jm1[k] = x_jm1[k] + v_jm1_2[k] * dt
+    c_drift(ndim, dt, x_jm1, v_jm1_2)
 
     p._gradient(t, x_jm1, grad)  # compute gradient at new position
 
@@ -46,46 +65,128 @@ cdef void c_leapfrog_step(_CPotential p, int ndim, double t, double dt,
         v_jm1[k] = v_jm1_2[k] - grad[k] * dt/2.
         v_jm1_2[k] = v_jm1_2[k] - grad[k] * dt
 
+cdef void c_leapfrog_orbits(_CPotential potential, double[::1] t, int[::1] out_ix,
+                            double[:,::1] w, double[:,:,:] all_w,
+                            double[:,::1] v_jm1_2, double *grad,
+                            EventDetector *det, int i1, int i2) nogil:
+    """
+    Integrate orbits ``i1 <= i < i2`` starting from the initial conditions
+    in ``w``, which holds the current state of each orbit. The state at
+    time index ``out_ix[k]`` is stored in ``all_w[k]``. ``grad`` is
+    scratch space. Events are found with ``det`` using Hermite
+    interpolation between steps.
+    """
+    cdef:
+        int i,j,k
+        int jout = 0
+        int ndim = w.shape[1] // 2
+        int ntimes = t.shape[0]
+        int nout = out_ix.shape[0]
+        double dt = t[1]-t[0]
+
+    # first initialize the velocities so they are evolved by a
+    #   half step relative to the positions
+    for i in range(i1,i2):
+        for k in range(ndim):
+            grad[k] = 0.
+
+        c_init_velocity(potential, ndim, t[0], dt,
+                        &w[i,0], &w[i,ndim], &v_jm1_2[i,0], grad)
+        c_event_start(det, i, &w[i,0], grad)
+
+    for j in range(0,ntimes,1):
+        if j > 0:
+            for i in range(i1,i2):
+                for k in range(ndim):
+                    grad[k] = 0.
+
+                c_leapfrog_step(potential, ndim, t[j], dt,
+                                &w[i,0], &w[i,ndim], &v_jm1_2[i,0], grad)
+                c_event_step(det, i, t[j-1], t[j], &w[i,0], grad, NULL, NULL)
+
+        if jout < nout and out_ix[jout] == j:
+            for i in range(i1,i2):
+                for k in range(2*ndim):
+                    all_w[jout,i,k] = w[i,k]
+            jout += 1
+
+def _leapfrog_worker(_CPotential potential, double[::1] t, int[::1] out_ix,
+                     double[:,::1] w, double[:,:,:] all_w,
+                     double[:,::1] v_jm1_2, _EventDetector detector,
+                     int i1, int i2):
+    # each thread gets its own scratch space for the gradient
+    cdef double[::1] grad = np.zeros(all_w.shape[2] // 2)
+    with nogil:
+        c_leapfrog_orbits(potential, t, out_ix, w, all_w, v_jm1_2, &grad[0],
+                          &detector.det, i1, i2)
+
 cpdef leapfrog_integrate_potential(_CPotential potential, double [:,::1] w0,
-                                   double[::1] t):
+                                   double[::1] t, int nthreads=1, int store_every=1,
+                                   out=None, events=None):
     """
     CAUTION: Interpretation of axes is different here! We need the
     arrays to be C ordered and easy to iterate over, so here the
     axes are (norbits, ndim).
+
+    With ``nthreads > 1``, the orbits are split into contiguous blocks that
+    are integrated concurrently (with the GIL released) in separate threads.
+    The orbits are independent, so the output is identical to the serial case.
+
+    Only every ``store_every`` step is stored, starting with the initial
+    conditions, and the times of the stored steps are returned. If
+    ``store_every`` is 0, only the final state is stored.
+
+    The output is written into ``out`` if given, which must be a writable
+    array (e.g., a view of a `numpy.memmap`) of shape ``(nout, norbits, ndim)``,
+    where ``nout`` is the number of stored times. It does not need to be
+    C-contiguous, so the final output layout can be filled in directly.
+
+    If a list of ``events`` (`~gary.integrate.Event` instances) is given,
+    the events are located using cubic Hermite interpolation between steps
+    and the orbit index, event index, time, and phase-space position of
+    each event are also returned, sorted by orbit and time.
     """
     cdef:
         # temporary scalars
-        int i,j,k
+        int i
         int n = w0.shape[0]
         int ndim = w0.shape[1] // 2
 
         int ntimes = len(t)
-        double dt = t[1]-t[0]
+        int[::1] out_ix = _store_indices(ntimes, store_every)
 
         # temporary array containers
-        double[::1] grad = np.zeros(ndim)
         double[:,::1] v_jm1_2 = np.zeros((n,ndim))
+        double[:,::1] w = w0.copy()
 
         # return arrays
-        double[:,:,::1] all_w = np.zeros((ntimes,n,2*ndim))
-
-    # save initial conditions
-    all_w[0,:,:] = w0.copy()
-
-    with nogil:
-        # first initialize the velocities so they are evolved by a
-        #   half step relative to the positions
-        for i in range(n):
-            c_init_velocity(potential, ndim, t[0], dt,
-                            &all_w[0,i,0], &all_w[0,i,ndim], &v_jm1_2[i,0], &grad[0])
-
-        for j in range(1,ntimes,1):
-            for i in range(n):
-                for k in range(ndim):
-                    all_w[j,i,k] = all_w[j-1,i,k]
-                    grad[k] = 0.
-
-                c_leapfrog_step(potential, ndim, t[j], dt,
-                                &all_w[j,i,0], &all_w[j,i,ndim], &v_jm1_2[i,0], &grad[0])
-
-    return np.asarray(t), np.asarray(all_w)
+        double[:,:,:] all_w = _output_array((out_ix.shape[0],n,2*ndim), out)
+
+        double posneg = 1. if t[ntimes-1] >= t[0] else -1.
+
+    if events is not None:
+        events = _pack_events(events, ndim)
+
+    nthreads = max(1, min(nthreads, n))
+    bounds = np.linspace(0, n, nthreads+1).astype(int)
+    detectors = [_EventDetector(events, bounds[i], bounds[i+1], ndim, posneg)
+                 for i in range(nthreads)]
+
+    if nthreads == 1:
+        _leapfrog_worker(potential, t, out_ix, w, all_w, v_jm1_2,
+                         detectors[0], 0, n)
+
+    else:
+        threads = [threading.Thread(target=_leapfrog_worker,
+                                    args=(potential, t, out_ix, w, all_w, v_jm1_2,
+                                          detectors[i], bounds[i], bounds[i+1]))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if events is not None:
+        return (np.asarray(t)[np.asarray(out_ix)], np.asarray(all_w),
+                _collect_events(detectors, posneg))
+    return np.asarray(t)[np.asarray(out_ix)], np.asarray(all_w)
@@ -0,0 +1,158 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" 5th order Runge-Kutta integration in Cython. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import threading
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+# Project
+from ...potential.cpotential cimport _CPotential
+from ..pyintegrators.rk5 import A as _A, B as _B, C as _C
+from ..core import _output_array
+from ..timespec import _store_indices
+
+# Cash-Karp parameters, shared with the Python implementation
+cdef double[::1] A = np.ascontiguousarray(_A)
+cdef double[:,::1] B = np.ascontiguousarray(_B)
+cdef double[::1] C = np.ascontiguousarray(_C)
+
+cdef void c_derivs(_CPotential p, int ndim, double t, double *w, double *dw) nogil:
+    """ Phase-space derivatives, ``dw``, at the phase-space position ``w``. """
+    cdef int k
+
+    for k in range(ndim):
+        dw[k] = w[ndim+k]
+        dw[ndim+k] = 0.
+
+    p._gradient(t, w, &dw[ndim])
+    for k in range(ndim):
+        dw[ndim+k] = -dw[ndim+k]  # acceleration is minus gradient
+
+cdef void c_rk5_step(_CPotential p, int ndim, double t, double dt,
+                     double *w, double[:,::1] K, double *tmp) nogil:
+    """
+    Step the phase-space position ``w`` forward by ``dt``. ``K`` (shape
+    ``(6,2*ndim)``) and ``tmp`` (length ``2*ndim``) are scratch space for
+    the stages.
+    """
+    cdef int k, s, r
+
+    for s in range(6):
+        for k in range(2*ndim):
+            tmp[k] = w[k]
+            for r in range(s):
+                tmp[k] = tmp[k] + B[s,r]*K[r,k]
+
+        c_derivs(p, ndim, t + A[s]*dt, tmp, &K[s,0])
+        for k in range(2*ndim):
+            K[s,k] = K[s,k] * dt
+
+    for s in range(6):
+        for k in range(2*ndim):
+            w[k] = w[k] + C[s]*K[s,k]
+
+cdef void c_rk5_orbits(_CPotential potential, double[::1] t, int[::1] out_ix,
+                       double[:,::1] w, double[:,:,:] all_w,
+                       double[:,::1] K, double *tmp, int i1, int i2) nogil:
+    """
+    Integrate orbits ``i1 <= i < i2`` starting from the initial conditions
+    in ``w``, which holds the current state of each orbit. The state at
+    time index ``out_ix[k]`` is stored in ``all_w[k]``. ``K`` and ``tmp``
+    are scratch space.
+    """
+    cdef:
+        int i,j,k
+        int jout = 0
+        int ndim = w.shape[1] // 2
+        int ntimes = t.shape[0]
+        int nout = out_ix.shape[0]
+        double dt = t[1]-t[0]
+
+    for j in range(0,ntimes,1):
+        if j > 0:
+            for i in range(i1,i2):
+                c_rk5_step(potential, ndim, t[j-1], dt, &w[i,0], K, tmp)
+
+        if jout < nout and out_ix[jout] == j:
+            for i in range(i1,i2):
+                for k in range(2*ndim):
+                    all_w[jout,i,k] = w[i,k]
+            jout += 1
+
+def _rk5_worker(_CPotential potential, double[::1] t, int[::1] out_ix,
+                double[:,::1] w, double[:,:,:] all_w, int i1, int i2):
+    # each thread gets its own scratch space for the stages
+    cdef:
+        int ndim = w.shape[1] // 2
+        double[:,::1] K = np.zeros((6,2*ndim))
+        double[::1] tmp = np.zeros(2*ndim)
+
+    with nogil:
+        c_rk5_orbits(potential, t, out_ix, w, all_w, K, &tmp[0], i1, i2)
+
+cpdef rk5_integrate_potential(_CPotential potential, double [:,::1] w0,
+                              double[::1] t, int nthreads=1, int store_every=1,
+                              out=None):
+    """
+    CAUTION: Interpretation of axes is different here! We need the
+    arrays to be C ordered and easy to iterate over, so here the
+    axes are (norbits, ndim).
+
+    With ``nthreads > 1``, the orbits are split into contiguous blocks that
+    are integrated concurrently (with the GIL released) in separate threads.
+    The orbits are independent, so the output is identical to the serial case.
+
+    Only every ``store_every`` step is stored, starting with the initial
+    conditions, and the times of the stored steps are returned. If
+    ``store_every`` is 0, only the final state is stored.
+
+    The output is written into ``out`` if given, which must be a writable
+    array (e.g., a view of a `numpy.memmap`) of shape ``(nout, norbits, ndim)``,
+    where ``nout`` is the number of stored times. It does not need to be
+    C-contiguous, so the final output layout can be filled in directly.
+    """
+    cdef:
+        # temporary scalars
+        int i
+        int n = w0.shape[0]
+        int ndim = w0.shape[1] // 2
+
+        int ntimes = len(t)
+        int[::1] out_ix = _store_indices(ntimes, store_every)
+
+        # current state of each orbit
+        double[:,::1] w = w0.copy()
+
+        # return arrays
+        double[:,:,:] all_w = _output_array((out_ix.shape[0],n,2*ndim), out)
+
+    nthreads = max(1, min(nthreads, n))
+    if nthreads == 1:
+        _rk5_worker(potential, t, out_ix, w, all_w, 0, n)
+
+    else:
+        bounds = np.linspace(0, n, nthreads+1).astype(int)
+        threads = [threading.Thread(target=_rk5_worker,
+                                    args=(potential, t, out_ix, w, all_w,
+                                          bounds[i], bounds[i+1]))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return np.asarray(t)[np.asarray(out_ix)], np.asarray(all_w)
@@ -0,0 +1,159 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Higher-order symplectic (composition) integration in Cython. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import threading
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+# Project
+from ...potential.cpotential cimport _CPotential
+from .leapfrog cimport c_drift, c_kick
+from ..core import _output_array
+from ..timespec import _store_indices
+
+cdef void c_symplectic_step(_CPotential p, int ndim, double t, double dt,
+                            double[::1] drift, double[::1] kick,
+                            double *x, double *v, double *grad) nogil:
+    """
+    One step of a kick-drift composition method,
+
+        K(kick[0] dt) D(drift[0] dt) K(kick[1] dt) ... D(drift[s-1] dt) K(kick[s] dt)
+
+    On input, ``grad`` must contain the gradient at ``x``; on output it
+    contains the gradient at the new position, so the first kick of the
+    next step doesn't need another gradient evaluation.
+    """
+    cdef:
+        int k, s
+        int nstages = drift.shape[0]
+
+    for s in range(nstages):
+        c_kick(ndim, kick[s]*dt, grad, v)
+        c_drift(ndim, drift[s]*dt, x, v)
+        t = t + drift[s]*dt
+
+        for k in range(ndim):
+            grad[k] = 0.
+        p._gradient(t, x, grad)
+
+    c_kick(ndim, kick[nstages]*dt, grad, v)
+
+cdef void c_symplectic_orbits(_CPotential potential, double[::1] t,
+                              int[::1] out_ix, double[::1] drift, double[::1] kick,
+                              double[:,::1] w, double[:,:,:] all_w,
+                              double[:,::1] grad, int i1, int i2) nogil:
+    """
+    Integrate orbits ``i1 <= i < i2`` starting from the initial conditions
+    in ``w``, which holds the current state of each orbit. The state at
+    time index ``out_ix[k]`` is stored in ``all_w[k]``. ``grad`` stores the
+    gradient at the current position of each orbit.
+    """
+    cdef:
+        int i,j,k
+        int jout = 0
+        int ndim = w.shape[1] // 2
+        int ntimes = t.shape[0]
+        int nout = out_ix.shape[0]
+        double dt = t[1]-t[0]
+
+    for i in range(i1,i2):
+        for k in range(ndim):
+            grad[i,k] = 0.
+        potential._gradient(t[0], &w[i,0], &grad[i,0])
+
+    for j in range(0,ntimes,1):
+        if j > 0:
+            for i in range(i1,i2):
+                c_symplectic_step(potential, ndim, t[j-1], dt, drift, kick,
+                                  &w[i,0], &w[i,ndim], &grad[i,0])
+
+        if jout < nout and out_ix[jout] == j:
+            for i in range(i1,i2):
+                for k in range(2*ndim):
+                    all_w[jout,i,k] = w[i,k]
+            jout += 1
+
+def _symplectic_worker(_CPotential potential, double[::1] t, int[::1] out_ix,
+                       double[::1] drift, double[::1] kick,
+                       double[:,::1] w, double[:,:,:] all_w,
+                       double[:,::1] grad, int i1, int i2):
+    with nogil:
+        c_symplectic_orbits(potential, t, out_ix, drift, kick, w, all_w, grad, i1, i2)
+
+cpdef symplectic_integrate_potential(_CPotential potential, double [:,::1] w0,
+                                     double[::1] t, double[::1] drift,
+                                     double[::1] kick, int nthreads=1,
+                                     int store_every=1, out=None):
+    """
+    CAUTION: Interpretation of axes is different here! We need the
+    arrays to be C ordered and easy to iterate over, so here the
+    axes are (norbits, ndim).
+
+    Integrate with a kick-drift composition method specified by the drift
+    and kick coefficients of each stage (see
+    `~gary.integrate.SymplecticIntegrator`). There must be one more kick
+    than drift coefficient. Leapfrog is ``drift=[1.]``, ``kick=[0.5,0.5]``.
+
+    With ``nthreads > 1``, the orbits are split into contiguous blocks that
+    are integrated concurrently (with the GIL released) in separate threads.
+    The orbits are independent, so the output is identical to the serial case.
+
+    Only every ``store_every`` step is stored, starting with the initial
+    conditions, and the times of the stored steps are returned. If
+    ``store_every`` is 0, only the final state is stored.
+
+    The output is written into ``out`` if given, which must be a writable
+    array (e.g., a view of a `numpy.memmap`) of shape ``(nout, norbits, ndim)``,
+    where ``nout`` is the number of stored times. It does not need to be
+    C-contiguous, so the final output layout can be filled in directly.
+    """
+    cdef:
+        # temporary scalars
+        int i
+        int n = w0.shape[0]
+        int ndim = w0.shape[1] // 2
+
+        int ntimes = len(t)
+        int[::1] out_ix = _store_indices(ntimes, store_every)
+
+        # current state and gradient at the current position of each orbit
+        double[:,::1] w = w0.copy()
+        double[:,::1] grad = np.zeros((n,ndim))
+
+        # return arrays
+        double[:,:,:] all_w = _output_array((out_ix.shape[0],n,2*ndim), out)
+
+    if kick.shape[0] != drift.shape[0] + 1:
+        raise ValueError("There must be one more kick coefficient than drift "
+                         "coefficient.")
+
+    nthreads = max(1, min(nthreads, n))
+    if nthreads == 1:
+        _symplectic_worker(potential, t, out_ix, drift, kick, w, all_w, grad, 0, n)
+
+    else:
+        bounds = np.linspace(0, n, nthreads+1).astype(int)
+        threads = [threading.Thread(target=_symplectic_worker,
+                                    args=(potential, t, out_ix, drift, kick, w,
+                                          all_w, grad, bounds[i], bounds[i+1]))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return np.asarray(t)[np.asarray(out_ix)], np.asarray(all_w)
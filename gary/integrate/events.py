@@ -0,0 +1,131 @@
+# coding: utf-8
+
+""" Events that can be detected while integrating orbits with the Cython
+    integrators.
+"""
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+
+__all__ = ['Event', 'PlaneCrossing', 'Pericenter', 'Apocenter']
+
+# event function types, must match the definitions in cyintegrators/events.pyx
+_LINEAR = 0 # g(w) = coeff . w - offset
+_RADIAL = 1 # g(w) = x . v, i.e. r dr/dt
+
+class Event(object):
+    r"""
+    An event to detect while integrating an orbit. An event happens when an
+    event function of the phase-space position, :math:`g(w)`, crosses zero.
+    The time of the crossing is found by root-finding on an interpolant of
+    the orbit between two integration steps, so the event states are
+    accurate to the order of the integration scheme rather than to the
+    output time sampling.
+
+    Only the Cython integrators support events, see
+    `~gary.potential.PotentialBase.integrate_orbit`. Use one of the
+    subclasses to specify a particular event.
+
+    Parameters
+    ----------
+    direction : int (optional)
+        Only detect crossings where :math:`g` increases (1) or decreases
+        (-1) with time. The default (0) detects both.
+    """
+    _kind = _LINEAR
+
+    def __init__(self, direction=0):
+        if direction not in (-1, 0, 1):
+            raise ValueError("direction must be -1, 0, or 1.")
+        self.direction = int(direction)
+
+    def _coefficients(self, ndim):
+        """
+        The coefficients and offset of the event function, for events that
+        are linear in the phase-space position.
+        """
+        return np.zeros(2*ndim), 0.
+
+class PlaneCrossing(Event):
+    r"""
+    Crossings of the plane :math:`\hat{n} \cdot x = d`. For example, the
+    upward crossings of the :math:`z=0` plane used for a surface of section
+    are ``PlaneCrossing([0,0,1], direction=1)``.
+
+    Parameters
+    ----------
+    normal : array_like
+        The normal vector of the plane. If this has ``2*ndim`` components,
+        the plane is in phase-space, so any linear combination of the
+        positions and velocities can be used.
+    offset : numeric (optional)
+        The offset of the plane, :math:`d`.
+    direction : int (optional)
+        Only detect crossings in the direction of the normal (1) or in the
+        opposite direction (-1). The default (0) detects both.
+    """
+
+    def __init__(self, normal, offset=0., direction=0):
+        super(PlaneCrossing, self).__init__(direction=direction)
+        self.normal = np.array(normal, dtype=float)
+        self.offset = float(offset)
+
+        if self.normal.ndim != 1:
+            raise ValueError("normal must be a 1D array.")
+
+    def _coefficients(self, ndim):
+        coeff = np.zeros(2*ndim)
+        if len(self.normal) not in (ndim, 2*ndim):
+            raise ValueError("normal must have {} or {} components, not {}."
+                             .format(ndim, 2*ndim, len(self.normal)))
+        coeff[:len(self.normal)] = self.normal
+        return coeff, self.offset
+
+class Pericenter(Event):
+    """
+    Pericenters, where :math:`dr/dt` crosses zero from below.
+    """
+    _kind = _RADIAL
+
+    def __init__(self):
+        super(Pericenter, self).__init__(direction=1)
+
+class Apocenter(Event):
+    """
+    Apocenters, where :math:`dr/dt` crosses zero from above.
+    """
+    _kind = _RADIAL
+
+    def __init__(self):
+        super(Apocenter, self).__init__(direction=-1)
+
+def _pack_events(events, ndim):
+    """
+    Pack a list of `Event` objects into arrays that can be passed to the
+    Cython integrators: the event function types, the coefficients (with
+    shape ``(nevents, 2*ndim)``) and offsets of the linear event functions,
+    and the directions.
+    """
+    if isinstance(events, Event):
+        events = [events]
+
+    nevents = len(events)
+    kind = np.zeros(nevents, dtype=np.intc)
+    coeff = np.zeros((nevents, 2*ndim))
+    offset = np.zeros(nevents)
+    direction = np.zeros(nevents, dtype=np.intc)
+
+    for i,event in enumerate(events):
+        if not isinstance(event, Event):
+            raise TypeError("Events must be Event instances, not '{}'"
+                            .format(type(event)))
+
+        kind[i] = event._kind
+        coeff[i], offset[i] = event._coefficients(ndim)
+        direction[i] = event.direction
+
+    return kind, coeff, offset, direction
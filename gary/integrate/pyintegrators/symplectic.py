@@ -0,0 +1,166 @@
+# coding: utf-8
+
+""" Higher-order symplectic integration by composition. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+
+# Project
+from ..core import Integrator
+from ..timespec import parse_time_specification
+from ...util import inherit_docs
+
+__all__ = ["SymplecticIntegrator", "ForestRuthIntegrator", "BlanesMoanIntegrator",
+           "Yoshida6Integrator", "Yoshida8Integrator"]
+
+def _compose_leapfrog(weights):
+    """
+    Drift and kick coefficients for a symmetric composition of
+    (kick-drift-kick) leapfrog steps with the given weights. The last kick
+    of each leapfrog step is merged with the first kick of the next.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    drift = weights.copy()
+    kick = np.concatenate(([weights[0]/2.],
+                           (weights[1:] + weights[:-1])/2.,
+                           [weights[-1]/2.]))
+    return drift, kick
+
+def _triple_jump_weights(inner):
+    """
+    Weights for a symmetric composition given the outer half of the
+    weights, ``inner``, listed from the outside in. The central weight is
+    set so that the weights sum to 1.
+    """
+    inner = list(inner)
+    return inner + [1. - 2*sum(inner)] + inner[::-1]
+
+@inherit_docs
+class SymplecticIntegrator(Integrator):
+    r"""
+    A fixed-step, symplectic integrator for separable Hamiltonians that
+    takes each step as a sequence of kicks (velocity updates) and drifts
+    (position updates),
+
+    .. math::
+
+        K(b_0 \Delta t)\,D(a_0 \Delta t)\,K(b_1 \Delta t) \cdots D(a_{s-1} \Delta t)\,K(b_s \Delta t)
+
+    The gradient at the end of a step is reused for the first kick of the
+    next, so each step costs :math:`s` force evaluations. Subclasses set the
+    coefficients, ``drift`` (:math:`a_i`) and ``kick`` (:math:`b_i`). The
+    base class with the default coefficients is the (kick-drift-kick)
+    leapfrog.
+
+    When integrating in a potential with a C implementation, the same
+    coefficients are used by
+    `~gary.integrate.cyintegrators.symplectic_integrate_potential`.
+
+    Parameters
+    ----------
+    func : func
+        A callable object that computes the phase-space time derivatives
+        at a time and point in phase space.
+    func_args : tuple (optional)
+        Any extra arguments for the derivative function.
+    func_units : `~gary.units.UnitSystem` (optional)
+        If using units, this is the unit system assumed by the
+        integrand function.
+
+    """
+    drift, kick = _compose_leapfrog([1.])
+
+    def _acceleration(self, t, x, v):
+        F = self.F(t, np.vstack((x,v)), *self._func_args)
+        return F[self.ndim:]
+
+    def step(self, t, x, v, a, dt):
+        """
+        Step forward the positions and velocities by the given timestep.
+
+        Parameters
+        ----------
+        t : numeric
+            The time at the start of the step.
+        x : array_like
+            The positions.
+        v : array_like
+            The velocities.
+        a : array_like
+            The acceleration at the positions, ``x``.
+        dt : numeric
+            The timestep to move forward.
+        """
+        for a_i,b_i in zip(self.drift, self.kick[:-1]):
+            v = v + a * b_i*dt
+            x = x + v * a_i*dt
+            t = t + a_i*dt
+            a = self._acceleration(t, x, v)
+
+        v = v + a * self.kick[-1]*dt
+        return x, v, a
+
+    def run(self, w0, mmap=None, **time_spec):
+
+        # generate the array of times
+        times = parse_time_specification(**time_spec)
+        nsteps = len(times) - 1
+        dt = times[1] - times[0]
+
+        w0_obj, w0, ws = self._prepare_ws(w0, mmap, nsteps)
+        x = w0[:self.ndim]
+        v = w0[self.ndim:]
+        a = self._acceleration(times[0], x, v)
+
+        ws[:,0] = w0
+        for ii in range(1,nsteps+1):
+            x, v, a = self.step(times[ii-1], x, v, a, dt)
+            ws[:self.ndim,ii,:] = x
+            ws[self.ndim:,ii,:] = v
+
+        return self._handle_output(w0_obj, times, ws)
+
+class ForestRuthIntegrator(SymplecticIntegrator):
+    """
+    4th-order symplectic integrator of Forest & Ruth (1990): three leapfrog
+    steps with weights :math:`(w_1, 1-2w_1, w_1)`, with
+    :math:`w_1 = 1/(2-2^{1/3})`. 3 force evaluations per step.
+    """
+    drift, kick = _compose_leapfrog(_triple_jump_weights([1. / (2. - 2**(1/3.))]))
+
+class BlanesMoanIntegrator(SymplecticIntegrator):
+    """
+    4th-order symplectic Runge-Kutta-Nyström integrator with optimized
+    coefficients from Blanes & Moan (2002; SRKN_6^b). 6 force evaluations
+    per step, but with errors orders of magnitude smaller than
+    `ForestRuthIntegrator` at the same cost.
+    """
+    _b = [0.0829844064174052, 0.396309801498368, -0.0390563049223486]
+    _a = [0.245298957184271, 0.604872665711080]
+    kick = np.array(_triple_jump_weights(_b))
+    drift = np.array(_a + [0.5 - sum(_a)]*2 + _a[::-1])
+    del _a, _b
+
+class Yoshida6Integrator(SymplecticIntegrator):
+    """
+    6th-order symplectic integrator of Yoshida (1990; solution A): a
+    symmetric composition of 7 leapfrog steps. 7 force evaluations per
+    step.
+    """
+    drift, kick = _compose_leapfrog(_triple_jump_weights([
+        0.784513610477560, 0.235573213359357, -1.17767998417887]))
+
+class Yoshida8Integrator(SymplecticIntegrator):
+    """
+    8th-order symplectic integrator of Yoshida (1990; solution D): a
+    symmetric composition of 15 leapfrog steps. 15 force evaluations per
+    step.
+    """
+    drift, kick = _compose_leapfrog(_triple_jump_weights([
+        0.914844246229740, 0.253693336566229, -1.44485223686048,
+        -0.158240635368243, 1.93813913762276, -1.96061023297549,
+        0.102799849391985]))
@@ -8,6 +8,13 @@ def get_extensions():
     # malloc
     mac_incl_path = "/usr/include/malloc"
 
+    cfg = setup_helpers.DistutilsExtensionArgs()
+    cfg['include_dirs'].append('numpy')
+    cfg['include_dirs'].append(mac_incl_path)
+    cfg['extra_compile_args'].append('--std=gnu99')
+    cfg['sources'].append('gary/integrate/cyintegrators/events.pyx')
+    exts.append(Extension('gary.integrate.cyintegrators.events', **cfg))
+
     cfg = setup_helpers.DistutilsExtensionArgs()
     cfg['include_dirs'].append('numpy')
     cfg['include_dirs'].append(mac_incl_path)
@@ -15,6 +22,20 @@ def get_extensions():
     cfg['sources'].append('gary/integrate/cyintegrators/leapfrog.pyx')
     exts.append(Extension('gary.integrate.cyintegrators.leapfrog', **cfg))
 
+    cfg = setup_helpers.DistutilsExtensionArgs()
+    cfg['include_dirs'].append('numpy')
+    cfg['include_dirs'].append(mac_incl_path)
+    cfg['extra_compile_args'].append('--std=gnu99')
+    cfg['sources'].append('gary/integrate/cyintegrators/symplectic.pyx')
+    exts.append(Extension('gary.integrate.cyintegrators.symplectic', **cfg))
+
+    cfg = setup_helpers.DistutilsExtensionArgs()
+    cfg['include_dirs'].append('numpy')
+    cfg['include_dirs'].append(mac_incl_path)
+    cfg['extra_compile_args'].append('--std=gnu99')
+    cfg['sources'].append('gary/integrate/cyintegrators/rk5.pyx')
+    exts.append(Extension('gary.integrate.cyintegrators.rk5', **cfg))
+
     cfg = setup_helpers.DistutilsExtensionArgs()
     cfg['include_dirs'].append('numpy')
     cfg['include_dirs'].append(mac_incl_path)
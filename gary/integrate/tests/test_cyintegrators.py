@@ -9,6 +9,7 @@ __author__ = "adrn <adrn@astro.columbia.edu>"
 
 # Standard library
 import os
+import threading
 import time
 
 # Third-party
@@ -21,11 +22,19 @@ from ..pyintegrators.leapfrog import LeapfrogIntegrator
 from ..cyintegrators.leapfrog import leapfrog_integrate_potential
 from ..pyintegrators.dopri853 import DOPRI853Integrator
 from ..cyintegrators.dop853 import dop853_integrate_potential
+from ..pyintegrators.rk5 import RK5Integrator
+from ..cyintegrators.rk5 import rk5_integrate_potential
+from ..pyintegrators.symplectic import (SymplecticIntegrator, ForestRuthIntegrator,
+                                        BlanesMoanIntegrator, Yoshida6Integrator,
+                                        Yoshida8Integrator)
+from ..cyintegrators.symplectic import symplectic_integrate_potential
+from ..events import PlaneCrossing, Pericenter, Apocenter
 from ...potential import HernquistPotential
 from ...units import galactic
 
-integrator_list = [LeapfrogIntegrator, DOPRI853Integrator]
-func_list = [leapfrog_integrate_potential, dop853_integrate_potential]
+integrator_list = [LeapfrogIntegrator, DOPRI853Integrator, RK5Integrator]
+func_list = [leapfrog_integrate_potential, dop853_integrate_potential,
+             rk5_integrate_potential]
 _list = zip(integrator_list, func_list)
 
 # ----------------------------------------------------------------------------
@@ -58,6 +67,443 @@ def test_compare_to_py(Integrator, integrate_func):
     assert py_w.shape == cy_w.shape
     assert np.allclose(cy_w[:,-1], py_w[:,-1])
 
+symplectic_list = [SymplecticIntegrator, ForestRuthIntegrator, BlanesMoanIntegrator,
+                   Yoshida6Integrator, Yoshida8Integrator]
+
+@pytest.mark.parametrize("Integrator", symplectic_list)
+def test_symplectic_compare_to_py(Integrator):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    def F(t,w):
+        dq = w[3:]
+        dp = -p.gradient(w[:3])
+        return np.vstack((dq,dp))
+
+    cy_w0 = np.array([[0.,10.,0.,0.2,0.,0.],
+                      [10.,0.,0.,0.,0.2,0.]])
+    py_w0 = np.ascontiguousarray(cy_w0.T)
+
+    nsteps = 1000
+    dt = 2.
+    t = np.linspace(0,dt*nsteps,nsteps+1)
+
+    cy_t,cy_w = symplectic_integrate_potential(p.c_instance, cy_w0, t,
+                                               Integrator.drift, Integrator.kick)
+    cy_w = np.rollaxis(cy_w, -1)
+
+    integrator = Integrator(F)
+    orbit = integrator.run(py_w0, dt=dt, nsteps=nsteps)
+    py_w = orbit.w()
+
+    assert py_w.shape == cy_w.shape
+    assert np.allclose(cy_w[:,-1], py_w[:,-1])
+
+def test_symplectic_leapfrog():
+    # the default coefficients are kick-drift-kick leapfrog
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[0.,10.,0.,0.2,0.,0.],
+                   [10.,0.,0.,0.,0.2,0.]])
+    t = np.linspace(0,2000.,1001)
+
+    t1,w1 = leapfrog_integrate_potential(p.c_instance, w0, t)
+    t2,w2 = symplectic_integrate_potential(p.c_instance, w0, t,
+                                           SymplecticIntegrator.drift,
+                                           SymplecticIntegrator.kick)
+    assert np.allclose(w1, w2)
+
+    with pytest.raises(ValueError):
+        symplectic_integrate_potential(p.c_instance, w0, t,
+                                       np.ones(2), np.ones(2))
+
+@pytest.mark.parametrize("Integrator", symplectic_list)
+def test_symplectic_integrate_orbit(Integrator):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = [10.,0.,0.,0.,0.2,0.]
+
+    orbit = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+    E = orbit.energy().value
+    assert np.all(np.abs((E[1:] - E[0]) / E[0]) < 1E-3)
+
+    orbit2 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator,
+                               nthreads=2)
+    assert np.allclose(orbit.w(p.units), orbit2.w(p.units))
+
+def test_rk5_integrate_orbit():
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = [10.,0.,0.,0.,0.2,0.]
+
+    orbit1 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=RK5Integrator)
+    orbit2 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=RK5Integrator,
+                               cython_if_possible=False)
+    assert np.allclose(orbit1.w(p.units), orbit2.w(p.units))
+
+@pytest.mark.parametrize("dt", [2., -2.])
+def test_dop853_dense_output(dt):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    cy_w0 = np.array([[0.,10.,0.,0.2,0.,0.],
+                      [10.,0.,0.,0.,0.2,0.]])
+
+    nsteps = 10000
+    t = np.linspace(0,dt*nsteps,nsteps+1)
+
+    t1,w1 = dop853_integrate_potential(p.c_instance, cy_w0, t)
+    t2,w2 = dop853_integrate_potential(p.c_instance, cy_w0, t, dense_output=True)
+
+    assert w1.shape == w2.shape
+    assert np.allclose(w2[0], cy_w0)
+    assert np.allclose(w1, w2, atol=1E-6)
+
+@pytest.mark.parametrize("dense_output", [False, True])
+def test_dop853_threads(dense_output):
+    # integrations running concurrently must not interfere with each other
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    nthreads = 4
+    all_w0 = [np.array([[0.,10.+i,0.,0.2,0.,0.]]) for i in range(nthreads)]
+    t = np.linspace(0,2000.,1001)
+
+    serial = [dop853_integrate_potential(p.c_instance, w0, t,
+                                         dense_output=dense_output)[1]
+              for w0 in all_w0]
+
+    results = [None]*nthreads
+    def worker(i):
+        results[i] = dop853_integrate_potential(p.c_instance, all_w0[i], t,
+                                                dense_output=dense_output)[1]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(nthreads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i in range(nthreads):
+        assert np.all(results[i] == serial[i])
+
+@pytest.mark.parametrize("dense_output", [False, True])
+def test_dop853_independent(dense_output):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    # one orbit that plunges close to the center and one that stays far out
+    w0 = np.array([[0.1,0.,0.,0.,0.01,0.],
+                   [30.,0.,0.,0.,0.1,0.]])
+    t = np.linspace(0,1000.,501)
+
+    _,w1,nfcn1 = dop853_integrate_potential(p.c_instance, w0, t,
+                                            dense_output=dense_output,
+                                            return_nfcn=True)
+    _,w2,nfcn2 = dop853_integrate_potential(p.c_instance, w0, t,
+                                            dense_output=dense_output,
+                                            independent=True, return_nfcn=True)
+
+    assert w1.shape == w2.shape
+    assert np.allclose(w1, w2, atol=1E-4)
+
+    # both orbits share a step size in the default mode
+    assert nfcn1[0] == nfcn1[1]
+    assert nfcn2[1] < nfcn2[0]
+    assert nfcn2[1] < nfcn1[1]
+
+    # each orbit is integrated on its own, so the result can't depend on
+    #   the other orbits or on the number of threads
+    _,w3 = dop853_integrate_potential(p.c_instance, w0[1:], t,
+                                      dense_output=dense_output,
+                                      independent=True)
+    _,w4 = dop853_integrate_potential(p.c_instance, w0, t,
+                                      dense_output=dense_output,
+                                      independent=True, nthreads=2)
+    assert np.all(w2[:,1:] == w3)
+    assert np.all(w2 == w4)
+
+@pytest.mark.parametrize("integrate_func", func_list)
+def test_nthreads(integrate_func):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    norbits = 10
+    w0 = np.zeros((norbits,6))
+    w0[:,0] = np.linspace(5.,15.,norbits)
+    w0[:,4] = 0.2
+    t = np.linspace(0,1000.,501)
+
+    t1,w1 = integrate_func(p.c_instance, w0, t)
+    for nthreads in [2,3,16]:
+        t2,w2 = integrate_func(p.c_instance, w0, t, nthreads=nthreads)
+        assert w1.shape == w2.shape
+        assert np.allclose(w2[0], w0)
+        assert np.allclose(w1, w2, atol=1E-5)
+
+        # output must not depend on how threads are scheduled
+        t3,w3 = integrate_func(p.c_instance, w0, t, nthreads=nthreads)
+        assert np.all(w2 == w3)
+
+@pytest.mark.parametrize("integrate_func", func_list)
+def test_store_every(integrate_func):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    w0 = np.array([[0.,10.,0.,0.2,0.,0.],
+                   [10.,0.,0.,0.,0.2,0.]])
+    t = np.linspace(0,1000.,501)
+
+    t1,w1 = integrate_func(p.c_instance, w0, t)
+    for store_every in [1,3,10]:
+        t2,w2 = integrate_func(p.c_instance, w0, t, store_every=store_every)
+        assert np.all(t2 == t1[::store_every])
+        assert w2.shape == w1[::store_every].shape
+        assert np.allclose(w2[0], w0)
+        assert np.allclose(w2, w1[::store_every], atol=1E-5)
+
+    # only the final state
+    t2,w2 = integrate_func(p.c_instance, w0, t, store_every=0)
+    assert np.all(t2 == t1[-1:])
+    assert w2.shape == (1,) + w1.shape[1:]
+    assert np.allclose(w2[0], w1[-1], atol=1E-5)
+
+    with pytest.raises(ValueError):
+        integrate_func(p.c_instance, w0, t, store_every=-1)
+
+@pytest.mark.parametrize("Integrator", integrator_list)
+def test_integrate_orbit_store_every(Integrator):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = [10.,0.,0.,0.,0.2,0.]
+
+    orbit = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+    for cython_if_possible in [True, False]:
+        orbit2 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator,
+                                   cython_if_possible=cython_if_possible,
+                                   store_every=10)
+        assert orbit2.t.shape == (101,)
+        assert np.allclose(orbit2.w(p.units), orbit[::10].w(p.units), atol=1E-5)
+
+        orbit3 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator,
+                                   cython_if_possible=cython_if_possible,
+                                   store_every=0)
+        assert orbit3.t.shape == (1,)
+        assert np.allclose(orbit3.w(p.units)[:,0], orbit.w(p.units)[:,-1], atol=1E-5)
+
+@pytest.mark.parametrize("integrate_func", func_list)
+def test_out(tmpdir, integrate_func):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    w0 = np.array([[0.,10.,0.,0.2,0.,0.],
+                   [10.,0.,0.,0.,0.2,0.]])
+    t = np.linspace(0,1000.,501)
+    t1,w1 = integrate_func(p.c_instance, w0, t, store_every=2)
+
+    # write straight into a memory-mapped array in the (ndim, ntimes, norbits)
+    #   layout returned by integrate_orbit()
+    mmap = np.memmap(str(tmpdir.join("out.dat")), mode='w+', dtype=float,
+                     shape=(6,len(t1),2))
+    t2,w2 = integrate_func(p.c_instance, w0, t, store_every=2,
+                           out=np.rollaxis(mmap, 0, 3))
+    assert np.all(t1 == t2)
+    assert np.all(w1 == w2)
+    assert np.all(np.rollaxis(w1, -1) == mmap)
+
+    with pytest.raises(ValueError):
+        integrate_func(p.c_instance, w0, t, out=np.rollaxis(mmap, 0, 3))
+
+@pytest.mark.parametrize("Integrator", integrator_list)
+def test_integrate_orbit_mmap(tmpdir, Integrator):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[10.,0.,0.,0.,0.2,0.],
+                   [0.,10.,0.,0.2,0.,0.]]).T
+
+    orbit = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+
+    filename = str(tmpdir.join("orbit.dat"))
+    orbit2 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator,
+                               mmap=filename)
+    assert np.allclose(orbit.w(p.units), orbit2.w(p.units))
+
+    mmap = np.memmap(filename, mode='r', dtype=float, shape=(6,1001,2))
+    assert np.allclose(orbit.w(p.units), mmap)
+
+    # the orbit is a view of the memory-mapped array
+    mmap = np.memmap(filename, mode='r+', dtype=float, shape=(6,101,2))
+    orbit3 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator,
+                               store_every=10, mmap=mmap)
+    assert np.allclose(orbit3.w(p.units), orbit.w(p.units)[:,::10], atol=1E-5)
+    assert np.may_share_memory(orbit3.pos.value, mmap)
+
+event_func_list = [leapfrog_integrate_potential, dop853_integrate_potential]
+
+@pytest.mark.parametrize("integrate_func", event_func_list)
+def test_events(integrate_func):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    w0 = np.array([[10.,0.,0.,0.,0.15,0.1],
+                   [0.,15.,0.,-0.1,0.,0.05]])
+    t = np.linspace(0,2000.,2001)
+    events = [Pericenter(), Apocenter(), PlaneCrossing([0,0,1], direction=1)]
+
+    _,w,found = integrate_func(p.c_instance, w0, t, events=events)
+    orbit, event, ev_t, ev_w = found
+    assert ev_w.shape == (len(ev_t), 6)
+
+    for i in range(len(w0)):
+        ix = orbit == i
+        assert np.all(np.diff(ev_t[ix]) > 0)
+
+        # pericenters and apocenters alternate
+        radial = event[ix][event[ix] < 2]
+        assert np.all(np.diff(radial) != 0)
+
+        r = np.sqrt(np.sum(w[:,i,:3]**2, axis=-1))
+        for e in range(3):
+            ev_wi = ev_w[ix & (event == e)]
+            assert len(ev_wi) > 2
+
+            ev_r = np.sqrt(np.sum(ev_wi[:,:3]**2, axis=-1))
+            ev_v = np.sqrt(np.sum(ev_wi[:,3:]**2, axis=-1))
+            rdotv = np.sum(ev_wi[:,:3]*ev_wi[:,3:], axis=-1)
+
+            if e == 0:
+                assert np.all(np.abs(rdotv) < 1E-10*ev_r*ev_v)
+                assert np.allclose(ev_r, r.min(), rtol=1E-3)
+
+            elif e == 1:
+                assert np.all(np.abs(rdotv) < 1E-10*ev_r*ev_v)
+                assert np.allclose(ev_r, r.max(), rtol=1E-3)
+
+            else:
+                assert np.all(np.abs(ev_wi[:,2]) < 1E-10)
+                assert np.all(ev_wi[:,5] > 0)
+
+    # the events don't depend on the number of threads
+    _,_,found2 = integrate_func(p.c_instance, w0, t, events=events, nthreads=2)
+    for a,b in zip(found, found2):
+        assert np.allclose(a, b)
+
+    # direction of a crossing is defined relative to time, not integration
+    _,_,(orbit, event, ev_t, ev_w) = integrate_func(p.c_instance, w0, -t,
+                                                    events=events)
+    for i in range(len(w0)):
+        assert np.all(np.diff(ev_t[orbit == i]) < 0)
+
+    ix = event == 2
+    assert np.all(np.abs(ev_w[ix,2]) < 1E-10)
+    assert np.all(ev_w[ix,5] > 0)
+
+def test_dop853_events():
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    w0 = np.array([[10.,0.,0.,0.,0.15,0.1],
+                   [0.,15.,0.,-0.1,0.,0.05]])
+    t = np.linspace(0,2000.,201)
+    events = [Pericenter(), PlaneCrossing([0,1,0,0,0,0], offset=1.)]
+
+    # the events are found on the dense output interpolant, so they don't
+    #   depend on the output times or on how the orbits are integrated
+    _,_,found = dop853_integrate_potential(p.c_instance, w0, t, events=events)
+    for kw in [dict(dense_output=True), dict(independent=True),
+               dict(dense_output=True, independent=True), dict(store_every=0)]:
+        _,_,found2 = dop853_integrate_potential(p.c_instance, w0, t,
+                                                events=events, **kw)
+        assert np.all(found[0] == found2[0])
+        assert np.all(found[1] == found2[1])
+        assert np.allclose(found[2], found2[2], atol=1E-6)
+        assert np.allclose(found[3], found2[3], atol=1E-6)
+
+    # pericenters of a regular orbit are all at the same radius
+    orbit, event, ev_t, ev_w = found
+    for i in range(len(w0)):
+        ev_r = np.sqrt(np.sum(ev_w[(orbit == i) & (event == 0),:3]**2, axis=-1))
+        assert np.allclose(ev_r, ev_r[0], rtol=1E-8)
+
+    assert np.allclose(ev_w[event == 1, 1], 1., atol=1E-10)
+
+    _,_,nfcn,found2 = dop853_integrate_potential(p.c_instance, w0, t,
+                                                 events=events, return_nfcn=True)
+    assert np.all(nfcn > 0)
+
+def test_integrate_orbit_events():
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = [10.,0.,0.,0.,0.15,0.1]
+
+    orbit,peri = p.integrate_orbit(w0, dt=1., nsteps=2000, events=Pericenter())
+    assert peri.t.shape == (peri.pos.shape[1],)
+    assert np.allclose(np.sqrt(np.sum(peri.pos**2, axis=0)).value,
+                       np.sqrt(np.sum(orbit.pos**2, axis=0)).value.min(), rtol=1E-3)
+
+    # multiple orbits, multiple events, and only storing the final state
+    w0 = np.array([[10.,0.,0.,0.,0.15,0.1],
+                   [0.,15.,0.,-0.1,0.,0.05]]).T
+    events = [Pericenter(), PlaneCrossing([0,0,1], direction=1)]
+    orbit,found = p.integrate_orbit(w0, dt=1., nsteps=2000, store_every=0,
+                                    Integrator=DOPRI853Integrator, events=events)
+    assert orbit.t.shape == (1,)
+    assert len(found) == 2
+    assert len(found[1]) == 2
+    for sos in found[1]:
+        assert np.all(np.abs(sos.pos[2].value) < 1E-10)
+        assert np.all(sos.vel[2].value > 0)
+
+    with pytest.raises(ValueError):
+        p.integrate_orbit(w0, dt=1., nsteps=100, Integrator=RK5Integrator,
+                          events=events)
+
+    with pytest.raises(ValueError):
+        p.integrate_orbit(w0, dt=1., nsteps=100, cython_if_possible=False,
+                          events=events)
+
+@pytest.mark.skipif(True, reason="For timing locally")
+@pytest.mark.parametrize("integrate_func", func_list)
+def test_time_nthreads(integrate_func):
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    norbits = 1024
+    w0 = np.zeros((norbits,6))
+    w0[:,0] = np.random.uniform(5.,15.,norbits)
+    w0[:,4] = 0.2
+    t = np.linspace(0,1000.,1001)
+
+    serial_time = None
+    for nthreads in [1,2,4,8]:
+        time0 = time.time()
+        integrate_func(p.c_instance, w0, t, nthreads=nthreads)
+        exec_time = time.time()-time0
+        if serial_time is None:
+            serial_time = exec_time
+
+        print("nthreads={}: {:.3f} sec, speedup {:.2f}"
+              .format(nthreads, exec_time, serial_time/exec_time))
+
+@pytest.mark.skipif(True, reason="For timing locally")
+def test_time_symplectic():
+    """
+    Benchmark: gradient evaluations needed to reach a given energy error
+    for the symplectic integrators, leapfrog, and DOP853.
+    """
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[10.,0.,0.,0.,0.15,0.]])
+    t_end = 10000.
+
+    def energy_error(w):
+        E = p.value(w[:,0,:3].T) + 0.5*np.sum(w[:,0,3:]**2, axis=1)
+        return np.max(np.abs((E[1:] - E[0]) / E[0]))
+
+    for Integrator in symplectic_list:
+        nstages = len(Integrator.drift)
+        for dt in [4., 2., 1., 0.5]:
+            t = np.arange(0, t_end+dt/2., dt)
+            time0 = time.time()
+            _,w = symplectic_integrate_potential(p.c_instance, w0, t,
+                                                 Integrator.drift, Integrator.kick)
+            exec_time = time.time() - time0
+            print("{}, dt={}: {} gradient evaluations, dE/E={:.2e}, {:.3f} sec"
+                  .format(Integrator.__name__, dt, nstages*(len(t)-1),
+                          energy_error(w), exec_time))
+
+    t = np.linspace(0, t_end, 10001)
+    for tol in [1E-6, 1E-8, 1E-10, 1E-12]:
+        time0 = time.time()
+        _,w,nfcn = dop853_integrate_potential(p.c_instance, w0, t, tol, tol,
+                                              return_nfcn=True)
+        exec_time = time.time() - time0
+        print("DOP853, tol={}: {} gradient evaluations, dE/E={:.2e}, {:.3f} sec"
+              .format(tol, nfcn[0], energy_error(w), exec_time))
+
 @pytest.mark.skipif(True, reason="For timing locally")
 def test_time_integration():
     niter = 100
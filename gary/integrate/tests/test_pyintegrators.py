@@ -14,6 +14,8 @@ import numpy as np
 
 # Project
 from .. import LeapfrogIntegrator, RK5Integrator, DOPRI853Integrator
+from .. import (SymplecticIntegrator, ForestRuthIntegrator, BlanesMoanIntegrator,
+                Yoshida6Integrator, Yoshida8Integrator)
 
 # Integrators to test
 integrator_list = [RK5Integrator, DOPRI853Integrator, LeapfrogIntegrator]
@@ -108,3 +110,47 @@ def test_memmap(tmpdir, Integrator):
     integrator = Integrator(sho, func_args=(1.,))
 
     orbit = integrator.run(w0, dt=dt, nsteps=nsteps, mmap=mmap)
+
+def _kepler_period_error(Integrator, nsteps):
+    """ Error after integrating an eccentric Kepler orbit for one period. """
+    def F(t,w):
+        x,y,px,py = w
+        a = -1./(x*x+y*y)**1.5
+        return np.array([px, py, x*a, y*a])
+
+    w0 = np.array([1., 0., 0., 1.2])
+    E = 0.5*1.2**2 - 1.
+    T = 2*np.pi * (-0.5/E)**1.5
+
+    integrator = Integrator(F)
+    orbit = integrator.run(w0, t1=0., t2=T, nsteps=nsteps)
+    return np.sqrt(np.sum((orbit.w()[:2,-1,0] - w0[:2])**2))
+
+@pytest.mark.parametrize(("Integrator","order"), [
+    (SymplecticIntegrator, 2),
+    (ForestRuthIntegrator, 4),
+    (Yoshida6Integrator, 6),
+    (Yoshida8Integrator, 8),
+])
+def test_symplectic_order(Integrator, order):
+    err1 = _kepler_period_error(Integrator, 128)
+    err2 = _kepler_period_error(Integrator, 256)
+    assert np.log2(err1/err2) > order - 0.5
+
+def test_blanes_moan():
+    # same number of force evaluations, but much more accurate
+    assert (_kepler_period_error(BlanesMoanIntegrator, 64) <
+            1E-2*_kepler_period_error(ForestRuthIntegrator, 128))
+
+@pytest.mark.parametrize("Integrator", [ForestRuthIntegrator, BlanesMoanIntegrator,
+                                        Yoshida6Integrator, Yoshida8Integrator])
+def test_symplectic_forward_backward(Integrator):
+    def sho(t,w,T):
+        q,p = w
+        return np.array([p, -(2*np.pi/T)**2*q])
+
+    integrator = Integrator(sho, func_args=(1.,))
+    forw = integrator.run([0., 1.], dt=1E-3, nsteps=1000)
+    back = integrator.run([0., 1.], dt=-1E-3, nsteps=1000)
+
+    assert np.allclose(forw.w()[:,-1], back.w()[:,-1], atol=1E-6)
@@ -93,3 +93,17 @@ def parse_time_specification(dt=None, nsteps=None, t1=None, t2=None, t=None):
             raise ValueError("Invalid options. See docstring.")
 
         return times
+
+def _store_indices(ntimes, store_every=1):
+    """
+    Indices of the times at which to store the state when only every
+    ``store_every`` time step is kept. If ``store_every`` is 0, only the
+    final state is stored.
+    """
+    store_every = int(store_every)
+    if store_every < 0:
+        raise ValueError("store_every must be a non-negative integer.")
+
+    if store_every == 0:
+        return np.array([ntimes-1], dtype=np.intc)
+    return np.arange(0, ntimes, store_every, dtype=np.intc)
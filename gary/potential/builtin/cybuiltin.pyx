@@ -13,6 +13,7 @@ __author__ = "adrn <adrn@astro.columbia.edu>"
 
 # Standard library
 from collections import OrderedDict
+import threading
 
 # Third-party
 from astropy.coordinates.angles import rotation_matrix
@@ -21,13 +22,15 @@ import astropy.units as u
 import numpy as np
 cimport numpy as np
 np.import_array()
+from scipy.special import gammaln, lpmv
 import cython
 cimport cython
 
 # Project
-from ...units import galactic
+from ...units import galactic, UnitSystem
 from ..cpotential cimport _CPotential
-from ..cpotential import CPotentialBase
+from ..core import PotentialBase
+from ..cpotential import CPotentialBase, _natural_spline_y2
 
 cdef extern from "math.h":
     double sqrt(double x) nogil
@@ -45,61 +48,91 @@ cdef extern from "src/_cbuiltin.h":
 
     double henon_heiles_value(double t, double *pars, double *q) nogil
     void henon_heiles_gradient(double t, double *pars, double *q, double *grad) nogil
+    void henon_heiles_hessian(double t, double *pars, double *q, double *hess) nogil
 
     double kepler_value(double t, double *pars, double *q) nogil
     void kepler_gradient(double t, double *pars, double *q, double *grad) nogil
+    void kepler_hessian(double t, double *pars, double *q, double *hess) nogil
 
     double isochrone_value(double t, double *pars, double *q) nogil
     void isochrone_gradient(double t, double *pars, double *q, double *grad) nogil
+    void isochrone_hessian(double t, double *pars, double *q, double *hess) nogil
     double isochrone_density(double t, double *pars, double *q) nogil
 
     double hernquist_value(double t, double *pars, double *q) nogil
     void hernquist_gradient(double t, double *pars, double *q, double *grad) nogil
+    void hernquist_hessian(double t, double *pars, double *q, double *hess) nogil
     double hernquist_density(double t, double *pars, double *q) nogil
 
     double plummer_value(double t, double *pars, double *q) nogil
     void plummer_gradient(double t, double *pars, double *q, double *grad) nogil
+    void plummer_hessian(double t, double *pars, double *q, double *hess) nogil
     double plummer_density(double t, double *pars, double *q) nogil
 
+    double moving_plummer_value(double t, double *pars, double *q) nogil
+    void moving_plummer_gradient(double t, double *pars, double *q, double *grad) nogil
+    void moving_plummer_hessian(double t, double *pars, double *q, double *hess) nogil
+    double moving_plummer_density(double t, double *pars, double *q) nogil
+
     double jaffe_value(double t, double *pars, double *q) nogil
     void jaffe_gradient(double t, double *pars, double *q, double *grad) nogil
+    void jaffe_hessian(double t, double *pars, double *q, double *hess) nogil
     double jaffe_density(double t, double *pars, double *q) nogil
 
     double stone_value(double t, double *pars, double *q) nogil
     void stone_gradient(double t, double *pars, double *q, double *grad) nogil
+    void stone_hessian(double t, double *pars, double *q, double *hess) nogil
 
     double sphericalnfw_value(double t, double *pars, double *q) nogil
     void sphericalnfw_gradient(double t, double *pars, double *q, double *grad) nogil
+    void sphericalnfw_hessian(double t, double *pars, double *q, double *hess) nogil
     double sphericalnfw_density(double t, double *pars, double *q) nogil
 
     double flattenednfw_value(double t, double *pars, double *q) nogil
     void flattenednfw_gradient(double t, double *pars, double *q, double *grad) nogil
+    void flattenednfw_hessian(double t, double *pars, double *q, double *hess) nogil
     double flattenednfw_density(double t, double *pars, double *q) nogil
 
     double miyamotonagai_value(double t, double *pars, double *q) nogil
     void miyamotonagai_gradient(double t, double *pars, double *q, double *grad) nogil
+    void miyamotonagai_hessian(double t, double *pars, double *q, double *hess) nogil
     double miyamotonagai_density(double t, double *pars, double *q) nogil
 
     double leesuto_value(double t, double *pars, double *q) nogil
     void leesuto_gradient(double t, double *pars, double *q, double *grad) nogil
+    void leesuto_hessian(double t, double *pars, double *q, double *hess) nogil
     double leesuto_density(double t, double *pars, double *q) nogil
 
     double logarithmic_value(double t, double *pars, double *q) nogil
     void logarithmic_gradient(double t, double *pars, double *q, double *grad) nogil
+    void logarithmic_hessian(double t, double *pars, double *q, double *hess) nogil
 
     double rotating_logarithmic_value(double t, double *pars, double *q) nogil
     void rotating_logarithmic_gradient(double t, double *pars, double *q, double *grad) nogil
+    void rotating_logarithmic_hessian(double t, double *pars, double *q, double *hess) nogil
 
     double lm10_value(double t, double *pars, double *q) nogil
     void lm10_gradient(double t, double *pars, double *q, double *grad) nogil
+    void lm10_hessian(double t, double *pars, double *q, double *hess) nogil
+
+    double scf_value(double t, double *pars, double *q) nogil
+    void scf_gradient(double t, double *pars, double *q, double *grad) nogil
+    double scf_density(double t, double *pars, double *q) nogil
+    void scf_coefficient_sums(int n, double *xyz, double *mass, double r_s,
+                              int nmax, int lmax, double *S, double *T) nogil
+
+    double multipole_value(double t, double *pars, double *q) nogil
+    void multipole_gradient(double t, double *pars, double *q, double *grad) nogil
+    double multipole_density(double t, double *pars, double *q) nogil
 
 __all__ = ['HenonHeilesPotential', 'KeplerPotential', 'HernquistPotential',
-           'PlummerPotential', 'MiyamotoNagaiPotential',
+           'PlummerPotential', 'MovingPlummerPotential', 'MiyamotoNagaiPotential',
            'SphericalNFWPotential', 'FlattenedNFWPotential',
            'LeeSutoTriaxialNFWPotential',
            'LogarithmicPotential', 'JaffePotential',
            'StonePotential', 'IsochronePotential',
-           'LM10Potential', 'RotatingLogarithmicPotential']
+           'LM10Potential', 'RotatingLogarithmicPotential',
+           'SCFPotential', 'scf_coefficients', 'MultipolePotential']
 
 # ============================================================================
 #    Hénon-Heiles potential
@@ -111,6 +144,7 @@ cdef class _HenonHeilesPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &henon_heiles_value
         self.c_gradient = &henon_heiles_gradient
+        self.c_hessian = &henon_heiles_hessian
         self.c_density = &nan_density
 
 class HenonHeilesPotential(CPotentialBase):
@@ -130,6 +164,8 @@ class HenonHeilesPotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    ndim = 2
+
     def __init__(self, units=None):
         self.parameters = dict()
         super(HenonHeilesPotential, self).__init__(units=units)
@@ -149,6 +185,7 @@ cdef class _KeplerPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &kepler_value
         self.c_gradient = &kepler_gradient
+        self.c_hessian = &kepler_hessian
         self.c_density = &nan_density
 
 class KeplerPotential(CPotentialBase):
@@ -186,6 +223,7 @@ cdef class _IsochronePotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &isochrone_value
         self.c_gradient = &isochrone_gradient
+        self.c_hessian = &isochrone_hessian
         self.c_density = &isochrone_density
 
 class IsochronePotential(CPotentialBase):
@@ -265,6 +303,7 @@ cdef class _HernquistPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &hernquist_value
         self.c_gradient = &hernquist_gradient
+        self.c_hessian = &hernquist_hessian
         self.c_density = &hernquist_density
 
 class HernquistPotential(CPotentialBase):
@@ -304,6 +343,7 @@ cdef class _PlummerPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &plummer_value
         self.c_gradient = &plummer_gradient
+        self.c_hessian = &plummer_hessian
         self.c_density = &plummer_density
 
 class PlummerPotential(CPotentialBase):
@@ -333,6 +373,82 @@ class PlummerPotential(CPotentialBase):
         self.G = G.decompose(units).value
         self.c_instance = _PlummerPotential(G=self.G, **self.parameters)
 
+# ============================================================================
+#    Moving Plummer potential
+#
+cdef class _MovingPlummerPotential(_CPotential):
+
+    def __cinit__(self, double G, double b, double[::1] t, double[:,::1] pos, double[::1] m):
+        self._parvec = np.concatenate(([G,b,len(t)], t, np.asarray(pos).ravel(), m))
+        self._parameters = &(self._parvec)[0]
+        self.c_value = &moving_plummer_value
+        self.c_gradient = &moving_plummer_gradient
+        self.c_hessian = &moving_plummer_hessian
+        self.c_density = &moving_plummer_density
+
+    def __reduce__(self):
+        cdef int n = int(self._parvec[2])
+        parvec = np.asarray(self._parvec)
+        return (self.__class__, (parvec[0], parvec[1], parvec[3:3+n],
+                                 parvec[3+n:3+4*n].reshape(3,n), parvec[3+4*n:]))
+
+class MovingPlummerPotential(CPotentialBase):
+    r"""
+    MovingPlummerPotential(m, b, t, pos, units)
+
+    Plummer potential for a spheroid that moves along a tabulated track,
+    e.g., the self-gravity of a satellite following its orbit.
+
+    .. math::
+
+        \Phi(\boldsymbol{r},t) = -\frac{G M(t)}{\sqrt{|\boldsymbol{r} - \boldsymbol{r}_0(t)|^2 + b^2}}
+
+    The center, :math:`\boldsymbol{r}_0`, and mass are linearly interpolated
+    between the tabulated times. Before the first or after the last time, the
+    first or last values are used.
+
+    Parameters
+    ----------
+    m : numeric, array_like
+       Mass. Either a single value, or the mass at each of the times, ``t``.
+    b : numeric
+        Core concentration.
+    t : array_like
+        Times at which the center (and mass) are tabulated.
+    pos : array_like
+        Position of the center at each time. Should have shape ``(3,len(t))``.
+    units : iterable
+        Unique list of non-reducable units that specify (at minimum) the
+        length, mass, time, and angle units.
+
+    """
+    def __init__(self, m, b, t, pos, units):
+        t = np.atleast_1d(t).astype(np.float64)
+        pos = np.atleast_2d(pos).astype(np.float64)
+        m = np.atleast_1d(m).astype(np.float64)
+
+        if pos.shape != (3,len(t)):
+            raise ValueError("Position array must have shape (3,len(t)), not {0}."
+                             .format(pos.shape))
+
+        if len(m) == 1:
+            m = np.repeat(m, len(t))
+        elif len(m) != len(t):
+            raise ValueError("Mass must be a single value or have the same length "
+                             "as the time array.")
+
+        # the C interpolation assumes the times are in increasing order
+        ix = np.argsort(t)
+        t = t[ix]
+        pos = pos[:,ix]
+        m = m[ix]
+
+        self.parameters = dict(m=m, b=b, t=t, pos=pos)
+        super(MovingPlummerPotential, self).__init__(units=units)
+        self.G = G.decompose(units).value
+        self.c_instance = _MovingPlummerPotential(G=self.G, b=b, t=t,
+                                                  pos=np.ascontiguousarray(pos), m=m)
+
 # ============================================================================
 #    Jaffe spheroid potential
 #
@@ -343,6 +459,7 @@ cdef class _JaffePotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &jaffe_value
         self.c_gradient = &jaffe_gradient
+        self.c_hessian = &jaffe_hessian
         self.c_density = &jaffe_density
 
 class JaffePotential(CPotentialBase):
@@ -384,6 +501,7 @@ cdef class _MiyamotoNagaiPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &miyamotonagai_value
         self.c_gradient = &miyamotonagai_gradient
+        self.c_hessian = &miyamotonagai_hessian
         self.c_density = &miyamotonagai_density
 
 class MiyamotoNagaiPotential(CPotentialBase):
@@ -425,6 +543,7 @@ cdef class _StonePotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &stone_value
         self.c_gradient = &stone_gradient
+        self.c_hessian = &stone_hessian
         self.c_density = &nan_density
 
 class StonePotential(CPotentialBase):
@@ -466,6 +585,7 @@ cdef class _SphericalNFWPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &sphericalnfw_value
         self.c_gradient = &sphericalnfw_gradient
+        self.c_hessian = &sphericalnfw_hessian
         self.c_density = &sphericalnfw_density
 
 class SphericalNFWPotential(CPotentialBase):
@@ -506,6 +626,7 @@ cdef class _FlattenedNFWPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &flattenednfw_value
         self.c_gradient = &flattenednfw_gradient
+        self.c_hessian = &flattenednfw_hessian
         self.c_density = &flattenednfw_density
 
 class FlattenedNFWPotential(CPotentialBase):
@@ -554,6 +675,7 @@ cdef class _LeeSutoTriaxialNFWPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &leesuto_value
         self.c_gradient = &leesuto_gradient
+        self.c_hessian = &leesuto_hessian
         self.c_density = &leesuto_density
 
 class LeeSutoTriaxialNFWPotential(CPotentialBase):
@@ -644,6 +766,7 @@ cdef class _LogarithmicPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &logarithmic_value
         self.c_gradient = &logarithmic_gradient
+        self.c_hessian = &logarithmic_hessian
         self.c_density = &nan_density
 
 class LogarithmicPotential(CPotentialBase):
@@ -729,6 +852,7 @@ cdef class _RotatingLogarithmicPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &rotating_logarithmic_value
         self.c_gradient = &rotating_logarithmic_gradient
+        self.c_hessian = &rotating_logarithmic_hessian
         self.c_density = &nan_density
 
 class RotatingLogarithmicPotential(CPotentialBase):
@@ -768,6 +892,440 @@ class RotatingLogarithmicPotential(CPotentialBase):
         self.G = G.decompose(units).value
         self.c_instance = _RotatingLogarithmicPotential(**self.parameters)
 
+# ============================================================================
+#    Self-consistent field (basis function expansion) potential
+#
+cdef class _SCFPotential(_CPotential):
+
+    def __cinit__(self, double G, double m, double r_s,
+                  double[:,:,::1] cos_coeff, double[:,:,::1] sin_coeff):
+        self._parvec = np.concatenate(([G, m, r_s, cos_coeff.shape[0]-1, cos_coeff.shape[1]-1],
+                                       np.asarray(cos_coeff).ravel(),
+                                       np.asarray(sin_coeff).ravel()))
+        self._parameters = &(self._parvec)[0]
+        self.c_value = &scf_value
+        self.c_gradient = &scf_gradient
+        self.c_density = &scf_density
+
+    def __reduce__(self):
+        cdef int nmax = int(self._parvec[3])
+        cdef int lmax = int(self._parvec[4])
+        shape = (nmax+1, lmax+1, lmax+1)
+        ncoeff = np.prod(shape)
+        parvec = np.asarray(self._parvec)
+        return (self.__class__, (parvec[0], parvec[1], parvec[2],
+                                 parvec[5:5+ncoeff].reshape(shape),
+                                 parvec[5+ncoeff:].reshape(shape)))
+
+class SCFPotential(CPotentialBase):
+    r"""
+    SCFPotential(m, r_s, cos_coeff, sin_coeff, units)
+
+    A basis function expansion potential, using the self-consistent field
+    (SCF) basis of Hernquist & Ostriker (1992).
+
+    .. math::
+
+        \Phi(r,\theta,\phi) = \frac{G M}{r_s} \sum_{n=0}^{n_{\rm max}} \sum_{l=0}^{l_{\rm max}} \sum_{m=0}^{l}
+            \Phi_{nl}(s) \, Y_{lm}(\theta) \, [S_{nlm}\cos m\phi + T_{nlm}\sin m\phi]\\
+        \Phi_{nl}(s) = -\frac{s^l}{(1+s)^{2l+1}} C_n^{(2l+3/2)}\left(\frac{s-1}{s+1}\right)\\
+        Y_{lm}(\theta) = \sqrt{(2l+1)\frac{(l-m)!}{(l+m)!}} P_l^m(\cos\theta)
+
+    where :math:`s = r/r_s`, :math:`C_n^{(\alpha)}` are the Gegenbauer
+    polynomials and :math:`P_l^m` the associated Legendre functions. With
+    this normalization, :math:`S_{000}=1` (and all other coefficients zero)
+    is a Hernquist sphere with mass ``m`` and scale radius ``r_s``.
+
+    See :meth:`SCFPotential.from_particles` to compute the coefficients from
+    an N-body snapshot.
+
+    Parameters
+    ----------
+    m : numeric
+        Mass scale.
+    r_s : numeric
+        Scale radius.
+    cos_coeff : array_like
+        Cosine expansion coefficients, :math:`S_{nlm}`, with shape
+        ``(nmax+1, lmax+1, lmax+1)``. Coefficients with ``m > l`` are ignored.
+    sin_coeff : array_like
+        Sine expansion coefficients, :math:`T_{nlm}`, with the same shape.
+    units : iterable
+        Unique list of non-reducable units that specify (at minimum) the
+        length, mass, time, and angle units.
+
+    """
+    def __init__(self, m, r_s, cos_coeff, sin_coeff, units):
+        cos_coeff = np.array(cos_coeff, dtype=np.float64)
+        sin_coeff = np.array(sin_coeff, dtype=np.float64)
+
+        if cos_coeff.ndim != 3 or cos_coeff.shape[1] != cos_coeff.shape[2]:
+            raise ValueError("Coefficient arrays must have shape (nmax+1, lmax+1, lmax+1), "
+                             "not {0}.".format(cos_coeff.shape))
+
+        if sin_coeff.shape != cos_coeff.shape:
+            raise ValueError("Cosine and sine coefficient arrays must have the same "
+                             "shape ({0} vs. {1}).".format(cos_coeff.shape, sin_coeff.shape))
+
+        self.parameters = dict(m=m, r_s=r_s, cos_coeff=cos_coeff, sin_coeff=sin_coeff)
+        super(SCFPotential, self).__init__(units=units)
+        self.G = G.decompose(units).value
+        self.c_instance = _SCFPotential(G=self.G, m=m, r_s=r_s,
+                                        cos_coeff=cos_coeff, sin_coeff=sin_coeff)
+
+    @classmethod
+    def from_particles(cls, xyz, mass, nmax, lmax, r_s, units, nthreads=1):
+        """
+        from_particles(xyz, mass, nmax, lmax, r_s, units, nthreads=1)
+
+        Create an :class:`SCFPotential` from the positions and masses of the
+        particles in an N-body snapshot. See :func:`scf_coefficients`.
+
+        Parameters
+        ----------
+        xyz : array_like, :class:`~astropy.units.Quantity`
+            Particle positions, with shape ``(3,nparticles)``.
+        mass : numeric, array_like, :class:`~astropy.units.Quantity`
+            Particle masses, either a single value or one per particle.
+        nmax : int
+            Maximum radial order of the expansion.
+        lmax : int
+            Maximum angular order of the expansion.
+        r_s : numeric, :class:`~astropy.units.Quantity`
+            Scale radius of the basis.
+        units : iterable
+            Unique list of non-reducable units that specify (at minimum) the
+            length, mass, time, and angle units.
+        nthreads : int (optional)
+            Number of threads to split the particles over.
+
+        Returns
+        -------
+        potential : :class:`SCFPotential`
+
+        """
+        if not isinstance(units, UnitSystem):
+            units = UnitSystem(*units)
+
+        def _decompose(x):
+            if hasattr(x, 'unit'):
+                return x.decompose(units).value
+            return x
+
+        xyz = np.atleast_2d(_decompose(xyz))
+        mass = np.atleast_1d(_decompose(mass)) * np.ones(xyz.shape[1])
+        r_s = _decompose(r_s)
+
+        m = mass.sum()
+        cos_coeff, sin_coeff = scf_coefficients(xyz, mass/m, nmax, lmax,
+                                                r_s=r_s, nthreads=nthreads)
+        return cls(m=m, r_s=r_s, cos_coeff=cos_coeff, sin_coeff=sin_coeff,
+                   units=units)
+
+cdef void _scf_coefficients_block(double[:,::1] xyz, double[::1] mass,
+                                  double r_s, int nmax, int lmax,
+                                  double[:,:,::1] S, double[:,:,::1] T,
+                                  int i1, int i2) nogil:
+    if i2 > i1:
+        scf_coefficient_sums(i2-i1, &xyz[i1,0], &mass[i1], r_s, nmax, lmax,
+                             &S[0,0,0], &T[0,0,0])
+
+def _scf_coefficients_worker(double[:,::1] xyz, double[::1] mass, double r_s,
+                             int nmax, int lmax, double[:,:,::1] S,
+                             double[:,:,::1] T, int i1, int i2):
+    with nogil:
+        _scf_coefficients_block(xyz, mass, r_s, nmax, lmax, S, T, i1, i2)
+
+def scf_coefficients(xyz, mass, int nmax, int lmax, double r_s=1., int nthreads=1):
+    r"""
+    scf_coefficients(xyz, mass, nmax, lmax, r_s=1., nthreads=1)
+
+    Compute the expansion coefficients of the self-consistent field basis
+    (see :class:`SCFPotential`) for a set of particles,
+
+    .. math::
+
+        S_{nlm} = \frac{2-\delta_{m0}}{4\pi I_{nl}} \sum_k m_k \Phi_{nl}(s_k) Y_{lm}(\theta_k) \cos m\phi_k
+
+    and similarly for :math:`T_{nlm}` with :math:`\sin m\phi_k`. The sums
+    over particles are computed in C with the GIL released, optionally
+    split over several threads.
+
+    Parameters
+    ----------
+    xyz : array_like
+        Particle positions, with shape ``(3,nparticles)``.
+    mass : array_like
+        Particle masses in units of the total mass of the expansion, i.e.
+        for an isolated system these should sum to 1.
+    nmax : int
+        Maximum radial order of the expansion.
+    lmax : int
+        Maximum angular order of the expansion.
+    r_s : numeric (optional)
+        Scale radius of the basis, in the same units as ``xyz``.
+    nthreads : int (optional)
+        Number of threads to split the particles over.
+
+    Returns
+    -------
+    cos_coeff : :class:`~numpy.ndarray`
+        Cosine coefficients, with shape ``(nmax+1, lmax+1, lmax+1)``.
+    sin_coeff : :class:`~numpy.ndarray`
+        Sine coefficients, with shape ``(nmax+1, lmax+1, lmax+1)``.
+
+    """
+    cdef int i, n
+
+    xyz = np.ascontiguousarray(np.atleast_2d(xyz).T, dtype=np.float64)
+    n = xyz.shape[0]
+    if xyz.shape[1] != 3:
+        raise ValueError("Positions must have shape (3,nparticles).")
+    mass = np.ascontiguousarray(np.atleast_1d(mass) * np.ones(n), dtype=np.float64)
+
+    if nmax < 0 or lmax < 0:
+        raise ValueError("nmax and lmax must be non-negative.")
+
+    # each thread accumulates into its own set of sums
+    nthreads = max(1, min(nthreads, n))
+    S = np.zeros((nthreads, nmax+1, lmax+1, lmax+1))
+    T = np.zeros((nthreads, nmax+1, lmax+1, lmax+1))
+    bounds = np.linspace(0, n, nthreads+1).astype(int)
+
+    if nthreads == 1:
+        _scf_coefficients_worker(xyz, mass, r_s, nmax, lmax, S[0], T[0], 0, n)
+
+    else:
+        threads = [threading.Thread(target=_scf_coefficients_worker,
+                                    args=(xyz, mass, r_s, nmax, lmax, S[i], T[i],
+                                          bounds[i], bounds[i+1]))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    S = S.sum(axis=0)
+    T = T.sum(axis=0)
+
+    # normalization, I_nl = \int \rho_nl \Phi_nl s^2 ds
+    nn = np.arange(nmax+1)[:,None]
+    ll = np.arange(lmax+1)[None]
+    K = 0.5*nn*(nn + 4*ll + 3) + (ll + 1)*(2*ll + 1)
+    lnI = (gammaln(nn + 4*ll + 3.) - gammaln(nn + 1.) - 2*gammaln(2*ll + 1.5)
+           - (8*ll + 6)*np.log(2.))
+    I = -K * np.exp(lnI) / (nn + 2*ll + 1.5)
+
+    mm = np.arange(lmax+1)
+    fac = (2. - (mm == 0)) / (4*np.pi*I[...,None])
+
+    return S*fac, T*fac
+
+# ============================================================================
+#    Multipole expansion potential
+#
+cdef class _MultipolePotential(_CPotential):
+
+    def __cinit__(self, int lmax, double lnr_min, double dlnr, double[::1] mask,
+                  double[::1] Phi_out, double[:,::1] Phi, double[:,::1] rho):
+        lnr = lnr_min + dlnr*np.arange(Phi.shape[1])
+        self._parvec = np.concatenate(([lmax, Phi.shape[1], lnr_min, dlnr], mask,
+                                       Phi_out, np.asarray(Phi).ravel(),
+                                       _natural_spline_y2(lnr, Phi).ravel(),
+                                       np.asarray(rho).ravel(),
+                                       _natural_spline_y2(lnr, rho).ravel()))
+        self._parameters = &(self._parvec)[0]
+        self.c_value = &multipole_value
+        self.c_gradient = &multipole_gradient
+        self.c_density = &multipole_density
+
+    def __reduce__(self):
+        cdef int lmax = int(self._parvec[0])
+        cdef int nr = int(self._parvec[1])
+        cdef int ncomp = 2*(lmax+1)*(lmax+1)
+        parvec = np.asarray(self._parvec)
+        i = 4 + 2*ncomp
+        return (self.__class__, (lmax, parvec[2], parvec[3], parvec[4:4+ncomp],
+                                 parvec[4+ncomp:i],
+                                 parvec[i:i+ncomp*nr].reshape(ncomp,nr),
+                                 parvec[i+2*ncomp*nr:i+3*ncomp*nr].reshape(ncomp,nr)))
+
+@cython.wraparound(True)
+def _spline_cumulative_integral(double dx, y, a):
+    """
+    Cumulative integral of the natural cubic splines through each row of
+    ``y``, tabulated on a uniform grid with spacing ``dx``, weighted by
+    :math:`e^{a (x - x_i)}` at each grid point :math:`x_i`. ``a`` (which
+    should be non-negative) has the shape of ``y`` without the last axis.
+    The weight is scaled out at each grid point, so steep weights can't
+    overflow or spread roundoff along the grid.
+    """
+    n = y.shape[-1]
+    x = dx*np.arange(n)
+    y2 = _natural_spline_y2(x, np.ascontiguousarray(y.reshape(-1, n)))
+    y2 = y2.reshape(y.shape)
+    a = np.asarray(a)[...,None,None]
+
+    # Gauss-Legendre quadrature of each grid step
+    B,w = np.polynomial.legendre.leggauss(4)
+    B = 0.5*(B + 1)
+    A = 1. - B
+    f = (A*y[...,:-1,None] + B*y[...,1:,None] +
+         ((A**3 - A)*y2[...,:-1,None] + (B**3 - B)*y2[...,1:,None]) * dx*dx/6.)
+    dI = 0.5*dx*np.sum(w * np.exp(-a*(1. - B)*dx) * f, axis=-1)
+
+    I = np.zeros(y.shape)
+    decay = np.exp(-a[...,0,0]*dx)
+    for i in range(1,n):
+        I[...,i] = decay*I[...,i-1] + dI[...,i-1]
+    return I
+
+class MultipolePotential(CPotentialBase):
+    r"""
+    MultipolePotential(density, lmax=8, limits=None, nr=128, units=None)
+
+    The potential of an arbitrary density distribution, computed from a
+    multipole (spherical harmonic) expansion of the density,
+
+    .. math::
+
+        \rho(r,\theta,\phi) = \sum_{l=0}^{l_{\rm max}} \sum_{m=0}^{l}
+            Y_{lm}(\theta) [\rho^c_{lm}(r)\cos m\phi + \rho^s_{lm}(r)\sin m\phi]\\
+        \Phi^{c,s}_{lm}(r) = -\frac{4\pi G}{2l+1} \left[ r^{-(l+1)} \int_0^r \rho^{c,s}_{lm}(r') r'^{l+2} dr'
+            + r^l \int_r^\infty \rho^{c,s}_{lm}(r') r'^{1-l} dr' \right]
+
+    with :math:`Y_{lm}` as for :class:`SCFPotential`. The density is projected
+    onto the spherical harmonics with Gauss-Legendre quadrature on a grid of
+    radii that is uniform in :math:`\ln r`, and Poisson's equation is solved
+    for each term by integrating cubic splines through the projections. The
+    radial functions are then evaluated in C with cubic spline
+    interpolation in :math:`\ln r`, so the potential can be used with the
+    Cython integrators and in a :class:`~gary.potential.CCompositePotential`.
+
+    Inside of the inner radius of the grid, each term of the potential is
+    continued as :math:`r^l`. Within the grid, mass inside of the inner
+    radius and outside of the outer radius is included by extrapolating the
+    density as a power law. Outside of the outer radius, the density is zero
+    and the potential is that of the mass inside of the grid, so each term
+    falls off as :math:`r^{-(l+1)}`.
+
+    Parameters
+    ----------
+    density : `~gary.potential.PotentialBase`, callable
+        Either a potential, in which case its ``density()`` method is used
+        (at time 0), or a function that takes an array of positions with
+        shape ``(3,n)`` and returns the density at each position.
+    lmax : int (optional)
+        Maximum order of the spherical harmonic expansion.
+    limits : iterable (optional)
+        The inner and outer radius of the grid, ``(r_min, r_max)`` (default:
+        ``(1E-2, 1E3)``).
+    nr : int (optional)
+        Number of radial grid points.
+    units : iterable (optional)
+        Unique list of non-reducable units that specify (at minimum) the
+        length, mass, time, and angle units. Defaults to the units of the
+        potential if a potential is passed in.
+
+    """
+    @cython.wraparound(True)
+    def __init__(self, density, lmax=8, limits=None, nr=128, units=None):
+        if isinstance(density, PotentialBase):
+            if units is None:
+                units = density.units
+            density_func = density.density
+        elif callable(density):
+            density_func = density
+        else:
+            raise TypeError("Input density must be a potential or a callable.")
+
+        if limits is None:
+            limits = (1E-2, 1E3)
+        lnr_limits = np.log(limits)
+        if not np.all(np.isfinite(lnr_limits)) or lnr_limits[1] <= lnr_limits[0]:
+            raise ValueError("Radial limits must be positive and increasing.")
+
+        lmax = int(lmax)
+        nr = int(nr)
+        if lmax < 0:
+            raise ValueError("lmax must be non-negative.")
+        if nr < 4:
+            raise ValueError("Need at least 4 radial grid points.")
+
+        self.parameters = dict(lmax=lmax, limits=tuple(limits), nr=nr)
+        super(MultipolePotential, self).__init__(units=units)
+        if self.units is None:
+            self.G = 1.
+        else:
+            self.G = G.decompose(self.units).value
+
+        # quadrature in cos(theta) and phi, oversampled so that aliasing of
+        #   higher order structure in the density is small
+        ntheta = 2*(lmax+1)
+        nphi = 4*(lmax+1)
+        costh, w_theta = np.polynomial.legendre.leggauss(ntheta)
+        phi = 2*np.pi*np.arange(nphi) / nphi
+        lnr = np.linspace(lnr_limits[0], lnr_limits[1], nr)
+        dlnr = lnr[1] - lnr[0]
+        r = np.exp(lnr)
+
+        R,X,P = np.meshgrid(r, costh, phi, indexing='ij')
+        sinth = np.sqrt(1 - X**2)
+        q = np.vstack((np.ravel(R*sinth*np.cos(P)),
+                       np.ravel(R*sinth*np.sin(P)),
+                       np.ravel(R*X)))
+        dens = np.asarray(density_func(q), dtype=np.float64).reshape(R.shape)
+        if not np.all(np.isfinite(dens)):
+            raise ValueError("Density must be finite everywhere on the grid.")
+
+        # normalized associated Legendre functions, Y[l,m,theta]
+        Y = np.zeros((lmax+1, lmax+1, ntheta))
+        for l in range(lmax+1):
+            for m in range(l+1):
+                norm = np.sqrt((2*l+1) * np.exp(gammaln(l-m+1) - gammaln(l+m+1)))
+                Y[l,m] = norm * lpmv(m, l, costh)
+
+        # project onto the spherical harmonics: rho[cos/sin,l,m,r]
+        mm = np.arange(lmax+1)
+        rho = np.zeros((2, lmax+1, lmax+1, nr))
+        for j,trig in enumerate([np.cos, np.sin]):
+            F = np.einsum('ijk,mk->ijm', dens, trig(mm[:,None]*phi[None]))
+            rho[j] = np.einsum('ijm,lmj,j->lmi', F, Y, w_theta)
+        rho *= ((2. - (mm == 0)) / (4*np.pi) * 2*np.pi / nphi)[None,None,:,None]
+
+        # solve Poisson's equation for each term: the interior and exterior
+        #   parts are r^-(l+1) int_0^r rho r'^(l+3) dln(r') and
+        #   r^l int_r^inf rho r'^(2-l) dln(r'), integrated with the powers of
+        #   r scaled out so that high order terms stay well conditioned
+        l = np.arange(lmax+1)[None,:,None] * np.ones(rho.shape[:-1])
+        P_in = _spline_cumulative_integral(dlnr, rho * r**2, l+1)
+        P_out = _spline_cumulative_integral(dlnr, (rho * r**2)[...,::-1], l)[...,::-1]
+
+        # extrapolate the density as a power law, rho ~ r^-gamma, to include
+        #   the mass inside of and outside of the grid
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gamma_in = -np.log(rho[...,1] / rho[...,0]) / dlnr
+            gamma_out = -np.log(rho[...,-1] / rho[...,-2]) / dlnr
+            gamma_in = np.where(np.isfinite(gamma_in) & (gamma_in < l+3), gamma_in, 0.)
+            ok = np.isfinite(gamma_out) & (gamma_out > 2-l)
+        P_in += (rho[...,0] * r[0]**2 / (l+3-gamma_in))[...,None] * (r / r[0])**(-(l[...,None]+1))
+        P_out += (np.where(ok, rho[...,-1] * r[-1]**2 / np.where(ok, gamma_out+l-2, 1.), 0.)[...,None] *
+                  (r / r[-1])**l[...,None])
+
+        l = l[...,None]
+        Phi = -4*np.pi*self.G / (2*l+1) * (P_in + P_out)
+
+        # outside of the grid, only the interior part remains
+        Phi_out = -4*np.pi*self.G / (2*l[...,0]+1) * P_in[...,-1]
+
+        # skip terms that are zero, e.g., because of symmetries of the density
+        amp = np.abs(rho).max(axis=-1)
+        mask = (amp > 1E-10*amp.max()).astype(np.float64)
+
+        ncomp = 2*(lmax+1)*(lmax+1)
+        self.c_instance = _MultipolePotential(lmax, lnr[0], dlnr, mask.ravel(), Phi_out.ravel(),
+                                              Phi.reshape(ncomp,nr), rho.reshape(ncomp,nr))
+
 # ------------------------------------------------------------------------
 # HACK
 cdef class _LM10Potential(_CPotential):
@@ -786,6 +1344,7 @@ cdef class _LM10Potential(_CPotential):
         self._parameters = &(self._parvec[0])
         self.c_value = &lm10_value
         self.c_gradient = &lm10_gradient
+        self.c_hessian = &lm10_hessian
         self.c_density = &nan_density
 
 class LM10Potential(CPotentialBase):
@@ -46,6 +46,13 @@ class HarmonicOscillatorPotential(PotentialBase):
         omega = self.parameters['omega']
         return atleast_2d(omega**2, insert_axis=1)*x
 
+    def _hessian(self, x, t):
+        omega = np.atleast_1d(self.parameters['omega'])
+        hess = np.zeros((x.shape[0],x.shape[0]) + x.shape[1:])
+        for i in range(x.shape[0]):
+            hess[i,i] = omega[i % omega.size]**2
+        return hess
+
     def action_angle(self, x, v):
         """
         Transform the input cartesian position and velocity to action-angle
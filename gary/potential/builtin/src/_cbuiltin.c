@@ -5,6 +5,46 @@ double nan_density(double t, double *pars, double *q) {
     return NAN;
 }
 
+/* ---------------------------------------------------------------------------
+    Hessian helpers
+*/
+static void radial_hessian(double *q, double A, double B, double *hess) {
+    /*  For a potential that depends only on r, the Hessian is
+
+            H_ij = A delta_ij + B x_i x_j
+
+        with A = Phi'(r)/r and B = (Phi''(r) - Phi'(r)/r)/r^2. Also works
+        for potentials that depend on some scaled radius if q has already
+        been scaled appropriately.
+    */
+    int i,j;
+    for (i=0; i<3; i++) {
+        for (j=0; j<3; j++) {
+            hess[3*i+j] = B*q[i]*q[j];
+        }
+        hess[3*i+i] += A;
+    }
+}
+
+static void rotate_hessian(double *R, double *hess_prime, double *hess) {
+    /*  Transform a Hessian computed in a rotated frame, x' = R x, back to
+        the original frame: H = R^T H' R. R is stored row-major.
+    */
+    int a,b,i,j;
+    double tmp;
+    for (a=0; a<3; a++) {
+        for (b=0; b<3; b++) {
+            tmp = 0.;
+            for (i=0; i<3; i++) {
+                for (j=0; j<3; j++) {
+                    tmp += R[3*i+a] * hess_prime[3*i+j] * R[3*j+b];
+                }
+            }
+            hess[3*a+b] = tmp;
+        }
+    }
+}
+
 /* ---------------------------------------------------------------------------
     Henon-Heiles potential
 */
@@ -19,6 +59,14 @@ void henon_heiles_gradient(double t, double *pars, double *q, double *grad) {
     grad[1] = q[1] + q[0]*q[0] - q[1]*q[1];
 }
 
+void henon_heiles_hessian(double t, double *pars, double *q, double *hess) {
+    /*  no parameters... */
+    hess[0] = 1. + 2*q[1];
+    hess[1] = 2*q[0];
+    hess[2] = 2*q[0];
+    hess[3] = 1. - 2*q[1];
+}
+
 /* ---------------------------------------------------------------------------
     Kepler potential
 */
@@ -46,6 +94,17 @@ void kepler_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+void kepler_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+    */
+    double R, GM;
+    R = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]);
+    GM = pars[0] * pars[1];
+    radial_hessian(r, GM/(R*R*R), -3*GM/(R*R*R*R*R), hess);
+}
+
 /* ---------------------------------------------------------------------------
     Isochrone potential
 */
@@ -76,6 +135,19 @@ void isochrone_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+void isochrone_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - b (core scale)
+    */
+    double s, sb, GM;
+    s = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2] + pars[2]*pars[2]);
+    sb = s + pars[2];
+    GM = pars[0] * pars[1];
+    radial_hessian(r, GM / (s*sb*sb), -GM * (3*s + pars[2]) / (s*s*s*sb*sb*sb), hess);
+}
+
 double isochrone_density(double t, double *pars, double *q) {
     /*  pars:
             - G (Gravitational constant)
@@ -119,6 +191,19 @@ void hernquist_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+void hernquist_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - c (length scale)
+    */
+    double R, Rc, GM;
+    R = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]);
+    Rc = R + pars[2];
+    GM = pars[0] * pars[1];
+    radial_hessian(r, GM / (R*Rc*Rc), -GM * (3*R + pars[2]) / (R*R*R*Rc*Rc*Rc), hess);
+}
+
 double hernquist_density(double t, double *pars, double *q) {
     /*  pars:
             - G (Gravitational constant)
@@ -159,6 +244,18 @@ void plummer_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+void plummer_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - b (length scale)
+    */
+    double R2b, fac;
+    R2b = r[0]*r[0] + r[1]*r[1] + r[2]*r[2] + pars[2]*pars[2];
+    fac = pars[0] * pars[1] / sqrt(R2b) / R2b;
+    radial_hessian(r, fac, -3*fac/R2b, hess);
+}
+
 double plummer_density(double t, double *pars, double *r) {
     /*  pars:
             - G (Gravitational constant)
@@ -169,6 +266,78 @@ double plummer_density(double t, double *pars, double *r) {
     return 3*pars[1] / (4*M_PI*pars[2]*pars[2]*pars[2]) * pow(1 + r2/(pars[2]*pars[2]), -2.5);
 }
 
+/* ---------------------------------------------------------------------------
+    Moving Plummer sphere
+
+    A Plummer sphere whose center and mass are linearly interpolated from
+    tabulated values, e.g., to follow the orbit of a satellite.
+*/
+static void moving_plummer_pars(double t, double *pars, double *r,
+                                double *pl_pars, double *dr) {
+    /*  pars:
+            - G (Gravitational constant)
+            - b (length scale)
+            - n (number of tabulated times)
+            - t (n times, sorted in increasing order)
+            - x, y, z (n positions of the center for each coordinate)
+            - m (n masses)
+
+        Sets the parameters of the Plummer sphere at time t, and the
+        position relative to its center, dr. Outside of the tabulated
+        times, the first or last values are used.
+    */
+    int n = (int) pars[2];
+    double *ts = &pars[3];
+    int i, lo = 0, hi = n-1, mid;
+    double f = 0.;
+
+    if (t >= ts[n-1]) {
+        lo = n-1;
+    } else if (t > ts[0]) {
+        /* bisect for ts[lo] <= t < ts[lo+1] */
+        while (hi - lo > 1) {
+            mid = (lo + hi) / 2;
+            if (ts[mid] <= t) lo = mid;
+            else hi = mid;
+        }
+        f = (t - ts[lo]) / (ts[lo+1] - ts[lo]);
+    }
+
+    for (i=0; i<3; i++) {
+        dr[i] = r[i] - ts[(i+1)*n + lo];
+        if (f > 0.) dr[i] -= f * (ts[(i+1)*n + lo+1] - ts[(i+1)*n + lo]);
+    }
+
+    pl_pars[0] = pars[0];
+    pl_pars[1] = ts[4*n + lo];
+    if (f > 0.) pl_pars[1] += f * (ts[4*n + lo+1] - ts[4*n + lo]);
+    pl_pars[2] = pars[1];
+}
+
+double moving_plummer_value(double t, double *pars, double *r) {
+    double pl_pars[3], dr[3];
+    moving_plummer_pars(t, pars, r, &pl_pars[0], &dr[0]);
+    return plummer_value(t, &pl_pars[0], &dr[0]);
+}
+
+void moving_plummer_gradient(double t, double *pars, double *r, double *grad) {
+    double pl_pars[3], dr[3];
+    moving_plummer_pars(t, pars, r, &pl_pars[0], &dr[0]);
+    plummer_gradient(t, &pl_pars[0], &dr[0], grad);
+}
+
+void moving_plummer_hessian(double t, double *pars, double *r, double *hess) {
+    double pl_pars[3], dr[3];
+    moving_plummer_pars(t, pars, r, &pl_pars[0], &dr[0]);
+    plummer_hessian(t, &pl_pars[0], &dr[0], hess);
+}
+
+double moving_plummer_density(double t, double *pars, double *r) {
+    double pl_pars[3], dr[3];
+    moving_plummer_pars(t, pars, r, &pl_pars[0], &dr[0]);
+    return plummer_density(t, &pl_pars[0], &dr[0]);
+}
+
 /* ---------------------------------------------------------------------------
     Jaffe sphere
 
@@ -200,6 +369,19 @@ void jaffe_gradient(double t, double *pars, double *r, double *grad){
     grad[2] = fac*r[2];
 }
 
+void jaffe_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - c (length scale)
+    */
+    double R, Rc, GM;
+    R = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]);
+    Rc = R + pars[2];
+    GM = pars[0] * pars[1];
+    radial_hessian(r, GM / (R*R*Rc), -GM * (3*R + 2*pars[2]) / (R*R*R*R*Rc*Rc), hess);
+}
+
 double jaffe_density(double t, double *pars, double *q) {
     /*  pars:
             - G (Gravitational constant)
@@ -233,12 +415,42 @@ double stone_value(double t, double *pars, double *r) {
 }
 
 void stone_gradient(double t, double *pars, double *r, double *grad) {
-    double dphi_dr, rr;
-    // TODO: not implemented
+    /*  pars:
+            - G (Gravitational constant)
+            - m (total mass)
+            - r_c (core radius)
+            - r_t (truncation radius)
+    */
+    double rr, fac, f;
+    rr = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]);
+    f = 1.; // see stone_value()
+
+    // dPhi/dr / r
+    fac = pars[0] * pars[1] / f * (pars[3]*atan(rr/pars[3]) - pars[2]*atan(rr/pars[2])) / (rr*rr*rr);
+
+    grad[0] = fac*r[0];
+    grad[1] = fac*r[1];
+    grad[2] = fac*r[2];
+}
+
+void stone_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (total mass)
+            - r_c (core radius)
+            - r_t (truncation radius)
+    */
+    double rr, r2, GM, N, dN, f;
+    r2 = r[0]*r[0] + r[1]*r[1] + r[2]*r[2];
+    rr = sqrt(r2);
+    f = 1.; // see stone_value()
+    GM = pars[0] * pars[1] / f;
+
+    // dPhi/dr = GM N / r^2
+    N = pars[3]*atan(rr/pars[3]) - pars[2]*atan(rr/pars[2]);
+    dN = pars[3]*pars[3]/(r2 + pars[3]*pars[3]) - pars[2]*pars[2]/(r2 + pars[2]*pars[2]);
 
-    grad[0] = dphi_dr*r[0]/rr;
-    grad[1] = dphi_dr*r[1]/rr;
-    grad[2] = dphi_dr*r[2]/rr;
+    radial_hessian(r, GM*N/(r2*rr), GM*(dN/r2 - 3*N/(r2*rr))/r2, hess);
 }
 
 /* ---------------------------------------------------------------------------
@@ -273,6 +485,28 @@ void sphericalnfw_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+static void nfw_hessian_coeffs(double v_h2, double r_s, double u, double *A, double *B) {
+    /*  A = Phi'(r)/r and B = (dA/dr)/r for the NFW profile, u = r/r_s */
+    double m, dm;
+    m = log(1+u) - u/(1+u);
+    dm = u / ((1+u)*(1+u));
+    *A = v_h2 / (u*u*u) / (r_s*r_s) * m;
+    *B = v_h2 / (r_s*r_s*r_s) * (dm/(u*u*u) - 3*m/(u*u*u*u)) / (r_s*u);
+}
+
+void sphericalnfw_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - v_c (circular velocity at the scale radius)
+            - r_s (scale radius)
+    */
+    double u, v_h2, A, B;
+    v_h2 = pars[1]*pars[1] / (log(2.) - 0.5);
+    u = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]) / pars[2];
+    nfw_hessian_coeffs(v_h2, pars[2], u, &A, &B);
+    radial_hessian(r, A, B, hess);
+}
+
 double sphericalnfw_density(double t, double *pars, double *q) {
     /*  pars:
             - G (Gravitational constant)
@@ -321,6 +555,28 @@ void flattenednfw_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = fac*r[2]/(pars[3]*pars[3]);
 }
 
+void flattenednfw_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - v_c (circular velocity at the scale radius)
+            - r_s (scale radius)
+            - q (flattening)
+
+        With s^2 = x^2 + y^2 + z^2/q^2 and c = (1, 1, 1/q^2), the gradient
+        is A(s) c_i x_i so H_ij = A c_i delta_ij + B (c_i x_i)(c_j x_j).
+    */
+    double u, v_h2, A, B, cx[3];
+    v_h2 = pars[1]*pars[1] / (log(2.) - 0.5);
+    u = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]/(pars[3]*pars[3])) / pars[2];
+    nfw_hessian_coeffs(v_h2, pars[2], u, &A, &B);
+
+    cx[0] = r[0];
+    cx[1] = r[1];
+    cx[2] = r[2]/(pars[3]*pars[3]);
+    radial_hessian(cx, A, B, hess);
+    hess[8] += A * (1/(pars[3]*pars[3]) - 1);
+}
+
 double flattenednfw_density(double t, double *pars, double *xyz) {
     /*  pars:
             - G (Gravitational constant)
@@ -382,6 +638,34 @@ void miyamotonagai_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = fac*r[2] * (1. + pars[2] / sqrtz);
 }
 
+void miyamotonagai_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - a (length scale 1) TODO
+            - b (length scale 2) TODO
+    */
+    double GM, sqrtz, zd, S, fac3, fac5, dzd;
+
+    GM = pars[0]*pars[1];
+    sqrtz = sqrt(r[2]*r[2] + pars[3]*pars[3]);
+    zd = pars[2] + sqrtz;
+    S = r[0]*r[0] + r[1]*r[1] + zd*zd;
+    fac3 = GM * pow(S, -1.5);
+    fac5 = 3 * fac3 / S;
+    dzd = r[2] * zd / sqrtz; // (1/2) dS/dz
+
+    hess[0] = fac3 - fac5*r[0]*r[0];
+    hess[1] = -fac5*r[0]*r[1];
+    hess[2] = -fac5*r[0]*dzd;
+    hess[3] = hess[1];
+    hess[4] = fac3 - fac5*r[1]*r[1];
+    hess[5] = -fac5*r[1]*dzd;
+    hess[6] = hess[2];
+    hess[7] = hess[5];
+    hess[8] = fac3*(1. + pars[2]*pars[3]*pars[3]/(sqrtz*sqrtz*sqrtz)) - fac5*dzd*dzd;
+}
+
 double miyamotonagai_density(double t, double *pars, double *q) {
     /*  pars:
             - G (Gravitational constant)
@@ -397,7 +681,7 @@ double miyamotonagai_density(double t, double *pars, double *q) {
 
     double R2 = q[0]*q[0] + q[1]*q[1];
     double sqrt_zb = sqrt(q[2]*q[2] + b*b);
-    double numer = (b*b*M / (4*M_PI)) * (a*R2 + (a + 2*sqrt_zb)*(a + sqrt_zb)*(a + sqrt_zb));
+    double numer = (b*b*M / (4*M_PI)) * (a*R2 + (a + 3*sqrt_zb)*(a + sqrt_zb)*(a + sqrt_zb));
     double denom = pow(R2 + (a + sqrt_zb)*(a + sqrt_zb), 2.5) * sqrt_zb*sqrt_zb*sqrt_zb;
 
     return numer/denom;
@@ -435,7 +719,8 @@ double leesuto_value(double t, double *pars, double *r) {
     F3 = (u*u - 3*u - 6)/(2*u*u*(1+u)) + 3*pow(u,-3)*log(1+u);
     costh2 = z*z / (_r*_r);
     sinth2 = 1 - costh2;
-    sinph2 = y*y / (x*x + y*y);
+    // on the z axis sinth2 = 0, so the azimuthal term vanishes
+    sinph2 = (x*x + y*y > 0.) ? y*y / (x*x + y*y) : 0.;
     //return phi0 * ((e_b2/2 + e_c2/2)*((1/u - 1/(u*u*u))*log(u + 1) - 1 + (2*u*u - 3*u + 6)/(6*u*u)) + (e_b2*y*y/(2*_r*_r) + e_c2*z*z/(2*_r*_r))*((u*u - 3*u - 6)/(2*u*u*(u + 1)) + 3*log(u + 1)/(u*u*u)) - log(u + 1)/u);
     return phi0 * (F1 + (e_b2+e_c2)/2.*F2 + (e_b2*sinth2*sinph2 + e_c2*costh2)/2. * F3);
 }
@@ -490,6 +775,78 @@ void leesuto_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = pars[8]*ax  + pars[12]*ay + pars[14]*az;
 }
 
+void leesuto_hessian(double t, double *pars, double *r, double *hess) {
+    /*  pars: (alpha = 1)
+            0 - G
+            1 - v_c
+            2 - r_s
+            3 - a
+            4 - b
+            5 - c
+
+        In the rotated frame, the potential can be written
+
+            Phi = phi0 * (f(r) + W/2 * h(r))
+
+        with f = F1 + (e_b2 + e_c2)/2 F2, W = e_b2 y^2 + e_c2 z^2, and
+        h = F3 / r^2 (see leesuto_value()).
+    */
+    int i, j;
+    double x[3], e[3], hess_prime[9];
+    double _r, _r2, u, L, rs, phi0, W;
+    double dF1, d2F1, dF2, d2F2, Gu, dG, d2G;
+    double df, d2f, h, dh, d2h, A, B, Ah, Bh;
+    double e_b2 = 1-pow(pars[4]/pars[3],2);
+    double e_c2 = 1-pow(pars[5]/pars[3],2);
+
+    phi0 = pars[1]*pars[1] / (log(2.) - 0.5 + (log(2.)-0.75)*e_b2 + (log(2.)-0.75)*e_c2);
+    rs = pars[2];
+
+    // pars[6] up are R
+    for (i=0; i<3; i++) {
+        x[i] = pars[6+3*i]*r[0] + pars[7+3*i]*r[1] + pars[8+3*i]*r[2];
+    }
+    e[0] = 0.;
+    e[1] = e_b2;
+    e[2] = e_c2;
+
+    _r2 = x[0]*x[0] + x[1]*x[1] + x[2]*x[2];
+    _r = sqrt(_r2);
+    u = _r / rs;
+    L = log(1+u);
+
+    // derivatives of F1, F2, and G = F3/u^2 with respect to u
+    dF1 = (-u + (1+u)*L) / (u*u*(1+u));
+    d2F1 = (3*u*u + 2*u - 2*(1+u)*(1+u)*L) / (u*u*u*(1+u)*(1+u));
+    dF2 = (3*u*u - 6*u + (6 - 2*u*u)*L) / (2*pow(u,4));
+    d2F2 = 2*(-2*u*u*u + 3*u*u + 6*u + (u*u*u + u*u - 6*u - 6)*L) / (pow(u,5)*(1+u));
+    Gu = (u*u*u - 3*u*u - 6*u + 6*(1+u)*L) / (2*pow(u,5)*(1+u));
+    dG = (-3*pow(u,4) + 10*u*u*u + 45*u*u + 30*u - 30*(1+u)*(1+u)*L) / (2*pow(u,6)*(1+u)*(1+u));
+    d2G = (6*pow(u,5) - 22*pow(u,4) - 165*u*u*u - 225*u*u - 90*u + 90*pow(1+u,3)*L) / (pow(u,7)*pow(1+u,3));
+
+    // radial functions and their derivatives with respect to r
+    df = (dF1 + (e_b2+e_c2)/2.*dF2) / rs;
+    d2f = (d2F1 + (e_b2+e_c2)/2.*d2F2) / (rs*rs);
+    h = Gu / (rs*rs);
+    dh = dG / (rs*rs*rs);
+    d2h = d2G / (rs*rs*rs*rs);
+
+    W = e_b2*x[1]*x[1] + e_c2*x[2]*x[2];
+    A = df/_r + W/2.*dh/_r;
+    B = (d2f - df/_r + W/2.*(d2h - dh/_r)) / _r2;
+    Ah = dh / _r;
+
+    for (i=0; i<3; i++) {
+        for (j=0; j<3; j++) {
+            Bh = Ah * (e[i]*x[i]*x[j] + e[j]*x[j]*x[i]);
+            hess_prime[3*i+j] = phi0 * (B*x[i]*x[j] + Bh);
+        }
+        hess_prime[3*i+i] += phi0 * (A + e[i]*h);
+    }
+
+    rotate_hessian(&pars[6], hess_prime, hess);
+}
+
 double leesuto_density(double t, double *pars, double *r) {
     /*  pars: (alpha = 1)
             0 - G
@@ -552,6 +909,39 @@ void logarithmic_gradient(double t, double *pars, double *r, double *grad) {
     grad[2] = pars[7]*ax  + pars[10]*ay + pars[13]*az;
 }
 
+static void logarithmic_hessian_prime(double *pars, double *x, double *hess_prime) {
+    /*  Hessian in the frame aligned with the axes of the potential. pars are
+        the same as for logarithmic_gradient() up to pars[4].
+    */
+    int i, j;
+    double D, v2, q2[3];
+    v2 = pars[0]*pars[0];
+    q2[0] = pars[2]*pars[2];
+    q2[1] = pars[3]*pars[3];
+    q2[2] = pars[4]*pars[4];
+    D = pars[1]*pars[1] + x[0]*x[0]/q2[0] + x[1]*x[1]/q2[1] + x[2]*x[2]/q2[2];
+
+    for (i=0; i<3; i++) {
+        for (j=0; j<3; j++) {
+            hess_prime[3*i+j] = -2*v2 * x[i]*x[j] / (q2[i]*q2[j]*D*D);
+        }
+        hess_prime[3*i+i] += v2 / (q2[i]*D);
+    }
+}
+
+void logarithmic_hessian(double t, double *pars, double *r, double *hess) {
+    double x[3], hess_prime[9];
+    int i;
+
+    // pars[5] up to and including pars[13] are R
+    for (i=0; i<3; i++) {
+        x[i] = pars[5+3*i]*r[0] + pars[6+3*i]*r[1] + pars[7+3*i]*r[2];
+    }
+
+    logarithmic_hessian_prime(pars, x, hess_prime);
+    rotate_hessian(&pars[5], hess_prime, hess);
+}
+
 /* ---------------------------------------------------------------------------
     Rotating Triaxial Logarithmic
 */
@@ -598,6 +988,27 @@ void rotating_logarithmic_gradient(double t, double *pars, double *r, double *gr
     grad[1] = tmp2;
 }
 
+void rotating_logarithmic_hessian(double t, double *pars, double *r, double *hess) {
+    double x[3], R[9], hess_prime[9];
+
+    double bar_angle0 = pars[5];
+    double pattern_speed = -pars[6]; // added minus sign to make it rotate clockwise by default
+    double alpha = (-bar_angle0 + pattern_speed*t);
+
+    double cosa = cos(alpha);
+    double sina = sin(alpha);
+    R[0] = cosa;  R[1] = sina; R[2] = 0.;
+    R[3] = -sina; R[4] = cosa; R[5] = 0.;
+    R[6] = 0.;    R[7] = 0.;   R[8] = 1.;
+
+    x[0] = cosa*r[0] + sina*r[1];
+    x[1] = -sina*r[0] + cosa*r[1];
+    x[2] = r[2];
+
+    logarithmic_hessian_prime(pars, x, hess_prime);
+    rotate_hessian(R, hess_prime, hess);
+}
+
 /* TOTAL HACK */
 double lm10_value(double t, double *pars, double*r) {
     double v = 0.;
@@ -620,3 +1031,472 @@ void lm10_gradient(double t, double *pars, double *r, double *grad) {
     logarithmic_gradient(0., &pars[7], &r[0], &tmp_grad[0]);
     for (i=0; i<3; i++) grad[i] += tmp_grad[i];
 }
+
+void lm10_hessian(double t, double *pars, double *r, double *hess) {
+    double tmp_hess[9];
+    int i;
+
+    hernquist_hessian(0., &pars[0], &r[0], &tmp_hess[0]);
+    for (i=0; i<9; i++) hess[i] = tmp_hess[i];
+
+    miyamotonagai_hessian(0., &pars[3], &r[0], &tmp_hess[0]);
+    for (i=0; i<9; i++) hess[i] += tmp_hess[i];
+
+    logarithmic_hessian(0., &pars[7], &r[0], &tmp_hess[0]);
+    for (i=0; i<9; i++) hess[i] += tmp_hess[i];
+}
+
+/* ---------------------------------------------------------------------------
+    Self-consistent field (Hernquist & Ostriker 1992) basis expansion
+
+    The potential and density are expanded as
+
+        Phi(r,theta,phi) = G M / r_s  sum_nlm Phi_nl(s) Y_lm(theta) [S_nlm cos(m phi) + T_nlm sin(m phi)]
+        rho(r,theta,phi) = M / r_s^3  sum_nlm rho_nl(s) Y_lm(theta) [S_nlm cos(m phi) + T_nlm sin(m phi)]
+
+    with s = r/r_s and Y_lm = sqrt((2l+1)(l-m)!/(l+m)!) P_l^m(cos(theta)),
+    normalized so that S_000 = 1 (all others 0) is a Hernquist sphere of
+    mass M and scale radius r_s.
+*/
+#define SCF_IX(n,l,m,lmax) (((n)*((lmax)+1) + (l))*((lmax)+1) + (m))
+
+static void scf_gegenbauer(double xi, double alpha, int nmax, double *C) {
+    /*  Gegenbauer polynomials C_n^alpha(xi) for n = 0..nmax */
+    int n;
+    C[0] = 1.;
+    if (nmax > 0) C[1] = 2.*alpha*xi;
+    for (n=2; n<=nmax; n++) {
+        C[n] = (2.*xi*(n+alpha-1.)*C[n-1] - (n+2.*alpha-2.)*C[n-2]) / n;
+    }
+}
+
+static void legendre_recurrence(double x, int m, int lmax, double pmm, double *Y) {
+    /*  Fill Y[l*(lmax+1)+m] = P_l^m(x) for l = m..lmax, given P_m^m(x) */
+    int l, k = lmax+1;
+
+    Y[m*k+m] = pmm;
+    if (m < lmax) Y[(m+1)*k+m] = x*(2.*m+1.)*pmm;
+    for (l=m+2; l<=lmax; l++) {
+        Y[l*k+m] = (x*(2.*l-1.)*Y[(l-1)*k+m] - (l+m-1.)*Y[(l-2)*k+m]) / (l-m);
+    }
+}
+
+static void sph_legendre(double x, double somx2, int lmax, double *Y, double *dY,
+                         double *Ys) {
+    /*  Normalized associated Legendre functions, Y_lm(theta), and (if dY
+        is not NULL) their derivatives with respect to theta, for
+        x = cos(theta) and somx2 = sin(theta), 0 <= m <= l <= lmax. If Ys
+        is not NULL, it is filled with Y_lm(theta) / sin(theta), which is
+        finite on the z axis (and 0 for m = 0). Stored as Y[l*(lmax+1)+m].
+    */
+    int l, m, k = lmax+1;
+    double pmm = 1., pmms = 0.;
+
+    for (m=0; m<=lmax; m++) {
+        if (m > 0) {
+            /* P_m^m / sin(theta), then P_m^m */
+            pmms = -(2.*m-1.) * pmm;
+            pmm = pmms * somx2;
+        }
+        legendre_recurrence(x, m, lmax, pmm, Y);
+        if (Ys != NULL) legendre_recurrence(x, m, lmax, pmms, Ys);
+    }
+
+    if (dY != NULL) {
+        /* dP_l^m/dtheta = [P_l^(m+1) - (l+m)(l-m+1) P_l^(m-1)] / 2 */
+        for (l=0; l<=lmax; l++) {
+            for (m=0; m<=l; m++) {
+                if (m == 0) {
+                    dY[l*k] = (l > 0) ? Y[l*k+1] : 0.;
+                } else {
+                    dY[l*k+m] = -0.5*(l+m)*(l-m+1.)*Y[l*k+m-1];
+                    if (m < l) dY[l*k+m] += 0.5*Y[l*k+m+1];
+                }
+            }
+        }
+    }
+
+    for (l=0; l<=lmax; l++) {
+        for (m=0; m<=l; m++) {
+            double norm = sqrt((2.*l+1.) * exp(lgamma(l-m+1.) - lgamma(l+m+1.)));
+            Y[l*k+m] *= norm;
+            if (dY != NULL) dY[l*k+m] *= norm;
+            if (Ys != NULL) Ys[l*k+m] *= norm;
+        }
+    }
+}
+
+static void spherical_coords(double *q, double r_s, double *s, double *costh,
+                             double *sinth, double *phi) {
+    /*  sin(theta) is computed from the cylindrical radius, so is accurate
+        close to the z axis */
+    double R2 = q[0]*q[0] + q[1]*q[1];
+    double r = sqrt(R2 + q[2]*q[2]);
+    *s = r / r_s;
+    *costh = (r > 0.) ? q[2]/r : 1.;
+    *sinth = (r > 0.) ? sqrt(R2)/r : 0.;
+    *phi = atan2(q[1], q[0]);
+}
+
+static void spherical_to_cartesian(double v_r, double v_th, double v_ph,
+                                   double costh, double sinth, double phi,
+                                   double *v) {
+    /*  Cartesian components of a vector with spherical components
+        (v_r, v_theta, v_phi) */
+    v[0] = v_r*sinth*cos(phi) + v_th*costh*cos(phi) - v_ph*sin(phi);
+    v[1] = v_r*sinth*sin(phi) + v_th*costh*sin(phi) + v_ph*cos(phi);
+    v[2] = v_r*costh - v_th*sinth;
+}
+
+double scf_value(double t, double *pars, double *q) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - r_s (length scale)
+            - nmax
+            - lmax
+            - S (cosine coefficients, (nmax+1)*(lmax+1)*(lmax+1))
+            - T (sine coefficients, (nmax+1)*(lmax+1)*(lmax+1))
+    */
+    int nmax = (int) pars[3], lmax = (int) pars[4];
+    int ncoeff = (nmax+1)*(lmax+1)*(lmax+1);
+    double *S = &pars[5], *T = &pars[5+ncoeff];
+    double Y[(lmax+1)*(lmax+1)], C[nmax+1], cosm[lmax+1], sinm[lmax+1];
+    double s, costh, sinth, phi, xi, phi_nl, ang, val = 0.;
+    int n, l, m;
+
+    spherical_coords(q, pars[2], &s, &costh, &sinth, &phi);
+    sph_legendre(costh, sinth, lmax, &Y[0], NULL, NULL);
+    for (m=0; m<=lmax; m++) {
+        cosm[m] = cos(m*phi);
+        sinm[m] = sin(m*phi);
+    }
+    xi = (s - 1.) / (s + 1.);
+
+    for (l=0; l<=lmax; l++) {
+        scf_gegenbauer(xi, 2.*l+1.5, nmax, &C[0]);
+        for (n=0; n<=nmax; n++) {
+            ang = 0.;
+            for (m=0; m<=l; m++) {
+                ang += Y[l*(lmax+1)+m] * (S[SCF_IX(n,l,m,lmax)]*cosm[m] +
+                                          T[SCF_IX(n,l,m,lmax)]*sinm[m]);
+            }
+            if (ang == 0.) continue;
+            phi_nl = -pow(s, l) / pow(1.+s, 2*l+1) * C[n];
+            val += phi_nl * ang;
+        }
+    }
+
+    return pars[0] * pars[1] / pars[2] * val;
+}
+
+void scf_gradient(double t, double *pars, double *q, double *grad) {
+    int nmax = (int) pars[3], lmax = (int) pars[4];
+    int ncoeff = (nmax+1)*(lmax+1)*(lmax+1);
+    double *S = &pars[5], *T = &pars[5+ncoeff];
+    double r_s = pars[2];
+    double Y[(lmax+1)*(lmax+1)], dY[(lmax+1)*(lmax+1)], Ys[(lmax+1)*(lmax+1)];
+    double C[nmax+1], dC[nmax+1], cosm[lmax+1], sinm[lmax+1];
+    double s, r, costh, sinth, phi, xi, A, dA, Sc;
+    double phi_nl, dphi_nl, ang, dang_th, dang_ph;
+    double dr = 0., dth = 0., dph = 0., fac;
+    int n, l, m, k;
+
+    spherical_coords(q, r_s, &s, &costh, &sinth, &phi);
+    r = s * r_s;
+    if (r == 0.) {
+        /* the direction is undefined at the origin */
+        grad[0] = grad[1] = grad[2] = 0.;
+        return;
+    }
+
+    sph_legendre(costh, sinth, lmax, &Y[0], &dY[0], &Ys[0]);
+    for (m=0; m<=lmax; m++) {
+        cosm[m] = cos(m*phi);
+        sinm[m] = sin(m*phi);
+    }
+    xi = (s - 1.) / (s + 1.);
+
+    for (l=0; l<=lmax; l++) {
+        scf_gegenbauer(xi, 2.*l+1.5, nmax, &C[0]);
+        /* dC_n^a/dxi = 2a C_(n-1)^(a+1) */
+        dC[0] = 0.;
+        if (nmax > 0) {
+            scf_gegenbauer(xi, 2.*l+2.5, nmax-1, &dC[1]);
+            for (n=1; n<=nmax; n++) dC[n] *= 2.*(2.*l+1.5);
+        }
+
+        /* Phi_nl = -A(s) C_n(xi), A = s^l / (1+s)^(2l+1) */
+        A = pow(s, l) / pow(1.+s, 2*l+1);
+        dA = -(2.*l+1.) * A / (1.+s);
+        if (l > 0) dA += l * pow(s, l-1) / pow(1.+s, 2*l+1);
+
+        for (n=0; n<=nmax; n++) {
+            ang = dang_th = dang_ph = 0.;
+            for (m=0; m<=l; m++) {
+                k = SCF_IX(n,l,m,lmax);
+                Sc = S[k]*cosm[m] + T[k]*sinm[m];
+                ang += Y[l*(lmax+1)+m] * Sc;
+                dang_th += dY[l*(lmax+1)+m] * Sc;
+                /* divided by sin(theta) */
+                dang_ph += Ys[l*(lmax+1)+m] * m * (T[k]*cosm[m] - S[k]*sinm[m]);
+            }
+            if ((ang == 0.) && (dang_th == 0.) && (dang_ph == 0.)) continue;
+
+            phi_nl = -A * C[n];
+            dphi_nl = -dA * C[n] - A * dC[n] * 2. / ((1.+s)*(1.+s));
+
+            dr += dphi_nl * ang / r_s;
+            dth += phi_nl * dang_th / r;
+            dph += phi_nl * dang_ph / r;
+        }
+    }
+
+    fac = pars[0] * pars[1] / r_s;
+    spherical_to_cartesian(fac*dr, fac*dth, fac*dph, costh, sinth, phi, grad);
+}
+
+double scf_density(double t, double *pars, double *q) {
+    int nmax = (int) pars[3], lmax = (int) pars[4];
+    int ncoeff = (nmax+1)*(lmax+1)*(lmax+1);
+    double *S = &pars[5], *T = &pars[5+ncoeff];
+    double r_s = pars[2];
+    double Y[(lmax+1)*(lmax+1)], C[nmax+1], cosm[lmax+1], sinm[lmax+1];
+    double s, costh, sinth, phi, xi, K_nl, rho_nl, ang, val = 0.;
+    int n, l, m;
+
+    spherical_coords(q, r_s, &s, &costh, &sinth, &phi);
+    sph_legendre(costh, sinth, lmax, &Y[0], NULL, NULL);
+    for (m=0; m<=lmax; m++) {
+        cosm[m] = cos(m*phi);
+        sinm[m] = sin(m*phi);
+    }
+    xi = (s - 1.) / (s + 1.);
+
+    for (l=0; l<=lmax; l++) {
+        scf_gegenbauer(xi, 2.*l+1.5, nmax, &C[0]);
+        for (n=0; n<=nmax; n++) {
+            ang = 0.;
+            for (m=0; m<=l; m++) {
+                ang += Y[l*(lmax+1)+m] * (S[SCF_IX(n,l,m,lmax)]*cosm[m] +
+                                          T[SCF_IX(n,l,m,lmax)]*sinm[m]);
+            }
+            if (ang == 0.) continue;
+            K_nl = 0.5*n*(n + 4.*l + 3.) + (l + 1.)*(2.*l + 1.);
+            rho_nl = K_nl / (2.*M_PI) * pow(s, l) / (s * pow(1.+s, 2*l+3)) * C[n];
+            val += rho_nl * ang;
+        }
+    }
+
+    return pars[1] / (r_s*r_s*r_s) * val;
+}
+
+void scf_coefficient_sums(int n, double *xyz, double *mass, double r_s,
+                          int nmax, int lmax, double *S, double *T) {
+    /*  Accumulate the (unnormalized) sums over particles,
+
+            S_nlm += sum_k m_k Phi_nl(s_k) Y_lm(theta_k) cos(m phi_k)
+            T_nlm += sum_k m_k Phi_nl(s_k) Y_lm(theta_k) sin(m phi_k)
+
+        for the n particles with positions xyz (shape (n,3), C order) and
+        masses mass. S and T have shape (nmax+1, lmax+1, lmax+1).
+    */
+    double Y[(lmax+1)*(lmax+1)], C[nmax+1];
+    double s, costh, sinth, phi, xi, phi_nl;
+    int i, nn, l, m, k;
+
+    for (i=0; i<n; i++) {
+        spherical_coords(&xyz[3*i], r_s, &s, &costh, &sinth, &phi);
+        sph_legendre(costh, sinth, lmax, &Y[0], NULL, NULL);
+        xi = (s - 1.) / (s + 1.);
+
+        for (l=0; l<=lmax; l++) {
+            scf_gegenbauer(xi, 2.*l+1.5, nmax, &C[0]);
+            for (nn=0; nn<=nmax; nn++) {
+                phi_nl = -mass[i] * pow(s, l) / pow(1.+s, 2*l+1) * C[nn];
+                for (m=0; m<=l; m++) {
+                    k = SCF_IX(nn,l,m,lmax);
+                    S[k] += phi_nl * Y[l*(lmax+1)+m] * cos(m*phi);
+                    T[k] += phi_nl * Y[l*(lmax+1)+m] * sin(m*phi);
+                }
+            }
+        }
+    }
+}
+
+/* ---------------------------------------------------------------------------
+    Multipole expansion
+
+    The potential and density are expanded in (real) spherical harmonics,
+
+        Phi(r,theta,phi) = sum_lm Y_lm(theta) [Phi^c_lm(r) cos(m phi) + Phi^s_lm(r) sin(m phi)]
+
+    with Y_lm as for the SCF expansion above. The radial functions are
+    tabulated on a grid that is uniform in ln(r) and interpolated with
+    natural cubic splines. Inside of the grid, each term of the potential
+    is continued as r^l. Outside of the grid, only the potential of the
+    mass inside of the grid remains, so each term is continued as
+    r^-(l+1) from its interior part at the outer radius. The density is
+    held constant inside of the grid and is zero outside.
+
+    pars:
+        - lmax
+        - nr (number of radial grid points)
+        - ln(r_min)
+        - dln(r) (grid spacing)
+        - mask (2*(lmax+1)*(lmax+1), 1 if the term is non-zero)
+        - Phi_out (2*(lmax+1)*(lmax+1), the potential of the mass inside
+          of the grid at the outer radius)
+        - Phi (2*(lmax+1)*(lmax+1)*nr)
+        - second derivatives of the Phi splines
+        - rho (2*(lmax+1)*(lmax+1)*nr)
+        - second derivatives of the rho splines
+*/
+static double multipole_spline(double *y, double *y2, int nr, double x,
+                               double dx, double *dy) {
+    /*  Evaluate the spline through y at x (in units of the grid, measured
+        from the first point), and (if dy is not NULL) the derivative
+        with respect to x.
+    */
+    int i = (int) floor(x);
+    double A, B;
+
+    if (i < 0) i = 0;
+    if (i > nr-2) i = nr-2;
+    B = x - i;
+    A = 1. - B;
+
+    if (dy != NULL) {
+        *dy = (y[i+1] - y[i]) / dx
+            - (3.*A*A - 1.) / 6. * dx * y2[i]
+            + (3.*B*B - 1.) / 6. * dx * y2[i+1];
+    }
+    return A*y[i] + B*y[i+1] + ((A*A*A - A)*y2[i] + (B*B*B - B)*y2[i+1]) * dx*dx / 6.;
+}
+
+static double multipole_radial(double *pars, int k, int l, double lnr,
+                               double *dPhi) {
+    /*  The k-th radial term of the potential at ln(r), and its derivative
+        with respect to r.
+    */
+    int lmax = (int) pars[0], nr = (int) pars[1];
+    int ncomp = 2*(lmax+1)*(lmax+1);
+    double dlnr = pars[3];
+    double *y = &pars[4 + 2*ncomp + k*nr];
+    double *y2 = &pars[4 + 2*ncomp + ncomp*nr + k*nr];
+    double x = (lnr - pars[2]) / dlnr;
+    double val, dval, r = exp(lnr);
+
+    if (x < 0.) {
+        val = y[0] * pow(r / exp(pars[2]), l);
+        dval = l*val;
+    } else if (x > nr-1) {
+        val = pars[4 + ncomp + k] * exp(-(l+1.)*(lnr - pars[2] - (nr-1)*dlnr));
+        dval = -(l+1.)*val;
+    } else {
+        val = multipole_spline(y, y2, nr, x, dlnr, &dval);
+    }
+
+    *dPhi = dval / r;
+    return val;
+}
+
+double multipole_value(double t, double *pars, double *q) {
+    int lmax = (int) pars[0];
+    int nlm = (lmax+1)*(lmax+1);
+    double *mask = &pars[4];
+    double Y[nlm];
+    double r, lnr, costh, sinth, phi, dPhi, val = 0.;
+    int l, m;
+
+    spherical_coords(q, 1., &r, &costh, &sinth, &phi);
+    lnr = log(r);
+    sph_legendre(costh, sinth, lmax, &Y[0], NULL, NULL);
+
+    for (l=0; l<=lmax; l++) {
+        for (m=0; m<=l; m++) {
+            if (mask[l*(lmax+1)+m] != 0.) {
+                val += Y[l*(lmax+1)+m] * cos(m*phi) *
+                    multipole_radial(pars, l*(lmax+1)+m, l, lnr, &dPhi);
+            }
+            if (mask[nlm + l*(lmax+1)+m] != 0.) {
+                val += Y[l*(lmax+1)+m] * sin(m*phi) *
+                    multipole_radial(pars, nlm + l*(lmax+1)+m, l, lnr, &dPhi);
+            }
+        }
+    }
+
+    return val;
+}
+
+void multipole_gradient(double t, double *pars, double *q, double *grad) {
+    int lmax = (int) pars[0];
+    int nlm = (lmax+1)*(lmax+1);
+    double *mask = &pars[4];
+    double Y[nlm], dY[nlm], Ys[nlm];
+    double r, lnr, costh, sinth, phi, Phi, dPhi, cosm, sinm;
+    double dr = 0., dth = 0., dph = 0.;
+    int l, m, k;
+
+    spherical_coords(q, 1., &r, &costh, &sinth, &phi);
+    if (r == 0.) {
+        /* the direction is undefined at the origin */
+        grad[0] = grad[1] = grad[2] = 0.;
+        return;
+    }
+    lnr = log(r);
+    sph_legendre(costh, sinth, lmax, &Y[0], &dY[0], &Ys[0]);
+
+    for (l=0; l<=lmax; l++) {
+        for (m=0; m<=l; m++) {
+            k = l*(lmax+1) + m;
+            cosm = cos(m*phi);
+            sinm = sin(m*phi);
+            if (mask[k] != 0.) {
+                Phi = multipole_radial(pars, k, l, lnr, &dPhi);
+                dr += Y[k] * cosm * dPhi;
+                dth += dY[k] * cosm * Phi / r;
+                dph -= m * Ys[k] * sinm * Phi / r;
+            }
+            if (mask[nlm+k] != 0.) {
+                Phi = multipole_radial(pars, nlm+k, l, lnr, &dPhi);
+                dr += Y[k] * sinm * dPhi;
+                dth += dY[k] * sinm * Phi / r;
+                dph += m * Ys[k] * cosm * Phi / r;
+            }
+        }
+    }
+
+    spherical_to_cartesian(dr, dth, dph, costh, sinth, phi, grad);
+}
+
+double multipole_density(double t, double *pars, double *q) {
+    int lmax = (int) pars[0], nr = (int) pars[1];
+    int nlm = (lmax+1)*(lmax+1), ncomp = 2*nlm;
+    double *mask = &pars[4];
+    double *rho = &pars[4 + 2*ncomp + 2*ncomp*nr];
+    double *rho_y2 = &pars[4 + 2*ncomp + 3*ncomp*nr];
+    double Y[nlm];
+    double r, costh, sinth, phi, x, trig, val = 0.;
+    int l, m, k, j;
+
+    spherical_coords(q, 1., &r, &costh, &sinth, &phi);
+    x = (log(r) - pars[2]) / pars[3];
+    if (x > nr-1) return 0.;
+    if (x < 0.) x = 0.;
+    sph_legendre(costh, sinth, lmax, &Y[0], NULL, NULL);
+
+    for (l=0; l<=lmax; l++) {
+        for (m=0; m<=l; m++) {
+            for (j=0; j<2; j++) {
+                k = j*nlm + l*(lmax+1) + m;
+                if (mask[k] == 0.) continue;
+                trig = (j == 0) ? cos(m*phi) : sin(m*phi);
+                val += Y[l*(lmax+1)+m] * trig *
+                    multipole_spline(&rho[k*nr], &rho_y2[k*nr], nr, x, pars[3], NULL);
+            }
+        }
+    }
+
+    return val;
+}
@@ -2,50 +2,79 @@ extern double nan_density(double t, double *pars, double *q);
 
 extern double henon_heiles_value(double t, double *pars, double *q);
 extern void henon_heiles_gradient(double t, double *pars, double *q, double *grad);
+extern void henon_heiles_hessian(double t, double *pars, double *q, double *hess);
 
 extern double kepler_value(double t, double *pars, double *q);
 extern void kepler_gradient(double t, double *pars, double *q, double *grad);
+extern void kepler_hessian(double t, double *pars, double *q, double *hess);
 
 extern double isochrone_value(double t, double *pars, double *q);
 extern void isochrone_gradient(double t, double *pars, double *q, double *grad);
+extern void isochrone_hessian(double t, double *pars, double *q, double *hess);
 extern double isochrone_density(double t, double *pars, double *q);
 
 extern double hernquist_value(double t, double *pars, double *q);
 extern void hernquist_gradient(double t, double *pars, double *q, double *grad);
+extern void hernquist_hessian(double t, double *pars, double *q, double *hess);
 extern double hernquist_density(double t, double *pars, double *q);
 
 extern double plummer_value(double t, double *pars, double *q);
 extern void plummer_gradient(double t, double *pars, double *q, double *grad);
+extern void plummer_hessian(double t, double *pars, double *q, double *hess);
 extern double plummer_density(double t, double *pars, double *q);
 
+extern double moving_plummer_value(double t, double *pars, double *q);
+extern void moving_plummer_gradient(double t, double *pars, double *q, double *grad);
+extern void moving_plummer_hessian(double t, double *pars, double *q, double *hess);
+extern double moving_plummer_density(double t, double *pars, double *q);
+
 extern double jaffe_value(double t, double *pars, double *q);
 extern void jaffe_gradient(double t, double *pars, double *q, double *grad);
+extern void jaffe_hessian(double t, double *pars, double *q, double *hess);
 extern double jaffe_density(double t, double *pars, double *q);
 
 extern double stone_value(double t, double *pars, double *q);
 extern void stone_gradient(double t, double *pars, double *q, double *grad);
+extern void stone_hessian(double t, double *pars, double *q, double *hess);
 
 extern double sphericalnfw_value(double t, double *pars, double *q);
 extern void sphericalnfw_gradient(double t, double *pars, double *q, double *grad);
+extern void sphericalnfw_hessian(double t, double *pars, double *q, double *hess);
 extern double sphericalnfw_density(double t, double *pars, double *q);
 
 extern double flattenednfw_value(double t, double *pars, double *q);
 extern void flattenednfw_gradient(double t, double *pars, double *q, double *grad);
+extern void flattenednfw_hessian(double t, double *pars, double *q, double *hess);
 extern double flattenednfw_density(double t, double *pars, double *q);
 
 extern double miyamotonagai_value(double t, double *pars, double *q);
 extern void miyamotonagai_gradient(double t, double *pars, double *q, double *grad);
+extern void miyamotonagai_hessian(double t, double *pars, double *q, double *hess);
 extern double miyamotonagai_density(double t, double *pars, double *q);
 
 extern double leesuto_value(double t, double *pars, double *q);
 extern void leesuto_gradient(double t, double *pars, double *q, double *grad);
+extern void leesuto_hessian(double t, double *pars, double *q, double *hess);
 extern double leesuto_density(double t, double *pars, double *q);
 
 extern double logarithmic_value(double t, double *pars, double *q);
 extern void logarithmic_gradient(double t, double *pars, double *q, double *grad);
+extern void logarithmic_hessian(double t, double *pars, double *q, double *hess);
 
 extern double rotating_logarithmic_value(double t, double *pars, double *q);
 extern void rotating_logarithmic_gradient(double t, double *pars, double *q, double *grad);
+extern void rotating_logarithmic_hessian(double t, double *pars, double *q, double *hess);
 
 extern double lm10_value(double t, double *pars, double *q);
 extern void lm10_gradient(double t, double *pars, double *q, double *grad);
+extern void lm10_hessian(double t, double *pars, double *q, double *hess);
+
+extern double scf_value(double t, double *pars, double *q);
+extern void scf_gradient(double t, double *pars, double *q, double *grad);
+extern double scf_density(double t, double *pars, double *q);
+extern void scf_coefficient_sums(int n, double *xyz, double *mass, double r_s,
+                                 int nmax, int lmax, double *S, double *T);
+
+extern double multipole_value(double t, double *pars, double *q);
+extern void multipole_gradient(double t, double *pars, double *q, double *grad);
+extern double multipole_density(double t, double *pars, double *q);
@@ -21,6 +21,28 @@ from ..dynamics import CartesianOrbit, CartesianPhaseSpacePosition
 
 __all__ = ["PotentialBase", "CompositePotential"]
 
+def _check_output(out, shape):
+    """
+    Make sure an output array passed in by the user can be written to
+    directly -- a reshaped copy would silently lose the results.
+    """
+    if (not isinstance(out, np.ndarray) or out.dtype != np.float64 or
+            not out.flags['C_CONTIGUOUS'] or not out.flags['WRITEABLE']):
+        raise ValueError("Output array must be a writeable, C-contiguous array "
+                         "of 64-bit floats.")
+
+    if out.shape != tuple(shape):
+        raise ValueError("Output array has shape {0}, expected {1}."
+                         .format(out.shape, tuple(shape)))
+
+def _store_output(result, out):
+    if out is None:
+        return result
+
+    _check_output(out, result.shape)
+    out[...] = result
+    return out
+
 class PotentialBase(object):
     """
     A baseclass for defining gravitational potentials.
@@ -30,6 +52,9 @@ class PotentialBase(object):
     subclasses should also define a gradient function. Optionally, they
     may also define functions to compute the density and hessian.
     """
+    # number of spatial dimensions
+    ndim = 3
+
     def __init__(self, units=None):
         # make sure the units specified are a UnitSystem instance
         if units is not None and not isinstance(units, UnitSystem):
@@ -48,7 +73,7 @@ class PotentialBase(object):
     def _value(self):
         raise NotImplementedError()
 
-    def value(self, q, t=0.):
+    def value(self, q, t=0., nthreads=1, out=None):
         """
         Compute the value of the potential at the given position(s).
 
@@ -56,6 +81,14 @@ class PotentialBase(object):
         ----------
         q : array_like, numeric
             Position to compute the value of the potential.
+        t : numeric (optional)
+            The time.
+        nthreads : int (optional)
+            Number of threads to split the positions over. Only used by
+            potentials implemented in C.
+        out : `~numpy.ndarray` (optional)
+            A C-contiguous array to store the output in. Must have the
+            same shape as the return value.
 
         Returns
         -------
@@ -65,12 +98,12 @@ class PotentialBase(object):
             without the coordinate axis, ``axis=0``.
         """
         q = np.ascontiguousarray(atleast_2d(q, insert_axis=1))
-        return self._value(q, t=t)
+        return _store_output(self._value(q, t=t), out)
 
     def _gradient(self, *args, **kwargs):
         raise NotImplementedError()
 
-    def gradient(self, q, t=0.):
+    def gradient(self, q, t=0., nthreads=1, out=None):
         """
         Compute the gradient of the potential at the given position(s).
 
@@ -78,6 +111,14 @@ class PotentialBase(object):
         ----------
         q : array_like, numeric
             Position to compute the gradient.
+        t : numeric (optional)
+            The time.
+        nthreads : int (optional)
+            Number of threads to split the positions over. Only used by
+            potentials implemented in C.
+        out : `~numpy.ndarray` (optional)
+            A C-contiguous array to store the output in. Must have the
+            same shape as the return value.
 
         Returns
         -------
@@ -87,14 +128,14 @@ class PotentialBase(object):
         """
         q = np.ascontiguousarray(atleast_2d(q, insert_axis=1))
         try:
-            return self._gradient(q, t=t)
+            return _store_output(self._gradient(q, t=t), out)
         except NotImplementedError:
             raise NotImplementedError("This potential has no specified gradient function.")
 
     def _density(self, *args, **kwargs):
         raise NotImplementedError()
 
-    def density(self, q, t=0.):
+    def density(self, q, t=0., nthreads=1, out=None):
         """
         Compute the density value at the given position(s).
 
@@ -102,6 +143,14 @@ class PotentialBase(object):
         ----------
         q : array_like, numeric
             Position to compute the density.
+        t : numeric (optional)
+            The time.
+        nthreads : int (optional)
+            Number of threads to split the positions over. Only used by
+            potentials implemented in C.
+        out : `~numpy.ndarray` (optional)
+            A C-contiguous array to store the output in. Must have the
+            same shape as the return value.
 
         Returns
         -------
@@ -111,14 +160,14 @@ class PotentialBase(object):
         """
         q = np.ascontiguousarray(atleast_2d(q, insert_axis=1))
         try:
-            return self._density(q, t=t)
+            return _store_output(self._density(q, t=t), out)
         except NotImplementedError:
             raise NotImplementedError("This potential has no specified density function.")
 
     def _hessian(self, *args, **kwargs):
         raise NotImplementedError()
 
-    def hessian(self, q, t=0.):
+    def hessian(self, q, t=0., nthreads=1, out=None):
         """
         Compute the Hessian of the potential at the given position(s).
 
@@ -126,10 +175,27 @@ class PotentialBase(object):
         ----------
         q : array_like, numeric
             Position to compute the Hessian.
+        t : numeric (optional)
+            The time.
+        nthreads : int (optional)
+            Number of threads to split the positions over. Only used by
+            potentials implemented in C.
+        out : `~numpy.ndarray` (optional)
+            A C-contiguous array to store the output in. Must have the
+            same shape as the return value.
+
+        Returns
+        -------
+        hess : `~numpy.ndarray`
+            The Hessian matrix of second derivatives of the potential. The
+            first two axes index the coordinates, e.g., ``hess[0,1]`` is
+            :math:`\partial^2\Phi/\partial x \partial y`, and the remaining
+            axes have the same shape as the input position array, ``q``,
+            without the coordinate axis, ``axis=0``.
         """
         q = np.ascontiguousarray(atleast_2d(q, insert_axis=1))
         try:
-            return self._hessian(q, t=t)
+            return _store_output(self._hessian(q, t=t), out)
         except NotImplementedError:
             raise NotImplementedError("This potential has no specified hessian function.")
 
@@ -423,6 +489,7 @@ class PotentialBase(object):
 
     def integrate_orbit(self, w0, Integrator=LeapfrogIntegrator,
                         Integrator_kwargs=dict(), cython_if_possible=True,
+                        nthreads=1, store_every=1, mmap=None, events=None,
                         **time_spec):
         """
         Integrate an orbit in the current potential using the integrator class
@@ -437,11 +504,39 @@ class PotentialBase(object):
             Integrator class to use.
         Integrator_kwargs : dict (optional)
             Any extra keyword argumets to pass to the integrator class
-            when initializing. Only works in non-Cython mode.
+            when initializing. In Cython mode, only ``atol``, ``rtol``,
+            ``nmax``, ``dense_output``, and ``independent`` (integrate
+            each orbit with its own adaptive step size) are supported for
+            `~gary.integrate.DOPRI853Integrator`.
         cython_if_possible : bool (optional)
             If there is a Cython version of the integrator implemented,
             and the potential object has a C instance, using Cython
             will be *much* faster.
+        nthreads : int (optional)
+            In Cython mode, split the orbits into ``nthreads`` blocks that
+            are integrated concurrently on separate cores. Ignored if
+            integrating in Python.
+        store_every : int (optional)
+            Only store the orbit at every ``store_every`` time step, starting
+            with the initial conditions. If 0, only the final state is
+            stored. In Cython mode the skipped steps are never stored, which
+            saves memory for long integrations.
+        mmap : `numpy.memmap`, str (optional)
+            Write the orbit to a writable memory-mapped array with shape
+            ``(2*ndim, ntimes, norbits)``, where ``ntimes`` is the number of
+            stored times, or to a new memory-mapped array in the given file.
+            In Cython mode the integrators write directly into this array,
+            and the returned orbit is a view of it. In Python mode every
+            time step is written to it, regardless of ``store_every``. This
+            is useful for integrating a large number of orbits or time steps.
+        events : `~gary.integrate.Event`, list (optional)
+            Events to locate while integrating, e.g.,
+            `~gary.integrate.Pericenter` or a `~gary.integrate.PlaneCrossing`.
+            The time and phase-space position of each event are found by
+            root-finding on the interpolated orbit, so they don't depend on
+            the output time sampling. Only supported in Cython mode by
+            `~gary.integrate.LeapfrogIntegrator` and
+            `~gary.integrate.DOPRI853Integrator`.
         **time_spec
             Specification of how long to integrate. See documentation
             for `~gary.integrate.parse_time_specification`.
@@ -449,6 +544,11 @@ class PotentialBase(object):
         Returns
         -------
         orbit : `~gary.dynamics.CartesianOrbit`
+        found : list
+            Only returned if ``events`` is specified. For each event (or just
+            the one event, if a single event is given) and each orbit (or just
+            the one orbit), a `~gary.dynamics.CartesianOrbit` containing the
+            times and phase-space positions of the events found.
 
         """
 
@@ -460,45 +560,117 @@ class PotentialBase(object):
 
         ndim = w0.ndim
         arr_w0 = w0.w(self.units)
+
+        if events is not None and not (hasattr(self, 'c_instance') and cython_if_possible and
+                                       Integrator in (LeapfrogIntegrator, DOPRI853Integrator)):
+            raise ValueError("Events are only supported by the Cython leapfrog "
+                             "and DOP853 integrators.")
+
         if hasattr(self, 'c_instance') and cython_if_possible:
             # WARNING TO SELF: this transpose is there because the Cython
             #   functions expect a shape: (norbits, ndim)
             arr_w0 = np.ascontiguousarray(arr_w0.T)
 
             # array of times
-            from ..integrate.timespec import parse_time_specification
+            from ..integrate.timespec import parse_time_specification, _store_indices
             t = np.ascontiguousarray(parse_time_specification(**time_spec))
 
+            # the integrators write directly into the final output layout,
+            #   (ndim, ntimes, norbits), through a view with their axis order
+            from ..integrate.core import _output_array
+            nout = len(_store_indices(len(t), store_every))
+            ws = _output_array((arr_w0.shape[1], nout, arr_w0.shape[0]), mmap)
+            out = np.rollaxis(ws, 0, 3)
+
             if Integrator == LeapfrogIntegrator:
                 from ..integrate.cyintegrators import leapfrog_integrate_potential
-                t,w = leapfrog_integrate_potential(self.c_instance, arr_w0, t)
+                res = leapfrog_integrate_potential(self.c_instance, arr_w0, t,
+                                                   nthreads=nthreads,
+                                                   store_every=store_every,
+                                                   out=out, events=events)
 
             elif Integrator == DOPRI853Integrator:
                 from ..integrate.cyintegrators import dop853_integrate_potential
-                t,w = dop853_integrate_potential(self.c_instance, arr_w0, t,
+                res = dop853_integrate_potential(self.c_instance, arr_w0, t,
                                                  Integrator_kwargs.get('atol', 1E-10),
                                                  Integrator_kwargs.get('rtol', 1E-10),
-                                                 Integrator_kwargs.get('nmax', 0))
+                                                 Integrator_kwargs.get('nmax', 0),
+                                                 Integrator_kwargs.get('dense_output', False),
+                                                 nthreads=nthreads,
+                                                 independent=Integrator_kwargs.get('independent', False),
+                                                 store_every=store_every, out=out,
+                                                 events=events)
+            elif Integrator == RK5Integrator:
+                from ..integrate.cyintegrators import rk5_integrate_potential
+                res = rk5_integrate_potential(self.c_instance, arr_w0, t,
+                                              nthreads=nthreads,
+                                              store_every=store_every,
+                                              out=out)
+
+            elif isinstance(Integrator, type) and issubclass(Integrator, SymplecticIntegrator):
+                from ..integrate.cyintegrators import symplectic_integrate_potential
+                res = symplectic_integrate_potential(self.c_instance, arr_w0, t,
+                                                     Integrator.drift, Integrator.kick,
+                                                     nthreads=nthreads,
+                                                     store_every=store_every,
+                                                     out=out)
+
             else:
                 raise ValueError("Cython integration not supported for '{}'".format(Integrator))
 
-            # because shape is different from normal integrator return
-            w = np.rollaxis(w, -1)
+            t = res[0]
+            w = ws
             if w.shape[-1] == 1:
                 w = w[...,0]
 
         else:
             acc = lambda t,w: np.vstack((w[ndim:], self.acceleration(w[:ndim], t=t)))
             integrator = Integrator(acc, func_units=self.units, **Integrator_kwargs)
-            orbit = integrator.run(w0, **time_spec)
+            orbit = integrator.run(w0, mmap=mmap, **time_spec)
+            store_every = int(store_every)
+            if store_every < 0:
+                raise ValueError("store_every must be a non-negative integer.")
+            elif store_every == 0:
+                orbit = orbit[-1:]
+            elif store_every != 1:
+                orbit = orbit[::store_every]
             orbit.potential = self
             return orbit
 
         try:
             tunit = self.units['time']
+            lunit = self.units['length']
         except (TypeError, AttributeError):
-            tunit = u.dimensionless_unscaled
-        return CartesianOrbit.from_w(w=w, units=self.units, t=t*tunit, potential=self)
+            tunit = lunit = u.dimensionless_unscaled
+
+        # wrap the (possibly memory-mapped) output array without copying it
+        pos = u.Quantity(w[:ndim], lunit, copy=False)
+        vel = u.Quantity(w[ndim:], lunit/tunit, copy=False)
+        orbit = CartesianOrbit(pos=pos, vel=vel, t=t*tunit, potential=self)
+
+        if events is None:
+            return orbit
+
+        # split the events found by event and then by orbit
+        ev_orbit, ev_index, ev_t, ev_w = res[-1]
+        norbits = arr_w0.shape[0]
+        nevents = 1 if isinstance(events, Event) else len(events)
+
+        found = []
+        for e in range(nevents):
+            ix = ev_index == e
+            splits = np.searchsorted(ev_orbit[ix], np.arange(1, norbits))
+            orbits = [CartesianOrbit(pos=ev_wi[:,:ndim].T*lunit,
+                                     vel=ev_wi[:,ndim:].T*lunit/tunit,
+                                     t=ev_ti*tunit, potential=self)
+                      for ev_ti,ev_wi in zip(np.split(ev_t[ix], splits),
+                                             np.split(ev_w[ix], splits))]
+            found.append(orbits[0] if w.ndim == 2 else orbits)
+
+        if isinstance(events, Event):
+            found = found[0]
+
+        return orbit, found
 
     def total_energy(self, x, v):
         """
@@ -605,14 +777,18 @@ class CompositePotential(PotentialBase, OrderedDict):
             params[k] = v.parameters
         return ImmutableDict(params)
 
-    def value(self, q, t=0.):
-        return np.array([p.value(q, t) for p in self.values()]).sum(axis=0)
+    def value(self, q, t=0., nthreads=1, out=None):
+        return _store_output(np.array([p.value(q, t, nthreads=nthreads)
+                                       for p in self.values()]).sum(axis=0), out)
 
-    def gradient(self, q, t=0.):
-        return np.array([p.gradient(q, t) for p in self.values()]).sum(axis=0)
+    def gradient(self, q, t=0., nthreads=1, out=None):
+        return _store_output(np.array([p.gradient(q, t, nthreads=nthreads)
+                                       for p in self.values()]).sum(axis=0), out)
 
-    def hessian(self, w, t=0.):
-        return np.array([p.hessian(w, t) for p in self.values()]).sum(axis=0)
+    def hessian(self, w, t=0., nthreads=1, out=None):
+        return _store_output(np.array([p.hessian(w, t, nthreads=nthreads)
+                                       for p in self.values()]).sum(axis=0), out)
 
-    def density(self, q, t=0.):
-        return np.array([p.density(q, t) for p in self.values()]).sum(axis=0)
+    def density(self, q, t=0., nthreads=1, out=None):
+        return _store_output(np.array([p.density(q, t, nthreads=nthreads)
+                                       for p in self.values()]).sum(axis=0), out)
@@ -9,26 +9,95 @@ from __future__ import division, print_function
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
 
+# Standard library
+from collections import OrderedDict
+import ctypes
+import hashlib
+import numbers
+import os
+import tempfile
+import threading
+
 # Third-party
+from astropy.constants import G
 import numpy as np
 cimport numpy as np
 np.import_array()
 import cython
 cimport cython
+from libc.stdlib cimport malloc, free
 
 # Project
-from .core import PotentialBase, CompositePotential
-from ..util import atleast_2d
+from .core import PotentialBase, CompositePotential, _check_output
+from ..util import atleast_2d, inherit_docs
 
 cdef extern from "math.h":
     double sqrt(double x) nogil
     double fabs(double x) nogil
+    double NAN
 
 cdef extern from "stdint.h":
     ctypedef int intptr_t
 
-__all__ = ['CPotentialBase']
-
+cdef extern from "src/_cpotential.h":
+    ctypedef struct CompositeParameters:
+        int n
+        int ndim
+        valuefunc *value
+        gradientfunc *gradient
+        densityfunc *density
+        hessianfunc *hessian
+        double **parameters
+
+    double composite_value(double t, double *pars, double *q) nogil
+    void composite_gradient(double t, double *pars, double *q, double *grad) nogil
+    double composite_density(double t, double *pars, double *q) nogil
+    void composite_hessian(double t, double *pars, double *q, double *hess) nogil
+
+    ctypedef struct TimeDependentParameters:
+        valuefunc value
+        gradientfunc gradient
+        densityfunc density
+        hessianfunc hessian
+        int npars
+        double *parameters
+        int nvary
+        int *index
+        int ntimes
+        double *t
+        double *y
+        double *y2
+        int last
+
+    ctypedef struct InterpolatedParameters:
+        int spherical
+        int n[3]
+        double min[3]
+        double delta[3]
+        double *values
+
+    double interpolated_value(double t, double *pars, double *q) nogil
+    void interpolated_gradient(double t, double *pars, double *q, double *grad) nogil
+
+    double timedependent_value(double t, double *pars, double *q) nogil
+    void timedependent_gradient(double t, double *pars, double *q, double *grad) nogil
+    double timedependent_density(double t, double *pars, double *q) nogil
+    void timedependent_hessian(double t, double *pars, double *q, double *hess) nogil
+
+__all__ = ['CPotentialBase', 'CCompositePotential', 'TimeDependentPotential',
+           'CustomCPotential', 'InterpolatedPotential']
+
+# functions that can be evaluated in batch by _CPotential._evaluate()
+cdef enum:
+    EVAL_VALUE
+    EVAL_GRADIENT
+    EVAL_DENSITY
+    EVAL_HESSIAN
+    EVAL_D_DR
+    EVAL_D2_DR2
+    EVAL_MASS_ENCLOSED
+
+@inherit_docs
 class CPotentialBase(PotentialBase):
     """
     A base class for representing gravitational potentials with
@@ -37,45 +106,58 @@ class CPotentialBase(PotentialBase):
     TODO: better description here
     """
 
-    def _value(self, q, t=0.):
-        sh = q.shape
-        q = np.ascontiguousarray(q.reshape(sh[0],np.prod(sh[1:])).T)
-        return self.c_instance.value(q, t=t).reshape(sh[1:])
-
-    def _gradient(self, q, t=0.):
-        sh = q.shape
-        q = np.ascontiguousarray(q.reshape(sh[0],np.prod(sh[1:])).T)
+    def _c_input(self, q, out, out_shape):
+        # the C methods follow a (norbits, ndim) axis convention -- this is
+        #   just a transposed view, no copy is made
+        q = np.ascontiguousarray(atleast_2d(q, insert_axis=1))
+        if out is not None:
+            _check_output(out, out_shape(q.shape))
+        return q, q.reshape(q.shape[0], -1).T
+
+    def value(self, q, t=0., nthreads=1, out=None):
+        q,cq = self._c_input(q, out, lambda sh: sh[1:])
+        res = self.c_instance.value(cq, t=t, nthreads=nthreads,
+                                    out=None if out is None else out.reshape(-1))
+        return res.reshape(q.shape[1:]) if out is None else out
+
+    def gradient(self, q, t=0., nthreads=1, out=None):
+        q,cq = self._c_input(q, out, lambda sh: sh)
         try:
-            return self.c_instance.gradient(q, t=t).reshape(sh)
+            res = self.c_instance.gradient(cq, t=t, nthreads=nthreads,
+                                           out=None if out is None else out.reshape(q.shape[0],-1))
         except AttributeError,TypeError:
             raise ValueError("Potential C instance has no defined "
                              "gradient function")
+        return res.reshape(q.shape) if out is None else out
 
-    def _density(self, q, t=0.):
-        sh = q.shape
-        q = np.ascontiguousarray(q.reshape(sh[0],np.prod(sh[1:])).T)
+    def density(self, q, t=0., nthreads=1, out=None):
+        q,cq = self._c_input(q, out, lambda sh: sh[1:])
         try:
-            return self.c_instance.density(q, t=t).reshape(sh[1:])
+            res = self.c_instance.density(cq, t=t, nthreads=nthreads,
+                                          out=None if out is None else out.reshape(-1))
         except AttributeError,TypeError:
             # TODO: if no density function, should this numerically esimate
             #   the density?
             raise ValueError("Potential C instance has no defined "
                              "density function")
+        return res.reshape(q.shape[1:]) if out is None else out
 
-    def _hessian(self, q, t=0.):
-        sh = q.shape
-        q = np.ascontiguousarray(q.reshape(sh[0],np.prod(sh[1:])).T)
+    def hessian(self, q, t=0., nthreads=1, out=None):
+        q,cq = self._c_input(q, out, lambda sh: (sh[0],sh[0])+sh[1:])
+        ndim = q.shape[0]
         try:
-            return self.c_instance.hessian(q, t=t) # TODO: return shape?
+            res = self.c_instance.hessian(cq, t=t, nthreads=nthreads,
+                                          out=None if out is None else out.reshape(ndim,ndim,-1))
         except AttributeError,TypeError:
             raise ValueError("Potential C instance has no defined "
                              "Hessian function")
+        return res.reshape((ndim,ndim)+q.shape[1:]) if out is None else out
 
     # ----------------------------------------------------------
     # Overwrite the Python potential method to use Cython method
-    def mass_enclosed(self, q, t=0.):
+    def mass_enclosed(self, q, t=0., nthreads=1):
         """
-        mass_enclosed(q)
+        mass_enclosed(q, t=0., nthreads=1)
 
         Estimate the mass enclosed within the given position by assuming the potential
         is spherical. This is not so good!
@@ -84,15 +166,19 @@ class CPotentialBase(PotentialBase):
         ----------
         q : array_like, numeric
             Position to compute the mass enclosed.
+        t : numeric (optional)
+            The time.
+        nthreads : int (optional)
+            Number of threads to split the positions over.
         """
         if self.units is None:
             raise ValueError("No units specified when creating potential object.")
 
         q = atleast_2d(q, insert_axis=1)
         sh = q.shape
-        q = np.ascontiguousarray(q.reshape(sh[0],np.prod(sh[1:])).T)
+        q = q.reshape(sh[0],np.prod(sh[1:])).T
         try:
-            menc = self.c_instance.mass_enclosed(q, self.G, t=t)
+            menc = self.c_instance.mass_enclosed(q, self.G, t=t, nthreads=nthreads)
         except AttributeError,TypeError:
             raise ValueError("Potential C instance has no defined "
                              "mass_enclosed function")
@@ -116,103 +202,172 @@ cdef class _CPotential:
     def __reduce__(self):
         return (self.__class__, tuple(self._parvec))
 
-    cpdef value(self, double[:,::1] q, double t=0.):
+    # -------------------------------------------------------------
+    # Batch evaluation: the positions are split into contiguous blocks that
+    #   are evaluated with the GIL released, optionally in several threads.
+    #   Each block gets its own scratch space.
+    cdef void _evaluate_block(self, int func, double t, double G,
+                              double[:,:] q, double[:,:] out,
+                              double *qi, double *tmp, double *epsilon,
+                              int i1, int i2) nogil:
+        cdef:
+            int i, k
+            int ndim = q.shape[1]
+            int m = out.shape[1]
+
+        for i in range(i1,i2):
+            # copy so that input arrays with any strides can be used
+            for k in range(ndim):
+                qi[k] = q[i,k]
+
+            if func == EVAL_VALUE:
+                out[i,0] = self._value(t, qi)
+
+            elif func == EVAL_DENSITY:
+                out[i,0] = self._density(t, qi)
+
+            elif func == EVAL_GRADIENT or func == EVAL_HESSIAN:
+                for k in range(m):
+                    tmp[k] = 0.
+
+                if func == EVAL_GRADIENT:
+                    self._gradient(t, qi, tmp)
+                else:
+                    self._hessian(t, qi, tmp)
+
+                for k in range(m):
+                    out[i,k] = tmp[k]
+
+            elif func == EVAL_D_DR:
+                out[i,0] = self._d_dr(t, qi, epsilon, G)
+
+            elif func == EVAL_D2_DR2:
+                out[i,0] = self._d2_dr2(t, qi, epsilon, G)
+
+            elif func == EVAL_MASS_ENCLOSED:
+                out[i,0] = self._mass_enclosed(t, qi, epsilon, G)
+
+    def _evaluate_worker(self, int func, double t, double G,
+                         double[:,:] q, double[:,:] out, int i1, int i2):
+        cdef:
+            int ndim = q.shape[1]
+            double[::1] qi = np.zeros(max(ndim,3))
+            double[::1] tmp = np.zeros(max(out.shape[1],9))
+            double[::1] epsilon = np.zeros(max(ndim,3))
+
+        with nogil:
+            self._evaluate_block(func, t, G, q, out,
+                                 &qi[0], &tmp[0], &epsilon[0], i1, i2)
+
+    def _evaluate(self, int func, double[:,:] q, out, double t=0., double G=1.,
+                  int nthreads=1):
         """
-        CAUTION: Interpretation of axes is different here! We need the
-        arrays to be C ordered and easy to iterate over, so here the
-        axes are (norbits, ndim).
+        Evaluate the function ``func`` at all positions in ``q`` and store the
+        result in the 2D array ``out``, with shape ``(norbits, m)``. The array
+        may have any strides.
         """
-        cdef int norbits, ndim, i
-        norbits = q.shape[0]
-        ndim = q.shape[1]
+        cdef int i, n = q.shape[0]
+
+        nthreads = max(1, min(nthreads, n))
+        if nthreads == 1:
+            self._evaluate_worker(func, t, G, q, out, 0, n)
+
+        else:
+            bounds = np.linspace(0, n, nthreads+1).astype(int)
+            threads = [threading.Thread(target=self._evaluate_worker,
+                                        args=(func, t, G, q, out,
+                                              bounds[i], bounds[i+1]))
+                       for i in range(nthreads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def _output(self, out, shape):
+        if out is None:
+            return np.zeros(shape)
+        _check_output(out, shape)
+        return out
 
-        cdef double [::1] pot = np.zeros((norbits,))
-        for i in range(norbits):
-            pot[i] = self._value(t, &q[i,0])
+    # -------------------------------------------------------------
+    cpdef value(self, double[:,:] q, double t=0., int nthreads=1, out=None):
+        """
+        value(q, t=0., nthreads=1, out=None)
 
-        return np.array(pot)
+        CAUTION: Interpretation of axes is different here! We need the
+        arrays to be C ordered and easy to iterate over, so here the
+        axes are (norbits, ndim). The output has shape (norbits,).
+        """
+        out = self._output(out, (q.shape[0],))
+        self._evaluate(EVAL_VALUE, q, out.reshape(-1,1), t=t, nthreads=nthreads)
+        return out
 
     cdef public inline double _value(self, double t, double *r) nogil:
         return self.c_value(t, self._parameters, r)
 
     # -------------------------------------------------------------
-    cpdef gradient(self, double[:,::1] q, double t=0.):
+    cpdef gradient(self, double[:,:] q, double t=0., int nthreads=1, out=None):
         """
+        gradient(q, t=0., nthreads=1, out=None)
+
         CAUTION: Interpretation of axes is different here! We need the
         arrays to be C ordered and easy to iterate over, so here the
-        axes are (norbits, ndim).
+        axes are (norbits, ndim). The output has shape (ndim, norbits).
         """
-        cdef int norbits, ndim, i
-        norbits = q.shape[0]
-        ndim = q.shape[1]
-
-        cdef double [:,::1] grad = np.zeros((norbits,ndim))
-        for i in range(norbits):
-            self._gradient(t, &q[i,0], &grad[i,0])
-
-        return np.array(grad).T
+        out = self._output(out, (q.shape[1],q.shape[0]))
+        self._evaluate(EVAL_GRADIENT, q, out.T, t=t, nthreads=nthreads)
+        return out
 
     cdef public inline void _gradient(self, double t, double *r, double *grad) nogil:
         self.c_gradient(t, self._parameters, r, grad)
 
     # -------------------------------------------------------------
-    cpdef density(self, double[:,::1] q, double t=0.):
+    cpdef density(self, double[:,:] q, double t=0., int nthreads=1, out=None):
         """
+        density(q, t=0., nthreads=1, out=None)
+
         CAUTION: Interpretation of axes is different here! We need the
         arrays to be C ordered and easy to iterate over, so here the
-        axes are (norbits, ndim).
+        axes are (norbits, ndim). The output has shape (norbits,).
         """
-        cdef int norbits, ndim, i
-        norbits = q.shape[0]
-        ndim = q.shape[1]
-
-        cdef double [::1] pot = np.zeros((norbits,))
-        for i in range(norbits):
-            pot[i] = self._density(t, &q[i,0])
-
-        return np.array(pot)
+        out = self._output(out, (q.shape[0],))
+        self._evaluate(EVAL_DENSITY, q, out.reshape(-1,1), t=t, nthreads=nthreads)
+        return out
 
     cdef public inline double _density(self, double t, double *r) nogil:
         return self.c_density(t, self._parameters, r)
 
     # -------------------------------------------------------------
-    cpdef hessian(self, double[:,::1] w):
+    cpdef hessian(self, double[:,:] q, double t=0., int nthreads=1, out=None):
         """
+        hessian(q, t=0., nthreads=1, out=None)
+
         CAUTION: Interpretation of axes is different here! We need the
         arrays to be C ordered and easy to iterate over, so here the
-        axes are (norbits, ndim).
+        axes are (norbits, ndim). The output has shape (ndim, ndim, norbits).
         """
-        cdef int norbits, ndim, i
-        norbits = w.shape[0]
-        ndim = w.shape[1]
-
-        cdef double [:,:,::1] hess = np.zeros((norbits,ndim,ndim))
-        for i in range(norbits):
-            self._hessian(&w[i,0], &hess[i,0,0])
-
-        return np.array(hess) # TODO: this should be rollaxis
+        cdef int ndim = q.shape[1]
+        if self.c_hessian == NULL:
+            raise NotImplementedError("This potential has no Hessian function.")
+        out = self._output(out, (ndim,ndim,q.shape[0]))
+        self._evaluate(EVAL_HESSIAN, q, out.reshape(ndim*ndim,-1).T, t=t, nthreads=nthreads)
+        return out
 
-    cdef public void _hessian(self, double *w, double *hess) nogil:
-        cdef int i,j
-        for i in range(3):
-            for j in range(3):
-                hess[3*i+j] = 0.
+    cdef public inline void _hessian(self, double t, double *r, double *hess) nogil:
+        self.c_hessian(t, self._parameters, r, hess)
 
     # -------------------------------------------------------------
-    cpdef d_dr(self, double[:,::1] q, double G, double t=0.):
+    cpdef d_dr(self, double[:,:] q, double G, double t=0., int nthreads=1, out=None):
         """
+        d_dr(q, G, t=0., nthreads=1, out=None)
+
         CAUTION: Interpretation of axes is different here! We need the
         arrays to be C ordered and easy to iterate over, so here the
-        axes are (norbits, ndim).
+        axes are (norbits, ndim). The output has shape (norbits,).
         """
-        cdef int norbits, i
-        norbits = q.shape[0]
-
-        cdef double [::1] epsilon = np.zeros(3)
-        cdef double [::1] dr = np.zeros((norbits,))
-        for i in range(norbits):
-            dr[i] = self._d_dr(t, &q[i,0], &epsilon[0], G)
-        return np.array(dr)
+        out = self._output(out, (q.shape[0],))
+        self._evaluate(EVAL_D_DR, q, out.reshape(-1,1), t=t, G=G, nthreads=nthreads)
+        return out
 
     cdef public double _d_dr(self, double t, double *q, double *epsilon, double Gee) nogil:
         cdef double h, r, dPhi_dr
@@ -233,22 +388,17 @@ cdef class _CPotential:
 
         return dPhi_dr / (2.*h)
 
-    cpdef d2_dr2(self, double[:,::1] q, double G, double t=0.):
+    cpdef d2_dr2(self, double[:,:] q, double G, double t=0., int nthreads=1, out=None):
         """
-        d2_dr2(q, G, t=0.)
+        d2_dr2(q, G, t=0., nthreads=1, out=None)
 
         CAUTION: Interpretation of axes is different here! We need the
         arrays to be C ordered and easy to iterate over, so here the
-        axes are (norbits, ndim).
+        axes are (norbits, ndim). The output has shape (norbits,).
         """
-        cdef int norbits, i
-        norbits = q.shape[0]
-
-        cdef double [::1] epsilon = np.zeros(3)
-        cdef double [::1] dr = np.zeros((norbits,))
-        for i in range(norbits):
-            dr[i] = self._d2_dr2(t, &q[i,0], &epsilon[0], G)
-        return np.array(dr)
+        out = self._output(out, (q.shape[0],))
+        self._evaluate(EVAL_D2_DR2, q, out.reshape(-1,1), t=t, G=G, nthreads=nthreads)
+        return out
 
     cdef public double _d2_dr2(self, double t, double *q, double *epsilon, double Gee) nogil:
         cdef double h, r, d2Phi_dr2
@@ -271,15 +421,17 @@ cdef class _CPotential:
 
         return d2Phi_dr2 / (h*h)
 
-    cpdef mass_enclosed(self, double[:,::1] q, double G, double t=0.):
-        cdef int norbits, i
-        norbits = q.shape[0] # follows Cython axis convention
+    cpdef mass_enclosed(self, double[:,:] q, double G, double t=0., int nthreads=1, out=None):
+        """
+        mass_enclosed(q, G, t=0., nthreads=1, out=None)
 
-        cdef double [::1] epsilon = np.zeros(3)
-        cdef double [::1] mass = np.zeros((norbits,))
-        for i in range(norbits):
-            mass[i] = self._mass_enclosed(t, &q[i,0], &epsilon[0], G)
-        return np.array(mass)
+        CAUTION: Interpretation of axes is different here! We need the
+        arrays to be C ordered and easy to iterate over, so here the
+        axes are (norbits, ndim). The output has shape (norbits,).
+        """
+        out = self._output(out, (q.shape[0],))
+        self._evaluate(EVAL_MASS_ENCLOSED, q, out.reshape(-1,1), t=t, G=G, nthreads=nthreads)
+        return out
 
     cdef public double _mass_enclosed(self, double t, double *q, double *epsilon, double Gee) nogil:
         cdef double r, dPhi_dr
@@ -289,93 +441,722 @@ cdef class _CPotential:
 
 # ==============================================================================
 
-# class CCompositePotential(CompositePotential, CPotentialBase):
-#     """
+cdef class _CCompositePotential(_CPotential):
+    """
+    _CCompositePotential(cpotentials, ndim=3)
+
+    C-level composite of several ``_CPotential`` instances. The component
+    function pointers and parameter arrays are collected into a single
+    ``CompositeParameters`` struct, and a pointer to that struct is passed
+    around as the "parameters" of the composite. This means the composite
+    looks like any other ``_CPotential`` to the Cython integrators.
+
+    Parameters
+    ----------
+    cpotentials : iterable
+        An iterable of ``_CPotential`` instances.
+    ndim : int (optional)
+        Dimensionality of configuration space.
+    """
+    cdef CompositeParameters _composite
+    cdef list cpotentials # need to maintain references to the components
+
+    def __cinit__(self, cpotentials, int ndim=3):
+        cdef:
+            int i
+            int n = len(cpotentials)
+            _CPotential cp
+
+        self.cpotentials = list(cpotentials)
+        for cp in self.cpotentials:
+            if cp is None:
+                raise TypeError("All components must be _CPotential instances.")
+
+        self._composite.n = n
+        self._composite.ndim = ndim
+        self._composite.value = <valuefunc*>malloc(n*sizeof(valuefunc))
+        self._composite.gradient = <gradientfunc*>malloc(n*sizeof(gradientfunc))
+        self._composite.density = <densityfunc*>malloc(n*sizeof(densityfunc))
+        self._composite.hessian = <hessianfunc*>malloc(n*sizeof(hessianfunc))
+        self._composite.parameters = <double**>malloc(n*sizeof(double*))
+        if (self._composite.value == NULL or self._composite.gradient == NULL or
+                self._composite.density == NULL or self._composite.hessian == NULL or
+                self._composite.parameters == NULL):
+            raise MemoryError("Failed to allocate composite potential.")
+
+        for i in range(n):
+            cp = self.cpotentials[i]
+            self._composite.value[i] = cp.c_value
+            self._composite.gradient[i] = cp.c_gradient
+            self._composite.density[i] = cp.c_density
+            self._composite.hessian[i] = cp.c_hessian
+            self._composite.parameters[i] = cp._parameters
+
+        self._parameters = <double*>&(self._composite)
+        self.c_value = &composite_value
+        self.c_gradient = &composite_gradient
+        self.c_density = &composite_density
+
+        # the composite only has a Hessian if all of the components do
+        self.c_hessian = &composite_hessian
+        for cp in self.cpotentials:
+            if cp.c_hessian == NULL:
+                self.c_hessian = NULL
+                break
+
+    def __dealloc__(self):
+        free(self._composite.value)
+        free(self._composite.gradient)
+        free(self._composite.density)
+        free(self._composite.hessian)
+        free(self._composite.parameters)
 
-#     TODO!
+    def __reduce__(self):
+        return (self.__class__, (self.cpotentials, self._composite.ndim))
 
-#     A baseclass for representing gravitational potentials. You must specify
-#     a function that evaluates the potential value (func). You may also
-#     optionally add a function that computes derivatives (gradient), and a
-#     function to compute second derivatives (the Hessian) of the potential.
+class CCompositePotential(CompositePotential, CPotentialBase):
+    """
+    A composite potential in which all components are implemented in C,
+    i.e. are `~gary.potential.CPotentialBase` subclasses. The components
+    are summed at the C level, so orbit integration, mock stream generation,
+    and the fast Lyapunov exponent estimator all run at C speed.
 
-#     Parameters
-#     ----------
-#     TODO
-#     """
+    Created and modified just like `~gary.potential.CompositePotential`::
 
-#     def __init__(self, **kwargs):
-#         super(CCompositePotential, self).__init__(**kwargs)
+        >>> from gary.potential import HernquistPotential, MiyamotoNagaiPotential
+        >>> from gary.units import galactic
+        >>> cp = CCompositePotential()
+        >>> cp['bulge'] = HernquistPotential(m=3E10, c=0.7, units=galactic)
+        >>> cp['disk'] = MiyamotoNagaiPotential(m=1E11, a=6.5, b=0.27, units=galactic)
 
-#         self.c_instance = _CCompositePotential([v.c_instance for v in self.values()],
-#                                                n=len(self))  # number of components
+    """
+    def __init__(self, *args, **kwargs):
+        self._c_instance = None
+        self._ndim = None
+        super(CCompositePotential, self).__init__(*args, **kwargs)
+
+    def _check_component(self, p):
+        if not isinstance(p, CPotentialBase):
+            raise TypeError("Components of a CCompositePotential must be CPotentialBase "
+                            "subclasses, not {0}.".format(type(p)))
+        if self._ndim is None:
+            self._ndim = p.ndim
+        elif p.ndim != self._ndim:
+            raise ValueError("All components must have the same number of dimensions, "
+                             "not {0} and {1}.".format(self._ndim, p.ndim))
+        super(CCompositePotential, self)._check_component(p)
+
+    def __setitem__(self, key, value):
+        super(CCompositePotential, self).__setitem__(key, value)
+        self._c_instance = None
+
+    def __delitem__(self, key):
+        super(CCompositePotential, self).__delitem__(key)
+        self._c_instance = None
+
+    @property
+    def c_instance(self):
+        # rebuilt lazily because components can be added or removed at any time
+        if getattr(self, '_c_instance', None) is None:
+            self._c_instance = _CCompositePotential([p.c_instance for p in self.values()],
+                                                    ndim=self.ndim)
+        return self._c_instance
+
+    @property
+    def ndim(self):
+        if self._ndim is None:
+            return 3
+        return self._ndim
+
+    @property
+    def G(self):
+        if self.units is None:
+            return 1.
+        return G.decompose(self.units).value
 
-# from cpython cimport PyObject
-# cdef class _CCompositePotential: #(_CPotential):
+    # use the C implementation rather than summing over components in Python
+    def value(self, q, t=0., nthreads=1, out=None):
+        return CPotentialBase.value(self, q, t=t, nthreads=nthreads, out=out)
 
-#     def __init__(self, cobjs, n):
-#         """ Need a list of instances of _CPotential classes """
-#         cdef int i
+    def gradient(self, q, t=0., nthreads=1, out=None):
+        return CPotentialBase.gradient(self, q, t=t, nthreads=nthreads, out=out)
 
-#         self.n = n
-#         self.cpotentials = np.array(cobjs, dtype=_CPotential)
-#         self.pointers = np.zeros(self.n, dtype=np.int32)
-#         self.param_pointers = np.zeros(self.n, dtype=np.int32)
+    def density(self, q, t=0., nthreads=1, out=None):
+        return CPotentialBase.density(self, q, t=t, nthreads=nthreads, out=out)
 
-#         for i in range(n):
-#             self.pointers[i] = <intptr_t>&(self.cpotentials[i].c_value)
-#             self.param_pointers[i] = <intptr_t>&(self.cpotentials[i]._parameters[0])
+    def hessian(self, q, t=0., nthreads=1, out=None):
+        return CPotentialBase.hessian(self, q, t=t, nthreads=nthreads, out=out)
 
-#         self._pointers = &(self.pointers[0])
-#         self._param_pointers = &(self.pointers[0])
+# ==============================================================================
 
-#         composite_value
+def _natural_spline_y2(double[::1] t, double[:,::1] y):
+    """
+    Second derivatives of the natural cubic splines through each row of
+    ``y``, tabulated at the (increasing) times ``t``.
+    """
+    cdef:
+        int i, k
+        int n = t.shape[0]
+        double p, sig
+        double[:,::1] y2 = np.zeros((y.shape[0],n))
+        double[::1] u = np.zeros(n)
+
+    # tridiagonal solve, see Numerical Recipes 3.3
+    for i in range(y.shape[0]):
+        for k in range(1,n-1):
+            sig = (t[k] - t[k-1]) / (t[k+1] - t[k-1])
+            p = sig*y2[i,k-1] + 2.
+            y2[i,k] = (sig - 1.) / p
+            u[k] = ((y[i,k+1] - y[i,k]) / (t[k+1] - t[k]) -
+                    (y[i,k] - y[i,k-1]) / (t[k] - t[k-1]))
+            u[k] = (6.*u[k] / (t[k+1] - t[k-1]) - sig*u[k-1]) / p
+
+        y2[i,n-1] = 0.
+        for k in range(n-2,0,-1):
+            y2[i,k] = y2[i,k]*y2[i,k+1] + u[k]
+
+    return np.asarray(y2)
+
+cdef class _CTimeDependentPotential(_CPotential):
+    """
+    _CTimeDependentPotential(cpotential, t, parvecs)
+
+    C-level wrapper of a ``_CPotential`` with parameters that vary with time.
+    The parameter arrays of the wrapped potential, ``parvecs``, are tabulated
+    at the times ``t``, and those that vary are interpolated with a natural
+    cubic spline at the C level. A pointer to a ``TimeDependentParameters``
+    struct is passed around as the "parameters", like for the composite.
+
+    Parameters
+    ----------
+    cpotential : ``_CPotential``
+        The potential to wrap. Only its functions are used.
+    t : `numpy.ndarray`
+        The tabulated times, in increasing order.
+    parvecs : `numpy.ndarray`
+        The parameter arrays of the wrapped potential at each time. Should have
+        shape ``(len(t), npars)``.
+    """
+    cdef TimeDependentParameters _timedep
+    cdef _CPotential cpotential # need to maintain references to these arrays
+    cdef double[::1] _t
+    cdef double[:,::1] _y
+    cdef double[:,::1] _y2
+    cdef int[::1] _index
+
+    def __cinit__(self, _CPotential cpotential, t, parvecs):
+        parvecs = np.ascontiguousarray(np.atleast_2d(parvecs), dtype=np.float64)
+        t = np.ascontiguousarray(np.atleast_1d(t), dtype=np.float64)
+
+        if cpotential is None or cpotential._parvec is None:
+            raise TypeError("Can only wrap potentials with a parameter array.")
+
+        if parvecs.shape != (len(t), cpotential._parvec.shape[0]) or parvecs.shape[1] == 0:
+            raise ValueError("Parameter arrays must have shape (len(t), npars).")
+
+        if np.any(np.diff(t) <= 0):
+            raise ValueError("Times must be strictly increasing.")
+
+        index = np.where(np.any(parvecs != parvecs[0:1], axis=0))[0]
+
+        self.cpotential = cpotential
+        self._parvec = parvecs[0].copy()
+        self._t = t
+        self._index = index.astype(np.intc)
+        self._y = np.ascontiguousarray(parvecs[:,index].T)
+        self._y2 = _natural_spline_y2(self._t, self._y)
+
+        self._timedep.value = cpotential.c_value
+        self._timedep.gradient = cpotential.c_gradient
+        self._timedep.density = cpotential.c_density
+        self._timedep.hessian = cpotential.c_hessian
+        self._timedep.npars = self._parvec.shape[0]
+        self._timedep.parameters = &self._parvec[0]
+        self._timedep.nvary = index.shape[0]
+        self._timedep.ntimes = t.shape[0]
+        self._timedep.t = &self._t[0]
+        self._timedep.last = 0
+        if self._timedep.nvary > 0:
+            self._timedep.index = &self._index[0]
+            self._timedep.y = &self._y[0,0]
+            self._timedep.y2 = &self._y2[0,0]
+
+        self._parameters = <double*>&(self._timedep)
+        self.c_value = &timedependent_value
+        self.c_gradient = &timedependent_gradient
+        self.c_density = &timedependent_density
+        if cpotential.c_hessian != NULL:
+            self.c_hessian = &timedependent_hessian
 
-#     # def __setstate__(self, d):
-#     #     # for k,v in d.items():
-#     #     #     setattr(self, k, v)
-#     #     pass
+    def __reduce__(self):
+        parvecs = np.repeat(np.asarray(self._parvec)[None], self._t.shape[0], axis=0)
+        parvecs[:,np.asarray(self._index)] = np.asarray(self._y).T
+        return (self.__class__, (self.cpotential, np.asarray(self._t), parvecs))
 
-#     # def __getstate__(self):
-#     #     return None
+def _c_parvec(_CPotential cpotential):
+    if cpotential._parvec is None:
+        return None
+    return np.array(cpotential._parvec)
 
-#     cdef public double _value(self, double* q) nogil:
-#         # whoa this is some whack cython wizardry right here
-#         #   (stolen from stackoverflow)
-#         cdef int i
-#         cdef double v = 0.
-#         for i in range(self.n):
-#             v += (<valuefunc>(self._pointers[i]))(<double*>(self._param_pointers[i]), &q[0])
-#         return v
+class TimeDependentPotential(CPotentialBase):
+    """
+    TimeDependentPotential(potential_class, t, time_parameters, units=None, **parameters)
+
+    A potential implemented in C with parameters that vary with time, e.g.,
+    a growing disk or a halo that loses mass. An instance of
+    ``potential_class`` is created at each of the times ``t``, and the
+    C-level parameters that vary are interpolated between these times with
+    a natural cubic spline. Before the first or after the last time, the
+    first or last values are used. The interpolation is done in C, so
+    orbits can be integrated with the Cython integrators.
+
+    Parameters that are derived from the input parameters (e.g., a rotation
+    matrix from Euler angles) are interpolated element-wise, so the times
+    should sample any variation well.
+
+        >>> import numpy as np
+        >>> from gary.potential import MiyamotoNagaiPotential
+        >>> from gary.units import galactic
+        >>> t = np.linspace(0., 1000., 16)
+        >>> p = TimeDependentPotential(MiyamotoNagaiPotential, t=t,
+        ...                            time_parameters=dict(m=np.linspace(5E10, 1E11, 16)),
+        ...                            a=6.5, b=0.26, units=galactic)
+
+    Parameters
+    ----------
+    potential_class : class
+        A `~gary.potential.CPotentialBase` subclass.
+    t : array_like
+        Times at which the parameters are tabulated.
+    time_parameters : dict
+        The parameters that vary with time. Each value should be an array
+        with the same length as ``t``.
+    units : `~gary.units.UnitSystem` (optional)
+        Passed to ``potential_class``.
+    **parameters
+        Any other (constant) parameters passed to ``potential_class``.
+    """
+    def __init__(self, potential_class, t, time_parameters, units=None, **parameters):
+        if not issubclass(potential_class, CPotentialBase):
+            raise TypeError("Potential class must be a CPotentialBase subclass.")
+
+        if units is not None:
+            parameters['units'] = units
+
+        if hasattr(t, 'unit'):
+            t = t.decompose(units).value
+        t = np.atleast_1d(t).astype(np.float64)
+
+        for k,v in time_parameters.items():
+            if len(v) != len(t):
+                raise ValueError("Time-varying parameter '{0}' must have the same "
+                                 "length as the time array.".format(k))
+
+        # the C interpolation assumes the times are in increasing order
+        ix = np.argsort(t)
+        potentials = []
+        for i in ix:
+            pars = dict(parameters)
+            for k,v in time_parameters.items():
+                pars[k] = v[i]
+            potentials.append(potential_class(**pars))
+
+        parvecs = [_c_parvec(p.c_instance) for p in potentials]
+        if parvecs[0] is None:
+            raise TypeError("Potential class must have a single C parameter array, "
+                            "e.g. composite potentials are not supported.")
+
+        self.parameters = dict((k,v) for k,v in parameters.items() if k != 'units')
+        self.parameters.update(time_parameters)
+        self.parameters['t'] = t
+        super(TimeDependentPotential, self).__init__(units=potentials[0].units)
+        self.G = potentials[0].G
+        self.c_instance = _CTimeDependentPotential(potentials[0].c_instance, t[ix],
+                                                   np.array(parvecs))
 
-#     cpdef value(self, double[:,::1] q):
-#         cdef int norbits, ndim, k
-#         norbits = q.shape[0]
-#         ndim = q.shape[1]
+# ==============================================================================
 
-#         cdef double [::1] pot = np.zeros((norbits,))
-#         for k in range(norbits):
-#             pot[k] = self._value(&q[k,0])
+cdef double _nan_density(double t, double *pars, double *q) nogil:
+    return NAN
 
-#         return np.array(pot)
+cdef class _CFunctionPotential(_CPotential):
+    """
+    _CFunctionPotential(parameters, value, gradient, density=0, hessian=0, library=None, source=None)
+
+    A ``_CPotential`` that calls external, compiled C functions. The functions
+    are given by their addresses and must match the ``valuefunc``,
+    ``gradientfunc``, ``densityfunc``, and ``hessianfunc`` typedefs in
+    ``cpotential.pxd``. They are passed a pointer to a copy of the
+    ``parameters`` array.
+
+    Parameters
+    ----------
+    parameters : array_like
+        The parameter array passed to the functions.
+    value : int
+        Address of the value function.
+    gradient : int
+        Address of the gradient function.
+    density : int (optional)
+        Address of the density function. If 0, the density is NaN.
+    hessian : int (optional)
+        Address of the Hessian function. If 0, the potential has no Hessian.
+    library : object (optional)
+        Any object that has to stay alive for the functions to remain valid,
+        e.g. the ``ctypes.CDLL`` they were loaded from.
+    source : str (optional)
+        The C source generated by ``from_equation()`` that the functions were
+        compiled from. The function addresses are only valid in the current
+        process, so only instances with a source can be pickled: they are
+        unpickled by loading the library again (compiling it if it's not in
+        the cache).
+    """
+    cdef object library
+    cdef object source
+
+    def __cinit__(self, parameters, size_t value, size_t gradient,
+                  size_t density=0, size_t hessian=0, library=None, source=None):
+        if value == 0 or gradient == 0:
+            raise ValueError("The value and gradient functions are required.")
+
+        self._parvec = np.array(parameters, dtype=np.float64).reshape(-1)
+        if self._parvec.shape[0] == 0:
+            self._parvec = np.zeros(1)
+        self._parameters = &(self._parvec)[0]
+
+        self.library = library
+        self.source = source
+        self.c_value = <valuefunc><void*>value
+        self.c_gradient = <gradientfunc><void*>gradient
+        if density == 0:
+            self.c_density = &_nan_density
+        else:
+            self.c_density = <densityfunc><void*>density
+        if hessian != 0:
+            self.c_hessian = <hessianfunc><void*>hessian
 
-#     # cdef public void _gradient(self, double *r, double *grad) nogil:
-#     #     # whoa this is some whack cython wizardry right here
-#     #     #   (stolen from stackoverflow)
-#     #     cdef double v = 0.
+    def __reduce__(self):
+        if self.source is None:
+            raise TypeError("Potentials implemented by external C functions can't be "
+                            "pickled: the function addresses are only valid in the "
+                            "current process.")
 
-#     #     for i in range(self.ninstances):
-#     #         (<_CPotential>(self.obj_list[i]))._gradient(r, grad)
+        from .util import _c_function_potential
+        return (_c_function_potential, (self.source, np.asarray(self._parvec)))
 
-#     # cdef public void _hessian(self, double *w, double *hess) nogil:
-#     #     # whoa this is some whack cython wizardry right here
-#     #     #   (stolen from stackoverflow)
-#     #     for i in range(self.ninstances):
-#     #         (<_CPotential>(self.obj_list[i]))._hessian(w, hess)
+def _function_address(func):
+    """
+    The address of a compiled function, given as an integer, a `ctypes`
+    function, or a ``cffi`` function pointer. Returns 0 for `None`.
+    """
+    if func is None:
+        return 0
 
-#     # cdef public double _mass_enclosed(self, double *q, double *epsilon, double Gee) nogil:
-#     #     cdef double mm = 0.
-#     #     for i in range(self.ninstances):
-#     #         mm += (<_CPotential>(self.obj_list[i]))._mass_enclosed(q, epsilon, Gee)
-#     #     return mm
+    if isinstance(func, numbers.Integral):
+        return func
 
+    if isinstance(func, ctypes._CFuncPtr):
+        return ctypes.cast(func, ctypes.c_void_p).value
+
+    try:
+        import cffi
+        return int(cffi.FFI().cast("uintptr_t", func))
+    except (ImportError, TypeError):
+        pass
+
+    raise TypeError("Can't get the address of a function from {0}. Functions must be "
+                    "given as an address, a ctypes function, or a cffi function "
+                    "pointer.".format(type(func)))
+
+class CustomCPotential(CPotentialBase):
+    """
+    CustomCPotential(value, gradient, parameters=(), density=None, hessian=None, units=None)
+
+    A potential implemented by external, compiled C functions, e.g. loaded
+    from a shared library with `ctypes` or ``cffi``. The functions are called
+    directly from C, so orbit integration, mock stream generation, and the
+    fast Lyapunov exponent estimator run at C speed.
+
+    The functions must have the signatures of the typedefs in
+    ``cpotential.pxd``::
+
+        double value(double t, double *pars, double *q);
+        void gradient(double t, double *pars, double *q, double *grad);
+        double density(double t, double *pars, double *q);
+        void hessian(double t, double *pars, double *q, double *hess);
+
+    where ``pars`` points to (a copy of) the parameter array. The functions
+    may be called concurrently from several threads, so must be re-entrant.
+
+        >>> import ctypes
+        >>> lib = ctypes.CDLL("libmypotential.so") # doctest: +SKIP
+        >>> p = CustomCPotential(lib.my_value, lib.my_gradient,
+        ...                      parameters=[1E10, 0.5], units=galactic) # doctest: +SKIP
+
+    Parameters
+    ----------
+    value : int, `ctypes` function, ``cffi`` function pointer
+        The value function, or its address.
+    gradient : int, `ctypes` function, ``cffi`` function pointer
+        The gradient function, or its address.
+    parameters : array_like, dict (optional)
+        The parameter array passed to the functions. If a dictionary, the
+        values are passed in order.
+    density : int, `ctypes` function, ``cffi`` function pointer (optional)
+        The density function, or its address. If not specified, the
+        density is NaN.
+    hessian : int, `ctypes` function, ``cffi`` function pointer (optional)
+        The Hessian function, or its address. If not specified, the
+        potential has no Hessian.
+    units : `~gary.units.UnitSystem` (optional)
+        The unit system of the parameters and the functions.
+    """
+    def __init__(self, value, gradient, parameters=(), density=None, hessian=None,
+                 units=None):
+        if hasattr(parameters, 'keys'):
+            self.parameters = OrderedDict(parameters)
+        else:
+            self.parameters = OrderedDict([('p{0}'.format(i),v)
+                                           for i,v in enumerate(parameters)])
+        super(CustomCPotential, self).__init__(units=units)
+
+        if self.units is None:
+            self.G = 1.
+        else:
+            self.G = G.decompose(self.units).value
+
+        # keep references to the functions (and so the libraries they are from)
+        funcs = (value, gradient, density, hessian)
+        self.c_instance = _CFunctionPotential(list(self.parameters.values()),
+                                              value=_function_address(value),
+                                              gradient=_function_address(gradient),
+                                              density=_function_address(density),
+                                              hessian=_function_address(hessian),
+                                              library=funcs)
+
+# ==============================================================================
+
+cdef class _CInterpolatedPotential(_CPotential):
+    """
+    _CInterpolatedPotential(spherical, grid_min, grid_delta, values)
+
+    C-level potential interpolated from the value and gradient tabulated on a
+    regular grid. A pointer to an ``InterpolatedParameters`` struct is passed
+    around as the "parameters", like for the composite.
+
+    Parameters
+    ----------
+    spherical : int
+        0 for a Cartesian grid in ``(x, y, z)``, or 1 for a spherical grid in
+        ``(ln r, theta, phi)``. The ``phi`` axis is periodic, so the grid
+        should not include ``phi = 2 pi``.
+    grid_min : array_like
+        The first grid point along each axis.
+    grid_delta : array_like
+        The grid spacing along each axis.
+    values : `numpy.ndarray`
+        The value and the Cartesian components of the gradient at each grid
+        point. Should have shape ``(n0, n1, n2, 4)``.
+    """
+    cdef InterpolatedParameters _interp
+    cdef double[:,:,:,::1] _values
+
+    def __cinit__(self, int spherical, grid_min, grid_delta, values):
+        cdef int k
+
+        self._values = np.ascontiguousarray(values, dtype=np.float64)
+        if self._values.shape[3] != 4:
+            raise ValueError("Tabulated values must have shape (n0, n1, n2, 4).")
+
+        self._interp.spherical = spherical
+        for k in range(3):
+            self._interp.n[k] = self._values.shape[k]
+            self._interp.min[k] = grid_min[k]
+            self._interp.delta[k] = grid_delta[k]
+        self._interp.values = &self._values[0,0,0,0]
+
+        self._parameters = <double*>&(self._interp)
+        self.c_value = &interpolated_value
+        self.c_gradient = &interpolated_gradient
+        self.c_density = &_nan_density
+
+    def __reduce__(self):
+        return (self.__class__, (self._interp.spherical,
+                                 [self._interp.min[k] for k in range(3)],
+                                 [self._interp.delta[k] for k in range(3)],
+                                 np.asarray(self._values)))
+
+def _cache_key(potential):
+    """
+    A representation of a potential used to identify cached tabulations:
+    the class and parameters of the potential (or its components), and the
+    C parameter array if there is one.
+    """
+    if isinstance(potential, CompositePotential):
+        return [(k, _cache_key(v)) for k,v in potential.items()]
+
+    key = [potential.__class__.__name__]
+    for k in sorted(potential.parameters.keys()):
+        key.append((k, np.asarray(potential.parameters[k]).tolist()))
+
+    if isinstance(potential, CPotentialBase):
+        parvec = _c_parvec(potential.c_instance)
+        if parvec is not None:
+            key.append(parvec.tolist())
+
+    return key
+
+class InterpolatedPotential(CPotentialBase):
+    r"""
+    InterpolatedPotential(potential, grid='spherical', limits=None, shape=None, t=0., cache_dir=None, nthreads=1)
+
+    A fast surrogate for an expensive potential (e.g., a composite, a rotated
+    triaxial potential, or a potential implemented in Python). The value and
+    gradient of the potential are tabulated once on a regular grid and then
+    evaluated in C with cubic convolution interpolation, so orbits can be
+    integrated with the Cython integrators. The accuracy is set by the grid
+    resolution, and can be checked with `relative_error`.
+
+    On a ``'spherical'`` grid, the potential is tabulated in
+    :math:`(\ln r, \theta, \phi)`. Inside of the inner radius the values at
+    the inner radius are used, and outside of the outer radius the potential
+    is extrapolated as a point mass. On a ``'cartesian'`` grid, the values at
+    the closest point on the boundary are used outside of the grid, so the
+    grid should cover the region of interest.
+
+    The interpolation assumes the potential is smooth on the scale of the grid
+    spacing, so features that are smaller (e.g., the vertical structure of a
+    thin disk, or the central cusp of an NFW halo on a Cartesian grid) are
+    smoothed out and the gradient can be off by several percent near them.
+
+    The tabulation can be cached on disk, keyed by the class and parameters
+    of the potential (or its components), the unit system, and the grid.
+
+    Parameters
+    ----------
+    potential : `~gary.potential.PotentialBase`
+        The (3D) potential to tabulate.
+    grid : str (optional)
+        Either ``'spherical'`` or ``'cartesian'``.
+    limits : iterable (optional)
+        For a spherical grid, the inner and outer radius, ``(r_min, r_max)``
+        (default: ``(1E-2, 1E3)``). For a Cartesian grid, either a single
+        ``(min, max)`` used for all axes, or one for each axis (required).
+    shape : tuple (optional)
+        Number of grid points along each axis. Defaults to ``(128, 33, 64)``
+        for a spherical grid, and ``(64, 64, 64)`` for a Cartesian grid.
+    t : numeric (optional)
+        The time at which to tabulate the potential.
+    cache_dir : str (optional)
+        If specified, tabulations are saved to (and loaded from) this directory.
+    nthreads : int (optional)
+        Number of threads used to evaluate C potentials for the tabulation.
+    """
+    def __init__(self, potential, grid='spherical', limits=None, shape=None, t=0.,
+                 cache_dir=None, nthreads=1):
+        if not isinstance(potential, PotentialBase):
+            raise TypeError("Input potential must be a PotentialBase subclass.")
+
+        if grid == 'spherical':
+            if limits is None:
+                limits = (1E-2, 1E3)
+            if shape is None:
+                shape = (128, 33, 64)
+
+            limits = np.array([np.log(limits), [0., np.pi], [0., 2*np.pi]])
+            if not np.all(np.isfinite(limits[0])):
+                raise ValueError("Radial limits must be positive.")
+
+        elif grid == 'cartesian':
+            if limits is None:
+                raise ValueError("Limits must be specified for a Cartesian grid.")
+            if shape is None:
+                shape = (64, 64, 64)
+
+            limits = np.array(limits, dtype=np.float64) * np.ones((3,2))
+
+        else:
+            raise ValueError("Grid must be 'spherical' or 'cartesian', not '{0}'."
+                             .format(grid))
+
+        shape = tuple(int(n) for n in shape)
+        if len(shape) != 3 or min(shape) < 2:
+            raise ValueError("Grid must have at least 2 points along each of the 3 axes.")
+
+        self.parameters = dict(grid=grid, limits=limits, shape=shape, t=t)
+        super(InterpolatedPotential, self).__init__(units=potential.units)
+        if self.units is None:
+            self.G = 1.
+        else:
+            self.G = G.decompose(self.units).value
+
+        # the phi axis is periodic, so doesn't include 2 pi
+        axes = [np.linspace(lo, hi, n, endpoint=(grid == 'cartesian' or k < 2))
+                for k,((lo,hi),n) in enumerate(zip(limits, shape))]
+        grid_min = [x[0] for x in axes]
+        grid_delta = [x[1] - x[0] for x in axes]
+
+        values = None
+        if cache_dir is not None:
+            key = repr([_cache_key(potential), str(self.units), grid,
+                        limits.tolist(), shape, float(t)])
+            cache_file = os.path.join(cache_dir, "interpolated_{0}.npy".format(
+                hashlib.sha1(key.encode('utf-8')).hexdigest()))
+            if os.path.exists(cache_file):
+                values = np.load(cache_file)
+
+        if values is None:
+            X = np.meshgrid(*axes, indexing='ij')
+            if grid == 'spherical':
+                r = np.exp(X[0])
+                X = [r*np.sin(X[1])*np.cos(X[2]),
+                     r*np.sin(X[1])*np.sin(X[2]),
+                     r*np.cos(X[1])]
+            q = np.vstack([x.ravel() for x in X])
+
+            values = np.empty(shape + (4,))
+            values[...,0] = potential.value(q, t=t, nthreads=nthreads).reshape(shape)
+            values[...,1:] = np.rollaxis(potential.gradient(q, t=t, nthreads=nthreads)
+                                         .reshape((3,) + shape), 0, 4)
+
+            if cache_dir is not None:
+                if not os.path.exists(cache_dir):
+                    try:
+                        os.makedirs(cache_dir)
+                    except OSError: # created in the meantime
+                        pass
+
+                # atomic, so a tabulation in the cache is always complete
+                fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".npy.tmp")
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        np.save(f, values)
+                    os.rename(tmp_file, cache_file)
+                finally:
+                    if os.path.exists(tmp_file):
+                        os.remove(tmp_file)
+
+        self.potential = potential
+        self.c_instance = _CInterpolatedPotential(int(grid == 'spherical'),
+                                                  grid_min, grid_delta, values)
+
+    def relative_error(self, q, t=None):
+        """
+        relative_error(q, t=None)
+
+        The maximum relative error of the interpolated gradient with respect to
+        the original potential at the given positions.
+
+        Parameters
+        ----------
+        q : array_like
+            Positions at which to compare the gradients.
+        t : numeric (optional)
+            The time at which to evaluate the original potential. Defaults to the
+            time of the tabulation.
+        """
+        if t is None:
+            t = self.parameters['t']
+        grad = self.potential.gradient(q, t=t)
+        dgrad = self.gradient(q) - grad
+        return np.max(np.sqrt(np.sum(dgrad**2, axis=0) / np.sum(grad**2, axis=0)))
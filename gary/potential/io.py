@@ -72,9 +72,9 @@ def from_dict(d, module=None):
     else:
         potential = module
 
-    if isinstance(class_name, dict):  # CompositePotential
-        p = potential.CompositePotential()
-        composite = class_name.values()[0]
+    if isinstance(class_name, dict):  # CompositePotential or CCompositePotential
+        composite_name, composite = class_name.items()[0]
+        p = getattr(potential, composite_name)()
         for k,potential_name in composite.items():
             p[k] = getattr(potential, potential_name)(units=unitsys, **params[k])
         return p
@@ -96,8 +96,9 @@ def to_dict(potential):
     """
     d = dict()
 
-    if potential.__class__.__name__ == 'CompositePotential':
-        d['class'] = dict(CompositePotential=dict([(k,p.__class__.__name__) for k,p in potential.items()]))
+    composite_name = potential.__class__.__name__
+    if composite_name in ['CompositePotential', 'CCompositePotential']:
+        d['class'] = {composite_name: dict([(k,p.__class__.__name__) for k,p in potential.items()])}
     else:
         d['class'] = potential.__class__.__name__
 
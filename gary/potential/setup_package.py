@@ -23,6 +23,7 @@ def get_extensions():
     cfg['include_dirs'].append(mac_incl_path)
     cfg['extra_compile_args'].append('--std=gnu99')
     cfg['sources'].append('gary/potential/cpotential.pyx')
+    cfg['sources'].append('gary/potential/src/_cpotential.c')
     exts.append(Extension('gary.potential.cpotential', **cfg))
 
     cfg = setup_helpers.DistutilsExtensionArgs()
@@ -36,4 +37,5 @@ def get_extensions():
     return exts
 
 def get_package_data():
-    return {'gary.potential': ['*.pxd', 'builtin/src/*.c', 'builtin/src/*.h', 'tests/*.yml']}
+    return {'gary.potential': ['*.pxd', 'src/*.c', 'src/*.h',
+                               'builtin/src/*.c', 'builtin/src/*.h', 'tests/*.yml']}
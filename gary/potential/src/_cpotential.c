@@ -0,0 +1,283 @@
+#include <math.h>
+#include "_cpotential.h"
+
+/* ---------------------------------------------------------------------------
+    Composite potential -- sums over the component potentials
+*/
+double composite_value(double t, double *pars, double *q) {
+    /*  pars:
+            - pointer to a CompositeParameters struct
+    */
+    CompositeParameters *cp = (CompositeParameters *) pars;
+    double v = 0.;
+    int i;
+
+    for (i=0; i < cp->n; i++) {
+        v += (cp->value[i])(t, cp->parameters[i], q);
+    }
+    return v;
+}
+
+void composite_gradient(double t, double *pars, double *q, double *grad) {
+    /*  pars:
+            - pointer to a CompositeParameters struct
+    */
+    CompositeParameters *cp = (CompositeParameters *) pars;
+    double tmp_grad[cp->ndim];
+    int i, k;
+
+    for (k=0; k < cp->ndim; k++) grad[k] = 0.;
+
+    for (i=0; i < cp->n; i++) {
+        (cp->gradient[i])(t, cp->parameters[i], q, &tmp_grad[0]);
+        for (k=0; k < cp->ndim; k++) grad[k] += tmp_grad[k];
+    }
+}
+
+double composite_density(double t, double *pars, double *q) {
+    /*  pars:
+            - pointer to a CompositeParameters struct
+    */
+    CompositeParameters *cp = (CompositeParameters *) pars;
+    double v = 0.;
+    int i;
+
+    for (i=0; i < cp->n; i++) {
+        v += (cp->density[i])(t, cp->parameters[i], q);
+    }
+    return v;
+}
+
+void composite_hessian(double t, double *pars, double *q, double *hess) {
+    /*  pars:
+            - pointer to a CompositeParameters struct
+    */
+    CompositeParameters *cp = (CompositeParameters *) pars;
+    int ndim2 = cp->ndim * cp->ndim;
+    double tmp_hess[ndim2];
+    int i, k;
+
+    for (k=0; k < ndim2; k++) hess[k] = 0.;
+
+    for (i=0; i < cp->n; i++) {
+        (cp->hessian[i])(t, cp->parameters[i], q, &tmp_hess[0]);
+        for (k=0; k < ndim2; k++) hess[k] += tmp_hess[k];
+    }
+}
+
+/* ---------------------------------------------------------------------------
+    Time-dependent potential -- interpolates the parameters of the wrapped
+    potential in time
+*/
+static int timedependent_interval(TimeDependentParameters *tp, double t) {
+    /*  Find k such that t[k] <= t < t[k+1], assuming t[0] < t < t[ntimes-1].
+        Integrations usually ask for times in the same or the next interval
+        as the last call, so check those before bisecting. The cached
+        interval is only a hint, so concurrent calls can't give wrong
+        results.
+    */
+    int lo = tp->last, hi, mid;
+
+    if (lo >= 0 && lo < tp->ntimes-1) {
+        if (tp->t[lo] <= t && t < tp->t[lo+1]) return lo;
+        if (lo < tp->ntimes-2 && tp->t[lo+1] <= t && t < tp->t[lo+2]) {
+            tp->last = lo+1;
+            return lo+1;
+        }
+    }
+
+    lo = 0;
+    hi = tp->ntimes-1;
+    while (hi - lo > 1) {
+        mid = (lo + hi) / 2;
+        if (tp->t[mid] <= t) lo = mid;
+        else hi = mid;
+    }
+    tp->last = lo;
+    return lo;
+}
+
+void timedependent_parameters(double t, TimeDependentParameters *tp, double *pars) {
+    /*  Fill pars with the parameters of the wrapped potential at time t.
+        Outside of the tabulated times, the first or last values are used.
+    */
+    int i, k, n = tp->ntimes;
+    double h, a, b, *y, *y2;
+
+    for (i=0; i < tp->npars; i++) pars[i] = tp->parameters[i];
+
+    if (t <= tp->t[0]) {
+        for (i=0; i < tp->nvary; i++) pars[tp->index[i]] = tp->y[i*n];
+        return;
+    }
+
+    if (t >= tp->t[n-1]) {
+        for (i=0; i < tp->nvary; i++) pars[tp->index[i]] = tp->y[i*n + n-1];
+        return;
+    }
+
+    k = timedependent_interval(tp, t);
+    h = tp->t[k+1] - tp->t[k];
+    a = (tp->t[k+1] - t) / h;
+    b = 1. - a;
+
+    for (i=0; i < tp->nvary; i++) {
+        y = &tp->y[i*n];
+        y2 = &tp->y2[i*n];
+        pars[tp->index[i]] = a*y[k] + b*y[k+1] +
+            ((a*a*a - a)*y2[k] + (b*b*b - b)*y2[k+1]) * h*h / 6.;
+    }
+}
+
+double timedependent_value(double t, double *pars, double *q) {
+    /*  pars:
+            - pointer to a TimeDependentParameters struct
+    */
+    TimeDependentParameters *tp = (TimeDependentParameters *) pars;
+    double p[tp->npars];
+
+    timedependent_parameters(t, tp, &p[0]);
+    return (tp->value)(t, &p[0], q);
+}
+
+void timedependent_gradient(double t, double *pars, double *q, double *grad) {
+    /*  pars:
+            - pointer to a TimeDependentParameters struct
+    */
+    TimeDependentParameters *tp = (TimeDependentParameters *) pars;
+    double p[tp->npars];
+
+    timedependent_parameters(t, tp, &p[0]);
+    (tp->gradient)(t, &p[0], q, grad);
+}
+
+double timedependent_density(double t, double *pars, double *q) {
+    /*  pars:
+            - pointer to a TimeDependentParameters struct
+    */
+    TimeDependentParameters *tp = (TimeDependentParameters *) pars;
+    double p[tp->npars];
+
+    timedependent_parameters(t, tp, &p[0]);
+    return (tp->density)(t, &p[0], q);
+}
+
+void timedependent_hessian(double t, double *pars, double *q, double *hess) {
+    /*  pars:
+            - pointer to a TimeDependentParameters struct
+    */
+    TimeDependentParameters *tp = (TimeDependentParameters *) pars;
+    double p[tp->npars];
+
+    timedependent_parameters(t, tp, &p[0]);
+    (tp->hessian)(t, &p[0], q, hess);
+}
+
+/* ---------------------------------------------------------------------------
+    Interpolated potential -- cubic convolution interpolation of the value
+    and gradient tabulated on a regular grid
+*/
+static void interpolated_weights(InterpolatedParameters *ip, int axis, double x,
+                                 int periodic, int *ix, double *w) {
+    /*  Fill the 4 grid indices around the coordinate x along the given axis,
+        and the corresponding weights of the Keys (a = -1/2) cubic
+        convolution kernel. Indices are wrapped for periodic axes, otherwise
+        x and the indices are clamped to the grid.
+    */
+    int n = ip->n[axis];
+    int i, k;
+    double s;
+
+    s = (x - ip->min[axis]) / ip->delta[axis];
+    if (!periodic) {
+        if (s < 0.) s = 0.;
+        if (s > n-1) s = n-1;
+    }
+    i = (int) floor(s);
+    s = s - i;
+
+    w[0] = ((-0.5*s + 1.)*s - 0.5)*s;
+    w[1] = (1.5*s - 2.5)*s*s + 1.;
+    w[2] = ((-1.5*s + 2.)*s + 0.5)*s;
+    w[3] = (0.5*s - 0.5)*s*s;
+
+    for (k=0; k<4; k++) {
+        ix[k] = i + k - 1;
+        if (periodic) {
+            ix[k] = ix[k] % n;
+            if (ix[k] < 0) ix[k] += n;
+        } else {
+            if (ix[k] < 0) ix[k] = 0;
+            if (ix[k] > n-1) ix[k] = n-1;
+        }
+    }
+}
+
+void interpolated_evaluate(double *pars, double *q, double *out) {
+    /*  pars:
+            - pointer to an InterpolatedParameters struct
+
+        Fills out with the value and the 3 components of the gradient at q.
+        Outside of a Cartesian grid, the values at the closest point on the
+        boundary are used. Inside the inner radius of a spherical grid, the
+        values at the inner radius are used, and outside of the outer radius
+        the potential is extrapolated as a point mass.
+    */
+    InterpolatedParameters *ip = (InterpolatedParameters *) pars;
+    double x[3], w[3][4], r = 0., r_max = 0., fac, wijk;
+    int ix[3][4], i, j, k, m, a;
+    double *v;
+
+    if (ip->spherical) {
+        r = sqrt(q[0]*q[0] + q[1]*q[1] + q[2]*q[2]);
+        r_max = exp(ip->min[0] + (ip->n[0]-1)*ip->delta[0]);
+        x[0] = log(r);
+        x[1] = (r > 0.) ? acos(q[2] / r) : 0.;
+        x[2] = atan2(q[1], q[0]);
+        if (x[2] < 0.) x[2] += 2*M_PI;
+    } else {
+        for (a=0; a<3; a++) x[a] = q[a];
+    }
+
+    for (a=0; a<3; a++) {
+        interpolated_weights(ip, a, x[a], ip->spherical && a == 2, &ix[a][0], &w[a][0]);
+    }
+
+    for (m=0; m<4; m++) out[m] = 0.;
+
+    for (i=0; i<4; i++) {
+        for (j=0; j<4; j++) {
+            for (k=0; k<4; k++) {
+                wijk = w[0][i] * w[1][j] * w[2][k];
+                v = &ip->values[4*((ix[0][i]*ip->n[1] + ix[1][j])*ip->n[2] + ix[2][k])];
+                for (m=0; m<4; m++) out[m] += wijk * v[m];
+            }
+        }
+    }
+
+    if (ip->spherical && r > r_max) {
+        /* point mass: Phi ~ 1/r, grad Phi ~ -Phi r_hat / r */
+        out[0] *= r_max / r;
+        fac = -out[0] / (r*r);
+        for (a=0; a<3; a++) out[a+1] = fac * q[a];
+    }
+}
+
+double interpolated_value(double t, double *pars, double *q) {
+    /*  pars:
+            - pointer to an InterpolatedParameters struct
+    */
+    double out[4];
+    interpolated_evaluate(pars, q, &out[0]);
+    return out[0];
+}
+
+void interpolated_gradient(double t, double *pars, double *q, double *grad) {
+    /*  pars:
+            - pointer to an InterpolatedParameters struct
+    */
+    double out[4];
+    int k;
+    interpolated_evaluate(pars, q, &out[0]);
+    for (k=0; k<3; k++) grad[k] = out[k+1];
+}
@@ -0,0 +1,73 @@
+typedef double (*valuefunc)(double t, double *pars, double *q);
+typedef double (*densityfunc)(double t, double *pars, double *q);
+typedef void (*gradientfunc)(double t, double *pars, double *q, double *grad);
+typedef void (*hessianfunc)(double t, double *pars, double *q, double *hess);
+
+/*
+    The composite potential "parameters" are not an array of doubles: the
+    pointer passed to the composite functions actually points to one of these
+    structs, so a composite has the same signature as any built-in potential
+    and can be handed to the C integrators.
+*/
+typedef struct {
+    int n;                      /* number of components */
+    int ndim;                   /* dimensionality of configuration space */
+    valuefunc *value;           /* array of component value functions */
+    gradientfunc *gradient;     /* array of component gradient functions */
+    densityfunc *density;       /* array of component density functions */
+    hessianfunc *hessian;       /* array of component Hessian functions */
+    double **parameters;        /* array of component parameter arrays */
+} CompositeParameters;
+
+extern double composite_value(double t, double *pars, double *q);
+extern void composite_gradient(double t, double *pars, double *q, double *grad);
+extern double composite_density(double t, double *pars, double *q);
+extern void composite_hessian(double t, double *pars, double *q, double *hess);
+
+/*
+    Time-dependent potential: wraps another potential whose parameters are
+    tabulated at a set of times. The parameters that vary are interpolated
+    with a natural cubic spline at the requested time before calling the
+    wrapped functions. As for the composite, the "parameters" pointer
+    actually points to one of these structs.
+*/
+typedef struct {
+    valuefunc value;            /* wrapped value function */
+    gradientfunc gradient;      /* wrapped gradient function */
+    densityfunc density;        /* wrapped density function */
+    hessianfunc hessian;        /* wrapped Hessian function */
+    int npars;                  /* number of parameters of the wrapped potential */
+    double *parameters;         /* parameter values, used for those that don't vary */
+    int nvary;                  /* number of parameters that vary with time */
+    int *index;                 /* indices of the parameters that vary */
+    int ntimes;                 /* number of tabulated times */
+    double *t;                  /* tabulated times, in increasing order */
+    double *y;                  /* tabulated parameter values, shape (nvary, ntimes) */
+    double *y2;                 /* spline second derivatives, shape (nvary, ntimes) */
+    int last;                   /* interval found by the last lookup */
+} TimeDependentParameters;
+
+extern void timedependent_parameters(double t, TimeDependentParameters *tp, double *pars);
+extern double timedependent_value(double t, double *pars, double *q);
+extern void timedependent_gradient(double t, double *pars, double *q, double *grad);
+extern double timedependent_density(double t, double *pars, double *q);
+extern void timedependent_hessian(double t, double *pars, double *q, double *hess);
+
+/*
+    Interpolated potential: the value and gradient of a potential tabulated
+    on a regular grid, either Cartesian (x, y, z) or spherical (ln r, theta,
+    phi), and evaluated with separable cubic convolution interpolation. As
+    for the composite, the "parameters" pointer actually points to one of
+    these structs.
+*/
+typedef struct {
+    int spherical;              /* 0 for a Cartesian grid, 1 for a spherical grid */
+    int n[3];                   /* number of grid points along each axis */
+    double min[3];              /* first grid point along each axis */
+    double delta[3];            /* grid spacing along each axis */
+    double *values;             /* shape (n[0], n[1], n[2], 4): value and gradient */
+} InterpolatedParameters;
+
+extern void interpolated_evaluate(double *pars, double *q, double *out);
+extern double interpolated_value(double t, double *pars, double *q);
+extern void interpolated_gradient(double t, double *pars, double *q, double *grad);
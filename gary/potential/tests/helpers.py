@@ -64,9 +64,55 @@ class PotentialTestBase(object):
             g = self.potential.gradient(arr[:self.ndim])
             assert g.shape == shp
 
-    @pytest.mark.skipif(True, reason="not implemented")
+    def test_nthreads_out(self):
+        q = np.random.uniform(-10., 10., size=(self.ndim//2,32,8))
+
+        v = self.potential.value(q)
+        assert np.allclose(self.potential.value(q, nthreads=3), v)
+        out = np.zeros(v.shape)
+        res = self.potential.value(q, nthreads=3, out=out)
+        assert res is out
+        assert np.allclose(out, v)
+
+        g = self.potential.gradient(q)
+        assert np.allclose(self.potential.gradient(q, nthreads=3), g)
+        out = np.zeros(g.shape)
+        res = self.potential.gradient(q, nthreads=3, out=out)
+        assert res is out
+        assert np.allclose(out, g)
+
+        with pytest.raises(ValueError):
+            self.potential.value(q, out=np.zeros(v.shape[::-1]))
+
+        with pytest.raises(ValueError):
+            self.potential.gradient(q, out=np.zeros(g.shape[::-1]).T)
+
     def test_hessian(self):
-        pass
+        ndim = self.ndim//2
+        q = np.random.RandomState(42).uniform(1., 10., size=(ndim,16))
+
+        try:
+            hess = self.potential.hessian(q)
+        except NotImplementedError:
+            pytest.skip("No Hessian function for this potential.")
+
+        assert hess.shape == (ndim,ndim,16)
+        assert self.potential.hessian(q[:,0]).shape == (ndim,ndim,1)
+        assert self.potential.hessian(q.reshape(ndim,4,4)).shape == (ndim,ndim,4,4)
+        assert np.allclose(hess, np.swapaxes(hess, 0, 1))
+
+        # compare to finite differences of the gradient
+        h = 1E-4
+        for i in range(ndim):
+            dq = np.zeros((ndim,1))
+            dq[i] = h
+            dgrad = (self.potential.gradient(q + dq) - self.potential.gradient(q - dq)) / (2*h)
+            assert np.allclose(hess[:,i], dgrad, rtol=1E-5, atol=1E-8*np.abs(hess).max())
+
+        out = np.zeros(hess.shape)
+        res = self.potential.hessian(q, nthreads=3, out=out)
+        assert res is out
+        assert np.allclose(out, hess)
 
     def test_mass_enclosed(self):
         if self.potential.units is None:
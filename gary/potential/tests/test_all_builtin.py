@@ -14,6 +14,7 @@ import pytest
 
 # This project
 from ..core import CompositePotential
+from ..cpotential import CCompositePotential
 from ..builtin import *
 from ...units import solarsystem, galactic
 from .helpers import PotentialTestBase
@@ -36,7 +37,7 @@ class TestHarmonicOscillator1D(PotentialTestBase):
 
 class TestHenonHeiles(PotentialTestBase):
     potential = HenonHeilesPotential()
-    w0 = [1.,0.,0.,0.,2*np.pi,0.]
+    w0 = [1.,0.,0.,2*np.pi]
 
 class TestKepler(PotentialTestBase):
     potential = KeplerPotential(units=solarsystem, m=1.)
@@ -66,9 +67,9 @@ class TestMiyamotoNagai(PotentialTestBase):
     potential = MiyamotoNagaiPotential(units=galactic, m=1.E11, a=6.5, b=0.26)
     w0 = [8.,0.,0.,0.,0.22,0.1]
 
-# class TestStone(PotentialTestBase):
-#     potential = StonePotential(units=galactic, v_c=0.2, r_c=1, r_t=2.)
-#     w0 = [8.,0.,0.,0.,0.22,0.1]
+class TestStone(PotentialTestBase):
+    potential = StonePotential(units=galactic, m_tot=1E11, r_c=1., r_t=20.)
+    w0 = [8.,0.,0.,0.,0.22,0.1]
 
 class TestSphericalNFWPotential(PotentialTestBase):
     potential = SphericalNFWPotential(units=galactic, v_c=0.35, r_s=12.)
@@ -133,6 +134,17 @@ class TestComposite(PotentialTestBase):
     potential['halo'] = p1
     w0 = [19.0,2.7,-6.9,0.0352238,-0.03579493,0.075]
 
+class TestCComposite(PotentialTestBase):
+    p1 = LogarithmicPotential(units=galactic,
+                              v_c=0.17, r_h=10.,
+                              q1=1.2, q2=1., q3=0.8, phi=0.35)
+    p2 = MiyamotoNagaiPotential(units=galactic,
+                                m=1.E11, a=6.5, b=0.26)
+    potential = CCompositePotential()
+    potential['disk'] = p2
+    potential['halo'] = p1
+    w0 = [19.0,2.7,-6.9,0.0352238,-0.03579493,0.075]
+
 class TestMisalignedLogarithmic(PotentialTestBase):
     potential = LogarithmicPotential(units=galactic, v_c=0.17, r_h=10.,
                                      q1=1.2, q2=1., q3=0.8, phi=41*u.deg)
@@ -147,13 +159,102 @@ class TestMisalignedLeeSutoNFW(PotentialTestBase):
     w0 = [19.0,2.7,-6.9,0.0352238,-0.03579493,0.075]
     tol = 1E-2
 
-# class TestSCFPotential(PotentialTestBase):
-#     cc = np.array([[[1.509, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-2.606, 0.0, 0.665, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [6.406, 0.0, -0.66, 0.0, 0.044, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-5.5859, 0.0, 0.984, 0.0, -0.03, 0.0, 0.001]], [[-0.086, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-0.221, 0.0, 0.129, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [1.295, 0.0, -0.14, 0.0, -0.012, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]], [[-0.033, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-0.001, 0.0, 0.006, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]], [[-0.02, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]])
-#     sc = np.zeros_like(cc)
-#     potential = SCFPotential(m=1E10, r_s=1.,
-#                              sin_coeff=sc, cos_coeff=cc,
-#                              units=galactic)
-#     w0 = [2.0,2.7,-6.9,0.0352238,-0.03579493,0.075]
+def test_moving_plummer():
+    t = np.linspace(0., 100., 11)
+    pos = np.zeros((3,len(t)))
+    pos[0] = 0.1*t
+    m = np.linspace(1E10, 2E10, len(t))
+    p = MovingPlummerPotential(m=m, b=0.5, t=t, pos=pos, units=galactic)
+
+    q = np.array([[1.,0.5,0.2], [-2.,0.1,1.]]).T
+
+    # at a tabulated time, same as a static Plummer sphere at that position
+    pl = PlummerPotential(m=m[3], b=0.5, units=galactic)
+    assert np.allclose(p.value(q, t=t[3]), pl.value(q - pos[:,3:4]))
+    assert np.allclose(p.gradient(q, t=t[3]), pl.gradient(q - pos[:,3:4]))
+    assert np.allclose(p.hessian(q, t=t[3]), pl.hessian(q - pos[:,3:4]))
+
+    # linearly interpolated between times
+    pl = PlummerPotential(m=1.25E10, b=0.5, units=galactic)
+    assert np.allclose(p.value(q, t=25.), pl.value(q - np.array([[2.5,0,0]]).T))
+
+    # clamped outside of the tabulated times
+    assert np.allclose(p.value(q, t=200.), p.value(q, t=100.))
+    assert np.allclose(p.value(q, t=-10.), p.value(q, t=0.))
+
+class TestSCFPotential(PotentialTestBase):
+    cc = np.array([[[1.509, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-2.606, 0.0, 0.665, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [6.406, 0.0, -0.66, 0.0, 0.044, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-5.5859, 0.0, 0.984, 0.0, -0.03, 0.0, 0.001]], [[-0.086, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-0.221, 0.0, 0.129, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [1.295, 0.0, -0.14, 0.0, -0.012, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]], [[-0.033, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [-0.001, 0.0, 0.006, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]], [[-0.02, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]])
+    sc = np.zeros_like(cc)
+    potential = SCFPotential(m=1E10, r_s=1.,
+                             sin_coeff=sc, cos_coeff=cc,
+                             units=galactic)
+    w0 = [2.0,2.7,-6.9,0.0352238,-0.03579493,0.075]
+
+def test_scf_hernquist():
+    # the lowest order basis function is a Hernquist sphere
+    cc = np.zeros((4,3,3))
+    cc[0,0,0] = 1.
+    p = SCFPotential(m=1E11, r_s=2.5, cos_coeff=cc, sin_coeff=np.zeros_like(cc),
+                     units=galactic)
+    h = HernquistPotential(m=1E11, c=2.5, units=galactic)
+
+    q = np.random.RandomState(42).uniform(-10, 10, size=(3,128))
+    assert np.allclose(p.value(q), h.value(q))
+    assert np.allclose(p.gradient(q), h.gradient(q))
+    assert np.allclose(p.density(q), h.density(q))
+
+def test_scf_gradient_z_axis():
+    # m=1 terms have a gradient perpendicular to the z axis, on the axis
+    cc = np.zeros((1,2,2))
+    sc = np.zeros((1,2,2))
+    sc[0,1,1] = 1.
+    p = SCFPotential(m=1E11, r_s=1., cos_coeff=cc, sin_coeff=sc, units=galactic)
+
+    h = 1E-5
+    for q in [[0.,0.,2.], [1E-7,0.,2.], [0.,0.,-2.]]:
+        q = np.array(q)[:,None]
+        fd = np.vstack([(p.value(q + h*e[:,None]) - p.value(q - h*e[:,None])) / (2*h)
+                        for e in np.eye(3)])
+        assert np.allclose(p.gradient(q), fd, rtol=1E-6)
+        assert np.abs(p.gradient(q)[1,0]) > 0.
+
+def test_scf_from_particles():
+    # sample particles from a Hernquist sphere with M=1, a=1
+    rnd = np.random.RandomState(42)
+    n = 100000
+    s = np.sqrt(rnd.uniform(size=n))
+    r = s / (1 - s)
+    phi = rnd.uniform(0, 2*np.pi, size=n)
+    theta = np.arccos(2*rnd.uniform(size=n) - 1)
+    xyz = np.vstack((r*np.sin(theta)*np.cos(phi),
+                     r*np.sin(theta)*np.sin(phi),
+                     r*np.cos(theta)))
+
+    cc,sc = scf_coefficients(xyz, np.ones(n)/n, nmax=4, lmax=4)
+    assert cc.shape == sc.shape == (5,5,5)
+
+    # the coefficients are sums over the particles, so estimate their shot
+    #   noise from the scatter of the sums over batches of particles
+    nbatch = 20
+    batches = [scf_coefficients(xyz[:,i::nbatch], np.ones(n//nbatch)/n, nmax=4, lmax=4)
+               for i in range(nbatch)]
+    cc_err,sc_err = np.sqrt(nbatch) * np.std(batches, axis=0, ddof=1)
+    assert np.allclose(np.sum(batches, axis=0), (cc,sc))
+
+    cc_true = np.zeros_like(cc)
+    cc_true[0,0,0] = 1.
+    assert np.all(np.abs(cc - cc_true) < 5*cc_err + 1E-10)
+    assert np.all(np.abs(sc) < 5*sc_err + 1E-10)
+
+    # threads just split the sum over particles
+    cc2,sc2 = scf_coefficients(xyz, np.ones(n)/n, nmax=4, lmax=4, nthreads=4)
+    assert np.allclose(cc, cc2)
+    assert np.allclose(sc, sc2)
+
+    p = SCFPotential.from_particles(xyz*u.kpc, 1E7*u.Msun, nmax=4, lmax=4,
+                                    r_s=1.*u.kpc, units=galactic)
+    assert np.allclose(p.parameters['m'], 1E12)
+    assert np.allclose(p.parameters['cos_coeff'], cc)
 
 # class TestWangZhaoBarPotential(PotentialTestBase):
 #     potential = WangZhaoBarPotential(m=1E10, r_s=1., alpha=0., Omega=0.,
@@ -16,8 +16,10 @@ import numpy as np
 
 # This project
 from ..core import *
+from ..cpotential import *
 from ..builtin import *
-from ...units import solarsystem
+from ...integrate import LeapfrogIntegrator, DOPRI853Integrator
+from ...units import solarsystem, galactic
 
 class TestComposite(object):
     units = solarsystem
@@ -50,3 +52,93 @@ class TestComposite(object):
 
         fig = potential.plot_contours(grid=(grid,grid,0.))
         # fig.savefig(os.path.join(plot_path, "composite_kepler_sho_2d.png"))
+
+class TestCComposite(object):
+    units = galactic
+
+    def setup(self):
+        self.components = [('bulge', HernquistPotential(m=3.4E10, c=0.7, units=self.units)),
+                           ('disk', MiyamotoNagaiPotential(m=1E11, a=6.5, b=0.26, units=self.units)),
+                           ('halo', SphericalNFWPotential(v_c=0.2, r_s=20., units=self.units))]
+
+    def test_ccomposite_create(self):
+        potential = CCompositePotential()
+        potential["bulge"] = self.components[0][1]
+
+        # only C potentials are allowed
+        with pytest.raises(TypeError):
+            potential["two"] = HarmonicOscillatorPotential(omega=1., units=self.units)
+
+        assert "bulge" in potential.parameters
+        assert hasattr(potential, 'c_instance')
+
+    def test_compare_to_python(self):
+        py_pot = CompositePotential(self.components)
+        c_pot = CCompositePotential(self.components)
+
+        q = np.random.uniform(-10., 10., size=(3,128))
+        assert np.allclose(py_pot.value(q), c_pot.value(q))
+        assert np.allclose(py_pot.gradient(q), c_pot.gradient(q))
+        assert np.allclose(py_pot.density(q), c_pot.density(q))
+        assert np.allclose(py_pot.mass_enclosed(q), c_pot.mass_enclosed(q))
+
+    def test_modify(self):
+        c_pot = CCompositePotential(self.components[:2])
+        q = np.random.uniform(-10., 10., size=(3,16))
+        v1 = c_pot.value(q)
+
+        c_pot['halo'] = self.components[2][1]
+        v2 = c_pot.value(q)
+        assert np.allclose(v2 - v1, self.components[2][1].value(q))
+
+        del c_pot['halo']
+        assert np.allclose(c_pot.value(q), v1)
+
+    def test_integrate(self):
+        py_pot = CompositePotential(self.components)
+        c_pot = CCompositePotential(self.components)
+
+        w0 = [10.,0.,0.,0.,0.2,0.02]
+        for Integrator in [LeapfrogIntegrator, DOPRI853Integrator]:
+            py_orbit = py_pot.integrate_orbit(w0, dt=1., nsteps=1000,
+                                              Integrator=Integrator)
+            c_orbit = c_pot.integrate_orbit(w0, dt=1., nsteps=1000,
+                                            Integrator=Integrator)
+            assert np.allclose(py_orbit.pos.value, c_orbit.pos.value)
+
+    def test_2d(self):
+        components = [('one', HenonHeilesPotential()), ('two', HenonHeilesPotential())]
+        py_pot = CompositePotential(components)
+        c_pot = CCompositePotential(components)
+        assert c_pot.ndim == 2
+
+        q = np.random.RandomState(42).uniform(-0.5, 0.5, size=(2,16))
+        assert np.allclose(py_pot.gradient(q), c_pot.gradient(q))
+        assert np.allclose(py_pot.hessian(q), c_pot.hessian(q))
+
+        w0 = [0.,0.1,0.2,0.]
+        for Integrator in [LeapfrogIntegrator, DOPRI853Integrator]:
+            py_orbit = py_pot.integrate_orbit(w0, dt=0.1, nsteps=1000,
+                                              Integrator=Integrator)
+            c_orbit = c_pot.integrate_orbit(w0, dt=0.1, nsteps=1000,
+                                            Integrator=Integrator)
+            assert np.allclose(py_orbit.pos.value, c_orbit.pos.value)
+
+        # can't mix components with different numbers of dimensions
+        with pytest.raises(ValueError):
+            c_pot['three'] = self.components[0][1]
+
+    def test_pickle(self, tmpdir):
+        from six.moves import cPickle as pickle
+
+        c_pot = CCompositePotential(self.components)
+        q = np.random.uniform(-10., 10., size=(3,16))
+
+        fn = str(tmpdir.join("ccomposite.pickle"))
+        with open(fn, "wb") as f:
+            pickle.dump(c_pot, f)
+
+        with open(fn, "rb") as f:
+            p = pickle.load(f)
+
+        assert np.allclose(p.value(q), c_pot.value(q))
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+    Test potentials implemented by external C functions
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import pickle
+
+# Third party
+import numpy as np
+import pytest
+
+# This project
+from ..builtin import PlummerPotential
+from ..cpotential import CustomCPotential, _function_address
+from ..util import _compile_c_source
+from ...dynamics.mockstream import streakline_stream
+from ...integrate import LeapfrogIntegrator, DOPRI853Integrator
+from ...units import galactic
+
+source = """
+#include <math.h>
+
+double my_value(double t, double *pars, double *q) {
+    return -pars[0]*pars[1] / sqrt(q[0]*q[0] + q[1]*q[1] + q[2]*q[2] + pars[2]*pars[2]);
+}
+
+void my_gradient(double t, double *pars, double *q, double *grad) {
+    double R2b = q[0]*q[0] + q[1]*q[1] + q[2]*q[2] + pars[2]*pars[2];
+    double fac = pars[0]*pars[1] / sqrt(R2b) / R2b;
+    grad[0] = fac*q[0];
+    grad[1] = fac*q[1];
+    grad[2] = fac*q[2];
+}
+"""
+
+class TestCustomCPotential(object):
+
+    def setup(self):
+        self.lib = _compile_c_source(source)
+        self.p1 = PlummerPotential(m=1E10, b=0.5, units=galactic)
+        self.p2 = CustomCPotential(self.lib.my_value, self.lib.my_gradient,
+                                   parameters=[self.p1.G, 1E10, 0.5], units=galactic)
+
+    def test_create(self):
+        # also from addresses
+        p = CustomCPotential(_function_address(self.lib.my_value),
+                             _function_address(self.lib.my_gradient),
+                             parameters=dict(G=self.p1.G, m=1E10, b=0.5), units=galactic)
+        assert list(p.parameters.keys()) == ['G', 'm', 'b']
+
+        with pytest.raises(TypeError):
+            CustomCPotential("derp", self.lib.my_gradient)
+
+        with pytest.raises(ValueError):
+            CustomCPotential(0, self.lib.my_gradient)
+
+    def test_pickle(self):
+        # the function addresses are only valid in this process
+        with pytest.raises(TypeError):
+            pickle.dumps(self.p2.c_instance)
+
+    def test_compare(self):
+        q = np.random.uniform(-10, 10, size=(3,32))
+        assert np.allclose(self.p1.value(q), self.p2.value(q))
+        assert np.allclose(self.p1.gradient(q), self.p2.gradient(q))
+        assert np.all(np.isnan(self.p2.density(q)))
+
+        with pytest.raises(NotImplementedError):
+            self.p2.hessian(q)
+
+    def test_integrate(self):
+        w0 = [1.,0.,0.,0.,0.1,0.1]
+        for Integrator in [LeapfrogIntegrator, DOPRI853Integrator]:
+            orbit1 = self.p1.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+            orbit2 = self.p2.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+            assert np.allclose(orbit1.pos.value, orbit2.pos.value)
+
+    def test_mock_stream(self):
+        w0 = [1.,0.,0.,0.,0.1,0.1]
+        prog1,stream1 = streakline_stream(self.p1, w0, prog_mass=1E4, t_f=-256., dt=-1.)
+        prog2,stream2 = streakline_stream(self.p2, w0, prog_mass=1E4, t_f=-256., dt=-1.)
+        assert np.allclose(stream1.pos.value, stream2.pos.value)
@@ -0,0 +1,95 @@
+# coding: utf-8
+"""
+    Test the interpolated potential
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import os
+
+# Third party
+import numpy as np
+import pytest
+
+# This project
+from ..core import CompositePotential
+from ..cpotential import InterpolatedPotential
+from ..builtin import *
+from ...integrate import LeapfrogIntegrator, DOPRI853Integrator
+from ...units import galactic
+
+def make_potential(b=0.26):
+    p = CompositePotential()
+    p['disk'] = MiyamotoNagaiPotential(m=6.5E10, a=6.5, b=b, units=galactic)
+    p['halo'] = LeeSutoTriaxialNFWPotential(v_c=0.2, r_s=20., a=1.3, b=1., c=0.8,
+                                            units=galactic)
+    return p
+
+def test_create():
+    p = make_potential()
+
+    with pytest.raises(TypeError):
+        InterpolatedPotential("derp")
+
+    with pytest.raises(ValueError):
+        InterpolatedPotential(p, grid='derp')
+
+    with pytest.raises(ValueError):
+        InterpolatedPotential(p, grid='cartesian')
+
+    with pytest.raises(ValueError):
+        InterpolatedPotential(p, limits=(0., 100.))
+
+@pytest.mark.parametrize("grid, kwargs", [
+    ('spherical', dict(limits=(0.1, 200.), shape=(96,49,64))),
+    # no grid point at the center, where the halo potential is singular
+    ('cartesian', dict(limits=(-25., 25.), shape=(100,100,100))),
+])
+def test_accuracy(grid, kwargs):
+    # a thick disk, and positions away from the center: these grids don't
+    #   resolve the vertical structure of a thin disk (b=0.26), nor the cusp
+    #   of the halo on the Cartesian grid
+    p = make_potential(b=2.)
+    ip = InterpolatedPotential(p, grid=grid, nthreads=4, **kwargs)
+
+    q = np.random.RandomState(42).uniform(-15., 15., size=(3,1000))
+    q = q[:, np.sqrt(np.sum(q**2, axis=0)) > 2.]
+    assert ip.relative_error(q) < 1E-2
+    assert np.allclose(ip.value(q), p.value(q), rtol=1E-3)
+    assert np.all(np.isnan(ip.density(q)))
+
+    w0 = [8.,0.,0.,0.,0.22,0.05]
+    orbit1 = p.integrate_orbit(w0, dt=1., nsteps=1000)
+    for Integrator in [LeapfrogIntegrator, DOPRI853Integrator]:
+        orbit2 = ip.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+        assert np.allclose(orbit1.pos.value, orbit2.pos.value, atol=1E-1)
+
+def test_extrapolate():
+    p = PlummerPotential(m=1E10, b=0.5, units=galactic)
+    ip = InterpolatedPotential(p, limits=(0.01, 50.))
+
+    # outside of the grid, point mass
+    q = np.array([[100.,0,0], [0.,-300.,50.]]).T
+    assert np.allclose(ip.value(q), p.value(q), rtol=1E-3)
+    assert np.allclose(ip.gradient(q), p.gradient(q), rtol=1E-3)
+
+def test_cache(tmpdir):
+    p = make_potential()
+    cache_dir = str(tmpdir.join("cache"))
+
+    ip1 = InterpolatedPotential(p, shape=(32,17,32), cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    ip2 = InterpolatedPotential(p, shape=(32,17,32), cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    q = np.random.uniform(-15., 15., size=(3,16))
+    assert np.all(ip1.value(q) == ip2.value(q))
+
+    # different parameters or grid get different cache files
+    p['disk'] = MiyamotoNagaiPotential(m=5E10, a=6.5, b=0.26, units=galactic)
+    InterpolatedPotential(p, shape=(32,17,32), cache_dir=cache_dir)
+    InterpolatedPotential(p, shape=(32,17,16), cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 3
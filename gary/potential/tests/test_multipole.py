@@ -0,0 +1,132 @@
+# coding: utf-8
+"""
+    Test the multipole expansion potential
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import pickle
+
+# Third party
+import numpy as np
+import pytest
+
+# This project
+from ..cpotential import CCompositePotential
+from ..builtin import *
+from ...integrate import LeapfrogIntegrator, DOPRI853Integrator
+from ...units import galactic
+
+def triaxial_density(q):
+    # triaxial Hernquist-like density
+    m = np.sqrt(q[0]**2 + (q[1]/0.8)**2 + (q[2]/0.6)**2)
+    return 1E10 / (2*np.pi*0.8*0.6) * 2. / (m * (m + 2.)**3)
+
+def test_create():
+    with pytest.raises(TypeError):
+        MultipolePotential("derp", units=galactic)
+
+    p = HernquistPotential(m=1E11, c=2., units=galactic)
+    with pytest.raises(ValueError):
+        MultipolePotential(p, limits=(0., 100.))
+
+    with pytest.raises(ValueError):
+        MultipolePotential(p, lmax=-1)
+
+    # no density function
+    p = LogarithmicPotential(v_c=0.2, r_h=10., q1=1., q2=0.9, q3=0.8,
+                             units=galactic)
+    with pytest.raises(ValueError):
+        MultipolePotential(p)
+
+def test_spherical():
+    p = HernquistPotential(m=1E11, c=2., units=galactic)
+    mp = MultipolePotential(p, lmax=0, limits=(1E-2, 1E3))
+    assert mp.units == p.units
+
+    r = np.logspace(-1, 2, 64)
+    q = np.random.RandomState(42).normal(size=(3,64))
+    q = q / np.sqrt(np.sum(q**2, axis=0)) * r
+
+    assert np.allclose(mp.value(q), p.value(q), rtol=1E-4)
+    assert np.allclose(mp.gradient(q), p.gradient(q), rtol=1E-4)
+    assert np.allclose(mp.density(q), p.density(q), rtol=1E-4)
+
+    # outside of the grid, point mass with the mass inside of the grid
+    q = np.array([[2000.,0,0], [0.,-1500.,3000.]]).T
+    r = np.sqrt(np.sum(q**2, axis=0))
+    m_enc = 1E11 * 1E3**2 / (1E3 + 2.)**2
+    assert np.allclose(mp.value(q), -p.G*m_enc/r, rtol=1E-5)
+
+def test_flattened():
+    p = MiyamotoNagaiPotential(m=1E11, a=3., b=5., units=galactic)
+    q = np.random.RandomState(42).uniform(-15., 15., size=(3,256))
+
+    # a much larger grid shouldn't change the result
+    for limits in [(1E-2, 1E3), (1E-2, 1E7)]:
+        mp = MultipolePotential(p, lmax=12, limits=limits)
+        assert np.allclose(mp.value(q), p.value(q), rtol=5E-3)
+        assert np.allclose(mp.gradient(q), p.gradient(q), rtol=3E-2,
+                           atol=1E-3*np.abs(p.gradient(q)).max())
+
+def test_gradient_z_axis():
+    def density(q):
+        # offset from the origin, so the m=1 terms are non-zero
+        m = np.sqrt((q[0]-0.5)**2 + (q[1]-0.3)**2 + q[2]**2)
+        return 1E10 / np.pi / (m * (m + 2.)**3)
+    mp = MultipolePotential(density, lmax=6, units=galactic)
+
+    h = 1E-5
+    for q in [[0.,0,2.], [1E-7,0,2.], [0.,0,-2.]]:
+        q = np.array(q)[:,None]
+        grad = np.zeros(3)
+        for i in range(3):
+            dq = np.zeros((3,1))
+            dq[i] = h
+            grad[i] = (mp.value(q + dq) - mp.value(q - dq))[0] / (2*h)
+        assert np.allclose(mp.gradient(q)[:,0], grad, rtol=1E-6)
+
+def test_callable():
+    mp = MultipolePotential(triaxial_density, lmax=10, units=galactic)
+
+    q = np.random.RandomState(42).uniform(-10., 10., size=(3,128))
+    assert np.allclose(mp.density(q), triaxial_density(q), rtol=1E-2)
+
+    # gradient is consistent with the value
+    h = 1E-5
+    for i in range(3):
+        dq = np.zeros((3,1))
+        dq[i] = h
+        dval = (mp.value(q + dq) - mp.value(q - dq)) / (2*h)
+        assert np.allclose(mp.gradient(q)[i], dval, rtol=1E-5, atol=1E-10)
+
+def test_composite_orbit():
+    disk = MiyamotoNagaiPotential(m=6.5E10, a=6.5, b=0.26, units=galactic)
+    halo = MultipolePotential(triaxial_density, lmax=6, units=galactic)
+
+    p = CCompositePotential()
+    p['disk'] = disk
+    p['halo'] = halo
+
+    w0 = [8.,0.,0.,0.,0.22,0.05]
+    for Integrator in [LeapfrogIntegrator, DOPRI853Integrator]:
+        orbit = p.integrate_orbit(w0, dt=0.5, nsteps=2000, Integrator=Integrator)
+        E = orbit.energy().value
+        assert np.all(np.abs((E[1:] - E[0]) / E[0]) < 1E-3)
+
+def test_pickle(tmpdir):
+    mp = MultipolePotential(triaxial_density, lmax=4, nr=64, units=galactic)
+    q = np.random.RandomState(42).uniform(-10., 10., size=(3,16))
+
+    fn = str(tmpdir.join("multipole.pickle"))
+    with open(fn, "wb") as f:
+        pickle.dump(mp, f)
+
+    with open(fn, "rb") as f:
+        p = pickle.load(f)
+
+    assert np.allclose(p.value(q), mp.value(q))
+    assert np.allclose(p.gradient(q), mp.gradient(q))
@@ -0,0 +1,95 @@
+# coding: utf-8
+"""
+    Test the time-dependent C potential
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third party
+import pytest
+import numpy as np
+from six.moves import cPickle as pickle
+
+# This project
+from ..cpotential import *
+from ..builtin import *
+from ...integrate import LeapfrogIntegrator, DOPRI853Integrator
+from ...units import galactic
+
+class TestTimeDependent(object):
+
+    def setup(self):
+        self.t = np.linspace(0., 1000., 16)
+        self.m = np.linspace(5E10, 1E11, 16)
+        self.potential = TimeDependentPotential(MiyamotoNagaiPotential, t=self.t,
+                                                time_parameters=dict(m=self.m),
+                                                a=6.5, b=0.26, units=galactic)
+        self.q = np.array([[8.,0.,0.1], [1.,2.,-0.5]]).T
+
+    def test_create(self):
+        with pytest.raises(TypeError):
+            TimeDependentPotential(object, t=self.t, time_parameters=dict(m=self.m))
+
+        with pytest.raises(ValueError):
+            TimeDependentPotential(MiyamotoNagaiPotential, t=self.t,
+                                   time_parameters=dict(m=self.m[:-1]),
+                                   a=6.5, b=0.26, units=galactic)
+
+    def test_tabulated(self):
+        # at the tabulated times, same as the static potential
+        for i in [0, 5, 15]:
+            p = MiyamotoNagaiPotential(m=self.m[i], a=6.5, b=0.26, units=galactic)
+            for func in ['value', 'gradient', 'density', 'hessian']:
+                assert np.allclose(getattr(self.potential, func)(self.q, t=self.t[i]),
+                                   getattr(p, func)(self.q))
+
+    def test_interpolate(self):
+        # the mass varies linearly, which the spline reproduces exactly
+        p = MiyamotoNagaiPotential(m=7.5E10, a=6.5, b=0.26, units=galactic)
+        assert np.allclose(self.potential.value(self.q, t=500.), p.value(self.q))
+
+        # a non-monotonic sequence of times uses the cached interval and bisection
+        for t in [500., 10., 990., 500.]:
+            m = np.interp(t, self.t, self.m)
+            p = MiyamotoNagaiPotential(m=m, a=6.5, b=0.26, units=galactic)
+            assert np.allclose(self.potential.gradient(self.q, t=t), p.gradient(self.q))
+
+        # outside of the tabulated times, the end values are used
+        assert np.allclose(self.potential.value(self.q, t=-100.),
+                           self.potential.value(self.q, t=0.))
+        assert np.allclose(self.potential.value(self.q, t=2000.),
+                           self.potential.value(self.q, t=1000.))
+
+    def test_integrate(self):
+        w0 = [8.,0.,0.,0.,0.22,0.1]
+        for Integrator in [LeapfrogIntegrator, DOPRI853Integrator]:
+            orbit = self.potential.integrate_orbit(w0, dt=1., nsteps=1000,
+                                                   Integrator=Integrator)
+            assert np.all(np.isfinite(orbit.pos.value))
+
+        # with a growing mass, the orbit isn't the same as in the final potential
+        p = MiyamotoNagaiPotential(m=self.m[-1], a=6.5, b=0.26, units=galactic)
+        orbit2 = p.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+        assert not np.allclose(orbit.pos.value, orbit2.pos.value)
+
+    def test_composite(self):
+        p = CCompositePotential()
+        p['disk'] = self.potential
+        p['bulge'] = HernquistPotential(m=3E10, c=0.7, units=galactic)
+
+        bulge = p['bulge'].value(self.q)
+        assert np.allclose(p.value(self.q, t=300.), self.potential.value(self.q, t=300.) + bulge)
+
+    def test_pickle(self, tmpdir):
+        fn = str(tmpdir.join("timedep.pickle"))
+        with open(fn, "wb") as f:
+            pickle.dump(self.potential.c_instance, f)
+
+        with open(fn, "rb") as f:
+            c_instance = pickle.load(f)
+
+        qT = np.ascontiguousarray(self.q.T)
+        assert np.allclose(c_instance.value(qT, t=333.),
+                           self.potential.c_instance.value(qT, t=333.))
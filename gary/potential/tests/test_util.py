@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+    Test the potential utilities
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import pickle
+
+# Third party
+import numpy as np
+import pytest
+
+# This project
+from ..builtin import PlummerPotential
+from ..cpotential import CPotentialBase
+from ..util import from_equation
+from ...integrate import LeapfrogIntegrator, DOPRI853Integrator
+from ...units import galactic
+
+pytest.importorskip("sympy")
+
+def test_from_equation_compile_c():
+    Potential = from_equation("-G*m/sqrt(x**2 + y**2 + z**2 + b**2)",
+                              vars=["x","y","z"], pars=["G","m","b"],
+                              name="Plummer", hessian=True, compile_c=True)
+    assert issubclass(Potential, CPotentialBase)
+    assert Potential.__name__ == "PlummerPotential"
+
+    p1 = PlummerPotential(m=1E10, b=0.5, units=galactic)
+    p2 = Potential(G=p1.G, m=1E10, b=0.5, units=galactic)
+
+    q = np.random.uniform(-10, 10, size=(3,32))
+    assert np.allclose(p1.value(q), p2.value(q))
+    assert np.allclose(p1.gradient(q), p2.gradient(q))
+    assert np.allclose(p1.density(q), p2.density(q))
+    assert np.allclose(p1.hessian(q), p2.hessian(q))
+
+    w0 = [1.,0.,0.,0.,0.1,0.1]
+    for Integrator in [LeapfrogIntegrator, DOPRI853Integrator]:
+        orbit1 = p1.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+        orbit2 = p2.integrate_orbit(w0, dt=1., nsteps=1000, Integrator=Integrator)
+        assert np.allclose(orbit1.pos.value, orbit2.pos.value)
+
+    # the compiled library is cached
+    Potential2 = from_equation("-G*m/sqrt(x**2 + y**2 + z**2 + b**2)",
+                               vars=["x","y","z"], pars=["G","m","b"],
+                               compile_c=True)
+    p3 = Potential2(G=p1.G, m=1E10, b=0.5, units=galactic)
+    assert np.allclose(p1.value(q), p3.value(q))
+
+def test_from_equation_compile_c_1d():
+    Potential = from_equation("1/2*k*x**2", vars="x", pars="k", compile_c=True)
+    p = Potential(k=1.)
+
+    assert np.allclose(p.value([1.]), 0.5)
+    assert np.allclose(p.gradient([2.]), 2.)
+    with pytest.raises(NotImplementedError):
+        p.hessian([1.])
+
+    orbit1 = p.integrate_orbit([1.,0], dt=0.01, nsteps=1000, Integrator=LeapfrogIntegrator)
+    orbit2 = p.integrate_orbit([1.,0], dt=0.01, nsteps=1000, Integrator=DOPRI853Integrator)
+    assert np.allclose(orbit1.pos.value, orbit2.pos.value, atol=1E-3)
+
+def test_from_equation_compile_c_pickle(tmpdir):
+    Potential = from_equation("-G*m/sqrt(x**2 + y**2 + z**2 + b**2)",
+                              vars=["x","y","z"], pars=["G","m","b"],
+                              hessian=True, compile_c=True)
+    p = Potential(G=1., m=1., b=0.5)
+
+    # the source is pickled, not the function addresses
+    assert "gary_value" in pickle.dumps(p.c_instance).decode('latin-1')
+
+    fn = str(tmpdir.join("from_equation.pickle"))
+    with open(fn, "wb") as f:
+        pickle.dump(p.c_instance, f)
+
+    with open(fn, "rb") as f:
+        c_instance = pickle.load(f)
+
+    q = np.random.RandomState(42).uniform(-10, 10, size=(32,3))
+    assert np.allclose(c_instance.value(q), p.c_instance.value(q))
+    assert np.allclose(c_instance.gradient(q), p.c_instance.gradient(q))
+    assert np.allclose(c_instance.hessian(q), p.c_instance.hessian(q))
@@ -6,11 +6,20 @@ from __future__ import division, print_function
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
 
+# Standard library
+import ctypes
+import hashlib
+import os
+import shutil
+import tempfile
+
 # Third-party
+from astropy.constants import G
 import numpy as np
 
 # Project
 from .core import PotentialBase
+from .cpotential import CPotentialBase, _CFunctionPotential, _function_address
 
 __all__ = ['from_equation']
 
@@ -21,7 +30,108 @@ def _classnamify(s):
         words.append(word[0].upper() + word[1:])
     return "".join(words)
 
-def from_equation(expr, vars, pars, name=None, hessian=False):
+def _c_source(expr, vars, pars, hessian=False):
+    """
+    Generate C code for the value, gradient, density, and (optionally) Hessian
+    functions of a potential, with signatures that match the typedefs in
+    ``cpotential.pxd``. The variables are read from ``q`` and the parameters
+    from ``pars``, followed by the gravitational constant (used to compute the
+    density from the Laplacian).
+    """
+    import sympy
+
+    q = sympy.IndexedBase('q', shape=(len(vars),))
+    p = sympy.IndexedBase('pars', shape=(len(pars)+1,))
+    subs = dict([(v,q[i]) for i,v in enumerate(vars)] +
+                [(par,p[i]) for i,par in enumerate(pars)])
+
+    def ccode(e):
+        return sympy.ccode(e.subs(subs))
+
+    grad = [sympy.diff(expr,v) for v in vars]
+    laplacian = sum([sympy.diff(g,v) for g,v in zip(grad,vars)])
+
+    lines = ["#include <math.h>", ""]
+
+    lines += ["double gary_value(double t, double *pars, double *q) {",
+              "    return {0};".format(ccode(expr)),
+              "}", ""]
+
+    lines += ["void gary_gradient(double t, double *pars, double *q, double *grad) {"]
+    lines += ["    grad[{0}] = {1};".format(i, ccode(g)) for i,g in enumerate(grad)]
+    lines += ["}", ""]
+
+    lines += ["double gary_density(double t, double *pars, double *q) {",
+              "    return ({0}) / (4*M_PI*pars[{1}]);".format(ccode(laplacian), len(pars)),
+              "}", ""]
+
+    if hessian:
+        lines += ["void gary_hessian(double t, double *pars, double *q, double *hess) {"]
+        for i,g in enumerate(grad):
+            for j,v in enumerate(vars):
+                lines += ["    hess[{0}] = {1};".format(i*len(vars)+j, ccode(sympy.diff(g,v)))]
+        lines += ["}", ""]
+
+    return "\n".join(lines)
+
+def _compile_c_source(source):
+    """
+    Compile the C source into a shared library and load it with `ctypes`.
+    Libraries are cached by the hash of the source, so each expression is
+    only compiled once.
+    """
+    from astropy.config.paths import get_cache_dir
+    from distutils.ccompiler import new_compiler
+    from distutils.sysconfig import customize_compiler
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+
+    basename = "potential_" + hashlib.sha1(source.encode('utf-8')).hexdigest()
+    cache_dir = os.path.join(get_cache_dir(), 'gary', 'potential')
+    lib_path = os.path.join(cache_dir, compiler.shared_object_filename(basename))
+
+    if not os.path.exists(lib_path):
+        if not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError: # created in the meantime
+                pass
+
+        build_dir = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            src_path = os.path.join(build_dir, basename + ".c")
+            with open(src_path, 'w') as f:
+                f.write(source)
+
+            objects = compiler.compile([src_path], output_dir=build_dir,
+                                       extra_postargs=['--std=gnu99', '-fPIC'])
+            tmp_lib_path = os.path.join(build_dir, os.path.basename(lib_path))
+            compiler.link_shared_object(objects, tmp_lib_path, libraries=['m'])
+
+            # atomic, so a library in the cache is always complete
+            os.rename(tmp_lib_path, lib_path)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    return ctypes.CDLL(lib_path)
+
+def _c_function_potential(source, parameters, library=None):
+    """
+    Create a ``_CFunctionPotential`` for the functions in the C source
+    generated by `_c_source`, loading the library with `_compile_c_source` if
+    it isn't given. This is also how these potentials are unpickled, so the
+    function addresses are always valid in the current process.
+    """
+    if library is None:
+        library = _compile_c_source(source)
+
+    addresses = dict([(f, _function_address(getattr(library, 'gary_' + f, None)))
+                      for f in ['value', 'gradient', 'density', 'hessian']])
+    return _CFunctionPotential(parameters, library=library, source=source,
+                               **addresses)
+
+def from_equation(expr, vars, pars, name=None, hessian=False, compile_c=False):
     r"""
     Create a potential class from an expression for the potential.
 
@@ -41,7 +151,14 @@ def from_equation(expr, vars, pars, name=None, hessian=False):
     name : str (optional)
         The name of the potential class returned.
     hessian : bool (optional)
-        Generate a function to compute the Hessian.
+        Generate a function to compute the Hessian. Only supported with
+        ``compile_c=True``.
+    compile_c : bool (optional)
+        Generate C code for the potential and compile it into a shared library
+        (this requires a C compiler). The returned class is then a
+        `~gary.potential.CPotentialBase` subclass, so orbits and mock streams
+        are integrated at C speed. Compiled libraries are cached, so the same
+        expression is only compiled once.
 
     Returns
     -------
@@ -66,6 +183,14 @@ def from_equation(expr, vars, pars, name=None, hessian=False):
 
         >>> orbit = p1.integrate_orbit([1.,0], dt=0.01, nsteps=1000)
 
+    With ``compile_c=True``, the potential is instead implemented in C, so
+    the orbit is integrated with the Cython integrators::
+
+        >>> Potential = from_equation("1/2*k*x**2", vars="x", pars="k",
+        ...                           name='HarmonicOscillator', compile_c=True) # doctest: +SKIP
+        >>> p2 = Potential(k=1.) # doctest: +SKIP
+        >>> orbit = p2.integrate_orbit([1.,0], dt=0.01, nsteps=1000) # doctest: +SKIP
+
     """
     try:
         import sympy
@@ -81,7 +206,40 @@ def from_equation(expr, vars, pars, name=None, hessian=False):
     pars = [sympy.sympify(p) for p in pars]
     par_names = [p.name for p in pars]
 
+    if compile_c:
+        source = _c_source(expr, vars, pars, hessian=hessian)
+        library = _compile_c_source(source)
+
+        class MyCPotential(CPotentialBase):
+            ndim = len(vars)
+
+            def __init__(self, units=None, **kwargs):
+                self.parameters = kwargs
+                for par in par_names:
+                    if par not in self.parameters:
+                        raise ValueError("You must specify a value for "
+                                         "parameter '{}'.".format(par))
+                super(MyCPotential,self).__init__(units)
+
+                if self.units is None:
+                    self.G = 1.
+                else:
+                    self.G = G.decompose(self.units).value
+
+                parvec = [self.parameters[par] for par in par_names] + [self.G]
+                self.c_instance = _c_function_potential(source, parvec,
+                                                        library=library)
+
+        if name is not None:
+            name = _classnamify(name)
+            if "potential" not in name.lower():
+                name = name + "Potential"
+            MyCPotential.__name__ = name
+
+        return MyCPotential
+
     class MyPotential(PotentialBase):
+        ndim = len(vars)
 
         def __init__(self, units=None, **kwargs):
             self.parameters = kwargs